@@ -0,0 +1,77 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Micro-benchmarks of QuaLiKizXpoint key access and QuaLiKizPlan setup,
+written in the airspeed velocity (asv) format. Can also be run as a
+script to print the timings.
+"""
+import timeit
+from collections import OrderedDict
+from warnings import catch_warnings, simplefilter
+
+import numpy as np
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+
+access_keys = ['Ati', 'Ate', 'q', 'ni1', 'Ati0', 'Zeff', 'rot_flag', 'options']
+set_values = OrderedDict([('Ati', 3.), ('Ate', 3.), ('q', 2.),
+                          ('ni1', .1), ('Ati0', 3.)])
+
+
+class XpointAccess():
+    params = access_keys
+    param_names = ['key']
+
+    def setup(self, key):
+        self.xpoint = QuaLiKizPlan.from_defaults()['xpoint_base']
+
+    def time_getitem(self, key):
+        for __ in range(1000):
+            self.xpoint[key]
+
+
+class XpointAssign():
+    params = list(set_values)
+    param_names = ['key']
+
+    def setup(self, key):
+        self.xpoint = QuaLiKizPlan.from_defaults()['xpoint_base']
+        self.value = set_values[key]
+
+    def time_setitem(self, key):
+        for __ in range(1000):
+            self.xpoint[key] = self.value
+
+
+class PlanSetup():
+    timeout = 120
+
+    def setup(self):
+        self.plan = QuaLiKizPlan.from_defaults()
+        self.plan['scan_type'] = 'hyperrect'
+        self.plan['scan_dict'] = OrderedDict([
+            ('Ati', list(np.linspace(1, 10, 100))),
+            ('Ate', list(np.linspace(1, 10, 100))),
+            ('Zeff', [1, 1.5])])
+
+    def time_setup(self):
+        with catch_warnings():
+            simplefilter('ignore')
+            self.plan.setup()
+
+
+if __name__ == '__main__':
+    for cls, method in [(XpointAccess, 'time_getitem'),
+                        (XpointAssign, 'time_setitem')]:
+        bench = cls()
+        for key in cls.params:
+            bench.setup(key)
+            timing = min(timeit.repeat(lambda: getattr(bench, method)(key),
+                                       number=20, repeat=3)) / 20e3
+            print('{!s:<8} {!s:<14} {:7.0f} ns'.format(key, method, timing * 1e9))
+    bench = PlanSetup()
+    bench.setup()
+    timing = min(timeit.repeat(bench.time_setup, number=1, repeat=3))
+    print('{!s:<23} {:7.2f} s'.format('time_setup', timing))
@@ -0,0 +1,143 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+End-to-end benchmark of the Slurm submission and polling code against
+the local mock Slurm in qualikiz_tools.machine_specific.mock_slurm.
+Hundreds of one-run batches are launched with Batch.launch and polled
+with poll_sacct, so the timings are dominated by our own code and the
+scheduler round-trips, not by QuaLiKiz itself. Written in the airspeed
+velocity (asv) format. Can also be run as a script to print the timings
+of each stage.
+"""
+import os
+import io
+import stat
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+from contextlib import redirect_stdout
+from warnings import catch_warnings, simplefilter
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.machine_specific.mock_slurm import install
+from qualikiz_tools.machine_specific.slurm import Run, Batch
+from qualikiz_tools.machine_specific.sacct import poll_sacct
+
+stub_mpirun = """#!/bin/sh
+# Stub of mpirun: QuaLiKiz itself is not what we benchmark
+exit 0
+"""
+
+
+def setup_batches(testdir, num_batches, max_jobs):
+    """ Install the mock Slurm in testdir and prepare one-run batches
+
+    Args:
+        testdir:     Directory to put the mock Slurm and the batches in
+        num_batches: Amount of batches to prepare
+        max_jobs:    Amount of jobs the mock Slurm runs concurrently
+
+    Returns:
+        batchlist:   The prepared batches
+    """
+    bindir = install(os.path.join(testdir, 'bin'), os.path.join(testdir, 'spool'),
+                     max_jobs=max_jobs)
+    mpirun = os.path.join(bindir, 'mpirun')
+    with open(mpirun, 'w') as file_:
+        file_.write(stub_mpirun)
+    os.chmod(mpirun, os.stat(mpirun).st_mode | stat.S_IXUSR)
+    os.environ['PATH'] = bindir + os.pathsep + os.environ['PATH']
+
+    plan = QuaLiKizPlan.from_defaults()
+    batchlist = []
+    with catch_warnings():
+        simplefilter('ignore')
+        for ii in range(num_batches):
+            name = 'batch' + str(ii)
+            run = Run(os.path.join(testdir, name), 'run0', '../../QuaLiKiz',
+                      qualikiz_plan=plan, tasks=1)
+            batch = Batch(testdir, name, [run])
+            batch.prepare(overwrite_batch=True)
+            # Launching only checks that the input exists
+            with open(os.path.join(run.rundir, run.inputdir, 'R0.bin'), 'w'):
+                pass
+            batchlist.append(batch)
+    return batchlist
+
+def launch_batches(batchlist):
+    """ Submit all batches, silencing the sbatch output """
+    with redirect_stdout(io.StringIO()):
+        for batch in batchlist:
+            batch.launch()
+
+def wait_for_queue(poll_interval=.05):
+    """ Poll squeue until no job is pending or running anymore """
+    while subprocess.check_output(['squeue', '-h']).strip() != b'':
+        time.sleep(poll_interval)
+
+def poll_batches(batchlist):
+    """ Poll sacct for every batch, returning the tables """
+    with catch_warnings():
+        simplefilter('ignore')
+        return [poll_sacct(batch) for batch in batchlist]
+
+
+class MockSlurmTurnaround():
+    params = ([50, 200], [1, 4])
+    param_names = ['num_batches', 'max_jobs']
+    timeout = 600
+    # Every measurement needs freshly prepared batches
+    number = 1
+    repeat = 1
+    warmup_time = 0
+
+    def setup(self, num_batches, max_jobs):
+        self.old_path = os.environ['PATH']
+        self.testdir = tempfile.mkdtemp(prefix='bench_mock_slurm')
+        self.batchlist = setup_batches(self.testdir, num_batches, max_jobs)
+
+    def time_turnaround(self, num_batches, max_jobs):
+        launch_batches(self.batchlist)
+        wait_for_queue()
+        poll_batches(self.batchlist)
+
+    def teardown(self, num_batches, max_jobs):
+        os.environ['PATH'] = self.old_path
+        shutil.rmtree(self.testdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time Slurm submission and polling against a local mock Slurm')
+    parser.add_argument('--num_batches', type=int, default=200,
+                        help='Amount of one-run batches to submit')
+    parser.add_argument('--max_jobs', type=int, default=os.cpu_count(),
+                        help='Amount of jobs the mock Slurm runs concurrently')
+    args = parser.parse_args()
+
+    bench = MockSlurmTurnaround()
+    start = time.perf_counter()
+    bench.setup(args.num_batches, args.max_jobs)
+    prepared = time.perf_counter()
+    try:
+        launch_batches(bench.batchlist)
+        submitted = time.perf_counter()
+        wait_for_queue()
+        finished = time.perf_counter()
+        tables = poll_batches(bench.batchlist)
+        polled = time.perf_counter()
+    finally:
+        bench.teardown(args.num_batches, args.max_jobs)
+    completed = sum(table[0][header.index('State')] == 'COMPLETED'
+                    for header, table in tables)
+    print('{!s:<12} {:8.2f} s'.format('prepare', prepared - start))
+    print('{!s:<12} {:8.2f} s'.format('submit', submitted - prepared))
+    print('{!s:<12} {:8.2f} s'.format('turnaround', finished - prepared))
+    print('{!s:<12} {:8.2f} s'.format('poll', polled - finished))
+    print('{!s:<12} {:8.2f} batches/s'.format('throughput',
+                                              args.num_batches / (polled - prepared)))
+    print('{:d} of {:d} batches COMPLETED'.format(completed, args.num_batches))
@@ -0,0 +1,276 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Benchmarks of the post-processing hot paths: reading the QuaLiKiz text
+output, squeezing, orthogonalizing, gluing and converting to pandas, at
+dimx from 10^2 to 10^6. Written in the airspeed velocity (asv) format,
+run with 'asv run' from the repository root. Can also be run as a script
+to print the timings of a single scale.
+
+The fake runs are written with qualikiz_io.synthetic. Writing and
+reading the text output stops at 10^5 points. squeeze_dataset and orthogonalize_dataset
+loop over every point in Python and stop at 10^4 points, to keep a full
+asv run below an hour. The rest goes up to 10^6 points.
+"""
+import os
+import time
+import shutil
+import tempfile
+import argparse
+from collections import OrderedDict
+from warnings import catch_warnings, simplefilter
+
+import numpy as np
+import xarray as xr
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.synthetic import write_output
+from qualikiz_tools.qualikiz_io.outputfiles import (
+    determine_sizes, load_file, convert_debug, convert_output, convert_primitive,
+    squeeze_dataset, orthogonalize_dataset, merge_many_orthogonal, merge_many_lazy_snakes,
+    xarray_to_pandas)
+
+scales = [10**2, 10**4, 10**6]
+text_scales = [10**2, 10**3, 10**4, 10**5]
+# Steps with a Python loop over all points
+loop_scales = [10**2, 10**3, 10**4]
+dimn = 2
+nions = 2
+numsols = 2
+# Amount of Ate values in the scan, the rest of dimx is scanned in q
+num_ate = 10
+
+
+def scan_values(dimx):
+    """ The scanned Ate and q of every point of a dimx point hyperrect """
+    ate = np.linspace(2, 11, num_ate)
+    q = np.linspace(1, 5, dimx // num_ate)
+    return np.repeat(ate, len(q)), np.tile(q, num_ate)
+
+def bench_plan(dimx):
+    """ Plan of a dimx point hyperrect scan over Ate and q """
+    plan = QuaLiKizPlan.from_defaults()
+    ate, q = scan_values(dimx)
+    plan['scan_type'] = 'hyperrect'
+    plan['scan_dict'] = OrderedDict([('Ate', list(np.unique(ate))),
+                                     ('q', list(np.unique(q)))])
+    plan['xpoint_base']['special']['kthetarhos'] = list(np.linspace(.1, .8, dimn))
+    plan['xpoint_base']['meta']['numsols'] = numsols
+    # Write every file convert_output and convert_primitive look for
+    plan['xpoint_base']['meta']['phys_meth'] = 2
+    return plan
+
+def write_run(rundir, dimx):
+    """ Write a fake QuaLiKiz run with random output
+
+    Args:
+        rundir: Directory to write the debug, output and
+                output/primitive folders in
+        dimx:   Amount of points. Should be a multiple of num_ate
+    """
+    with catch_warnings():
+        simplefilter('ignore')
+        write_output(rundir, plan=bench_plan(dimx))
+
+def read_run(rundir):
+    """ Read a run as run_to_netcdf does, without writing the netCDF """
+    sizes = determine_sizes(rundir)
+    ds = convert_debug(sizes, rundir)
+    ds = convert_output(ds, sizes, rundir)
+    return convert_primitive(ds, sizes, rundir)
+
+def synthetic_dataset(dimx, orthogonal=False, q_offset=0, seed=0):
+    """ Build a dataset like a converted run in memory
+
+    Has the main fluxes and growth rates of a dimx point run, which is
+    enough to benchmark the functions that do not care about the
+    individual variables at scales too big to write as text.
+
+    Kwargs:
+        orthogonal: Fold dimx into the Ate and q dimensions, as
+                    orthogonalize_dataset does
+        q_offset:   Shift q by this value. Datasets with different
+                    offsets can be glued over q
+    """
+    rng = np.random.RandomState(seed)
+    ate, q = scan_values(dimx)
+    q = q + q_offset
+    if orthogonal:
+        point_dims = ['Ate', 'q']
+        coords = OrderedDict([('Ate', np.unique(ate)), ('q', np.unique(q))])
+        point_shape = (num_ate, dimx // num_ate)
+    else:
+        point_dims = ['dimx']
+        coords = OrderedDict([('dimx', np.arange(dimx)),
+                              ('Ate', ('dimx', ate)), ('q', ('dimx', q))])
+        point_shape = (dimx, )
+    coords['kthetarhos'] = np.linspace(.1, .8, dimn)
+    coords['nions'] = np.arange(nions)
+    coords['numsols'] = np.arange(numsols)
+    data_vars = OrderedDict()
+    for var, extra_dims in [('efe', []), ('pfe', []), ('efi', ['nions']),
+                            ('pfi', ['nions']), ('vfi', ['nions']),
+                            ('gam', ['kthetarhos', 'numsols']),
+                            ('ome', ['kthetarhos', 'numsols'])]:
+        shape = point_shape + tuple(len(coords[dim]) for dim in extra_dims)
+        for unit in ['_SI', '_GB']:
+            data_vars[var + unit] = (point_dims + extra_dims, rng.rand(*shape))
+    ds = xr.Dataset(data_vars, coords=coords)
+    ds.attrs['Zeff'] = 1.
+    return ds
+
+
+class ReadOutput():
+    params = text_scales
+    param_names = ['dimx']
+    timeout = 1800
+
+    def setup_cache(self):
+        # asv calls setup_cache in a directory it removes afterwards
+        rootdir = os.path.abspath('runs')
+        for dimx in text_scales:
+            write_run(os.path.join(rootdir, str(dimx)), dimx)
+        return rootdir
+
+    def setup(self, rootdir, dimx):
+        self.rundir = os.path.join(rootdir, str(dimx))
+        self.sizes = determine_sizes(self.rundir)
+        self.ds = convert_debug(self.sizes, self.rundir)
+
+    def time_load_file(self, rootdir, dimx):
+        load_file(self.rundir, 'output', 'gam_GB')
+
+    def time_convert_output(self, rootdir, dimx):
+        convert_output(self.ds.copy(), self.sizes, self.rundir)
+
+    def time_convert_primitive(self, rootdir, dimx):
+        convert_primitive(self.ds.copy(), self.sizes, self.rundir)
+
+
+class LoopFixture():
+    """ Fake runs for the benchmarks with a Python loop over all points """
+    params = loop_scales
+    param_names = ['dimx']
+    timeout = 1800
+    # The benchmarked functions change the dataset they are given
+    number = 1
+    warmup_time = 0
+
+    def setup_cache(self):
+        rootdir = os.path.abspath('runs')
+        for dimx in loop_scales:
+            write_run(os.path.join(rootdir, str(dimx)), dimx)
+        return rootdir
+
+
+class Squeeze(LoopFixture):
+    def setup(self, rootdir, dimx):
+        self.ds = read_run(os.path.join(rootdir, str(dimx)))
+
+    def time_squeeze_dataset(self, rootdir, dimx):
+        with catch_warnings():
+            simplefilter('ignore')
+            squeeze_dataset(self.ds)
+
+
+class Orthogonalize(LoopFixture):
+    def setup(self, rootdir, dimx):
+        with catch_warnings():
+            simplefilter('ignore')
+            self.ds = squeeze_dataset(read_run(os.path.join(rootdir, str(dimx))))
+
+    def time_orthogonalize_dataset(self, rootdir, dimx):
+        with catch_warnings():
+            simplefilter('ignore')
+            orthogonalize_dataset(self.ds)
+
+
+class PlanSetupScan():
+    params = scales
+    param_names = ['dimx']
+    timeout = 1800
+
+    def setup(self, dimx):
+        self.plan = bench_plan(dimx)
+
+    def time_setup_scan(self, dimx):
+        with catch_warnings():
+            simplefilter('ignore')
+            self.plan.setup()
+
+
+class Glue():
+    params = scales
+    param_names = ['dimx']
+    timeout = 1800
+    # Amount of runs glued together
+    num_runs = 4
+    number = 1
+    warmup_time = 0
+
+    def setup(self, dimx):
+        self.testdir = tempfile.mkdtemp(prefix='bench_glue')
+        self.dss = [synthetic_dataset(dimx // self.num_runs, orthogonal=True,
+                                      q_offset=ii * 10, seed=ii)
+                    for ii in range(self.num_runs)]
+
+    def time_merge_many_orthogonal(self, dimx):
+        merge_many_orthogonal(self.dss)
+
+    def time_merge_many_lazy_snakes(self, dimx):
+        merge_many_lazy_snakes(os.path.join(self.testdir, 'glued.nc'), self.dss).close()
+
+    def teardown(self, dimx):
+        shutil.rmtree(self.testdir, ignore_errors=True)
+
+
+class ToPandas():
+    params = scales
+    param_names = ['dimx']
+    timeout = 1800
+
+    def setup(self, dimx):
+        self.ds = synthetic_dataset(dimx)
+
+    def time_xarray_to_pandas(self, dimx):
+        xarray_to_pandas(self.ds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time the post-processing steps for a single dimx')
+    parser.add_argument('--dimx', type=int, default=10**4,
+                        help='Amount of points, a multiple of {:d}'.format(num_ate))
+    args = parser.parse_args()
+
+    def report(name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        print('{!s:<28} {:8.3f} s'.format(name, time.perf_counter() - start))
+        return result
+
+    rootdir = tempfile.mkdtemp(prefix='bench_outputfiles')
+    try:
+        rundir = os.path.join(rootdir, 'run')
+        report('write_run', write_run, rundir, args.dimx)
+        sizes = report('determine_sizes', determine_sizes, rundir)
+        ds = report('convert_debug', convert_debug, sizes, rundir)
+        ds = report('convert_output', convert_output, ds, sizes, rundir)
+        ds = report('convert_primitive', convert_primitive, ds, sizes, rundir)
+        with catch_warnings():
+            simplefilter('ignore')
+            ds = report('squeeze_dataset', squeeze_dataset, ds)
+            report('orthogonalize_dataset', orthogonalize_dataset, ds)
+            plan = PlanSetupScan()
+            plan.setup(args.dimx)
+            report('setup_scan', plan.time_setup_scan, args.dimx)
+        glue = Glue()
+        glue.setup(args.dimx)
+        report('merge_many_orthogonal', glue.time_merge_many_orthogonal, args.dimx)
+        report('merge_many_lazy_snakes', glue.time_merge_many_lazy_snakes, args.dimx)
+        glue.teardown(args.dimx)
+        report('xarray_to_pandas', xarray_to_pandas, synthetic_dataset(args.dimx))
+    finally:
+        shutil.rmtree(rootdir, ignore_errors=True)
@@ -4,20 +4,26 @@ qualikiz_tools
 
 Usage:
   qualikiz_tools <command> [<args>...]
-  qualikiz_tools [-v | -vv] <command> [<args>...]
+  qualikiz_tools [-v | -vv] [--instrument=<path>] <command> [<args>...]
 
 Options:
   -h --help                         Show this screen.
   [-v | -vv]                        Verbosity 
   --version                         Show version.
+  --instrument=<path>               Record the time spent per stage and write
+                                    it to <path> on exit. Chrome trace JSON, or
+                                    SQLite if <path> ends in .sqlite(3) or .db
 
 Examples:
+  qualikiz_tools campaign
+  qualikiz_tools compare
   qualikiz_tools create
   qualikiz_tools dump
   qualikiz_tools input
   qualikiz_tools launcher
   qualikiz_tools output
   qualikiz_tools plot
+  qualikiz_tools scaling
 
 Help:
   For help using this tool, please open an issue on the Github repository:
@@ -59,7 +65,17 @@ def main():
         print (passing)
         print ()
 
-    if args['<command>'] == 'create':
+    if args['--instrument'] is not None:
+        from qualikiz_tools.qualikiz_io import instrumentation
+        instrumentation.enable(args['--instrument'])
+
+    if args['<command>'] == 'campaign':
+        from qualikiz_tools.commands import campaign
+        campaign.run(passing)
+    elif args['<command>'] == 'compare':
+        from qualikiz_tools.commands import compare
+        compare.run(passing)
+    elif args['<command>'] == 'create':
         from qualikiz_tools.commands import create
         create.run(passing)
     elif args['<command>'] == 'dump':
@@ -77,6 +93,9 @@ def main():
     elif args['<command>'] == 'plot':
         from qualikiz_tools.commands import plot
         plot.run(passing)
+    elif args['<command>'] == 'scaling':
+        from qualikiz_tools.commands import scaling
+        scaling.run(passing)
     elif args['<command>'] == 'poll':
         from qualikiz_tools.commands import poll
         poll.run(passing)
@@ -0,0 +1,89 @@
+"""
+Usage:
+  qualikiz_tools campaign [-v | -vv] [--db <path>] [--state <state>] <command> <target_path>
+  qualikiz_tools campaign [-v | -vv] help
+
+Query and update the campaign state database, which tracks the lifecycle of every run:
+prepared, input_generated, launched, done, netcdf and glued. Only runs in <target_path> are considered.
+
+Commands:
+  status      Count the runs per state
+  list        List the runs and their state. Use --state to only list runs in that state
+  refresh     Mark launched runs that wrote all their output as done
+  sync        Add the runs not created by qualikiz_tools, deriving their state from the filesystem
+  to_netcdf   Convert the output of all done runs to netCDF
+
+Options:
+  --db <path>                       Path of the campaign database. Default from QUALIKIZ_CAMPAIGN_DB, one of them is required.
+  --state <state>                   Only consider runs in this state.
+  -h --help                         Show this screen.
+  [-v | -vv]                        Verbosity
+
+Often used commands:
+  qualikiz_tools campaign refresh .
+  qualikiz_tools campaign status .
+  qualikiz_tools campaign --state done list .
+
+"""
+from docopt import docopt
+from subprocess import call
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+from tabulate import tabulate
+from qualikiz_tools.qualikiz_io.campaign import CampaignDB, campaign_env_var, default_campaign_path
+from qualikiz_tools import __path__ as ROOT
+ROOT = ROOT[0]
+
+if __name__ == '__main__':
+    print (docopt(__doc__))
+
+def run(args):
+    args = docopt(__doc__, argv=args)
+
+    if args['-v'] >= 2:
+        print ('output received:')
+        print (args)
+        print ()
+
+    if args['<target_path>'] in ['help', None] or args['<command>'] in ['help', None]:
+        exit(call([sys.executable, __file__, '--help']))
+
+    if args['--db'] is not None:
+        # Also record the runs converted by this command in it
+        os.environ[campaign_env_var] = args['--db']
+    if default_campaign_path() is None:
+        exit('No campaign database. Pass --db or set {!s}'.format(campaign_env_var))
+
+    target_path = args['<target_path>']
+    with CampaignDB() as db:
+        if args['<command>'] == 'status':
+            counts = db.counts(target_path)
+            print(tabulate(list(counts.items()) + [('total', sum(counts.values()))],
+                           headers=['state', 'runs']))
+        elif args['<command>'] == 'list':
+            for rundir, state in db.runs(target_path, state=args['--state']).items():
+                print('{!s:<16} {!s}'.format(state, rundir))
+        elif args['<command>'] == 'refresh':
+            done = db.refresh(target_path)
+            if args['-v'] >= 1:
+                for rundir in done:
+                    print('done: {!s}'.format(rundir))
+            print('{:d} runs newly done'.format(len(done)))
+        elif args['<command>'] == 'sync':
+            added = db.sync(target_path)
+            if args['-v'] >= 1:
+                for rundir, state in added.items():
+                    print('{!s:<16} {!s}'.format(state, rundir))
+            print('{:d} runs added'.format(len(added)))
+        elif args['<command>'] == 'to_netcdf':
+            from qualikiz_tools.qualikiz_io.qualikizrun import run_to_netcdf
+            state = args['--state'] if args['--state'] is not None else 'done'
+            rundirs = list(db.runs(target_path, state=state))
+            for rundir in rundirs:
+                if args['-v'] >= 1:
+                    print('Converting {!s}'.format(rundir))
+                run_to_netcdf(rundir, overwrite=True)
+            print('{:d} runs converted'.format(len(rundirs)))
+        else:
+            exit("%r is not a valid command. See 'qualikiz_tools campaign help'." % args['<command>'])
@@ -0,0 +1,65 @@
+"""
+Usage:
+  qualikiz_tools compare [-v | -vv] [--rtol <rtol>] [--atol <atol>] [--processes <n>] [--json | --all] <path> <reference_path>
+  qualikiz_tools compare [-v | -vv] help
+
+  Compare a QuaLiKiz run with a reference run, or a netCDF file with a reference netCDF file.
+  Prints a row of statistics per differing file or variable and exits with status 1 if they differ.
+
+Options:
+  --rtol <rtol>                     Relative tolerance [default: 1e-2]
+  --atol <atol>                     Absolute tolerance [default: 0]
+  --processes <n>                   Amount of processes to read runs with, 'max' for all cores [default: 1]
+  --json                            Print the statistics of all files or variables as JSON
+  --all                             Also list identical files or variables
+  -h --help                         Show this screen.
+  [-v | -vv]                        Verbosity
+
+Often used commands:
+  qualikiz_tools compare --processes max runs/new runs/reference
+  qualikiz_tools compare new.nc reference.nc
+
+"""
+from docopt import docopt
+from subprocess import call
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+from qualikiz_tools import __path__ as ROOT
+ROOT = ROOT[0]
+
+if __name__ == '__main__':
+    print (docopt(__doc__))
+
+def run(args):
+    args = docopt(__doc__, argv=args)
+
+    if args['-v'] >= 2:
+        print ('compare received:')
+        print (args)
+        print ()
+
+    if args['<path>'] in ['help', None]:
+        exit(call([sys.executable, __file__, '--help']))
+
+    from qualikiz_tools.fs_manipulation.compare import (compare_run_folders, compare_datasets,
+                                                        is_different, report_table, report_json)
+    rtol = float(args['--rtol'])
+    atol = float(args['--atol'])
+    paths = [args['<path>'], args['<reference_path>']]
+    if all(os.path.isdir(path) for path in paths):
+        processes = args['--processes']
+        if processes != 'max':
+            processes = int(processes)
+        stats = compare_run_folders(*paths, rtol=rtol, atol=atol, processes=processes)
+    elif all(os.path.isfile(path) for path in paths):
+        stats = compare_datasets(*paths, rtol=rtol, atol=atol)
+    else:
+        exit('Compare two run folders or two netCDF files')
+
+    if args['--json']:
+        print(report_json(stats))
+    else:
+        print(report_table(stats, show_all=args['--all']))
+    if is_different(stats):
+        exit(1)
@@ -5,6 +5,8 @@ Usage:
 
   For example, create input binaries for QuaLiKiz batch or run contained in <target_path>
       qualikiz_tools input generate <target_path>
+  Or check all points of the QuaLiKiz batch or run for unphysical input
+      qualikiz_tools input validate <target_path>
 
 Options:
   --version <version>               Version of QuaLiKiz to generate input for [default: current]
@@ -13,6 +15,7 @@ Options:
 
 Often used commands:
   qualikiz_tools input generate <target_path>
+  qualikiz_tools input validate <target_path>
 
 """
 from docopt import docopt
@@ -46,15 +49,25 @@ def run(args):
         if args['<command>'] == 'generate':
             if args['-v'] >= 2:
                 kwargs['dotprint'] = True
-            if args['--version'] == 'current':
-                pass
-            elif args['--version'] in ['2.4.0', '2.3.2', '2.3.1', 'CEA_QuaLiKiz']:
-                from qualikiz_tools.qualikiz_io.legacy import convert_current_to
-                convert = lambda inputdir: convert_current_to(inputdir, target=args['--version'])
-                kwargs['conversion'] = convert
-            else:
+            from qualikiz_tools.qualikiz_io.legacy import versions
+            if args['--version'] not in versions:
                 raise Exception('Unknown version {!s}'.format(args['--version']))
+            kwargs['version'] = args['--version']
             qlk_instance.generate_input(**kwargs)
+        elif args['<command>'] == 'validate':
+            from qualikiz_tools.qualikiz_io.validation import validate_plan
+            if dirtype == 'batch':
+                runlist = qlk_instance.runlist
+            else:
+                runlist = [qlk_instance]
+            for qlk_run in runlist:
+                table = validate_plan(qlk_run.qualikiz_plan)
+                if len(table) == 0:
+                    print('{!s}: all points valid'.format(qlk_run.rundir))
+                else:
+                    print('{!s}: {:d} violations in {:d} points'.format(
+                        qlk_run.rundir, len(table), len(table['dimx'].unique())))
+                    print(table.to_string(index=False))
 
     elif args['<target_path>'] in ['help', None] or args['<command>'] in ['help', None]:
         exit(call([sys.executable, __file__, '--help']))
@@ -1,6 +1,6 @@
 """
 Usage:
-  qualikiz_tools launcher [-v | -vv] [--stdout <path>] [--stderr <path>] <command> <machine> <target_path>
+  qualikiz_tools launcher [-v | -vv] [--stdout <path>] [--stderr <path>] [--style <style>] [--resume] <command> <machine> <target_path>
   qualikiz_tools launcher [-v | -vv] help
 
   Launch a job using the machine-specific QuaLiKiz tools. In principle the 'bash' machine is machine-agnostic. It needs bash and mpirun at minimum. This command will create input binaries if they are missing.
@@ -9,11 +9,15 @@ Options:
   --version <version>               Version of QuaLiKiz to generate input for [default: current]
   --stdout <path>                   Path to put STDOUT. Default depends on <machine>.
   --stderr <path>                   Path to put STDERR. Default depends on <machine>.
+  --style <style>                   How to run the runs of a batch, for example 'concurrent' for the 'bash' machine. Default depends on <machine>.
+  --resume                          Only launch the runs that did not write all their output. Output of complete runs is kept.
   -h --help                         Show this screen.
   [-v | -vv]                        Verbosity
 
 Example command:
   qualikiz_tools launcher launch bash .
+  qualikiz_tools launcher --style concurrent launch bash .
+  qualikiz_tools launcher --resume launch bash .
 
 """
 from docopt import docopt
@@ -70,11 +74,33 @@ def run(args):
         if isinstance(qlk_instance, Run):
             qlk_instance.prepare(overwrite=False)
         elif isinstance(qlk_instance, Batch):
+            if args['--style'] is not None:
+                if args['--style'] not in getattr(Batch, 'styles', []):
+                    raise NotImplementedError('Style {!s} not implemented for machine {!s}'.format(args['--style'], args['<machine>']))
+                qlk_instance.style = args['--style']
             qlk_instance.prepare(overwrite_batch=False, overwrite_batch_script=True)
         else:
             raise Exception('Unrecognized instance {!s} for machine {!s}'.format(qlk_instance, args['<machine>']))
-        qlk_instance.generate_input()
-        qlk_instance.launch()
+        if args['--resume']:
+            if isinstance(qlk_instance, Batch):
+                runlist = qlk_instance.incomplete_runs()
+            elif qlk_instance.is_complete():
+                runlist = []
+            else:
+                runlist = [qlk_instance]
+            if len(runlist) == 0:
+                print('All output of {!s} is complete, nothing to resume'.format(args['<target_path>']))
+                return
+            for run in runlist:
+                if not run.inputbinaries_exist():
+                    run.generate_input()
+            if isinstance(qlk_instance, Batch):
+                qlk_instance.launch(resume=True)
+            else:
+                qlk_instance.launch()
+        else:
+            qlk_instance.generate_input()
+            qlk_instance.launch()
     elif args['<target_path>'] in ['help', None] or args['<command>'] in ['help', None]:
         exit(call([sys.executable, __file__, '--help']))
     else:
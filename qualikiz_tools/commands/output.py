@@ -3,7 +3,9 @@ Usage:
   qualikiz_tools output [-v | -vv] [options] <command> <target_path>
   qualikiz_tools output [-v | -vv] help
 
-Process QuaLiKiz ASCII output files. For example, convert to netCDF.
+Process QuaLiKiz ASCII output files. For example, convert to netCDF. The watch command
+keeps running, converting every run to netCDF as soon as it finishes. With --orthogonal,
+batches are glued once all their runs are converted.
 
 Options:
   --orthogonal                      Try to fold dataset into hypercube. Assumes run was orthogonal
@@ -12,11 +14,15 @@ Options:
   --delfile                         Delete files read by output parser.
   -r --recursive                    Recurse once into subdirectories. Only finds batches one deep!
   --snake                           Glue hypercubes together as a snake
+  --interval <seconds>              Time between checks for finished runs when watching [default: 10]
+  --processes <n>                   Amount of runs converted in parallel when watching [default: 1]
+  --timeout <seconds>               Stop watching after this time. Watch until all runs are converted by default.
   -h --help                         Show this screen.
   [-v | -vv]                        Verbosity
 
 Often used commands:
   qualikiz_tools output to_netcdf <target_path>
+  qualikiz_tools output --processes 4 watch <target_path>
 
 """
 from docopt import docopt
@@ -103,6 +109,33 @@ def run(args):
                 dsnew = merge_many_orthogonal(dss, **kwargs)
                 dsnew.to_netcdf(multibatch_name)
 
+    elif args['<command>'] == 'watch':
+        from qualikiz_tools.qualikiz_io.watch import watch
+        if dirtype == 'batchlist':
+            targets = batchlist
+        else:
+            targets = [qlk_instance]
+        run_kwargs = {}
+        glue = None
+        if args['--genfromtxt']:
+            run_kwargs['genfromtxt'] = True
+        if args['--delfile'] is True:
+            run_kwargs['keepfile'] = False
+        if args['--orthogonal']:
+            run_kwargs['runmode'] = 'orthogonal'
+            glue = 'glue_snake' if args['--snake'] else 'glue_orthogonal'
+        timeout = args['--timeout']
+        if timeout is not None:
+            timeout = float(timeout)
+        results = watch(targets, poll_interval=float(args['--interval']),
+                        processes=int(args['--processes']), glue=glue,
+                        timeout=timeout, run_kwargs=run_kwargs,
+                        verbose=args['-v'] >= 1)
+        failed = [rundir for rundir, result in results.items() if result is not None]
+        print('Converted {:d} runs'.format(len(results) - len(failed)))
+        if len(failed) != 0:
+            exit('Failed to convert {!s}'.format(', '.join(failed)))
+
     # Some legacy commands that might need to be re-implemented
     #elif args['<command>'] == 'squeeze':
     #    from qualikiz_tools.qualikiz_io.outputfiles import squeeze_dataset, orthogonalize_dataset, determine_sizes
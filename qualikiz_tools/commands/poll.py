@@ -1,13 +1,25 @@
 """
 Usage:
-  qualikiz_tools poll [-v | -vv]  <command> <poll_path> [<database_path>]
+  qualikiz_tools poll [-v | -vv] [--processes <n>] [--overwrite] [--index] <command> <poll_path> [<database_path>]
   qualikiz_tools poll [-v | -vv] help
 
+  Collect performance data of all batches in <poll_path> in an SQLite database, by default polldb.sqlite3.
+
+Commands:
+  basic     Parse the profiling output in the STDOUT of every run
+  sacct     Query the Slurm accounting of every batch, with as few sacct calls as possible
+  craypat   Read the CrayPat profile of every run with pat_report
+  samples   Collect the resource samples of every run launched with QUALIKIZ_SAMPLE_INTERVAL set
+
 Options:
+  --processes <n>                   Amount of processes to parse with, 'max' for all cores [default: 1]
+  --overwrite                       Overwrite an existing database instead of asking
+  --index                           Find the batches with the persistent directory index. Also enabled by setting QUALIKIZ_DIR_INDEX to the path of the index
   -h --help                         Show this screen.
-  [-v | -vv]                        Verbosity 
+  [-v | -vv]                        Verbosity
 
 Often used commands:
+  qualikiz_tools poll --processes max basic .
 
 """
 from docopt import docopt
@@ -23,7 +35,6 @@ if __name__ == '__main__':
     print (docopt(__doc__))
 
 def run(args):
-    raise NotImplementedError('Polling of statistics not available yet')
     args = docopt(__doc__, argv=args)
 
     if args['-v'] >= 2:
@@ -31,14 +42,33 @@ def run(args):
         print (args)
         print ()
 
+    if args['<database_path>']:
+        database_path = args['<database_path>']
+    else:
+        database_path = 'polldb.sqlite3'
+    processes = args['--processes']
+    if processes != 'max':
+        processes = int(processes)
+    kwargs = {}
+    if args['--overwrite']:
+        kwargs['overwrite'] = True
+        kwargs['append'] = False
+    if args['--index']:
+        kwargs['use_index'] = True
+
     if args['<command>'] == 'basic':
         from qualikiz_tools.machine_specific.basicpoll import create_database
-        if args['<database_path>']:
-            database_path = args['<database_path>']
-        else:
-            database_path = 'polldb.sqlite3'
-        create_database(args['<poll_path>'], database_path)
-    elif args['<target_path>'] in ['help', None] or args['<command>'] in ['help', None]:
+        create_database(args['<poll_path>'], database_path, processes=processes, **kwargs)
+    elif args['<command>'] == 'sacct':
+        from qualikiz_tools.machine_specific.sacct import create_database
+        create_database(args['<poll_path>'], database_path, **kwargs)
+    elif args['<command>'] == 'craypat':
+        from qualikiz_tools.machine_specific.craypat import create_database
+        create_database(args['<poll_path>'], database_path, processes=processes, **kwargs)
+    elif args['<command>'] == 'samples':
+        from qualikiz_tools.machine_specific.procsampler import create_database
+        create_database(args['<poll_path>'], database_path, **kwargs)
+    elif args['<poll_path>'] in ['help', None] or args['<command>'] in ['help', None]:
         exit(call([sys.executable, __file__, '--help']))
     else:
-        exit("%r is not a valid target. See 'qualikiz_tools poll help'." % args['<target_path>'])
+        exit("%r is not a valid command. See 'qualikiz_tools poll help'." % args['<command>'])
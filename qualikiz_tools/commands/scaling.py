@@ -0,0 +1,87 @@
+"""
+Usage:
+  qualikiz_tools scaling [-v | -vv] [--model <path>] [--plot <path>] fit <database_path>
+  qualikiz_tools scaling [-v | -vv] [--model <path>] [--cores <cores>] recommend <dimxn> <max_walltime>
+  qualikiz_tools scaling [-v | -vv] help
+
+  Analyse the strong and weak scaling of QuaLiKiz and recommend the amount of cores to use.
+
+Commands:
+  fit         Fit the scaling model per timing component on the stdout table of <database_path>, see 'qualikiz_tools poll basic'
+  recommend   Recommend the amount of cores that runs <dimxn> points within <max_walltime> seconds at the least CPU time
+
+Options:
+  --model <path>                    Path to store the fitted model at, or to load it from. Default from QUALIKIZ_SCALING_MODEL
+  --plot <path>                     Save the scaling curves to this file. Shown on screen by default
+  --cores <cores>                   Comma-separated amounts of cores to choose from. By default powers of two up to 4096
+  -h --help                         Show this screen.
+  [-v | -vv]                        Verbosity
+
+Often used commands:
+  qualikiz_tools scaling --model scaling.json fit polldb.sqlite3
+  qualikiz_tools scaling --model scaling.json recommend 24000 3600
+
+"""
+from docopt import docopt
+from subprocess import call
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+from tabulate import tabulate
+from qualikiz_tools import __path__ as ROOT
+ROOT = ROOT[0]
+
+if __name__ == '__main__':
+    print (docopt(__doc__))
+
+def run(args):
+    args = docopt(__doc__, argv=args)
+
+    if args['-v'] >= 2:
+        print ('scaling received:')
+        print (args)
+        print ()
+
+    from qualikiz_tools.qualikiz_io.scaling import (ScalingModel, read_profiling,
+                                                    load_model, plot_scaling, terms)
+    if args['fit']:
+        table = read_profiling(args['<database_path>'])
+        model = ScalingModel().fit(table)
+        rows = [[component] + coefficients + [fraction]
+                for (component, coefficients), fraction
+                in zip(model.coefficients.items(),
+                       model.serial_fraction(table['dimxn'].median()).values())]
+        print(tabulate(rows, headers=['component'] + terms + ['serial fraction'],
+                       floatfmt='.3g'))
+        print('Fitted on {:d} runs, relative error {:.1%}'.format(model.num_samples,
+                                                                  model.sigma))
+        if args['--model'] is not None:
+            model.to_json(args['--model'])
+        if args['--plot'] is not None:
+            import matplotlib
+            matplotlib.use('Agg')
+        fig = plot_scaling(table, model=model)
+        if args['--plot'] is not None:
+            fig.savefig(args['--plot'])
+        else:
+            import matplotlib.pyplot as plt
+            plt.show()
+    elif args['recommend']:
+        model = load_model(args['--model'])
+        if model is None:
+            exit('No scaling model configured. Use --model or set QUALIKIZ_SCALING_MODEL')
+        if args['--cores'] is not None:
+            candidates = [int(cores) for cores in args['--cores'].split(',')]
+        else:
+            candidates = [2 ** ii for ii in range(13)]
+        dimxn = int(args['<dimxn>'])
+        max_walltime = float(args['<max_walltime>'])
+        if args['-v'] >= 1:
+            walltimes = model.walltime(dimxn, candidates)
+            print(tabulate([[cores, walltime, walltime * cores / 3600]
+                            for cores, walltime in zip(candidates, walltimes)],
+                           headers=['cores', 'walltime [s]', 'CPU time [h]'],
+                           floatfmt='.1f'))
+        print(model.recommend_cores(dimxn, max_walltime, candidates))
+    else:
+        exit(call([sys.executable, __file__, '--help']))
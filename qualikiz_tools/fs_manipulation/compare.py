@@ -2,11 +2,32 @@
 Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
 Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
 License: CeCILL v2.1
+
+Compare two QuaLiKiz runs, or two netCDF datasets, for regression tests.
+
+Files are read in parallel with a fast parser that reads tokens it cannot
+parse, like the asterisks Fortran writes on overflow, as NaN. Every file
+or variable gets a row of summary statistics, see compare_arrays, which
+can be reported as a compact table or as JSON.
 """
 import os
 import re
+import json
 import warnings
+from collections import OrderedDict
+
 import numpy as np
+import pandas as pd
+import xarray as xr
+
+from qualikiz_tools import netcdf4_engine
+
+stat_fields = ['name', 'status', 'shape1', 'shape2', 'max_abs_err', 'max_rel_err',
+               'mismatches', 'first_mismatch']
+run_folders = OrderedDict([('debug', 'ascii_to_np'),
+                           ('input', 'bin_to_np'),
+                           ('output', 'ascii_to_np'),
+                           ('output/primitive', 'ascii_to_np')])
 
 
 def atoi(text):
@@ -36,21 +57,38 @@ def diff_filelist(folder1, folder2):
     return (not_in_1, not_in_2, in_both)
 
 
+def _to_float(token):
+    try:
+        return float(token)
+    except ValueError:
+        return np.nan
+
+def read_dat(filepath):
+    """ Read a QuaLiKiz text file as 2D array
+
+    Uses the C parser of pandas. If the file contains tokens that are
+    not plain floats, like Infinity or the asterisks Fortran writes on
+    overflow, it is read again as strings which are converted one by one.
+    Tokens that are not floats become NaN.
+
+    Returns:
+        2D float64 array with a row per line. A writable copy, as the
+        values of a DataFrame can be a read-only view
+    """
+    kwargs = dict(sep=r'\s+', header=None)
+    try:
+        return np.array(pd.read_csv(filepath, dtype='float64', **kwargs).values,
+                        dtype='float64', copy=True)
+    except pd.errors.EmptyDataError:
+        return np.empty((0, 0))
+    except ValueError:
+        tokens = pd.read_csv(filepath, dtype=str, na_filter=False, **kwargs).values
+        return np.vectorize(_to_float, otypes=['float64'])(tokens)
+
+
 def ascii_to_np(filepath):
     if filepath.endswith('.dat'):
-        with open(filepath, 'rb') as file:
-            try:
-                nparr = np.loadtxt(file)
-            except ValueError as error:
-                l_ = error.args[0].find('\'')
-                r_ = error.args[0].rfind('\'')
-                errorstr = error.args[0][l_+1:r_].encode('utf-8')
-                file.seek(0)
-                newlines = []
-                for line in file:
-                    newlines.append(line.replace(errorstr, b'NaN'))
-                nparr = np.loadtxt(newlines)
-        return nparr
+        return read_dat(filepath)
     else:
         warnings.warn('\'' + filepath + '\' is not ascii, ignoring..')
 
@@ -64,52 +102,242 @@ def bin_to_np(filepath):
         warnings.warn('\'' + filepath + '\' is not binary, ignoring..')
 
 
-def diff(folder1, folder2, to_np, rtol=1e-2):
+def compare_arrays(arr1, arr2, rtol=1e-2, atol=0., name=None):
+    """ Summary statistics of the difference of two arrays
+
+    Elements mismatch if they are not close following np.isclose with
+    arr2 as reference. NaNs at the same place are equal.
+
+    Args:
+        arr1: The array to check
+        arr2: The reference array
+
+    Kwargs:
+        rtol: Relative tolerance
+        atol: Absolute tolerance
+        name: Name of the compared file or variable
+
+    Returns:
+        OrderedDict with the stat_fields. status is 'identical',
+        'different' or 'shape' if the shapes differ. The errors are
+        None if the shapes differ. max_rel_err is relative to the
+        largest absolute value of the two elements. first_mismatch is
+        the index of the first mismatching element or None
+    """
+    arr1 = np.asarray(arr1)
+    arr2 = np.asarray(arr2)
+    stats = OrderedDict((field, None) for field in stat_fields)
+    stats['name'] = name
+    stats['shape1'] = list(arr1.shape)
+    stats['shape2'] = list(arr2.shape)
+    if arr1.shape != arr2.shape:
+        stats['status'] = 'shape'
+        return stats
+    if not (np.issubdtype(arr1.dtype, np.number) and np.issubdtype(arr2.dtype, np.number)):
+        mismatch = arr1 != arr2
+        abs_err = rel_err = np.zeros(0)
+    else:
+        arr1 = arr1.astype('float64')
+        arr2 = arr2.astype('float64')
+        mismatch = ~np.isclose(arr1, arr2, rtol=rtol, atol=atol, equal_nan=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            abs_err = np.abs(arr1 - arr2)
+            rel_err = abs_err / np.maximum(np.abs(arr1), np.abs(arr2))
+        # Equal elements, including both zero and both infinite, have no error
+        equal = arr1 == arr2
+        abs_err = abs_err[~equal & np.isfinite(abs_err)]
+        rel_err = rel_err[~equal & np.isfinite(rel_err)]
+    stats['max_abs_err'] = float(abs_err.max()) if abs_err.size > 0 else 0.
+    stats['max_rel_err'] = float(rel_err.max()) if rel_err.size > 0 else 0.
+    stats['mismatches'] = int(np.count_nonzero(mismatch))
+    if stats['mismatches'] > 0:
+        stats['status'] = 'different'
+        first = np.flatnonzero(mismatch)[0]
+        stats['first_mismatch'] = [int(ii) for ii in np.unravel_index(first, mismatch.shape)]
+    else:
+        stats['status'] = 'identical'
+    return stats
+
+def missing_stats(name, missing_in):
+    """ Statistics of a file or variable that is missing in one of the two """
+    stats = OrderedDict((field, None) for field in stat_fields)
+    stats['name'] = name
+    stats['status'] = 'missing' + str(missing_in)
+    return stats
+
+def compare_files(job):
+    """ Compare two files
+
+    Args:
+        job: Tuple of (name, path1, path2, reader, rtol, atol). reader is
+             the function that reads the files into arrays, or its name
+             in this module
+
+    Returns:
+        The statistics as returned by compare_arrays. The status is
+        'unreadable' if the reader returns None or fails
+    """
+    name, path1, path2, reader, rtol, atol = job
+    if isinstance(reader, str):
+        reader = globals()[reader]
+    try:
+        arr1 = reader(path1)
+        arr2 = reader(path2)
+    except (OSError, ValueError) as ee:
+        warnings.warn('Could not read \'' + name + '\': ' + str(ee))
+        arr1 = arr2 = None
+    if arr1 is None or arr2 is None:
+        stats = missing_stats(name, None)
+        stats['status'] = 'unreadable'
+        return stats
+    return compare_arrays(arr1, arr2, rtol=rtol, atol=atol, name=name)
+
+def compare_folders(folder1, folder2, to_np, rtol=1e-2, atol=0., processes=1,
+                    prefix=''):
+    """ Compare the files of two folders
+
+    Args:
+        folder1: The folder to check
+        folder2: The reference folder
+        to_np:   Function to read a file into an array, or its name in this
+                 module. Should be defined on module level to use more
+                 than one process
+
+    Kwargs:
+        rtol:      Relative tolerance, see compare_arrays
+        atol:      Absolute tolerance, see compare_arrays
+        processes: Amount of processes to read and compare with. 'max'
+                   to use all cores
+        prefix:    Prefix of the file names in the statistics
+
+    Returns:
+        List with the statistics per file, see compare_arrays. Files
+        missing in folder1 or folder2 have the status 'missing1' or
+        'missing2'
+    """
+    from qualikiz_tools.machine_specific.basicpoll import parallel_map
     not_in_1, not_in_2, in_both = diff_filelist(folder1, folder2)
-    different = False
-    if len(not_in_1) > 0:
-        print('Files not in \'' + folder1 + '\':')
-        for filename in not_in_1:
-            print(os.path.basename(filename))
-            print(to_np(os.path.join(folder2, filename)))
-        different = True
-    if len(not_in_2) > 0:
-        print('Files not in \'' + folder2 + '\':')
-        for filename in not_in_2:
-            print(os.path.basename(filename))
-            print(to_np(os.path.join(folder1, filename)))
-        different = True
-
-    print('Files in both:')
-    for filename in in_both:
-        arr1 = to_np(os.path.join(folder1, filename))
-        arr2 = to_np(os.path.join(folder2, filename))
-        if arr1 is not None and arr2 is not None:
-            try:
-                isclose = np.allclose(arr1, arr2, rtol=rtol, equal_nan=True)
-            except ValueError:
-                isclose = False
-            if not isclose or not arr1.shape == arr2.shape:
-                print(os.path.basename(filename))
-                print(arr1)
-                print(arr2)
-                different = True
+    stats = [missing_stats(prefix + filename, 1) for filename in not_in_1]
+    stats.extend(missing_stats(prefix + filename, 2) for filename in not_in_2)
+    jobs = [(prefix + filename, os.path.join(folder1, filename),
+             os.path.join(folder2, filename), to_np, rtol, atol)
+            for filename in in_both]
+    stats.extend(parallel_map(compare_files, jobs, processes=processes, chunksize=1))
+    return stats
+
+def compare_run_folders(folder1, folder2, rtol=1e-2, atol=0., processes=1):
+    """ Compare the debug, input, output and primitive files of two runs
+
+    See compare_folders. The names of the files are relative to the run
+    folder. Folders that exist in neither run are skipped.
+    """
+    from qualikiz_tools.machine_specific.basicpoll import parallel_map
+    jobs = []
+    stats = []
+    for folder, to_np in run_folders.items():
+        paths = [os.path.join(run, folder) for run in [folder1, folder2]]
+        exist = [os.path.isdir(path) for path in paths]
+        if not any(exist):
+            continue
+        elif not all(exist):
+            stats.append(missing_stats(folder + '/', 1 if exist[1] else 2))
+            continue
+        not_in_1, not_in_2, in_both = diff_filelist(*paths)
+        prefix = folder + '/'
+        stats.extend(missing_stats(prefix + filename, 1) for filename in not_in_1)
+        stats.extend(missing_stats(prefix + filename, 2) for filename in not_in_2)
+        jobs.extend((prefix + filename, os.path.join(paths[0], filename),
+                     os.path.join(paths[1], filename), to_np, rtol, atol)
+                    for filename in in_both)
+    # Pool all files of the run, so the processes stay busy
+    stats.extend(parallel_map(compare_files, jobs, processes=processes, chunksize=1))
+    return stats
+
+def compare_datasets(ds1, ds2, rtol=1e-2, atol=0.):
+    """ Compare the variables and coordinates of two datasets
+
+    Args:
+        ds1: The dataset to check, or the path of a netCDF file
+        ds2: The reference dataset, or the path of a netCDF file
+
+    Kwargs:
+        rtol: Relative tolerance, see compare_arrays
+        atol: Absolute tolerance, see compare_arrays
+
+    Returns:
+        List with the statistics per variable, see compare_arrays. The
+        status is 'dims' if the variables have different dimensions
+    """
+    opened = []
+    if isinstance(ds1, str):
+        ds1 = xr.open_dataset(ds1, engine=netcdf4_engine)
+        opened.append(ds1)
+    if isinstance(ds2, str):
+        ds2 = xr.open_dataset(ds2, engine=netcdf4_engine)
+        opened.append(ds2)
+    try:
+        names1 = list(ds1.variables)
+        names2 = list(ds2.variables)
+        stats = [missing_stats(name, 1) for name in names2 if name not in names1]
+        stats.extend(missing_stats(name, 2) for name in names1 if name not in names2)
+        for name in names1:
+            if name not in names2:
+                continue
+            var1, var2 = ds1.variables[name], ds2.variables[name]
+            if var1.dims != var2.dims:
+                row = missing_stats(name, None)
+                row['status'] = 'dims'
+                row['shape1'], row['shape2'] = list(var1.dims), list(var2.dims)
+                stats.append(row)
+            else:
+                stats.append(compare_arrays(var1.values, var2.values,
+                                            rtol=rtol, atol=atol, name=name))
+    finally:
+        for ds in opened:
+            ds.close()
+    return stats
+
+def is_different(stats):
+    """ True if any file or variable is not identical """
+    return any(row['status'] != 'identical' for row in stats)
+
+def report_table(stats, show_all=False):
+    """ Compact table of the statistics
+
+    Kwargs:
+        show_all: Also list the identical files or variables
+
+    Returns:
+        The table as string, followed by a line with the amount of
+        differing files or variables
+    """
+    rows = [[row[field] if not isinstance(row[field], list)
+             else 'x'.join(str(ii) for ii in row[field]) for field in stat_fields]
+            for row in stats if show_all or row['status'] != 'identical']
+    different = sum(row['status'] != 'identical' for row in stats)
+    summary = '{:d} of {:d} different'.format(different, len(stats))
+    if len(rows) == 0:
+        return summary
+    from tabulate import tabulate
+    return tabulate(rows, headers=stat_fields, floatfmt='.3g') + '\n' + summary
+
+def report_json(stats):
+    """ The statistics as JSON list """
+    return json.dumps(stats, indent=4)
+
+
+def diff(folder1, folder2, to_np, rtol=1e-2, processes=1):
+    stats = compare_folders(folder1, folder2, to_np, rtol=rtol, processes=processes)
+    different = is_different(stats)
+    if different:
+        print(report_table(stats))
     return different
 
 
-def compare_runs(folder1, folder2):
-    print('comparing \'debug\'')
-    different = diff(os.path.join(folder1, 'debug'),
-                     os.path.join(folder2, 'debug'), ascii_to_np)
-    print('comparing \'input\'')
-    different = diff(os.path.join(folder1, 'input'),
-                     os.path.join(folder2, 'input'), bin_to_np)
-    print('comparing \'output\'')
-    different |= diff(os.path.join(folder1, 'output'),
-                      os.path.join(folder2, 'output'), ascii_to_np)
-    print('comparing \'primitive\'')
-    different |= diff(os.path.join(folder1, 'output/primitive'),
-                      os.path.join(folder2, 'output/primitive'), ascii_to_np)
+def compare_runs(folder1, folder2, rtol=1e-2, processes=1):
+    stats = compare_run_folders(folder1, folder2, rtol=rtol, processes=processes)
+    print(report_table(stats))
+    different = is_different(stats)
     if different:
         print('different')
     else:
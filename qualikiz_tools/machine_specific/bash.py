@@ -7,11 +7,17 @@ import subprocess
 import multiprocessing as mp
 import os
 import stat
+import json
+import time
+from collections import OrderedDict
 from warnings import warn
 
 from qualikiz_tools.machine_specific.system import Run, Batch
 from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
 from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun, QuaLiKizBatch
+from qualikiz_tools.qualikiz_io.campaign import record_state
+from qualikiz_tools.machine_specific.procsampler import (ProcessSampler, samples_file,
+                                                         default_interval as default_sample_interval)
 
 def get_num_threads():
     """Returns amount of threads/virtual cores on current system"""
@@ -46,6 +52,7 @@ class Run(Run):
     def __init__(self, parent_dir, name, binaryrelpath,
                  qualikiz_plan=None, stdout=None, stderr=None,
                  verbose=False, nodes=1, HT=False, tasks=None,
+                 max_walltime=None, scaling_model=None,
                  **kwargs):
         """ Initializes the Run class
 
@@ -59,6 +66,11 @@ class Run(Run):
             stdout:         Standard target of redirect of STDOUT [default: terminal]
             stderr:         Standard target of redirect of STDERR [default: terminal]
             verbose:        Verbose output while creating the Run [default: False]
+            max_walltime:   Walltime target in seconds. If given, use the amount
+                            of nodes, at most nodes, that runs within it at the
+                            least CPU time, see QuaLiKizRun.recommend_cores
+            scaling_model:  ScalingModel used with max_walltime. By default the
+                            model configured with QUALIKIZ_SCALING_MODEL
             **kwargs:       kwargs past to superclass
         """
         if stdout is None:
@@ -70,6 +82,12 @@ class Run(Run):
                          stdout=stdout, stderr=stderr,
                          verbose=verbose, **kwargs)
 
+        if max_walltime is not None and tasks is None:
+            cores_per_node = self.defaults['cores_per_node']
+            cores = self.recommend_cores(max_walltime,
+                                         [cores_per_node * ii for ii in range(1, nodes + 1)],
+                                         model=scaling_model)
+            nodes = cores // cores_per_node
         self.nodes = nodes
         for name in ['HT', 'threads_per_core']:
             if name in self.defaults:
@@ -140,8 +158,10 @@ class Run(Run):
                 if not os.path.isabs(path):
                     path = os.path.relpath(os.path.join(batchdir, path), rundir)
             paths.append(path)
-        return cls.from_dir(rundir,
-                   stdout=paths[0], stderr=paths[1])
+        run = cls.from_dir(rundir,
+                           stdout=paths[0], stderr=paths[1])
+        run.tasks = tasks
+        return run
 
     @classmethod
     def from_dir(cls, dir, **kwargs):
@@ -159,15 +179,64 @@ class Run(Run):
                    stdout=qualikiz_run.stdout, stderr=qualikiz_run.stderr, qualikiz_plan=qualikiz_run.qualikiz_plan, labellist=qualikiz_run.labellist,
                    **kwargs)
 
-    def launch(self):
+    def start_process(self, env=None):
+        """ Start QuaLiKizRun using mpirun without waiting for it
+
+        Special variables self.stdout == 'STDOUT' and self.stderr == 'STDERR'
+        will output to terminal.
+
+        Kwargs:
+            env: Environment of the process. The current one by default
+
+        Returns:
+            The subprocess.Popen instance
+        """
+        cmd = [self.runstring, '-n', str(self.tasks),
+               './' + os.path.basename(self.binaryrelpath)]
+        if self.stdout == 'STDOUT':
+            stdout = None
+        else:
+            stdout = open(os.path.join(self.rundir, self.stdout), 'w')
+        if self.stderr == 'STDERR':
+            stderr = None
+        else:
+            stderr = open(os.path.join(self.rundir, self.stderr), 'w')
+        try:
+            return subprocess.Popen(cmd, cwd=self.rundir, env=env,
+                                    stdout=stdout, stderr=stderr)
+        finally:
+            # The child has its own copy of the file descriptors
+            for file_ in [stdout, stderr]:
+                if file_ is not None:
+                    file_.close()
+
+    def launch(self, sample_interval=None):
         """ Launch QuaLiKizRun using mpirun
 
         Special variables self.stdout == 'STDOUT' and self.stderr == 'STDERR'
         will output to terminal.
+
+        Kwargs:
+            sample_interval: Sample the resource usage of the mpirun process
+                             tree every sample_interval seconds, and write
+                             the samples to the run folder. By default the
+                             value of QUALIKIZ_SAMPLE_INTERVAL, see procsampler
         """
         self.inputbinaries_exist()
         # Check if batch script is generated
         self.clean()
+        record_state([self.rundir], 'launched', regress=True)
+
+        if sample_interval is None:
+            sample_interval = default_sample_interval()
+        if sample_interval is not None:
+            process = self.start_process()
+            with ProcessSampler(process.pid, interval=sample_interval) as sampler:
+                process.wait()
+            sampler.to_csv(os.path.join(self.rundir, samples_file))
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode, process.args)
+            return
 
         cmd = ' '.join(['cd', self.rundir, '&&', self.runstring,
                         '-n', str(self.tasks), './' + os.path.basename(self.binaryrelpath)])
@@ -182,6 +251,128 @@ class Run(Run):
         subprocess.check_call(cmd, shell=True, stdout=stdout, stderr=stderr)
 
 
+def read_batchinfo(path):
+    """ Read a batchinfo file. Empty if it does not exist """
+    try:
+        with open(path) as file_:
+            return json.load(file_, object_pairs_hook=OrderedDict)
+    except FileNotFoundError:
+        return OrderedDict()
+
+def update_batchinfo(path, **entries):
+    """ Update the entries of a batchinfo file, keeping all others """
+    batchinfo = read_batchinfo(path)
+    batchinfo.update(entries)
+    with open(path, 'w') as file_:
+        json.dump(batchinfo, file_, indent=4)
+
+def restore_tasks(runlist, batchinfo):
+    """ Set the tasks of the runs to the ones stored in a batchinfo file """
+    tasks = batchinfo.get('tasks', {})
+    for run in runlist:
+        name = os.path.basename(run.rundir)
+        if name in tasks:
+            run.tasks = tasks[name]
+
+def schedule_runs(runlist, cores, batchinfopath=None, poll_interval=.1,
+                  omp_num_threads=2, verbose=False, sample_interval=None):
+    """ Run QuaLiKizRuns concurrently on the local machine
+
+    Runs are started in order as long as their tasks fit on the free
+    cores. A run that does not fit is skipped until enough cores are
+    free, so smaller runs further down the list can fill the gaps. A run
+    with more tasks than cores is started once nothing else is running.
+
+    Args:
+        runlist:         List of bash Runs to run
+        cores:           Amount of cores to pack the runs on
+
+    Kwargs:
+        batchinfopath:   Path of a json file to write the start and end
+                         times of the runs to. Written after every
+                         started and finished run. The runs are merged
+                         into the existing file, see update_batchinfo
+        poll_interval:   Time in seconds between checking for finished runs
+        omp_num_threads: Value of OMP_NUM_THREADS for the runs
+        verbose:         Print when runs start and finish
+        sample_interval: Sample the resource usage of every run, see
+                         Run.launch. By default the value of
+                         QUALIKIZ_SAMPLE_INTERVAL
+
+    Returns:
+        OrderedDict with the tasks, start and end time (since epoch) and
+        returncode per run, by the name of the run folder
+
+    If scheduling is interrupted, for example by a KeyboardInterrupt, the
+    running runs are terminated before the exception is passed on.
+    """
+    env = os.environ.copy()
+    env['OMP_NUM_THREADS'] = str(omp_num_threads)
+    if sample_interval is None:
+        sample_interval = default_sample_interval()
+    samplers = {}
+    names = [os.path.basename(run.rundir) for run in runlist]
+    info = OrderedDict((name, OrderedDict([('tasks', run.tasks),
+                                           ('start', None),
+                                           ('end', None),
+                                           ('returncode', None)]))
+                       for name, run in zip(names, runlist))
+
+    def dump():
+        if batchinfopath is not None:
+            runs = read_batchinfo(batchinfopath).get('runs', OrderedDict())
+            runs.update(info)
+            update_batchinfo(batchinfopath, style='concurrent', cores=cores, runs=runs)
+
+    def finish(ii):
+        process = running.pop(ii)
+        if ii in samplers:
+            samplers[ii].stop()
+            samplers.pop(ii).to_csv(os.path.join(runlist[ii].rundir, samples_file))
+        info[names[ii]]['end'] = time.time()
+        info[names[ii]]['returncode'] = process.returncode
+        if verbose:
+            print('Finished {!s} with returncode {:d}'.format(
+                names[ii], process.returncode))
+
+    queue = list(range(len(runlist)))
+    running = OrderedDict()
+    free = cores
+    try:
+        while queue or running:
+            for ii in list(queue):
+                run = runlist[ii]
+                if run.tasks <= free or len(running) == 0:
+                    if run.tasks > cores:
+                        warn('Run {!s} has {:d} tasks, more than the {:d} '
+                             'available cores'.format(names[ii], run.tasks, cores))
+                    running[ii] = run.start_process(env=env)
+                    if sample_interval is not None:
+                        samplers[ii] = ProcessSampler(running[ii].pid,
+                                                      interval=sample_interval).start()
+                    queue.remove(ii)
+                    free -= run.tasks
+                    info[names[ii]]['start'] = time.time()
+                    if verbose:
+                        print('Started {!s} on {:d} cores, {:d} free'.format(
+                            names[ii], run.tasks, max(free, 0)))
+            dump()
+            time.sleep(poll_interval)
+            for ii, process in list(running.items()):
+                if process.poll() is not None:
+                    free += runlist[ii].tasks
+                    finish(ii)
+    finally:
+        # Only left running when interrupted, do not leave orphans behind
+        for process in running.values():
+            process.terminate()
+        for ii, process in list(running.items()):
+            process.wait()
+            finish(ii)
+        dump()
+    return info
+
+
 class Batch(Batch):
     """ Defines a batch job
 
@@ -189,13 +380,17 @@ class Batch(Batch):
         shell:            The shell to use for batch scripts.
                           Tested only with bash
         run_class:        class that represents the runs contained in batch
+        omp_num_threads:  Value of OMP_NUM_THREADS for the runs
+        styles:           Supported ways to glue the runs together
     """
     shell = '/bin/bash'
     run_class = Run
+    omp_num_threads = 2
+    styles = ['sequential', 'concurrent']
 
     def __init__(self, parent_dir, name, runlist,
                  stdout=None, stderr=None,
-                 style='sequential',
+                 style='sequential', cores=None,
                  verbose=False):
         """ Initialize batch job
 
@@ -207,8 +402,13 @@ class Batch(Batch):
         Kwargs:
             stdout:         Standard target of redirect of STDOUT [default: terminal]
             stderr:         Standard target of redirect of STDERR [default: terminal]
-            style:          How to glue the different runs together. Currently
-                            only 'sequential' is used
+            style:          How to glue the different runs together. Either
+                            'sequential', one run after the other using the
+                            batch script, or 'concurrent', running as many
+                            runs as fit on the cores at the same time.
+                            See schedule_runs
+            cores:          Amount of cores to use for the 'concurrent'
+                            style. By default all physical cores
             verbose:        Verbose output while creating the Run [default: False]
             **kwargs:       kwargs past to superclass
 
@@ -226,17 +426,26 @@ class Batch(Batch):
         super().__init__(parent_dir, name, runlist,
                          stdout=stdout, stderr=stderr)
 
-        if style == 'sequential':
-            pass
-        else:
+        if style not in self.styles:
             raise NotImplementedError('Style {!s} not implemented yet.'.format(style))
+        self.style = style
+        if cores is None:
+            cores = self.run_class.defaults['cores_per_node']
+        self.cores = cores
+        self.verbose = verbose
 
-    def to_batch_file(self, path, overwrite_batch_script=False):
+    def to_batch_file(self, path, overwrite_batch_script=False, runlist=None):
         """ Writes batch script to file
 
         Args:
             path:       Path of the sbatch script file.
+
+        Kwargs:
+            overwrite_batch_script: Remove the script if it exists
+            runlist:    Runs to include in the script. All runs by default
         """
+        if runlist is None:
+            runlist = self.runlist
         if overwrite_batch_script:
             try:
                 os.remove(path)
@@ -246,11 +455,11 @@ class Batch(Batch):
         batch_lines = ['#!' + self.shell + '\n\n']
 
         # Write sruns to file
-        batch_lines.append('export OMP_NUM_THREADS=2\n\n')
-        batch_lines.append('echo "Starting job {:d}/{:d}"\n'.format(1, len(self.runlist)))
-        batch_lines.append(self.runlist[0].to_batch_string(os.path.dirname(path)))
-        for ii, run in enumerate(self.runlist[1:]):
-            batch_lines.append(' &&\necho "Starting job {:d}/{:d}"'.format(ii + 2, len(self.runlist)))
+        batch_lines.append('export OMP_NUM_THREADS={:d}\n\n'.format(self.omp_num_threads))
+        batch_lines.append('echo "Starting job {:d}/{:d}"\n'.format(1, len(runlist)))
+        batch_lines.append(runlist[0].to_batch_string(os.path.dirname(path)))
+        for ii, run in enumerate(runlist[1:]):
+            batch_lines.append(' &&\necho "Starting job {:d}/{:d}"'.format(ii + 2, len(runlist)))
             batch_lines.append(' &&\n' + run.to_batch_string(os.path.dirname(path)))
 
         if overwrite_batch_script:
@@ -265,9 +474,28 @@ class Batch(Batch):
         st = os.stat(path)
         os.chmod(path, st.st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
 
+    def prepare(self, *args, **kwargs):
+        """ Prepare the batch, see QuaLiKizBatch.prepare
+
+        The style, cores and tasks of each run are stored in the
+        batchinfo file, so the batch is reconstructed with them by from_dir.
+        """
+        super().prepare(*args, **kwargs)
+        tasks = OrderedDict((os.path.basename(run.rundir), run.tasks) for run in self.runlist)
+        update_batchinfo(os.path.join(self.parent_dir, self.name, self.batchinfofile),
+                         style=self.style, cores=self.cores, tasks=tasks)
+
     @classmethod
     def from_batch_file(cls, path, **kwargs):
-        """ Reconstruct batch from batch file """
+        """ Reconstruct batch from batch file
+
+        The style, cores and tasks of each run are taken from the
+        batchinfo file next to the batch file, unless given as kwargs.
+        """
+        batchinfo = read_batchinfo(os.path.join(os.path.dirname(path), cls.batchinfofile))
+        for key in ['style', 'cores']:
+            if key in batchinfo:
+                kwargs.setdefault(key, batchinfo[key])
         name = os.path.basename(os.path.dirname(path))
         parent_dir = os.path.dirname(os.path.dirname(path))
         run_strings = []
@@ -279,31 +507,77 @@ class Batch(Batch):
         runlist = []
         for run_string in run_strings:
             runlist.append(Run.from_batch_string(run_string, os.path.join(parent_dir, name)))
+        restore_tasks(runlist, batchinfo)
         batch = Batch(parent_dir, name, runlist, **kwargs)
 
         return batch
 
+    @classmethod
+    def from_subdirs(cls, batchdir, *args, **kwargs):
+        """ Reconstruct batch from its directory, see QuaLiKizBatch.from_subdirs
+
+        If there is no batch file, the style, cores and tasks of each run
+        are still taken from the batchinfo file, and the runs are put back
+        in their original order.
+        """
+        batch = super().from_subdirs(batchdir, *args, **kwargs)
+        batchinfo = read_batchinfo(os.path.join(batch.parent_dir, batch.name, cls.batchinfofile))
+        batch_kwargs = kwargs.get('batch_kwargs') or {}
+        for key in ['style', 'cores']:
+            if key in batchinfo and key not in batch_kwargs:
+                setattr(batch, key, batchinfo[key])
+        order = list(batchinfo.get('tasks', {}))
+        batch.runlist.sort(key=lambda run: order.index(os.path.basename(run.rundir))
+                           if os.path.basename(run.rundir) in order else len(order))
+        restore_tasks(batch.runlist, batchinfo)
+        return batch
+
     @classmethod
     def from_dir(cls, dir, *args, **kwargs):
         return cls.from_subdirs(dir, *args, **kwargs)
 
-    def launch(self):
+    def launch(self, resume=False):
         """ Launch QuaLiKizBatch using a batch script with mpirun
+
+        With the 'concurrent' style the runs are scheduled directly
+        instead, see schedule_runs. The start and end times of the runs
+        are written to the batchinfo file.
+
+        Kwargs:
+            resume: Only launch the runs that did not write all their
+                    output, see QuaLiKizBatch.incomplete_runs. The output
+                    of the complete runs is left alone, and the incomplete
+                    runs are written to a separate resume script
         """
+        if self.style == 'concurrent':
+            return self.launch_concurrent(resume=resume)
         dirname = os.path.basename(os.path.abspath(os.curdir))
         if self.name != dirname:
             warn("Warning! Launching from outside the batch folder! Experimental!")
         self.inputbinaries_exist()
-        # Check if batch script is generated
         batchdir = os.path.join(self.parent_dir, self.name)
-        script_path = os.path.join(batchdir, self.scriptname)
-        if not os.path.exists(script_path):
-            warn('Batch script does not exist! Generating.. in {!s}'.format(batchdir))
-            self.to_batch_file(os.path.join(script_path))
+        if resume:
+            runlist = self.incomplete_runs()
+            if len(runlist) == 0:
+                print('All runs of {!s} are complete, nothing to resume'.format(batchdir))
+                return
+            scriptname = self.resume_scriptname
+            self.to_batch_file(os.path.join(batchdir, scriptname),
+                               overwrite_batch_script=True, runlist=runlist)
+            for run in runlist:
+                run.clean()
+        else:
+            runlist = self.runlist
+            # Check if batch script is generated
+            scriptname = self.scriptname
+            script_path = os.path.join(batchdir, scriptname)
+            if not os.path.exists(script_path):
+                warn('Batch script does not exist! Generating.. in {!s}'.format(batchdir))
+                self.to_batch_file(os.path.join(script_path))
 
-        self.clean()
+            self.clean()
 
-        cmd = ' '.join(['cd', batchdir, '&& bash', self.scriptname])
+        cmd = ' '.join(['cd', batchdir, '&& bash', scriptname])
         if self.stdout == 'STDOUT':
             stdout = None
         else:
@@ -312,8 +586,44 @@ class Batch(Batch):
             stderr = None
         else:
             stderr = open(os.path.join(batchdir, self.stderr), 'w')
+        record_state([run.rundir for run in runlist], 'launched', regress=True)
         subprocess.check_call(cmd, shell=True, stdout=stdout, stderr=stderr)
 
+    def launch_concurrent(self, poll_interval=.1, resume=False):
+        """ Launch all runs concurrently, packed on self.cores
+
+        Kwargs:
+            poll_interval: Time in seconds between checking for finished runs
+            resume:        Only launch the incomplete runs, see launch
+
+        Returns:
+            The run info as returned by schedule_runs, or None if there
+            is nothing to resume
+        """
+        self.inputbinaries_exist()
+        if resume:
+            runlist = self.incomplete_runs()
+            if len(runlist) == 0:
+                batchdir = os.path.join(self.parent_dir, self.name)
+                print('All runs of {!s} are complete, nothing to resume'.format(batchdir))
+                return
+        else:
+            runlist = self.runlist
+        for run in runlist:
+            run.clean()
+        record_state([run.rundir for run in runlist], 'launched', regress=True)
+        batchdir = os.path.join(self.parent_dir, self.name)
+        info = schedule_runs(runlist, self.cores,
+                             batchinfopath=os.path.join(batchdir, self.batchinfofile),
+                             poll_interval=poll_interval,
+                             omp_num_threads=self.omp_num_threads,
+                             verbose=self.verbose)
+        failed = [name for name, run_info in info.items()
+                  if run_info['returncode'] != 0]
+        if len(failed) != 0:
+            raise Exception('Runs {!s} failed'.format(', '.join(failed)))
+        return info
+
 
 #    def __eq__(self, other):
 #        if isinstance(other, self.__class__):
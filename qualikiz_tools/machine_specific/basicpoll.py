@@ -7,7 +7,9 @@ import os
 import sqlite3
 import json
 import re
+import multiprocessing as mp
 from warnings import warn
+from concurrent.futures import ProcessPoolExecutor
 
 from tabulate import tabulate
 from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizBatch
@@ -59,6 +61,44 @@ def database_exists(database_path, table_name, append=None, overwrite=None):
 
     return create_table
 
+def connect(database_path):
+    """ Open a polling database in WAL mode
+    WAL mode lets the database be read while a poll is ingesting
+    """
+    db = sqlite3.connect(database_path)
+    db.execute('PRAGMA journal_mode=WAL')
+    return db
+
+def parallel_map(function, iterable, processes=1, chunksize=16):
+    """ Map a function over an iterable in a process pool
+
+    Args:
+        function:  Function to map. Should be picklable, so defined on
+                   module level
+        iterable:  The arguments to map over
+
+    Kwargs:
+        processes: Amount of processes to use. 'max' to use all cores.
+                   With 1 process no pool is created
+        chunksize: Amount of arguments sent to a process at once
+
+    Returns:
+        A list of the results, in order
+    """
+    if processes == 'max':
+        processes = mp.cpu_count()
+    if processes == 1:
+        return [function(arg) for arg in iterable]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(function, iterable, chunksize=chunksize))
+
+def read_jobnumber(batch):
+    """ Read the job number from the batchinfo file of a batch """
+    batchinfopath = os.path.join(batch.parent_dir, batch.name, QuaLiKizBatch.batchinfofile)
+    with open(batchinfopath, 'r') as file_:
+        batchinfo = json.load(file_)
+    return batchinfo['jobnumber']
+
 
 # TODO: Polling of STDOUT can move to its own file
 def poll_stdout(stdoutpath):
@@ -112,26 +152,25 @@ def poll_batchdata(batch):
     pythontools scripts. For example, with 'pythontools.py inputgo runs/mini'
 
     Args:
-        - path: Path to poll. Path should contain a metadata
-               and job file.
+        - batch: The batch to poll. Its folder should contain a batchinfo file
+
+    Returns:
+        - header: The names of the fields
+        - table:  The jobdata. Fields the batch does not define are None
     """
-    batchdir = os.path.join(batch.batchsdir, batch.name)
-    batchinfopath = os.path.join(batchdir, QuaLiKizBatch.batchinfofile)
-    with open(batchinfopath, 'r') as file_:
-        batchinfo = json.load(file_)
     header = ['jobnumber', 'nodes', 'vcores_per_task', 'tasks']
-    table = [job_meta['jobnumber'],
-             job.batch.nodes,
-             job.batch.vcores_per_task,
-             job.batch.srun.tasks]
-    table = [int(x) for x in table]
+    tasks = [getattr(run, 'tasks', None) for run in batch.runlist]
+    table = [int(read_jobnumber(batch)),
+             getattr(batch, 'nodes', None),
+             getattr(batch, 'vcores_per_task', None),
+             None if None in tasks else sum(tasks)]
     return header, table
 
 
 def create_jobdata_database(batchlist, database_path, append=None, overwrite=None):
     """ Create a database with QuaLiKiz metadata
     Args:
-        - path:          The path to be polled
+        - batchlist:     The batches to be polled
         - database_path: Path to the database to be created
 
     Kwargs:
@@ -140,50 +179,58 @@ def create_jobdata_database(batchlist, database_path, append=None, overwrite=Non
     """
     create_table = database_exists(database_path, 'jobdata', append=append, overwrite=overwrite)
 
-    db = sqlite3.connect(database_path)
-    if create_table:
-        db.execute('''CREATE TABLE jobdata (
-            Jobnumber       INTEGER,
-            Nodes           INTEGER,
-            Vcores_per_task INTEGER,
-            Tasks           INTEGER
-          )''')
-
-    for batch in batchlist:
-        batchdir = os.path.join(batch.batchsdir, batch.name)
-        batchinfopath = os.path.join(batchdir, QuaLiKizBatch.batchinfofile)
-        tottasks = 0
-        for srun_instance in batch.batch.srun_instances:
-            tottasks += srun_instance.tasks
-
-        with open(batchinfopath, 'r') as file_:
-            batchinfo = json.load(file_)
-        jobnumber = batchinfo['jobnumber']
-        row = [jobnumber, batch.batch.nodes, batch.batch.vcores_per_task, tottasks]
-        db.execute('''
-                   INSERT INTO jobdata(
-                   Jobnumber, Nodes, Vcores_per_task, Tasks)
-                   VALUES (?, ?, ?, ?)''',
-                   row)
-    db.commit()
+    db = connect(database_path)
+    with db:
+        if create_table:
+            db.execute('''CREATE TABLE jobdata (
+                Jobnumber       INTEGER,
+                Nodes           INTEGER,
+                Vcores_per_task INTEGER,
+                Tasks           INTEGER
+              )''')
+
+        db.executemany('''
+                       INSERT INTO jobdata(
+                       Jobnumber, Nodes, Vcores_per_task, Tasks)
+                       VALUES (?, ?, ?, ?)''',
+                       [poll_batchdata(batch)[1] for batch in batchlist])
 
     query = db.execute('select * from jobdata')
     headers = [x[0] for x in query.description]
     print (tabulate(query, headers=headers, floatfmt='.0f'))
 
-def create_stdout_database(batchlist, database_path, append=None, overwrite=None):
+def stdout_row(job):
+    """ Parse the STDOUT of a run into a row of the stdout table
+
+    Args:
+        - job: Tuple of (jobnumber, runnumber, path to STDOUT)
+
+    Returns:
+        - The row, with the times in milliseconds
+    """
+    jobnumber, runnumber, stdoutpath = job
+    __, values = poll_stdout(stdoutpath)
+    row = [int(jobnumber), runnumber]
+    row.extend(values[:3])
+    row.extend(1000 * sec + msec for sec, msec in values[3:])
+    return row
+
+def create_stdout_database(batchlist, database_path, append=None, overwrite=None,
+                           processes=1):
     """ Create a database with parsed QuaLiKiz STDOUT
     Args:
-        - path:          The path to be polled
+        - batchlist:     The batches to be polled
         - database_path: Path to the database to be created
 
     Kwargs:
         - overwrite: Overwrite database if exists? Default 'ask user'
         - append:    Append to table if exists? Default 'ask user'
+        - processes: Amount of processes to parse STDOUT with. 'max'
+                     to use all cores
     """
     create_table = database_exists(database_path, 'stdout', append=append, overwrite=overwrite)
 
-    db = sqlite3.connect(database_path)
+    db = connect(database_path)
     if create_table:
         db.execute('''CREATE TABLE stdout (
             Jobnumber      INTEGER,
@@ -200,41 +247,27 @@ def create_stdout_database(batchlist, database_path, append=None, overwrite=None
             Total          INTEGER
           )''')
 
-    # Try to reconstruct the batches. 
-    result = []
+    # Only stat the runs here, the STDOUT files are parsed in parallel
+    jobs = []
     for batch in batchlist:
-        batchdir = os.path.join(batch.batchsdir, batch.name)
-        batchinfopath = os.path.join(batchdir, QuaLiKizBatch.batchinfofile)
-        with open(batchinfopath, 'r') as file_:
-            batchinfo = json.load(file_)
-        jobnumber = batchinfo['jobnumber']
+        jobnumber = read_jobnumber(batch)
         for i, run in enumerate(batch.runlist):
             if run.is_done():
-                poll_result = poll_stdout(run.stdout)
-                poll_result[0].insert(0, 'runnumber')
-                poll_result[1].insert(0, i)
-                poll_result[0].insert(0, 'jobnumber')
-                poll_result[1].insert(0, int(jobnumber))
-                result.append(poll_result)
-
-    for __, row in result:
-        data = []
-        for col in row[:5]:
-            data.append(col)
-        msec = [1000 * tup[0] + tup[1] for tup in row[5:]]
-        data.extend(msec)
-
-        db.execute('''
-                   INSERT INTO stdout 
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                   data)
-    db.commit()
+                jobs.append((jobnumber, i, os.path.join(run.rundir, run.stdout)))
+    rows = parallel_map(stdout_row, jobs, processes=processes)
+
+    with db:
+        db.executemany('''
+                       INSERT INTO stdout
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                       rows)
 
     query = db.execute('select * from stdout')
     headers = [x[0] for x in query.description]
     print (tabulate(query, headers=headers, floatfmt='.0f'))
 
-def create_database(path, database_path, append=None, overwrite=None):
+def create_database(path, database_path, append=None, overwrite=None, processes=1,
+                    use_index=None):
     """ Create a database with basic QuaLiKiz data
     Args:
         - database_path: Path to the database to be created
@@ -242,7 +275,11 @@ def create_database(path, database_path, append=None, overwrite=None):
     Kwargs:
         - overwrite: Overwrite database if exists? Default 'ask user'
         - append:    Append to table if exists? Default 'ask user'
+        - processes: Amount of processes to parse with
+        - use_index: Find the batches with the DirIndex, see
+                     QuaLiKizBatch.from_dir_recursive
     """
-    batchlist = QuaLiKizBatch.from_dir_recursive(path)
-    create_stdout_database(batchlist, database_path, append=append, overwrite=overwrite)
+    batchlist = QuaLiKizBatch.from_dir_recursive(path, use_index=use_index)
+    create_stdout_database(batchlist, database_path, append=append, overwrite=overwrite,
+                           processes=processes)
     create_jobdata_database(batchlist, database_path, append=None, overwrite=False)
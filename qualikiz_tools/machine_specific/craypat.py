@@ -14,8 +14,9 @@ from itertools import islice
 import numpy as np
 
 from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun, QuaLiKizBatch
-from qualikiz_tools.machine_specific.basicpoll import database_exists
-from .tabulate.tabulate import tabulate
+from qualikiz_tools.machine_specific.basicpoll import (database_exists, connect,
+                                                       parallel_map, read_jobnumber)
+from tabulate import tabulate
 
 def profile_job(job):
     """ Read QuaLiKiz Profiling info
@@ -44,10 +45,10 @@ def profile_job(job):
     if pat_result is None:
         warn('No folder starting with QuaLiKiz+pat+ found in ' + job.rundir + ', skipping..')
     else:
-        cmd = 'pat_report -O ca+src,profile -s show_data=csv '
-        cmd += os.path.join(job.rundir, pat_result)
-        print (cmd)
-        output = subprocess.check_output(cmd, shell=True, stderr=None).decode('UTF-8')
+        cmd = ['pat_report', '-O', 'ca+src,profile', '-s', 'show_data=csv',
+               os.path.join(job.rundir, pat_result)]
+        print (' '.join(cmd))
+        output = subprocess.check_output(cmd, stderr=None).decode('UTF-8')
         # With the previous command we created two tables and some useless data.
         # We need to only read only the relevant parts
         read = [False, False]
@@ -77,19 +78,41 @@ def profile_job(job):
                 formatted_tables[i].append([x.rstrip('%') for x in row.split(',')])
         return formatted_tables
 
-def create_profile_database(batchlist, database_path, append=None, overwrite=None):
+def profile_rows(job):
+    """ Profile a run and prefix every row with its job number
+
+    Args:
+        - job: Tuple of (jobnumber, run)
+
+    Returns:
+        - The two tables of profile_job, or None if the run could not
+          be profiled
+    """
+    jobnumber, run = job
+    try:
+        tables = profile_job(run)
+    except subprocess.CalledProcessError:
+        warn('Could not get profile data, skipping..')
+        return None
+    if tables is None:
+        return None
+    return [[[jobnumber] + row for row in table] for table in tables]
+
+def create_profile_database(batchlist, database_path, append=None, overwrite=None,
+                            processes=1):
     """ Create a database with QuaLiKiz metadata
     Args:
-        - path:          The path to be polled
+        - batchlist:     The batches to be polled
         - database_path: Path to the database to be created
 
     Kwargs:
         - overwrite: Overwrite database if exists? Default 'ask user'
         - append:    Append to table if exists? Default 'ask user'
+        - processes: Amount of pat_report calls to run in parallel
     """
     create_table = database_exists(database_path, 'patprofile', append=append, overwrite=overwrite)
 
-    db = sqlite3.connect(database_path)
+    db = connect(database_path)
     if create_table:
         db.execute('''CREATE TABLE patprofile (
                 Jobnumber INTEGER,
@@ -105,34 +128,23 @@ def create_profile_database(batchlist, database_path, append=None, overwrite=Non
                 Samp_percent REAL,
                 Samp INTEGER,
                 Group_Function_Caller TEXT)''')
+    jobs = []
     for batch in batchlist:
-        batchdir = os.path.join(batch.batchsdir, batch.name)
-        batchinfopath = os.path.join(batchdir, QuaLiKizBatch.batchinfofile)
-        with open(batchinfopath, 'r') as file_:
-            batchinfo = json.load(file_)
-
-        jobnumber = batchinfo['jobnumber']
-        for i, run in enumerate(batch.runlist):
+        jobnumber = read_jobnumber(batch)
+        for run in batch.runlist:
             if run.is_done():
-                try:
-                    result = profile_job(run)
-                except subprocess.CalledProcessError:
-                    warn('Could not get profile data, skipping..')
-                else:
-                    tables = result
-                    for j, table in enumerate(tables):
-                        for row in table:
-                            data = [jobnumber]
-                            data.extend(row)
-                            if j == 0:
-                                db.execute('''
-                                INSERT INTO patprofile_lines (Jobnumber, Level, Samp_percent, Samp, Group_Function_Caller)
-                                        VALUES (?,?,?,?,?)''', data)
-                            if j == 1:
-                                db.execute('''
-                                INSERT INTO patprofile (Jobnumber, Level, Samp_percent, Samp, Imb_Samp, Imb_Samp_percent, Group_Function)
-                                        VALUES (?,?,?,?,?,?,?)''', data)
-    db.commit()
+                jobs.append((jobnumber, run))
+    # pat_report is slow, so run it for many runs at once
+    results = [tables for tables in parallel_map(profile_rows, jobs, processes=processes,
+                                                 chunksize=1)
+               if tables is not None]
+    with db:
+        db.executemany('''
+        INSERT INTO patprofile_lines (Jobnumber, Level, Samp_percent, Samp, Group_Function_Caller)
+                VALUES (?,?,?,?,?)''', [row for tables in results for row in tables[0]])
+        db.executemany('''
+        INSERT INTO patprofile (Jobnumber, Level, Samp_percent, Samp, Imb_Samp, Imb_Samp_percent, Group_Function)
+                VALUES (?,?,?,?,?,?,?)''', [row for tables in results for row in tables[1]])
 
     query = db.execute('SELECT Level, Samp_percent, Group_Function FROM patprofile WHERE Level>1 ORDER BY Samp_percent DESC')
     headers = [x[0] for x in query.description]
@@ -145,7 +157,8 @@ def create_profile_database(batchlist, database_path, append=None, overwrite=Non
     print (tabulate(result, headers=headers, floatfmt='.0f'))
 
 
-def create_database(path, database_path, append=None, overwrite=None):
+def create_database(path, database_path, append=None, overwrite=None, processes=1,
+                    use_index=None):
     """ Create a database with basic QuaLiKiz data
     Args:
         - database_path: Path to the database to be created
@@ -153,6 +166,10 @@ def create_database(path, database_path, append=None, overwrite=None):
     Kwargs:
         - overwrite: Overwrite database if exists? Default 'ask user'
         - append:    Append to table if exists? Default 'ask user'
+        - processes: Amount of pat_report calls to run in parallel
+        - use_index: Find the batches with the DirIndex, see
+                     QuaLiKizBatch.from_dir_recursive
     """
-    batchlist = QuaLiKizBatch.from_dir_recursive(path)
-    create_profile_database(batchlist, database_path, append=append, overwrite=overwrite)
+    batchlist = QuaLiKizBatch.from_dir_recursive(path, use_index=use_index)
+    create_profile_database(batchlist, database_path, append=append, overwrite=overwrite,
+                            processes=processes)
@@ -0,0 +1,521 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Local stand-in for the Slurm commands sbatch, squeue, sacct and srun
+
+Submitted scripts are executed on the local machine, at most max_jobs at
+the same time. The jobs and their accounting are kept in an SQLite
+database in the spool directory, sacct prints them in the same format as
+the real sacct. Use install to write the commands to a directory and put
+that directory in front of PATH:
+
+    install('mock/bin', 'mock/spool', max_jobs=4)
+    os.environ['PATH'] = os.path.abspath('mock/bin') + os.pathsep + os.environ['PATH']
+
+The commands can also be called directly with
+python -m qualikiz_tools.machine_specific.mock_slurm <command> [args]
+"""
+import os
+import sys
+import stat
+import time
+import shlex
+import sqlite3
+import argparse
+import datetime
+import subprocess
+import multiprocessing as mp
+from collections import OrderedDict
+
+module = 'qualikiz_tools.machine_specific.mock_slurm'
+spool_env_var = 'MOCK_SLURM_SPOOL'
+max_jobs_env_var = 'MOCK_SLURM_MAX_JOBS'
+commands = ['sbatch', 'squeue', 'sacct', 'srun']
+databasename = 'jobs.sqlite3'
+first_jobid = 1000
+poll_interval = .02
+
+# Fields printed by sacct --long, after the fields given with --format
+long_fields = ['JobID', 'JobIDRaw', 'JobName', 'Partition', 'MaxVMSize',
+               'MaxVMSizeNode', 'MaxVMSizeTask', 'AveVMSize', 'MaxRSS',
+               'MaxRSSNode', 'MaxRSSTask', 'AveRSS', 'MaxPages',
+               'MaxPagesNode', 'MaxPagesTask', 'AvePages', 'MinCPU',
+               'MinCPUNode', 'MinCPUTask', 'AveCPU', 'NTasks', 'AllocCPUS',
+               'Elapsed', 'State', 'ExitCode', 'AveCPUFreq', 'ReqCPUFreqMin',
+               'ReqCPUFreqMax', 'ReqCPUFreqGov', 'ReqMem', 'ConsumedEnergy',
+               'MaxDiskRead', 'MaxDiskReadNode', 'MaxDiskReadTask',
+               'AveDiskRead', 'MaxDiskWrite', 'MaxDiskWriteNode',
+               'MaxDiskWriteTask', 'AveDiskWrite', 'AllocGRES', 'ReqGRES',
+               'ReqTRES', 'AllocTRES']
+default_fields = ['JobID', 'JobName', 'Partition', 'Account', 'AllocCPUS',
+                  'State', 'ExitCode']
+known_fields = long_fields + ['Account', 'User', 'Submit', 'Start', 'End',
+                              'CPUTime', 'CPUTimeRAW', 'ElapsedRaw', 'NNodes',
+                              'Timelimit', 'WorkDir']
+
+wrapper = """#!/bin/sh
+{spool_env_var}={spool!s} {max_jobs_env_var}={max_jobs:d} exec {python!s} -m {module!s} {command!s} "$@"
+"""
+
+
+def install(bindir, spooldir, max_jobs=1):
+    """ Write the mock Slurm commands to a directory
+
+    Args:
+        bindir:   Directory to write the commands to. Put it in front of
+                  PATH to use them
+        spooldir: Directory to keep the job database and job scripts in
+
+    Kwargs:
+        max_jobs: Maximum amount of jobs running at the same time
+
+    Returns:
+        The absolute path of bindir
+    """
+    bindir = os.path.abspath(bindir)
+    spooldir = os.path.abspath(spooldir)
+    os.makedirs(bindir, exist_ok=True)
+    os.makedirs(spooldir, exist_ok=True)
+    for command in commands:
+        path = os.path.join(bindir, command)
+        with open(path, 'w') as file_:
+            file_.write(wrapper.format(spool_env_var=spool_env_var,
+                                       spool=shlex.quote(spooldir),
+                                       max_jobs_env_var=max_jobs_env_var,
+                                       max_jobs=max_jobs,
+                                       python=shlex.quote(sys.executable),
+                                       module=module,
+                                       command=command))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    connect(spooldir).close()
+    return bindir
+
+
+def connect(spooldir=None):
+    """ Connect to the job database, creating it if needed
+
+    Kwargs:
+        spooldir: The spool directory. Read from the MOCK_SLURM_SPOOL
+                  environment variable by default
+
+    Returns:
+        The sqlite3 connection in autocommit mode
+    """
+    if spooldir is None:
+        spooldir = os.environ[spool_env_var]
+    db = sqlite3.connect(os.path.join(spooldir, databasename), timeout=60,
+                         isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                  jobid     INTEGER,
+                  taskid    INTEGER,
+                  name      TEXT,
+                  partition TEXT,
+                  workdir   TEXT,
+                  script    TEXT,
+                  stdout    TEXT,
+                  stderr    TEXT,
+                  nodes     INTEGER,
+                  cpus      INTEGER,
+                  throttle  INTEGER,
+                  state     TEXT,
+                  submit_time REAL,
+                  start_time  REAL,
+                  end_time    REAL,
+                  exitcode  INTEGER,
+                  PRIMARY KEY (jobid, taskid))''')
+    return db
+
+
+def parse_directives(path):
+    """ Read the #SBATCH directives of a script
+
+    Only long options with a value are supported, e.g. --nodes=2
+
+    Returns:
+        OrderedDict with the value per option name
+    """
+    directives = OrderedDict()
+    with open(path, 'r') as file_:
+        for line in file_:
+            line = line.strip()
+            if line.startswith('#SBATCH'):
+                option = line[len('#SBATCH'):].strip()
+                if option.startswith('--') and '=' in option:
+                    name, value = option[2:].split('=', 1)
+                    directives[name] = value.strip()
+            elif line != '' and not line.startswith('#'):
+                # Slurm stops reading directives at the first command
+                break
+    return directives
+
+
+def parse_array(spec):
+    """ Parse an array specification like '0-3,7%2'
+
+    Returns:
+        Tuple with the list of task ids and the throttle, None if unlimited
+    """
+    throttle = None
+    if '%' in spec:
+        spec, throttle = spec.split('%')
+        throttle = int(throttle)
+    taskids = []
+    for part in spec.split(','):
+        if '-' in part:
+            start, stop = [int(bound) for bound in part.split('-')]
+            taskids.extend(range(start, stop + 1))
+        else:
+            taskids.append(int(part))
+    return taskids, throttle
+
+
+def format_time(timestamp):
+    """ Format a timestamp like sacct does """
+    if timestamp is None:
+        return 'Unknown'
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def format_elapsed(seconds):
+    """ Format a duration in seconds like sacct does, [D-]HH:MM:SS """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    elapsed = '{:02d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+    if days > 0:
+        elapsed = '{:d}-{!s}'.format(days, elapsed)
+    return elapsed
+
+
+def sbatch(args):
+    """ Submit a batch script
+
+    Supports --parsable and --<option>=<value> options, which override
+    the #SBATCH directives in the script.
+    """
+    parsable = False
+    options = OrderedDict()
+    while len(args) > 0 and args[0].startswith('-'):
+        arg = args.pop(0)
+        if arg == '--parsable':
+            parsable = True
+        elif arg.startswith('--') and '=' in arg:
+            name, value = arg[2:].split('=', 1)
+            options[name] = value
+        else:
+            sys.stderr.write('sbatch: unsupported option {!s}\n'.format(arg))
+            return 1
+    if len(args) == 0:
+        sys.stderr.write('sbatch: no batch script given\n')
+        return 1
+    script = os.path.abspath(args[0])
+    directives = parse_directives(script)
+    directives.update(options)
+
+    workdir = os.path.abspath(directives.get('chdir', os.curdir))
+    name = directives.get('job-name', os.path.basename(script))
+    nodes = int(directives.get('nodes', 1))
+    tasks_per_node = directives.get('ntasks-per-node')
+    if tasks_per_node is None:
+        cpus = nodes * mp.cpu_count()
+    else:
+        cpus = nodes * int(tasks_per_node)
+    if 'array' in directives:
+        taskids, throttle = parse_array(directives['array'])
+        default_stdout = 'slurm-%A_%a.out'
+    else:
+        taskids, throttle = [-1], None
+        default_stdout = 'slurm-%j.out'
+    stdout = directives.get('output', default_stdout)
+    stderr = directives.get('error', stdout)
+
+    db = connect()
+    db.execute('BEGIN IMMEDIATE')
+    last_jobid = db.execute('SELECT MAX(jobid) FROM jobs').fetchone()[0]
+    if last_jobid is None:
+        jobid = first_jobid
+    else:
+        jobid = last_jobid + 1
+    # Slurm runs a copy of the script as it was at submission
+    spool_script = os.path.join(os.environ[spool_env_var], 'job{:d}.sh'.format(jobid))
+    with open(script, 'r') as source, open(spool_script, 'w') as target:
+        target.write(source.read())
+    now = time.time()
+    db.executemany('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                   [(jobid, taskid, name, directives.get('partition', 'mock'),
+                     workdir, spool_script, stdout, stderr, nodes, cpus,
+                     throttle, 'PENDING', now, None, None, None)
+                    for taskid in taskids])
+    db.execute('COMMIT')
+    db.close()
+
+    for taskid in taskids:
+        with open(os.devnull, 'r+') as devnull:
+            subprocess.Popen([sys.executable, '-m', module, '_run',
+                              str(jobid), str(taskid)],
+                             cwd=workdir, stdin=devnull, stdout=devnull,
+                             stderr=devnull, start_new_session=True)
+    if parsable:
+        print(jobid)
+    else:
+        print('Submitted batch job {:d}'.format(jobid))
+    return 0
+
+
+def _run(args):
+    """ Wait for a free slot, then run a submitted job """
+    jobid, taskid = [int(arg) for arg in args]
+    max_jobs = int(os.environ.get(max_jobs_env_var, 1))
+    db = connect()
+    while True:
+        db.execute('BEGIN IMMEDIATE')
+        running = db.execute("SELECT COUNT(*) FROM jobs WHERE state='RUNNING'").fetchone()[0]
+        # Like Slurm, array tasks are started in order
+        throttle, running_tasks, earlier_tasks = db.execute(
+            "SELECT MAX(throttle), SUM(state='RUNNING'), "
+            "SUM(state='PENDING' AND taskid<?) FROM jobs WHERE jobid=?",
+            (taskid, jobid)).fetchone()
+        if (running < max_jobs and earlier_tasks == 0 and
+                (throttle is None or running_tasks < throttle)):
+            db.execute("UPDATE jobs SET state='RUNNING', start_time=? WHERE jobid=? AND taskid=?",
+                       (time.time(), jobid, taskid))
+            db.execute('COMMIT')
+            break
+        db.execute('COMMIT')
+        time.sleep(poll_interval)
+    # A job that fails to start, or is interrupted, must not stay RUNNING
+    exitcode = 1
+    try:
+        name, workdir, script, stdout, stderr, nodes = db.execute(
+            'SELECT name, workdir, script, stdout, stderr, nodes FROM jobs WHERE jobid=? AND taskid=?',
+            (jobid, taskid)).fetchone()
+
+        env = os.environ.copy()
+        env.update({'SLURM_JOB_ID': str(jobid),
+                    'SLURM_JOB_NAME': name,
+                    'SLURM_JOB_NUM_NODES': str(nodes),
+                    'SLURM_SUBMIT_DIR': workdir})
+        patterns = {'%j': str(jobid), '%A': str(jobid), '%x': name}
+        if taskid >= 0:
+            env['SLURM_ARRAY_JOB_ID'] = str(jobid)
+            env['SLURM_ARRAY_TASK_ID'] = str(taskid)
+            patterns['%a'] = str(taskid)
+        paths = []
+        for path in [stdout, stderr]:
+            for pattern, value in patterns.items():
+                path = path.replace(pattern, value)
+            paths.append(os.path.join(workdir, path))
+        # Array tasks share a file unless it is named per task
+        mode = 'a' if taskid >= 0 else 'w'
+        with open(paths[0], mode) as out:
+            if paths[1] == paths[0]:
+                err = out
+            else:
+                err = open(paths[1], mode)
+            try:
+                exitcode = subprocess.call(['/bin/bash', script], cwd=workdir, env=env,
+                                           stdout=out, stderr=err)
+            finally:
+                if err is not out:
+                    err.close()
+    finally:
+        if exitcode == 0:
+            state = 'COMPLETED'
+        else:
+            state = 'FAILED'
+        db.execute('UPDATE jobs SET state=?, end_time=?, exitcode=? WHERE jobid=? AND taskid=?',
+                   (state, time.time(), exitcode, jobid, taskid))
+        db.close()
+    return 0
+
+
+def _parse_jobs(jobs):
+    """ Parse a --jobs argument to a list of job ids """
+    if jobs is None:
+        return None
+    return [int(job.split('_')[0]) for job in jobs.split(',')]
+
+
+def _select(db, columns, jobids=None, states=None):
+    query = 'SELECT ' + ', '.join(columns) + ' FROM jobs'
+    conditions = []
+    values = []
+    if jobids is not None:
+        conditions.append('jobid IN ({!s})'.format(', '.join('?' * len(jobids))))
+        values.extend(jobids)
+    if states is not None:
+        conditions.append('state IN ({!s})'.format(', '.join('?' * len(states))))
+        values.extend(states)
+    if len(conditions) > 0:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return db.execute(query + ' ORDER BY jobid, taskid', values)
+
+
+def _jobid_string(jobid, taskid):
+    if taskid >= 0:
+        return '{:d}_{:d}'.format(jobid, taskid)
+    return str(jobid)
+
+
+def squeue(args):
+    """ Show the pending and running jobs """
+    parser = argparse.ArgumentParser(prog='squeue', add_help=False)
+    parser.add_argument('-h', '--noheader', action='store_true')
+    parser.add_argument('-j', '--jobs')
+    parser.add_argument('-n', '--name')
+    parser.add_argument('-u', '--user')
+    args = parser.parse_args(args)
+
+    short_states = {'PENDING': 'PD', 'RUNNING': 'R'}
+    db = connect()
+    rows = _select(db, ['jobid', 'taskid', 'partition', 'name', 'state',
+                        'start_time', 'nodes'],
+                   jobids=_parse_jobs(args.jobs), states=list(short_states))
+    lines = []
+    if not args.noheader:
+        lines.append('{:>18} {:>9} {:>8} {:>8} {:>2} {:>10} {:>6} {!s}'.format(
+            'JOBID', 'PARTITION', 'NAME', 'USER', 'ST', 'TIME', 'NODES',
+            'NODELIST(REASON)'))
+    user = os.environ.get('USER', 'mock')
+    for jobid, taskid, partition, name, state, start, nodes in rows:
+        if args.name is not None and name != args.name:
+            continue
+        if start is None:
+            elapsed = '0:00'
+            nodelist = '(Resources)'
+        else:
+            elapsed = format_elapsed(time.time() - start)
+            nodelist = 'localhost'
+        lines.append('{:>18} {:>9} {:>8} {:>8} {:>2} {:>10} {:>6} {!s}'.format(
+            _jobid_string(jobid, taskid), partition[:9], name[:8], user[:8],
+            short_states[state], elapsed, nodes, nodelist))
+    db.close()
+    if len(lines) > 0:
+        print('\n'.join(lines))
+    return 0
+
+
+def _field_values(row, user):
+    """ The sacct fields of a job row """
+    (jobid, taskid, name, partition, workdir, nodes, cpus, state, submit,
+     start, end, exitcode) = row
+    if start is None:
+        elapsed = 0
+    elif end is None:
+        elapsed = int(time.time() - start)
+    else:
+        elapsed = int(end - start)
+    values = {'JobID': _jobid_string(jobid, taskid),
+              'JobIDRaw': str(jobid),
+              'JobName': name,
+              'Partition': partition,
+              'Account': user,
+              'User': user,
+              'AllocCPUS': str(cpus),
+              'NNodes': str(nodes),
+              'Elapsed': format_elapsed(elapsed),
+              'ElapsedRaw': str(elapsed),
+              'CPUTime': format_elapsed(elapsed * cpus),
+              'CPUTimeRAW': str(elapsed * cpus),
+              'State': state,
+              'ExitCode': '{:d}:0'.format(exitcode if exitcode is not None else 0),
+              'Submit': format_time(submit),
+              'Start': format_time(start),
+              'End': format_time(end),
+              'WorkDir': workdir,
+              'Timelimit': 'UNLIMITED'}
+    return values
+
+
+def sacct(args):
+    """ Show the accounting of submitted jobs """
+    parser = argparse.ArgumentParser(prog='sacct')
+    parser.add_argument('-o', '--format')
+    parser.add_argument('-l', '--long', action='store_true')
+    parser.add_argument('-X', '--allocations', action='store_true')
+    parser.add_argument('-P', '--parsable2', action='store_true')
+    parser.add_argument('-p', '--parsable', action='store_true')
+    parser.add_argument('-n', '--noheader', action='store_true')
+    parser.add_argument('--noconvert', action='store_true')
+    parser.add_argument('-j', '--jobs')
+    args = parser.parse_args(args)
+
+    fields = []
+    if args.format is not None:
+        fields.extend(args.format.split(','))
+    if args.long:
+        fields.extend(long_fields)
+    if len(fields) == 0:
+        fields = default_fields
+    canonical = {field.lower(): field for field in known_fields}
+    try:
+        fields = [canonical[field.lower()] for field in fields]
+    except KeyError as ee:
+        sys.stderr.write('sacct: error: Invalid field requested: {!s}\n'.format(ee.args[0]))
+        return 1
+
+    db = connect()
+    rows = _select(db, ['jobid', 'taskid', 'name', 'partition', 'workdir',
+                        'nodes', 'cpus', 'state', 'submit_time', 'start_time',
+                        'end_time', 'exitcode'],
+                   jobids=_parse_jobs(args.jobs))
+    user = os.environ.get('USER', 'mock')
+    table = [[_field_values(row, user).get(field, '') for field in fields]
+             for row in rows]
+    db.close()
+    if not args.noheader:
+        table.insert(0, fields)
+    if args.parsable2:
+        lines = ['|'.join(line) for line in table]
+    elif args.parsable:
+        lines = ['|'.join(line) + '|' for line in table]
+    else:
+        lines = [' '.join('{:>10}'.format(value[:10]) for value in line)
+                 for line in table]
+        if not args.noheader:
+            lines.insert(1, ' '.join(['-' * 10] * len(fields)))
+    if len(lines) > 0:
+        print('\n'.join(lines))
+    return 0
+
+
+def srun(args):
+    """ Run a command as job step
+
+    The resource options are ignored, except --chdir
+    """
+    value_options = ['-n', '--ntasks', '-N', '--nodes', '-c',
+                     '--cpus-per-task', '-D', '--chdir']
+    chdir = None
+    while len(args) > 0 and args[0].startswith('-'):
+        arg = args.pop(0)
+        if '=' in arg:
+            name, value = arg.split('=', 1)
+        elif arg in value_options:
+            name, value = arg, args.pop(0)
+        else:
+            continue
+        if name in ['-D', '--chdir']:
+            chdir = value
+    if len(args) == 0:
+        sys.stderr.write('srun: fatal: No command given to execute.\n')
+        return 1
+    if chdir is not None:
+        os.chdir(chdir)
+    os.execvp(args[0], args)
+
+
+def main(argv):
+    """ Run one of the mock Slurm commands """
+    if len(argv) == 0 or argv[0] not in commands + ['_run']:
+        sys.stderr.write('Usage: mock_slurm {{{!s}}} [args]\n'.format(','.join(commands)))
+        return 1
+    command = globals()[argv[0]]
+    return command(argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,297 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Resource sampler for runs launched on the local machine.
+
+ProcessSampler follows the process tree of a launched mpirun through
+/proc and records per process, at a fixed interval, the CPU utilisation,
+the resident set size and the bytes read and written. The MPI rank of a
+process is read from its environment. This finds memory blowups and load
+imbalance without Cray tooling.
+
+Sampling is off by default. Set the environment variable
+QUALIKIZ_SAMPLE_INTERVAL to the interval in seconds, or pass
+sample_interval to bash.Run.launch, to write the samples of a run to
+procsamples.csv in its folder. 'qualikiz_tools poll samples' collects
+them in the 'samples' table of a polling database.
+"""
+import os
+import csv
+import time
+import threading
+from warnings import warn
+
+from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizBatch
+from qualikiz_tools.misc.mpi import rank_env_vars
+
+sample_env_var = 'QUALIKIZ_SAMPLE_INTERVAL'
+samples_file = 'procsamples.csv'
+fields = ['time', 'pid', 'ppid', 'rank', 'name', 'cpu', 'cputime', 'rss',
+          'read_bytes', 'write_bytes']
+clock_ticks = os.sysconf('SC_CLK_TCK')
+page_size = os.sysconf('SC_PAGE_SIZE')
+
+
+def default_interval():
+    """ Sample interval in seconds from QUALIKIZ_SAMPLE_INTERVAL, None if not set """
+    interval = os.environ.get(sample_env_var)
+    if not interval:
+        return None
+    return float(interval)
+
+def read_stat(pid):
+    """ Read /proc/<pid>/stat
+
+    Returns:
+        Tuple of the name, parent pid, CPU time in seconds, start time
+        in seconds since boot and RSS in bytes of the process
+    """
+    with open('/proc/{:d}/stat'.format(pid), 'r') as file_:
+        content = file_.read()
+    # The name is between parentheses and can contain spaces
+    name = content[content.find('(') + 1:content.rfind(')')]
+    rest = content[content.rfind(')') + 2:].split()
+    cputime = (int(rest[11]) + int(rest[12])) / clock_ticks
+    return name, int(rest[1]), cputime, int(rest[19]) / clock_ticks, int(rest[21]) * page_size
+
+def read_io(pid):
+    """ Bytes read and written by a process, from /proc/<pid>/io
+
+    rchar and wchar count all read and write calls, including those
+    served from the page cache. Nones if not readable.
+    """
+    try:
+        with open('/proc/{:d}/io'.format(pid), 'rb') as file_:
+            counters = dict(line.split(b':') for line in file_.read().splitlines())
+        return int(counters[b'rchar']), int(counters[b'wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def read_rank(pid):
+    """ MPI rank of a process from its environment, None if not an MPI rank """
+    try:
+        with open('/proc/{:d}/environ'.format(pid), 'rb') as file_:
+            environ = dict(item.split(b'=', 1) for item in file_.read().split(b'\0')
+                           if b'=' in item)
+    except OSError:
+        return None
+    for env_var in rank_env_vars:
+        if env_var.encode() in environ:
+            return int(environ[env_var.encode()])
+    return None
+
+def read_uptime():
+    """ Seconds since boot """
+    with open('/proc/uptime', 'r') as file_:
+        return float(file_.read().split()[0])
+
+def process_tree(pid):
+    """ The pids of a process and all its descendants """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            ppid = read_stat(int(entry))[1]
+        except (OSError, IndexError, ValueError):
+            # The process exited while listing
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+
+class ProcessSampler():
+    """ Samples the resource usage of a process tree in a thread
+
+    Use as context manager, or call start and stop:
+
+        process = subprocess.Popen(...)
+        with ProcessSampler(process.pid, interval=1) as sampler:
+            process.wait()
+        sampler.to_csv(path)
+
+    Attributes:
+        pid:      Pid of the root of the process tree
+        interval: Time in seconds between samples
+        samples:  List with a dict with the fields per process per sample.
+                  time is relative to the start of sampling, cpu is the
+                  CPU utilisation since the previous sample in cores
+    """
+    def __init__(self, pid, interval=1.):
+        if not os.path.isdir('/proc'):
+            raise Exception('Sampling processes needs /proc')
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._previous = {}
+        self._ranks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """ Take a sample of every process in the tree """
+        now = time.time()
+        uptime = read_uptime()
+        for pid in process_tree(self.pid):
+            try:
+                name, ppid, cputime, start, rss = read_stat(pid)
+            except (OSError, IndexError, ValueError):
+                continue
+            if pid not in self._ranks:
+                self._ranks[pid] = read_rank(pid)
+            if pid in self._previous:
+                last_time, last_cputime = self._previous[pid]
+                elapsed = now - last_time
+                cpu = (cputime - last_cputime) / elapsed if elapsed > 0 else 0.
+            else:
+                # Average over the lifetime of the process
+                elapsed = uptime - start
+                cpu = cputime / elapsed if elapsed > 0 else 0.
+            self._previous[pid] = (now, cputime)
+            read_bytes, write_bytes = read_io(pid)
+            self.samples.append(dict(zip(fields, [
+                now - self.start_time, pid, ppid, self._ranks[pid], name, cpu,
+                cputime, rss, read_bytes, write_bytes])))
+
+    def _loop(self):
+        while True:
+            self.sample()
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        """ Start sampling in a background thread """
+        self.start_time = time.time()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop sampling and wait for the thread to finish """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def to_csv(self, path):
+        """ Write the samples as csv with a header line """
+        with open(path, 'w', newline='') as file_:
+            writer = csv.DictWriter(file_, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(self.samples)
+
+
+def read_samples(path):
+    """ Read a csv written by ProcessSampler.to_csv
+
+    Returns:
+        List of rows with the values of fields, empty values are None
+    """
+    converters = [float, int, int, int, str, float, float, int, int, int]
+    rows = []
+    with open(path, 'r', newline='') as file_:
+        for line in csv.DictReader(file_):
+            rows.append([None if line[field] == '' else converter(line[field])
+                         for field, converter in zip(fields, converters)])
+    return rows
+
+def create_samples_database(batchlist, database_path, append=None, overwrite=None):
+    """ Create a database with the resource samples of the runs
+    Args:
+        - batchlist:     The batches to be polled
+        - database_path: Path to the database to be created
+
+    Kwargs:
+        - overwrite: Overwrite database if exists? Default 'ask user'
+        - append:    Append to table if exists? Default 'ask user'
+    """
+    # Imported here, so the launchers do not need tabulate
+    from tabulate import tabulate
+    from qualikiz_tools.machine_specific.basicpoll import database_exists, connect
+    create_table = database_exists(database_path, 'samples', append=append, overwrite=overwrite)
+
+    db = connect(database_path)
+    if create_table:
+        db.execute('''CREATE TABLE samples (
+            Run         TEXT,
+            Time        REAL,
+            Pid         INTEGER,
+            Ppid        INTEGER,
+            Rank        INTEGER,
+            Name        TEXT,
+            CPU         REAL,
+            CPUtime     REAL,
+            RSS         INTEGER,
+            Read_bytes  INTEGER,
+            Write_bytes INTEGER
+          )''')
+
+    rows = []
+    for batch in batchlist:
+        for run in batch.runlist:
+            path = os.path.join(run.rundir, samples_file)
+            if os.path.isfile(path):
+                rows.extend([run.rundir] + row for row in read_samples(path))
+            else:
+                warn('No resource samples for {!s}, skipping..'.format(run.rundir))
+    with db:
+        db.executemany('INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    print (tabulate(summarize(db), headers=['Run', 'Duration', 'Peak RSS [MB]',
+                                           'Peak rank RSS [MB]', 'Imbalance'],
+                    floatfmt='.1f'))
+
+def summarize(db):
+    """ Summarize the samples table per run
+
+    The imbalance is the CPU time of the busiest rank over the mean CPU
+    time of the ranks, 1 for perfect balance.
+
+    Args:
+        db: Connection to the polling database
+
+    Returns:
+        List of rows with the run, the duration of sampling in seconds,
+        the peak RSS of the process tree and of a single rank in MB and
+        the imbalance. None if the run has no ranks
+    """
+    runs = db.execute('''
+        SELECT Run, MAX(Time), MAX(RSS_total)
+        FROM (SELECT Run, Time, SUM(RSS) AS RSS_total FROM samples GROUP BY Run, Time)
+        GROUP BY Run ORDER BY Run''').fetchall()
+    ranks = dict((run, (rss, imbalance)) for run, rss, imbalance in db.execute('''
+        SELECT Run, MAX(Peak_RSS), MAX(Final_CPUtime) / AVG(Final_CPUtime)
+        FROM (SELECT Run, Rank, MAX(RSS) AS Peak_RSS, MAX(CPUtime) AS Final_CPUtime
+              FROM samples WHERE Rank IS NOT NULL GROUP BY Run, Rank)
+        GROUP BY Run'''))
+    rows = []
+    for run, duration, rss in runs:
+        rank_rss, imbalance = ranks.get(run, (None, None))
+        rows.append([run, duration, rss / 1e6,
+                     None if rank_rss is None else rank_rss / 1e6, imbalance])
+    return rows
+
+def create_database(path, database_path, append=None, overwrite=None,
+                    use_index=None):
+    """ Create a database with the resource samples of all runs in path
+    Args:
+        - database_path: Path to the database to be created
+
+    Kwargs:
+        - overwrite: Overwrite database if exists? Default 'ask user'
+        - append:    Append to table if exists? Default 'ask user'
+        - use_index: Find the batches with the DirIndex, see
+                     QuaLiKizBatch.from_dir_recursive
+    """
+    batchlist = QuaLiKizBatch.from_dir_recursive(path, use_index=use_index)
+    create_samples_database(batchlist, database_path, append=append, overwrite=overwrite)
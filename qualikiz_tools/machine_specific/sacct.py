@@ -13,46 +13,78 @@ from warnings import warn
 import datetime
 
 from tabulate import tabulate
-from qualikiz_tools.qualikz_io.qualikizrun import QuaLiKizRun, QuaLiKizBatch
-from qualikiz_tools.machine_specific.basicpoll import database_exists
+from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun, QuaLiKizBatch
+from qualikiz_tools.machine_specific.basicpoll import database_exists, connect, read_jobnumber
 
 
+sacct_fields = 'submit,CPUTime,CPUTimeRAW,NNodes'
+# Amount of job ids per sacct call, to stay well below the maximum
+# command line length
+sacct_chunksize = 500
+
+def poll_sacct_many(batchlist):
+    """ Poll the jobs of many batches with as few sacct calls as possible
+    The job numbers are read from the batchinfo files, and polled with
+    one 'sacct -j id1,id2,...' call per sacct_chunksize batches.
+
+    Args:
+        - batchlist: The batches to poll. Their folders should contain
+                     a batchinfo file
+
+    Returns:
+        - header: The names of the fields in the table, returned by
+                  sacct
+        - tables: A table per batch, in the order of batchlist. The rows
+                  are the jobs, one per array task for job arrays
+    """
+    jobnumbers = [str(read_jobnumber(batch)) for batch in batchlist]
+    header = None
+    rows_per_job = {}
+    for start in range(0, len(jobnumbers), sacct_chunksize):
+        cmd = ['sacct', '-o', sacct_fields, '-lXP', '--noconvert',
+               '-j', ','.join(jobnumbers[start:start + sacct_chunksize])]
+        output = subprocess.check_output(cmd).decode('UTF-8')
+        lines = output.splitlines()
+        header = lines[0].split('|')
+        jobid_index = header.index('JobID')
+        for line in lines[1:]:
+            entry = line.split('|')
+            # Array tasks are reported as <jobnumber>_<task>
+            jobnumber = entry[jobid_index].split('_')[0]
+            rows_per_job.setdefault(jobnumber, []).append(entry)
+
+    tables = []
+    for batch, jobnumber in zip(batchlist, jobnumbers):
+        table = rows_per_job.get(jobnumber, [])
+        for entry in table:
+            jobname_index = header.index('JobName')
+            state_index = header.index('State')
+            if entry[jobname_index] == batch.name:
+                if entry[state_index] != 'COMPLETED':
+                    warn('State of ' + entry[jobname_index] + ' is ' + entry[state_index] + ', not COMPLETED. Results might not be reliable')
+        tables.append(table)
+    return header, tables
+
 def poll_sacct(batch):
     """ Poll a job in a specific directory using sacct
     We exploit the fact that every 'run' should be unique, e.g.
     having a unique job-id.
     Args:
-        - path: Path to poll. Path should contain a metadata
-                and job file.
+        - batch: The batch to poll. Its folder should contain a batchinfo
+                 file
 
     Returns:
         - header: The names of the fields in the table, returned by
                   sacct
         - table:  A table containing the polled data. This table should always
-                  have one row. The aforementioned headers defines the columns
-                  of the table
+                  have one row, or one row per array task for job arrays.
+                  The aforementioned headers defines the columns of the table
     """
-    batchdir = os.path.join(batch.batchsdir, batch.name)
-    batchinfopath = os.path.join(batchdir, QuaLiKizBatch.batchinfofile)
-    with open(batchinfopath, 'r') as file_:
-        batchinfo = json.load(file_)
-
-    extra_fields = 'submit,CPUTime,CPUTimeRAW,NNodes'
-    cmd = 'sacct -o ' + extra_fields + ' -lXP --noconvert -j ' + batchinfo['jobnumber']
-    output = subprocess.check_output(cmd, shell=True).decode('UTF-8')
-
-    lines = output.splitlines()
-    header = lines[0].split('|')
-    table = [line.split('|') for line in lines[1:]]
-    if len(table) > 1:
-        raise Exception('Could not uniquely identify job ' + job.batch.name)
-    for entry in table:
-        jobname_index = header.index('JobName')
-        state_index = header.index('State')
-        if entry[jobname_index] == batch.name:
-            if entry[state_index] != 'COMPLETED':
-                warn('State of ' + entry[jobname_index] + ' is ' + entry[state_index] + ', not COMPLETED. Results might not be reliable')
-
+    header, tables = poll_sacct_many([batch])
+    table = tables[0]
+    jobid_index = header.index('JobID')
+    if len(table) > 1 and not all('_' in entry[jobid_index] for entry in table):
+        raise Exception('Could not uniquely identify job ' + batch.name)
     return header, table
 
 def header_to_sql(header):
@@ -70,8 +102,11 @@ def header_to_sql(header):
 
 def create_sacct_database(batchlist, database_path, append=None, overwrite=None):
     """ Create a database with sacct data
+    All jobs are polled with as few sacct calls as possible, see
+    poll_sacct_many, and inserted in a single transaction.
+
     Args:
-        -  path:          The path to be polled
+        - batchlist:     The batches to be polled
         - database_path: Path to the database to be created
 
     Kwargs:
@@ -80,7 +115,7 @@ def create_sacct_database(batchlist, database_path, append=None, overwrite=None)
     """
     create_table = database_exists(database_path, 'sacct', append=append, overwrite=overwrite)
 
-    db = sqlite3.connect(database_path)
+    db = connect(database_path)
     if create_table:
         db.execute('''CREATE TABLE sacct (
                    Submit           TEXT,
@@ -131,14 +166,13 @@ def create_sacct_database(batchlist, database_path, append=None, overwrite=None)
                    ReqTRES          TEXT,
                    AllocTRES        TEXT
                    )''')
-    result = []
-    for batch in batchlist:
-        __, data = poll_sacct(batch) 
-        db.execute('''
+    __, tables = poll_sacct_many(batchlist)
+    with db:
+        db.executemany('''
         INSERT INTO sacct (
         Submit, CPUTime, CPUTimeRAW, NNodes, JobID, JobIDRaw, JobName, Partition, MaxVMSize, MaxVMSizeNode, MaxVMSizeTask, AveVMSize, MaxRSS, MaxRSSNode, MaxRSSTask, AveRSS, MaxPages, MaxPagesNode, MaxPagesTask, AvePages, MinCPU, MinCPUNode, MinCPUTask, AveCPU, NTasks, AllocCPUS, Elapsed, State, ExitCode, AveCPUFreq, ReqCPUFreqMin, ReqCPUFreqMax, ReqCPUFreqGov, ReqMem, ConsumedEnergy, MaxDiskRead, MaxDiskReadNode, MaxDiskReadTask, AveDiskRead, MaxDiskWrite, MaxDiskWriteNode, MaxDiskWriteTask, AveDiskWrite, AllocGRES, ReqGRES, ReqTRES, AllocTRES)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', data[0])
-    db.commit()
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                       [entry for table in tables for entry in table])
 
     query = db.execute('select JobID, CPUTime, NNodes, AllocCPUS, Elapsed, State from sacct')
     headers = [x[0] for x in query.description]
@@ -160,6 +194,7 @@ def acctstr_to_timedelta(acctstr):
             timedelta = datetime.timedelta(seconds=seconds, minutes=minutes, hours=hours, days=days)
     return timedelta
 
-def create_database(path, database_path, append=None, overwrite=None):
-    batchlist = QuaLiKizBatch.from_dir_recursive(path)
+def create_database(path, database_path, append=None, overwrite=None,
+                    use_index=None):
+    batchlist = QuaLiKizBatch.from_dir_recursive(path, use_index=use_index)
     create_sacct_database(batchlist, database_path, append=append, overwrite=overwrite)
@@ -5,17 +5,27 @@ License: CeCILL v2.1
 """
 from warnings import warn
 import os
+import re
 import subprocess
 
 import numpy as np
-from IPython import embed
 
-from qualikiz_tools.machine_specific.bash import Run
+from qualikiz_tools.machine_specific.bash import Run, update_batchinfo
 from qualikiz_tools.machine_specific.system import Batch
 from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun, QuaLiKizBatch
 from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.walltime_model import load_model as load_walltime_model
+from qualikiz_tools.qualikiz_io.campaign import record_state
 
 class Run(Run):
+    """ Defines the run command
+
+    Class Variables:
+        - srunstring: Command used to start runs concurrently inside
+                      a single allocation, see to_srun_string
+    """
+    srunstring = 'srun'
+
     def __init__(self, parent_dir, name, binaryrelpath,
                  stdout=None, stderr=None,
                  **kwargs):
@@ -28,6 +38,55 @@ class Run(Run):
                          stdout=stdout, stderr=stderr,
                          **kwargs)
 
+    def to_srun_string(self, batch_dir):
+        """ Create string to start the run in the background with srun
+
+        Used by the 'packed' Batch style. The exclusive job step only
+        gets the CPUs it needs, so multiple runs can share the nodes of
+        one allocation.
+
+        Args:
+            batch_dir: Directory the batch script lives in. Needed to
+                       generate the relative paths.
+        """
+        if self.binaryrelpath is None:
+            raise FileNotFoundError('No binary rel path specified, could not find link to QuaLiKiz binary in {!s}'.format(self.rundir))
+        rundir = os.path.normpath(os.path.relpath(self.rundir, batch_dir))
+        string = ' '.join([self.srunstring, '--exclusive',
+                           '-n', str(self.tasks),
+                           '--chdir', rundir,
+                           './' + os.path.basename(self.binaryrelpath)])
+        for redirect, path in zip(['>', '2>'], [self.stdout, self.stderr]):
+            if not os.path.isabs(path):
+                path = os.path.normpath(os.path.join(rundir, path))
+            string += ' ' + redirect + ' ' + path
+        return string + ' &'
+
+    @classmethod
+    def from_srun_string(cls, string, batchdir):
+        """ Reconstruct the Run from an srun string
+
+        Reverse of to_srun_string.
+
+        Args:
+            string:     The string to parse
+            batchdir:   The directory of the containing batch script
+
+        Returns:
+            The reconstructed Run instance
+        """
+        split = string.strip().rstrip('&').strip().split(' ')
+        tasks = int(split[3])
+        rundir = os.path.join(batchdir, split[5])
+        paths = []
+        for path in [split[8], split[10]]:
+            if not os.path.isabs(path):
+                path = os.path.relpath(os.path.join(batchdir, path), rundir)
+            paths.append(path)
+        run = cls.from_dir(rundir, stdout=paths[0], stderr=paths[1])
+        run.tasks = tasks
+        return run
+
 
 class Batch(Batch):
     """ Defines a batch job
@@ -39,6 +98,10 @@ class Batch(Batch):
         - attr:             All possible attributes as defined by Edison
         - sbatch:           Names of attributes as they are in the sbatch file
         - shell:            The shell to use for sbatch scripts. Usually bash
+        - styles:           Supported ways to glue the runs together
+        - partition_limits: Maximum walltime in seconds and maximum
+                            amount of nodes per partition. None if
+                            unlimited
     """
     # pylint: disable=too-many-instance-attributes
     attr = ['nodes',
@@ -67,10 +130,16 @@ class Batch(Batch):
     run_class = Run
     defaults = {'stdout': 'stdout.batch',
                 'stderr': 'stderr.batch'}
+    styles = ['sequential', 'job_array', 'packed']
+    # TODO: generalize for non-edison machines
+    partition_limits = {'debug': {'walltime': 30 * 60, 'nodes': 512},
+                        'regular': {'walltime': 48 * 3600, 'nodes': None}}
+    array_task_re = re.compile(r'^\s*\d+\)\s+(.*?)\s*;;\s*$')
 
     def __init__(self, parent_dir, name, runlist, maxtime=None,
                  stdout=None, stderr=None,
-                 safetytime=1.5, style='sequential',
+                 safetytime=1.5, style='sequential', walltime_model=None,
+                 array_throttle=None, packed_nodes=None,
                  **kwargs):
         """ Initialize Edison batch job
 
@@ -93,8 +162,21 @@ class Batch(Batch):
             - vcores_per_task: Amount of cores to use per task
             - safetytime: An extra factor that will be used in the calculation
                           of requested runtime. 1.5x by default
-            - style:      How to glue the different runs together. Currently
-                          only 'sequential' is used
+            - style:      How to glue the different runs together. One of
+                          'sequential', running the runs one after the
+                          other in one allocation; 'job_array', one array
+                          task per run; or 'packed', running as many runs
+                          as fit concurrently in one allocation
+            - array_throttle: Maximum amount of array tasks running at
+                          the same time for the 'job_array' style.
+                          Unlimited by default
+            - packed_nodes: Amount of nodes to allocate for the 'packed'
+                          style. Runs that do not fit wait for earlier
+                          runs to finish. By default all runs fit at once
+            - walltime_model: WalltimeModel used to estimate the walltime
+                          of the runs. By default the model configured with
+                          the QUALIKIZ_WALLTIME_MODEL environment variable,
+                          or a worst-case estimate if there is none
 
 
         Calculated:
@@ -117,64 +199,235 @@ class Batch(Batch):
         super().__init__(parent_dir, name, runlist,
                          stdout=self.stdout, stderr=self.stderr)
 
-        if style == 'sequential':
-            task_array = np.array([run.tasks for run in self.runlist])
-            cores_per_node = self.run_class.defaults['cores_per_node']
-            nodes_array = np.array([run.nodes for run in self.runlist])
-            cores_array = cores_per_node * nodes_array
-            if any(cores_array != task_array):
-                warn('Warning! More than 1 task per physical core! Walltime might be inaccurate')
-
-            totwallsec = np.sum([run.estimate_walltime(run.nodes * cores_per_node) for run in self.runlist])
-            totwallsec *= safetytime
-            m, s = divmod(totwallsec, 60)
-            h, m = divmod((m + 1), 60)
-
-            # TODO: generalize for non-edison machines
-            if self.partition == 'debug' and (h >= 1 or m >= 30):
-                warn('Walltime requested too high for debug partition')
-            self.maxtime = ("%d:%02d:%02d" % (h, m, s))
-        else:
+        if style not in self.styles:
             raise NotImplementedError('Style {!s} not implemented yet.'.format(style))
+        self.style = style
+        self.array_throttle = array_throttle
+        self.packed_nodes = packed_nodes
+
+        task_array = np.array([run.tasks for run in self.runlist])
+        cores_per_node = self.run_class.defaults['cores_per_node']
+        nodes_array = np.array([run.nodes for run in self.runlist])
+        cores_array = cores_per_node * nodes_array
+        if any(cores_array != task_array):
+            warn('Warning! More than 1 task per physical core! Walltime might be inaccurate')
+
+        self.safetytime = safetytime
+        self.walltime_model = walltime_model
+        self.maxtime = self.estimate_maxtime()
+
+    @property
+    def slots_per_node(self):
+        """ Amount of MPI tasks that fit on a node """
+        if self.tasks_per_node is not None:
+            return self.tasks_per_node
+        return self.run_class.defaults['cores_per_node']
+
+    def run_nodes(self, run):
+        """ Amount of nodes needed for the tasks of a run """
+        return int(np.ceil(run.tasks / self.slots_per_node))
+
+    def calc_nodes(self, runlist=None):
+        """ Amount of nodes to allocate
+
+        For the 'sequential' and 'job_array' styles this is the amount of
+        nodes needed by the largest run. For the 'packed' style this is
+        packed_nodes, or enough nodes to run all runs at once.
+
+        Kwargs:
+            runlist: Runs to allocate the nodes for. All runs by default
+
+        Returns:
+            The amount of nodes
+        """
+        if runlist is None:
+            runlist = self.runlist
+        run_nodes = [self.run_nodes(run) for run in runlist]
+        if self.style == 'packed':
+            if self.packed_nodes is not None:
+                return max([self.packed_nodes] + run_nodes)
+            tasks = np.sum([run.tasks for run in runlist])
+            return int(np.ceil(tasks / self.slots_per_node))
+        return max(run_nodes)
 
     @property
     def nodes(self):
-        return max([run.nodes for run in self.runlist])
+        return self.calc_nodes()
 
-    def launch(self):
-        self.inputbinaries_exist()
-        self.clean()
-        paths = []
-        batch_dir = os.path.join(self.parent_dir, self.name)
+    def pack_waves(self, runlist=None):
+        """ Group the runs in waves for the 'packed' style
+
+        Runs are added in order to the current wave as long as the tasks
+        of the wave fit on the allocated nodes. The runs of a wave run
+        concurrently, a wave starts when the previous one is done.
+
+        Kwargs:
+            runlist: Runs to group. All runs by default
+
+        Returns:
+            List of lists of runs
+        """
+        if runlist is None:
+            runlist = self.runlist
+        slots = self.calc_nodes(runlist) * self.slots_per_node
+        waves = []
+        used = slots
+        for run in runlist:
+            if used + run.tasks > slots:
+                waves.append([])
+                used = 0
+            waves[-1].append(run)
+            used += run.tasks
+        return waves
+
+    def run_cores(self, run):
+        """ Amount of cores a run gets
+
+        With the 'packed' style a run only gets a core per task, with
+        the other styles a run gets all cores of its nodes.
+        """
+        if self.style == 'packed':
+            return run.tasks
+        return self.run_nodes(run) * self.run_class.defaults['cores_per_node']
+
+    def estimate_maxtime(self, runlist=None):
+        """ Estimate the walltime to request
+
+        This is the sum of the walltimes of the runs for the 'sequential'
+        style, the walltime of the slowest run for the 'job_array' style,
+        and the sum of the slowest run per wave for the 'packed' style.
+
+        Kwargs:
+            runlist: Runs to estimate the walltime for. All runs by default
+
+        Returns:
+            The walltime as string in sbatch format
+        """
+        if runlist is None:
+            runlist = self.runlist
+        walltime_model = self.walltime_model
+        if walltime_model is None:
+            walltime_model = load_walltime_model()
+        def walltime(run):
+            return run.estimate_walltime(self.run_cores(run),
+                                         model=walltime_model)
+        if self.style == 'job_array':
+            totwallsec = max([walltime(run) for run in runlist])
+        elif self.style == 'packed':
+            totwallsec = np.sum([max([walltime(run) for run in wave])
+                                 for wave in self.pack_waves(runlist)])
+        else:
+            totwallsec = np.sum([walltime(run) for run in runlist])
+        totwallsec *= self.safetytime
+        m, s = divmod(totwallsec, 60)
+        h, m = divmod((m + 1), 60)
+
+        limit = self.partition_limits.get(self.partition, {}).get('walltime')
+        if limit is not None and 3600 * h + 60 * m + s > limit:
+            warn('Walltime requested too high for {!s} partition'.format(self.partition))
+        return ("%d:%02d:%02d" % (h, m, s))
 
-        cmd = ' '.join(['cd', batch_dir, '&&',
-                        'sbatch', self.scriptname])
-        out = subprocess.check_output(cmd, shell=True)
-        print(out.strip().decode('ascii'))
+    def launch(self, resume=False):
+        """ Submit the batch script with sbatch
+        The job number is written to the batchinfo file.
 
-    def to_batch_file(self, script_path, overwrite_batch_script=False, **kwargs):
+        Kwargs:
+            resume: Only submit the runs that did not write all their
+                    output, see QuaLiKizBatch.incomplete_runs. The output
+                    of the complete runs is left alone, and the incomplete
+                    runs are written to a separate resume script with
+                    its own walltime estimate
+        """
+        self.inputbinaries_exist()
+        batch_dir = os.path.join(self.parent_dir, self.name)
+        if resume:
+            runlist = self.incomplete_runs()
+            if len(runlist) == 0:
+                print('All runs of {!s} are complete, nothing to resume'.format(batch_dir))
+                return
+            scriptname = self.resume_scriptname
+            self.to_batch_file(os.path.join(batch_dir, scriptname),
+                               overwrite_batch_script=True, runlist=runlist)
+            for run in runlist:
+                run.clean()
+        else:
+            runlist = self.runlist
+            scriptname = self.scriptname
+            self.clean()
+
+        out = subprocess.check_output(['sbatch', scriptname],
+                                      cwd=batch_dir).strip().decode('ascii')
+        print(out)
+        # 'Submitted batch job <jobnumber>', used by sacct.poll_sacct
+        update_batchinfo(os.path.join(batch_dir, self.batchinfofile),
+                         jobnumber=out.split()[-1])
+        record_state([run.rundir for run in runlist], 'launched', regress=True)
+
+    def to_batch_file(self, script_path, overwrite_batch_script=False,
+                      runlist=None, **kwargs):
         """ Writes sbatch script to file
 
         Args:
             - path: Path of the sbatch script file.
+
+        Kwargs:
+            - overwrite_batch_script: Overwrite the script if it exists
+            - runlist: Runs to include in the script. All runs by default.
+                       The requested walltime is estimated for these runs
         """
         if os.path.isfile(script_path) and not overwrite_batch_script:
             raise OSError("Script path '{!s}' already exists".format(script_path))
+        if runlist is None:
+            runlist = self.runlist
+            # The style might have changed since initialization
+            self.maxtime = self.estimate_maxtime(runlist)
+            maxtime = self.maxtime
+        else:
+            maxtime = self.estimate_maxtime(runlist)
         sbatch_lines = ['#!' + self.shell + ' -l\n']
         for attr, sbatch in zip(self.attr, self.sbatch):
-            value = getattr(self, attr)
+            if attr == 'maxtime':
+                value = maxtime
+            elif attr == 'nodes':
+                value = self.calc_nodes(runlist)
+            else:
+                value = getattr(self, attr)
+            if (self.style == 'job_array' and attr in ['stdout', 'stderr']
+                    and value is not None):
+                # One file per array task
+                value += '_%a'
             if value is not None:
                 line = '#SBATCH --' + sbatch + '=' + str(value) + '\n'
                 sbatch_lines.append(line)
+        if self.style == 'job_array':
+            array = '0-{:d}'.format(len(runlist) - 1)
+            if self.array_throttle is not None:
+                array += '%{:d}'.format(self.array_throttle)
+            sbatch_lines.append('#SBATCH --array=' + array + '\n')
 
         sbatch_lines.append('\nexport OMP_NUM_THREADS=2\n\n')
 
         # Write sruns to file
         batchdir = os.path.join(self.parent_dir, self.name)
-        for ii, run_instance in enumerate(self.runlist):
-            sbatch_lines.append('\necho "Starting job {:d}/{:d}"'.format(ii + 1, len(self.runlist)))
-            sbatch_lines.append('\n' + run_instance.to_batch_string(batchdir))
-        sbatch_lines.append('\necho "All jobs done!"\n')
+        if self.style == 'job_array':
+            sbatch_lines.append('case $SLURM_ARRAY_TASK_ID in\n')
+            for ii, run_instance in enumerate(runlist):
+                sbatch_lines.append('    {:d}) {!s} ;;\n'.format(
+                    ii, run_instance.to_batch_string(batchdir)))
+            sbatch_lines.append('esac\n')
+        elif self.style == 'packed':
+            waves = self.pack_waves(runlist)
+            for ii, wave in enumerate(waves):
+                sbatch_lines.append('\necho "Starting wave {:d}/{:d}"'.format(ii + 1, len(waves)))
+                for run_instance in wave:
+                    sbatch_lines.append('\n' + run_instance.to_srun_string(batchdir))
+                sbatch_lines.append('\nwait')
+            sbatch_lines.append('\necho "All jobs done!"\n')
+        else:
+            for ii, run_instance in enumerate(runlist):
+                sbatch_lines.append('\necho "Starting job {:d}/{:d}"'.format(ii + 1, len(runlist)))
+                sbatch_lines.append('\n' + run_instance.to_batch_string(batchdir))
+            sbatch_lines.append('\necho "All jobs done!"\n')
 
         with open(script_path, 'w') as file:
             file.writelines(sbatch_lines)
@@ -184,8 +437,21 @@ class Batch(Batch):
         """ Reconstruct sbatch from sbatch file """
         srun_strings = []
         batch_dict = {}
+        style = 'sequential'
         with open(path, 'r') as file:
             for line in file:
+                if line.startswith('#SBATCH --array='):
+                    style = 'job_array'
+                    array = line.strip().split('=')[1]
+                    if '%' in array:
+                        batch_dict['array_throttle'] = int(array.split('%')[1])
+                    continue
+                array_task = cls.array_task_re.match(line)
+                if array_task is not None:
+                    srun_strings.append(array_task.group(1))
+                if line.startswith(cls.run_class.srunstring + ' '):
+                    style = 'packed'
+                    srun_strings.append(line)
                 if line.startswith('#SBATCH --'):
                     line = line.lstrip('#SBATCH --')
                     name, value = line.split('=')
@@ -208,7 +474,12 @@ class Batch(Batch):
         try:
             runlist = []
             for srun_string in srun_strings:
-                runlist.append(cls.run_class.from_batch_string(srun_string, batch_dir))
+                if style == 'packed':
+                    run = cls.run_class.from_srun_string(srun_string, batch_dir)
+                else:
+                    run = cls.run_class.from_batch_string(srun_string, batch_dir)
+                    run.tasks = int(srun_string.split(' ')[2])
+                runlist.append(run)
         except FileNotFoundError:
             raise Exception('Could not reconstruct run from string: {!s}'.format(srun_string))
 
@@ -216,8 +487,15 @@ class Batch(Batch):
         for var in ['nodes', 'tasks_per_node', 'name']:
             if var in batch_dict:
                 check_vars[var] = batch_dict.pop(var)
-
-        batch = Batch(batch_parent, batch_name, runlist, **batch_dict)
+        if style == 'job_array':
+            for var in ['stdout', 'stderr']:
+                if var in batch_dict and batch_dict[var].endswith('_%a'):
+                    batch_dict[var] = batch_dict[var][:-len('_%a')]
+        if style == 'packed' and 'nodes' in check_vars:
+            batch_dict['packed_nodes'] = check_vars['nodes']
+
+        batch = Batch(batch_parent, batch_name, runlist, style=style,
+                      **batch_dict)
         return batch
 
     @classmethod
@@ -246,6 +524,88 @@ class Batch(Batch):
         return NotImplemented
 
 
+def pack_runs(parent_dir, name, runlist, partition=None, max_walltime=None,
+              max_nodes=None, safetytime=1.5, walltime_model=None,
+              **kwargs):
+    """ Pack runs in as few sequential Batches as possible
+
+    The runs are grouped by the amount of nodes they need, so no nodes
+    are left idle. Per group the runs are packed with the first-fit
+    decreasing heuristic: the runs are sorted by their estimated walltime,
+    longest first, and every run is added to the first batch it fits in.
+    A batch is full when its requested walltime, including safetytime,
+    would exceed the maximum walltime.
+
+    Args:
+        parent_dir: Directory the batches live in
+        name:       Base name of the batches. The batches are called
+                    name_0, name_1, etc.
+        runlist:    List of Slurm Runs to pack
+
+    Kwargs:
+        partition:      Partition to run on. Its limits are used if
+                        max_walltime or max_nodes are not given, see
+                        Batch.partition_limits
+        max_walltime:   Maximum walltime of a batch in seconds
+        max_nodes:      Maximum amount of nodes of a batch
+        safetytime:     Factor on the estimated walltime, see Batch
+        walltime_model: WalltimeModel used to estimate the walltime of
+                        the runs, see QuaLiKizRun.estimate_walltime
+        **kwargs:       Passed to the Batches
+
+    Returns:
+        List of sequential Batches
+    """
+    limits = Batch.partition_limits.get(partition, {})
+    if max_walltime is None:
+        max_walltime = limits.get('walltime')
+    if max_nodes is None:
+        max_nodes = limits.get('nodes')
+    if walltime_model is None:
+        walltime_model = load_walltime_model()
+    slots_per_node = kwargs.get('tasks_per_node')
+    if slots_per_node is None:
+        slots_per_node = Batch.run_class.defaults['cores_per_node']
+    cores_per_node = Batch.run_class.defaults['cores_per_node']
+
+    groups = {}
+    for ii, run in enumerate(runlist):
+        nodes = int(np.ceil(run.tasks / slots_per_node))
+        if max_nodes is not None and nodes > max_nodes:
+            raise Exception('Run {!s} needs {:d} nodes, more than the maximum of {:d}'.format(
+                run.rundir, nodes, max_nodes))
+        walltime = safetytime * run.estimate_walltime(nodes * cores_per_node,
+                                                      model=walltime_model)
+        groups.setdefault(nodes, []).append((walltime, ii))
+
+    # Batch.estimate_maxtime rounds up to the next minute
+    if max_walltime is not None:
+        capacity = max_walltime - 60
+    bins = []
+    for nodes in sorted(groups, reverse=True):
+        group_bins = []
+        for walltime, ii in sorted(groups[nodes], key=lambda item: (-item[0], item[1])):
+            if max_walltime is not None and walltime > capacity:
+                warn('Run {!s} alone needs more than the maximum walltime'.format(
+                    runlist[ii].rundir))
+            for bin_ in group_bins:
+                if max_walltime is None or bin_[0] + walltime <= capacity:
+                    bin_[0] += walltime
+                    bin_[1].append(ii)
+                    break
+            else:
+                group_bins.append([walltime, [ii]])
+        bins.extend(group_bins)
+
+    batches = []
+    for jj, (__, indices) in enumerate(bins):
+        batches.append(Batch(parent_dir, '{!s}_{:d}'.format(name, jj),
+                             [runlist[ii] for ii in sorted(indices)],
+                             partition=partition, safetytime=safetytime,
+                             walltime_model=walltime_model, **kwargs))
+    return batches
+
+
 def str_to_number(string):
     """ Convert a string in a float or int if possible """
     try:
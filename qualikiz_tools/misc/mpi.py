@@ -0,0 +1,7 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+"""
+# Environment variables MPI implementations set to the rank of the process
+rank_env_vars = ['OMPI_COMM_WORLD_RANK', 'PMI_RANK', 'SLURM_PROCID']
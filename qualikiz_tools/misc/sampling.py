@@ -0,0 +1,208 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+"""
+import numpy as np
+
+# Direction numbers for the Sobol sequence, taken from the
+# new-joe-kuo-6.21201 table by S. Joe and F. Y. Kuo. Every row is
+# (s, a, m_1..m_s) for dimension 2 onwards, dimension 1 is trivial.
+sobol_direction_table = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]),
+    (5, 7, [1, 1, 7, 11, 19]),
+    (5, 11, [1, 1, 5, 1, 1]),
+    (5, 13, [1, 1, 1, 3, 11]),
+    (5, 14, [1, 3, 5, 5, 31]),
+    (6, 1, [1, 3, 3, 9, 7, 49]),
+    (6, 13, [1, 1, 1, 15, 21, 21]),
+    (6, 16, [1, 3, 1, 13, 27, 49]),
+    (6, 19, [1, 1, 1, 15, 7, 5]),
+    (6, 22, [1, 3, 1, 15, 13, 25]),
+    (6, 25, [1, 1, 5, 5, 19, 61]),
+    (7, 1, [1, 3, 7, 11, 23, 15, 103]),
+    (7, 4, [1, 3, 7, 13, 13, 15, 69]),
+]
+sobol_bits = 32
+max_sobol_dims = len(sobol_direction_table) + 1
+
+primes = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59,
+          61, 67, 71, 73, 79, 83, 89, 97, 101, 103, 107, 109, 113]
+
+
+def sobol_direction_numbers(ndims):
+    """ Calculate the Sobol direction numbers
+
+    Args:
+        ndims: Amount of dimensions
+
+    Returns:
+        Array of shape (ndims, sobol_bits) with the direction numbers
+        as unsigned integers
+    """
+    if ndims > max_sobol_dims:
+        raise ValueError('Sobol sequence only implemented up to {:d} '
+                         'dimensions, got {:d}'.format(max_sobol_dims, ndims))
+    directions = np.zeros((ndims, sobol_bits), dtype='uint64')
+    directions[0] = [1 << (sobol_bits - 1 - k) for k in range(sobol_bits)]
+    for dim in range(1, ndims):
+        s, a, m = sobol_direction_table[dim - 1]
+        v = [m[k] << (sobol_bits - 1 - k) for k in range(s)]
+        for k in range(s, sobol_bits):
+            new = v[k - s] ^ (v[k - s] >> s)
+            for l in range(1, s):
+                if (a >> (s - 1 - l)) & 1:
+                    new ^= v[k - l]
+            v.append(new)
+        directions[dim] = v
+    return directions
+
+
+def sobol(num_points, ndims, skip=1, scramble=False, seed=0):
+    """ Generate points of the Sobol sequence in the unit hypercube
+
+    The points are generated in Gray code order, without looping over
+    the points. The first point of the sequence is the origin, which
+    is skipped by default.
+
+    Args:
+        num_points: Amount of points to generate
+        ndims:      Amount of dimensions
+
+    Kwargs:
+        skip:       Amount of points to skip at the start of the sequence
+        scramble:   Apply a random digital shift to the sequence
+        seed:       Seed of the random digital shift
+
+    Returns:
+        Array of shape (num_points, ndims) with values in [0, 1)
+    """
+    directions = sobol_direction_numbers(ndims)
+    index = np.arange(skip, skip + num_points, dtype='uint64')
+    gray = index ^ (index >> np.uint64(1))
+    points = np.zeros((num_points, ndims), dtype='uint64')
+    for bit in range(sobol_bits):
+        mask = ((gray >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+        if not np.any(mask):
+            continue
+        points[mask] ^= directions[:, bit]
+    if scramble:
+        rng = np.random.RandomState(seed)
+        shift = rng.randint(0, 2 ** sobol_bits, size=ndims, dtype='uint64')
+        points ^= shift
+    return points / float(2 ** sobol_bits)
+
+
+def halton(num_points, ndims, skip=1, scramble=False, seed=0):
+    """ Generate points of the Halton sequence in the unit hypercube
+
+    Dimension i uses the radical inverse in base of the i-th prime.
+    The first point of the sequence is the origin, which is skipped
+    by default.
+
+    Args:
+        num_points: Amount of points to generate
+        ndims:      Amount of dimensions
+
+    Kwargs:
+        skip:       Amount of points to skip at the start of the sequence
+        scramble:   Apply a random (Cranley-Patterson) shift to the sequence
+        seed:       Seed of the random shift
+
+    Returns:
+        Array of shape (num_points, ndims) with values in [0, 1)
+    """
+    if ndims > len(primes):
+        raise ValueError('Halton sequence only implemented up to {:d} '
+                         'dimensions, got {:d}'.format(len(primes), ndims))
+    index = np.arange(skip, skip + num_points, dtype='int64')
+    points = np.zeros((num_points, ndims))
+    for dim, base in enumerate(primes[:ndims]):
+        remainder = index.copy()
+        factor = 1. / base
+        while np.any(remainder > 0):
+            remainder, digit = np.divmod(remainder, base)
+            points[:, dim] += digit * factor
+            factor /= base
+    if scramble:
+        rng = np.random.RandomState(seed)
+        points = np.mod(points + rng.random_sample(ndims), 1.)
+    return points
+
+
+def latin_hypercube(num_points, ndims, seed=0):
+    """ Generate a Latin hypercube sample in the unit hypercube
+
+    Every dimension is divided in num_points strata of equal size, with
+    exactly one point in each stratum.
+
+    Args:
+        num_points: Amount of points to generate
+        ndims:      Amount of dimensions
+
+    Kwargs:
+        seed:       Seed of the random number generator
+
+    Returns:
+        Array of shape (num_points, ndims) with values in [0, 1)
+    """
+    rng = np.random.RandomState(seed)
+    strata = np.argsort(rng.random_sample((num_points, ndims)), axis=0)
+    return (strata + rng.random_sample((num_points, ndims))) / num_points
+
+
+def uniform(num_points, ndims, seed=0):
+    """ Generate a random uniform sample in the unit hypercube
+
+    Args:
+        num_points: Amount of points to generate
+        ndims:      Amount of dimensions
+
+    Kwargs:
+        seed:       Seed of the random number generator
+
+    Returns:
+        Array of shape (num_points, ndims) with values in [0, 1)
+    """
+    rng = np.random.RandomState(seed)
+    return rng.random_sample((num_points, ndims))
+
+
+def scale_to_ranges(unit_points, ranges, log_scale=None):
+    """ Scale points in the unit hypercube to the given ranges
+
+    Args:
+        unit_points: Array of shape (num_points, ndims) with values in [0, 1)
+        ranges:      List of (low, high) pairs, one per dimension
+
+    Kwargs:
+        log_scale:   List of flags, one per dimension. Dimensions flagged
+                     are scaled logarithmically, so that the sample is
+                     uniform in log-space. By default all are linear.
+
+    Returns:
+        Array of shape (num_points, ndims) with the scaled points
+    """
+    ranges = np.array(ranges, dtype='float64')
+    if ranges.ndim != 2 or ranges.shape[1] != 2:
+        raise ValueError('Ranges should be a list of (low, high) pairs, '
+                         'got {!s}'.format(ranges.tolist()))
+    if log_scale is None:
+        log_scale = np.zeros(len(ranges), dtype=bool)
+    log_scale = np.array(log_scale, dtype=bool)
+    if np.any(ranges[log_scale] <= 0):
+        raise ValueError('Logarithmic ranges should be strictly positive, '
+                         'got {!s}'.format(ranges[log_scale].tolist()))
+    ranges[log_scale] = np.log(ranges[log_scale])
+    low = ranges[:, 0]
+    high = ranges[:, 1]
+    points = low + unit_points * (high - low)
+    points[:, log_scale] = np.exp(points[:, log_scale])
+    return points
@@ -0,0 +1,274 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Adaptive refinement of QuaLiKiz scans
+
+Most points of a regular scan end up in regions where all fluxes are zero.
+The AdaptiveScan starts from a coarse hyperrectangle, and only refines
+along the edges of the grid where the fluxes cross a threshold, change sign
+or change steeply. Every refinement step is a single 'parallel' QuaLiKizRun
+of all new midpoints.
+"""
+import os
+import itertools
+from collections import OrderedDict
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+
+default_fluxes = ['efe_GB', 'efi_GB', 'gam_GB']
+
+
+def reduce_flux(da):
+    """ Reduce a flux DataArray to a single value per dimx point
+
+    All dimensions but dimx are reduced by taking the value with the
+    largest absolute value, keeping its sign. NaNs are treated as zero.
+
+    Args:
+        da: xarray DataArray with a dimx dimension
+
+    Returns:
+        Numpy array of length dimx
+    """
+    other_dims = [dim for dim in da.dims if dim != 'dimx']
+    values = da.transpose('dimx', *other_dims).values
+    values = values.reshape(values.shape[0], -1)
+    values = np.where(np.isnan(values), 0, values)
+    idx = np.argmax(np.abs(values), axis=1)
+    return values[np.arange(values.shape[0]), idx]
+
+
+def flag_segments(left, right, zero_flux=1e-4, rel_jump=.5):
+    """ Determine which segments need refinement
+
+    A segment needs refinement if, for any of the fluxes, one endpoint is
+    stable and the other unstable, the flux changes sign or the
+    flux changes more than rel_jump relative to the largest endpoint.
+
+    Args:
+        left:      Array of shape (nsegments, nfluxes) with reduced fluxes
+                   at the first endpoint of every segment
+        right:     Same for the second endpoint
+
+    Kwargs:
+        zero_flux: Absolute value below which a flux is considered zero
+        rel_jump:  Relative change over a segment considered steep
+
+    Returns:
+        Boolean array of length nsegments
+    """
+    left = np.atleast_2d(left)
+    right = np.atleast_2d(right)
+    left_on = np.abs(left) > zero_flux
+    right_on = np.abs(right) > zero_flux
+    threshold = left_on != right_on
+    sign = left_on & right_on & (np.sign(left) != np.sign(right))
+    scale = np.maximum(np.maximum(np.abs(left), np.abs(right)), zero_flux)
+    steep = (left_on | right_on) & (np.abs(left - right) / scale > rel_jump)
+    return np.any(threshold | sign | steep, axis=1)
+
+
+class AdaptiveScan():
+    """ Iteratively refined scan around thresholds and steep gradients
+
+    Points are stored as tuples of scan values, in the order of scan_dict.
+    A segment is a pair of points that only differ along a single scan
+    variable. Flagged segments are bisected until they are smaller than
+    min_step of that variable, or max_iterations is reached.
+    """
+    def __init__(self, parent_dir, name, binaryrelpath, xpoint_base,
+                 scan_dict, min_step,
+                 run_class=None, run_kwargs=None,
+                 fluxes=None, zero_flux=1e-4, rel_jump=.5,
+                 max_iterations=5, evaluate=None, verbose=False):
+        """ Initialize the adaptive scan
+
+        Args:
+            parent_dir:     Directory the scan folder will be created in
+            name:           Name of the scan. Every iteration will be a
+                            run in the folder parent_dir/name
+            binaryrelpath:  Path of the QuaLiKiz binary relative to the
+                            run folders
+            xpoint_base:    The QuaLiKizXpoint used as base
+            scan_dict:      Dictionary with the coarse grid values per
+                            scan variable. Use an OrderedDict to
+                            conserve ordering.
+            min_step:       Target resolution. Dictionary with the smallest
+                            step per scan variable, or a single number
+                            used for all
+
+        Kwargs:
+            run_class:      Class used to run QuaLiKiz. Local bash Run by
+                            default
+            run_kwargs:     Extra kwargs passed to run_class
+            fluxes:         Names of the fluxes to base the refinement on.
+                            [efe_GB, efi_GB, gam_GB] by default
+            zero_flux:      Absolute value below which a flux is stable
+            rel_jump:       Relative change over a segment considered steep
+            max_iterations: Maximum amount of refinement steps
+            evaluate:       Function called as evaluate(plan, name) that
+                            should return a dict with a reduced flux array
+                            per flux name. Runs QuaLiKiz by default
+            verbose:        Print progress
+        """
+        self.parent_dir = parent_dir
+        self.name = name
+        self.binaryrelpath = binaryrelpath
+        self.xpoint_base = xpoint_base
+        self.scan_dict = OrderedDict((name, sorted(float(val) for val in values))
+                                     for name, values in scan_dict.items())
+        if not isinstance(min_step, dict):
+            min_step = dict.fromkeys(self.scan_dict, min_step)
+        self.min_step = [float(min_step[name]) for name in self.scan_dict]
+
+        if run_class is None:
+            from qualikiz_tools.machine_specific.bash import Run as run_class
+        self.run_class = run_class
+        if run_kwargs is None:
+            run_kwargs = {}
+        self.run_kwargs = run_kwargs
+        if fluxes is None:
+            fluxes = default_fluxes
+        self.fluxes = fluxes
+        self.zero_flux = zero_flux
+        self.rel_jump = rel_jump
+        self.max_iterations = max_iterations
+        if evaluate is None:
+            evaluate = self.run_qualikiz
+        self.evaluate = evaluate
+        self.verbose = verbose
+
+        self.points = OrderedDict()
+        self.segments = []
+        self.iterations = 0
+
+    @property
+    def scandir(self):
+        return os.path.join(self.parent_dir, self.name)
+
+    def run_qualikiz(self, plan, name):
+        """ Run QuaLiKiz for a plan and read the reduced fluxes
+
+        Args:
+            plan: The QuaLiKizPlan to run
+            name: Name of the run
+
+        Returns:
+            Dictionary with a reduced flux array per flux name
+        """
+        os.makedirs(self.scandir, exist_ok=True)
+        run = self.run_class(self.scandir, name, self.binaryrelpath,
+                             qualikiz_plan=plan, **self.run_kwargs)
+        run.prepare(overwrite=True)
+        run.generate_input()
+        run.launch()
+        ds = run.to_netcdf(overwrite=True)
+        return OrderedDict((flux, reduce_flux(ds[flux])) for flux in self.fluxes)
+
+    def coarse_grid(self):
+        """ Get the points and axis-neighbour segments of the coarse grid
+
+        Returns:
+            Tuple of the list of points and list of segments
+        """
+        points = list(itertools.product(*self.scan_dict.values()))
+        segments = []
+        for point in points:
+            for axis, values in enumerate(self.scan_dict.values()):
+                idx = values.index(point[axis])
+                if idx + 1 < len(values):
+                    neighbour = list(point)
+                    neighbour[axis] = values[idx + 1]
+                    segments.append((point, tuple(neighbour), axis))
+        return points, segments
+
+    def evaluate_points(self, points, name):
+        """ Evaluate new points and store their reduced fluxes
+
+        Args:
+            points: List of points to evaluate
+            name:   Name of the run
+        """
+        points = [point for point in points if point not in self.points]
+        if len(points) == 0:
+            return
+        scan_dict = OrderedDict((var, [point[ii] for point in points])
+                                for ii, var in enumerate(self.scan_dict))
+        plan = QuaLiKizPlan(scan_dict, 'parallel', self.xpoint_base)
+        if self.verbose:
+            print('Evaluating {:d} points in {!s}'.format(len(points), name))
+        result = self.evaluate(plan, name)
+        fluxes = np.vstack([np.asarray(result[flux]) for flux in self.fluxes]).T
+        if len(fluxes) != len(points):
+            raise Exception('Evaluated {:d} points, expected {:d}'.format(
+                len(fluxes), len(points)))
+        for point, flux in zip(points, fluxes):
+            self.points[point] = flux
+
+    def refine(self):
+        """ Bisect all flagged segments once
+
+        Returns:
+            List of new midpoints to evaluate
+        """
+        if len(self.segments) == 0:
+            return []
+        left = np.vstack([self.points[seg[0]] for seg in self.segments])
+        right = np.vstack([self.points[seg[1]] for seg in self.segments])
+        flagged = flag_segments(left, right, zero_flux=self.zero_flux,
+                                rel_jump=self.rel_jump)
+        new_segments = []
+        midpoints = OrderedDict()
+        for (start, stop, axis), flag in zip(self.segments, flagged):
+            if flag and (stop[axis] - start[axis]) / 2 >= self.min_step[axis]:
+                middle = list(start)
+                middle[axis] = (start[axis] + stop[axis]) / 2
+                middle = tuple(middle)
+                midpoints[middle] = None
+                new_segments.append((start, middle, axis))
+                new_segments.append((middle, stop, axis))
+        self.segments = new_segments
+        return list(midpoints)
+
+    def run(self):
+        """ Run the coarse scan and refine until converged
+
+        Returns:
+            DataFrame with all evaluated points, see to_dataframe
+        """
+        points, self.segments = self.coarse_grid()
+        self.evaluate_points(points, 'coarse')
+        self.iterations = 0
+        while self.iterations < self.max_iterations:
+            midpoints = self.refine()
+            if len(midpoints) == 0:
+                break
+            self.iterations += 1
+            self.evaluate_points(midpoints, 'refine{:d}'.format(self.iterations))
+        else:
+            warn('Reached max_iterations {:d}, target resolution might not '
+                 'be reached'.format(self.max_iterations))
+        return self.to_dataframe()
+
+    def uniform_points(self):
+        """ Amount of points of a uniform hyperrect at the target resolution """
+        num = 1
+        for values, step in zip(self.scan_dict.values(), self.min_step):
+            num *= int(np.ceil((values[-1] - values[0]) / step)) + 1
+        return num
+
+    def to_dataframe(self):
+        """ Get all evaluated points and their reduced fluxes
+
+        Returns:
+            DataFrame with a column per scan variable and flux
+        """
+        columns = list(self.scan_dict) + list(self.fluxes)
+        data = [list(point) + list(flux) for point, flux in self.points.items()]
+        return pd.DataFrame(data, columns=columns)
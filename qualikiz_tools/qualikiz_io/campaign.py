@@ -0,0 +1,305 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Campaign state database, tracking the lifecycle of every QuaLiKiz run.
+
+Every run is in one of the states in `states`, which are ordered by
+lifecycle. The state is recorded by QuaLiKizRun.prepare, generate_input,
+the machine specific launch functions and the to_netcdf functions, so
+questions like "which runs are done but not converted" are a single
+query instead of a walk over the filesystem. Only 'done' cannot be
+recorded by the tools themselves: `CampaignDB.refresh` checks the output
+of the launched runs only. Runs created outside the tools can be added
+with `CampaignDB.sync`.
+
+Recording is off by default, as a shared SQLite file does not work on
+every filesystem. Set the environment variable QUALIKIZ_CAMPAIGN_DB to
+the path of the database to record the state of all runs in it.
+"""
+import os
+import time
+import sqlite3
+from collections import OrderedDict
+from warnings import warn
+
+campaign_env_var = 'QUALIKIZ_CAMPAIGN_DB'
+states = ['prepared', 'input_generated', 'launched', 'done', 'netcdf', 'glued']
+
+# Open databases of this process, by path. Connections are not shared
+# with forked processes, so the pid is part of the key
+_open_dbs = {}
+
+
+def default_campaign_path():
+    """ Path of the database, from QUALIKIZ_CAMPAIGN_DB
+
+    Returns:
+        The path, or None if recording is disabled
+    """
+    path = os.environ.get(campaign_env_var)
+    if not path:
+        path = None
+    return path
+
+def state_index(state):
+    """ Position of state in the lifecycle """
+    try:
+        return states.index(state)
+    except ValueError:
+        raise Exception('Unknown state {!s}, should be one of {!s}'.format(state, states))
+
+def subtree_clause(searchdir):
+    """ SQL condition and parameters selecting the runs in searchdir """
+    if searchdir is None:
+        return '1', ()
+    searchdir = os.path.realpath(searchdir)
+    # All paths starting with searchdir + '/' sort before searchdir + '0'
+    return ('(rundir = ? OR (rundir >= ? AND rundir < ?))',
+            (searchdir, searchdir + os.sep, searchdir + chr(ord(os.sep) + 1)))
+
+
+class CampaignDB():
+    """ SQLite store of the state of QuaLiKiz runs, keyed on run directory """
+    def __init__(self, path=None):
+        """ Open or create the database
+
+        Kwargs:
+            path: Path of the database. See default_campaign_path
+        """
+        if path is None:
+            path = default_campaign_path()
+        if path is None:
+            raise Exception('No campaign database, set {!s}'.format(campaign_env_var))
+        self.path = path
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS runs '
+                            '(rundir TEXT PRIMARY KEY, state INTEGER, updated REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS runs_state ON runs (state)')
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, rundirs, state, regress=False):
+        """ Record that runs reached a state
+
+        Args:
+            rundirs: Directories of the runs
+            state:   The reached state, one of `states`
+
+        Kwargs:
+            regress: Also record the state for runs that are in a later
+                     state, for example when relaunching. By default
+                     runs never go back in their lifecycle
+        """
+        index = state_index(state)
+        now = time.time()
+        rows = [(os.path.realpath(rundir), index, now) for rundir in rundirs]
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO runs VALUES (?, ?, ?)', rows)
+            update = 'UPDATE runs SET state = ?, updated = ? WHERE rundir = ?'
+            if not regress:
+                update += ' AND state < ?'
+            self.db.executemany(update, [(index, now, rundir) + (() if regress else (index, ))
+                                         for rundir, __, __ in rows])
+
+    def forget(self, rundirs):
+        """ Remove runs from the database """
+        with self.db:
+            self.db.executemany('DELETE FROM runs WHERE rundir = ?',
+                                [(os.path.realpath(rundir), ) for rundir in rundirs])
+
+    def runs(self, searchdir=None, state=None):
+        """ Query the runs in a directory tree
+
+        Kwargs:
+            searchdir: Only return runs in this directory tree
+            state:     Only return runs in this state
+
+        Returns:
+            runs: OrderedDict of run directory: state, sorted by directory
+        """
+        clause, params = subtree_clause(searchdir)
+        if state is not None:
+            clause += ' AND state = ?'
+            params += (state_index(state), )
+        rows = self.db.execute('SELECT rundir, state FROM runs WHERE ' + clause +
+                               ' ORDER BY rundir', params)
+        return OrderedDict((rundir, states[index]) for rundir, index in rows)
+
+    def states(self, rundirs):
+        """ Query the state of runs
+
+        Args:
+            rundirs: Directories of the runs
+
+        Returns:
+            states: Dict of run directory: state, for the runs in the database
+        """
+        found = {}
+        for rundir in rundirs:
+            row = self.db.execute('SELECT state FROM runs WHERE rundir = ?',
+                                  (os.path.realpath(rundir), )).fetchone()
+            if row is not None:
+                found[rundir] = states[row[0]]
+        return found
+
+    def counts(self, searchdir=None):
+        """ Count the runs per state in a directory tree
+
+        Returns:
+            counts: OrderedDict of state: amount of runs, for all states
+        """
+        clause, params = subtree_clause(searchdir)
+        rows = dict(self.db.execute('SELECT state, COUNT(*) FROM runs WHERE ' + clause +
+                                    ' GROUP BY state', params))
+        return OrderedDict((state, rows.get(ii, 0)) for ii, state in enumerate(states))
+
+    def refresh(self, searchdir=None):
+        """ Mark launched runs that wrote all their output as done
+        Only the launched runs are checked, see QuaLiKizRun.is_complete.
+        Runs that no longer exist are forgotten.
+
+        Kwargs:
+            searchdir: Only check runs in this directory tree
+
+        Returns:
+            done: The run directories that are newly done
+        """
+        from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun
+        done = []
+        gone = []
+        for rundir in self.runs(searchdir, state='launched'):
+            if not os.path.isfile(os.path.join(rundir, QuaLiKizRun.parameterspath)):
+                gone.append(rundir)
+                continue
+            run = QuaLiKizRun.from_dir(rundir, binaryrelpath='')
+            if run.is_complete():
+                done.append(rundir)
+        self.record(done, 'done')
+        self.forget(gone)
+        return done
+
+    def sync(self, searchdir, use_index=None, index_path=None):
+        """ Add the runs in a directory tree that are not in the database
+        The state is derived from the filesystem: a netCDF file in the
+        run directory means 'netcdf', complete output 'done' and input
+        binaries 'input_generated'. Runs can not be recognized as
+        'launched' or 'glued' this way. Runs already in the database are
+        left alone, and runs in the database that no longer exist are
+        forgotten.
+
+        Args:
+            searchdir:  The directory tree to search
+
+        Kwargs:
+            use_index:  Search with the persistent DirIndex instead of
+                        os.walk. Falls back to os.walk if the index cannot
+                        be opened. By default only if QUALIKIZ_DIR_INDEX is
+                        set or index_path is given
+            index_path: Path of the DirIndex. See dir_index.default_index_path
+
+        Returns:
+            added: OrderedDict of run directory: state of the added runs
+        """
+        from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun
+        from qualikiz_tools.qualikiz_io.dir_index import DirIndex, index_enabled
+        if use_index is None:
+            use_index = index_path is not None or index_enabled()
+        files = None
+        if use_index:
+            try:
+                with DirIndex(index_path, run_file=QuaLiKizRun.parameterspath) as index:
+                    records = index.scan(searchdir)
+            except (OSError, sqlite3.Error) as ee:
+                warn('Could not use directory index: {!s}. Falling back to os.walk'.format(ee))
+            else:
+                files = OrderedDict((rundir, record.files) for rundir, record in records.items())
+        if files is None:
+            files = OrderedDict((os.path.realpath(dirpath), filenames)
+                                for dirpath, __, filenames in os.walk(searchdir))
+        known = self.runs(searchdir)
+        added = OrderedDict()
+        for rundir, filenames in files.items():
+            if QuaLiKizRun.parameterspath not in filenames or rundir in known:
+                continue
+            run = QuaLiKizRun.from_dir(rundir, binaryrelpath='')
+            if os.path.basename(rundir) + '.nc' in filenames:
+                added[rundir] = 'netcdf'
+            elif run.is_complete():
+                added[rundir] = 'done'
+            elif os.path.isfile(os.path.join(rundir, run.inputdir, 'R0.bin')):
+                added[rundir] = 'input_generated'
+            else:
+                added[rundir] = 'prepared'
+        for state in states:
+            self.record([rundir for rundir in added if added[rundir] == state], state)
+        self.forget([rundir for rundir in known if rundir not in files])
+        return added
+
+def record_state(rundirs, state, regress=False, path=None):
+    """ Record the state of runs in the campaign database of this process
+    Failing to record never breaks the calling function, it only warns.
+
+    Args:
+        rundirs: Directories of the runs
+        state:   The reached state. See CampaignDB.record
+
+    Kwargs:
+        regress: See CampaignDB.record
+        path:    Path of the database. See default_campaign_path
+    """
+    if path is None:
+        path = default_campaign_path()
+    if path is None:
+        return
+    try:
+        _process_db(path).record(rundirs, state, regress=regress)
+    except (OSError, sqlite3.Error) as ee:
+        warn('Could not record state {!s} in {!s}: {!s}'.format(state, path, ee))
+
+def lookup_states(rundirs, path=None):
+    """ Look up the state of runs in the campaign database of this process
+    Failing to look up never breaks the calling function, it only warns.
+
+    Args:
+        rundirs: Directories of the runs
+
+    Kwargs:
+        path:    Path of the database. See default_campaign_path
+
+    Returns:
+        Dict of run directory: state, see CampaignDB.states. Empty if
+        recording is disabled
+    """
+    if path is None:
+        path = default_campaign_path()
+    if path is None:
+        return {}
+    try:
+        return _process_db(path).states(rundirs)
+    except (OSError, sqlite3.Error) as ee:
+        warn('Could not look up states in {!s}: {!s}'.format(path, ee))
+        return {}
+
+def _process_db(path):
+    """ The open CampaignDB of this process at path """
+    key = (path, os.getpid())
+    # Reopen if the database was removed since
+    if key not in _open_dbs or not os.path.isfile(path):
+        if key in _open_dbs:
+            _open_dbs.pop(key).close()
+        _open_dbs[key] = CampaignDB(path)
+    return _open_dbs[key]
@@ -0,0 +1,207 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Persistent index of QuaLiKiz directory trees.
+
+The files and subdirectories of every scanned directory are cached in an
+SQLite database, together with the modification time of the directory.
+A directory only changes its modification time if entries are added,
+removed or renamed, so on the next scan unchanged directories cost a
+single stat instead of a listing. Every level of the tree is scanned in
+parallel with a thread pool, as the scan is bound by filesystem latency.
+The index is not used by default, as a shared SQLite file does not work
+on every filesystem. Set the environment variable QUALIKIZ_DIR_INDEX to
+the path of the index to use it when searching for batches. Enabled
+explicitly without a path, the index is stored in the user cache
+directory.
+"""
+import os
+import json
+import time
+import sqlite3
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+index_env_var = 'QUALIKIZ_DIR_INDEX'
+index_filename = 'dir_index.sqlite'
+# Modification times this close to the scan are not trusted, as the
+# directory might still change within the timestamp resolution
+racy_window = 2
+
+DirRecord = namedtuple('DirRecord', ['path', 'mtime', 'files', 'subdirs'])
+
+
+def default_index_path():
+    """ Path of the index, from QUALIKIZ_DIR_INDEX or the user cache dir """
+    path = os.environ.get(index_env_var)
+    if not path:
+        cachedir = os.environ.get('XDG_CACHE_HOME',
+                                  os.path.join(os.path.expanduser('~'), '.cache'))
+        path = os.path.join(cachedir, 'qualikiz_tools', index_filename)
+    return path
+
+def index_enabled():
+    """ True if the index is enabled with QUALIKIZ_DIR_INDEX """
+    return bool(os.environ.get(index_env_var))
+
+def scan_dir(path, cached=None):
+    """ List a directory, unless it did not change since it was cached
+
+    Args:
+        path:   Absolute path of the directory
+
+    Kwargs:
+        cached: DirRecord of the previous scan of this directory
+
+    Returns:
+        record: DirRecord of the directory, or None if it cannot be read
+        changed: True if the directory was listed again
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None, True
+    if cached is not None and cached.mtime == mtime:
+        return cached, False
+    files = []
+    subdirs = []
+    try:
+        for entry in os.scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            else:
+                files.append(entry.name)
+    except OSError:
+        return None, True
+    if time.time() - mtime / 1e9 < racy_window:
+        mtime = -1
+    return DirRecord(path, mtime, sorted(files), sorted(subdirs)), True
+
+
+class DirIndex():
+    """ Cached view of QuaLiKiz directory trees
+
+    Attributes:
+        batch_file: A directory containing this file is a batch
+        run_file:   A directory containing this file is a run. Runs are
+                    not descended into, they only contain in- and output
+    """
+    batch_file = 'qualikiz.batch'
+    run_file = 'parameters.json'
+
+    def __init__(self, path=None, workers=None,
+                 batch_file=None, run_file=None):
+        """ Open or create the index
+
+        Kwargs:
+            path:       Path of the SQLite index. See default_index_path
+            workers:    Amount of threads to scan with. By default four
+                        per CPU, at most 32
+            batch_file: Overrides DirIndex.batch_file
+            run_file:   Overrides DirIndex.run_file
+        """
+        if path is None:
+            path = default_index_path()
+        if workers is None:
+            workers = min(32, 4 * (os.cpu_count() or 1))
+        if batch_file is not None:
+            self.batch_file = batch_file
+        if run_file is not None:
+            self.run_file = run_file
+        self.path = path
+        self.workers = workers
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS dirs '
+                            '(path TEXT PRIMARY KEY, mtime INTEGER, '
+                            'files TEXT, subdirs TEXT)')
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def cached(self, searchdir):
+        """ Load the cached records of searchdir and everything below it """
+        # All paths starting with searchdir + '/' sort before searchdir + '0'
+        rows = self.db.execute(
+            'SELECT path, mtime, files, subdirs FROM dirs '
+            'WHERE path = ? OR (path >= ? AND path < ?)',
+            (searchdir, searchdir + os.sep, searchdir + chr(ord(os.sep) + 1)))
+        return {path: DirRecord(path, mtime, json.loads(files), json.loads(subdirs))
+                for path, mtime, files, subdirs in rows}
+
+    def scan(self, searchdir):
+        """ Scan a directory tree, only listing directories that changed
+
+        Args:
+            searchdir: Top of the tree to scan
+
+        Returns:
+            records: OrderedDict of path: DirRecord, sorted by path
+        """
+        searchdir = os.path.realpath(searchdir.rstrip(os.sep) or os.sep)
+        cached = self.cached(searchdir)
+        records = {}
+        changed = []
+        frontier = [searchdir]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while len(frontier) > 0:
+                results = executor.map(lambda path: scan_dir(path, cached.get(path)),
+                                       frontier)
+                next_frontier = []
+                for record, is_changed in results:
+                    if record is None:
+                        continue
+                    records[record.path] = record
+                    if is_changed:
+                        changed.append(record)
+                    if self.run_file not in record.files:
+                        next_frontier.extend(os.path.join(record.path, subdir)
+                                             for subdir in record.subdirs)
+                frontier = next_frontier
+
+        removed = [(path, ) for path in cached if path not in records]
+        if len(changed) > 0 or len(removed) > 0:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)',
+                                    [(record.path, record.mtime,
+                                      json.dumps(record.files),
+                                      json.dumps(record.subdirs))
+                                     for record in changed])
+                self.db.executemany('DELETE FROM dirs WHERE path = ?', removed)
+        return OrderedDict(sorted(records.items()))
+
+    def batches(self, searchdir):
+        """ Find the batches and their runs in a directory tree
+
+        Args:
+            searchdir: Top of the tree to search
+
+        Returns:
+            batches: OrderedDict of batch directory: list of run
+                     directories. A batch that is itself a run has
+                     only itself as run
+        """
+        records = self.scan(searchdir)
+        batches = OrderedDict()
+        for path, record in records.items():
+            if self.batch_file not in record.files:
+                continue
+            if self.run_file in record.files:
+                batches[path] = [path]
+            else:
+                rundirs = [os.path.join(path, subdir) for subdir in record.subdirs]
+                batches[path] = [rundir for rundir in rundirs
+                                 if rundir in records and
+                                 self.run_file in records[rundir].files]
+        return batches
@@ -14,6 +14,8 @@ import os
 import numpy as np
 
 from qualikiz_tools.misc.conversion import calc_te_from_nustar, calc_nustar_from_parts, calc_zeff, calc_puretor_absolute, calc_puretor_gradient, calc_epsilon_from_parts
+from qualikiz_tools.misc import sampling
+from qualikiz_tools.qualikiz_io.instrumentation import instrumented
 
 def json_serializer(obj):
     if isinstance(obj, np.ndarray):
@@ -28,6 +30,7 @@ def allequal(lst):
 class Particle(dict):
     """ Particle (ion or electron)
     """
+    __slots__ = ()
     in_args = ['T', 'n', 'At', 'An', 'type', 'anis', 'danisdr']
 
     def __init__(self, **kwargs):
@@ -57,12 +60,15 @@ class Particle(dict):
 
 
 class Electron(Particle):
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         """ See Particle.__init__ """
         super().__init__(**kwargs)
 
 
 class Ion(Particle):
+    __slots__ = ()
     in_args = ['A', 'Z']
 
     def __init__(self, **kwargs):
@@ -82,16 +88,19 @@ class IonList(list):
         args:
             list of Ions
     """
+    __slots__ = ()
+    _ion_keys = frozenset(Ion.in_args + Particle.in_args)
+
     def __init__(self, *args):
         super().__init__(args)
 
     def __getitem__(self, key):
-        if isinstance(key, int) or isinstance(key, slice):
+        if isinstance(key, (int, slice)):
             return super().__getitem__(key)
-        if key in Ion.in_args + Particle.in_args:
+        if key in self._ion_keys:
             valuelist = [ion[key] for ion in self]
             if allequal(valuelist):
-                return self[0][key]
+                return valuelist[0]
             else:
                 raise Exception('Unequal values for ion key \''
                                 + key + '\'= ' + str(valuelist))
@@ -119,7 +128,11 @@ class QuaLiKizXpoint(dict):
                    different radial points
         options:   information about different rescalings, assumptions, etc.
 
+    Keys are resolved to the right nested dict with a dispatch table that
+    is filled on first use of every key, see _add_accessors.
     """
+    __slots__ = ()
+
     def __init__(self, kthetarhos, electrons, ions, **kwargs):
         """ Initialize a single QuaLiKizXpoint
         Usually this point is part of a scan. Initialize an instance
@@ -311,6 +324,7 @@ class QuaLiKizXpoint(dict):
 
     class Options(dict):
         """ Wraps options for normalization, assumptions, etc."""
+        __slots__ = ()
         in_args = OrderedDict([
             ('set_qn_normni', True),
             ('set_qn_normni_ion', 0),
@@ -355,6 +369,7 @@ class QuaLiKizXpoint(dict):
 
     class Meta(dict):
         """ Wraps variables that stay constant during the QuaLiKiz run """
+        __slots__ = ()
         in_args = OrderedDict([
             ('phys_meth'    , 2),
             ('coll_flag'    , True),
@@ -401,6 +416,7 @@ class QuaLiKizXpoint(dict):
 
     class Special(dict):
         """ Wraps variables that need special convertion to binary"""
+        __slots__ = ()
         def __init__(self, kthetarhos):
             """ Initialize Special class
             kwargs:
@@ -410,6 +426,7 @@ class QuaLiKizXpoint(dict):
 
     class Geometry(dict):
         """ Wraps variables that change per scan point """
+        __slots__ = ()
         in_args =    ['x', 'rho', 'Ro', 'Rmin', 'Bo', 'q', 'smag',
                       'alpha', 'Machtor', 'Autor', 'Machpar', 'Aupar',
                       'gammaE']
@@ -437,54 +454,110 @@ class QuaLiKizXpoint(dict):
             super().__init__(key_values)
             assert len(kwargs) == 0, "unrecognized params: %s" % ", ".join(kwargs.keys())
 
-    def __getitem__(self, key):
-        """ Get value from nested dict
-        Use this method to get a value in the QuaLiKizRun class.
-        It adds some extra abstraction for the multi-layered structure
-        of the QuaLiKizRun class. You can get a specific internal variable,
-        or get an Electron variable by appending 'e', or get all Ions
-        by appending 'i'. You can also get a specific Ion with
-        'i#', for example 'i1'
+    # The getter and setter per key, filled on first use by _add_accessors
+    _getters = {}
+    _setters = {}
+
+    @classmethod
+    def _add_accessors(cls, key):
+        """ Resolve the aliases of a key to a getter and setter
+
+        The getter is called as getter(xpoint), the setter as
+        setter(xpoint, value). The result is cached, so resolving only
+        happens on the first access of every key.
+
+        Returns:
+            Tuple of the getter and setter for key
         """
+        getsub = dict.__getitem__
         if key == 'Zeff':
-            return self.calc_zeff()
+            getter, setter = cls.calc_zeff, cls.match_zeff
         elif key == 'Nustar':
-            return self.calc_nustar()
+            getter, setter = cls.calc_nustar, cls.match_nustar
         elif key == 'Ti_Te_rel':
-            return self.calc_tite()
+            getter, setter = cls.calc_tite, cls.match_tite
         elif key == 'epsilon':
-            return self.calc_epsilon()
-        elif key in self.Geometry.in_args:
-            return self['geometry'].__getitem__(key)
-        elif key in ['kthetarhos']:
-            return self['special'].__getitem__(key)
-        elif key in self.Meta.in_args:
-            return self['meta'].__getitem__(key)
-        elif key in self.Options.in_args:
-            return self['options'].__getitem__(key)
+            getter, setter = cls.calc_epsilon, cls.match_epsilon
+        elif (key in cls.Geometry.in_args or key in ['kthetarhos'] or
+              key in cls.Meta.in_args or key in cls.Options.in_args):
+            if key in cls.Geometry.in_args:
+                sub = 'geometry'
+            elif key in ['kthetarhos']:
+                sub = 'special'
+            elif key in cls.Meta.in_args:
+                sub = 'meta'
+            else:
+                sub = 'options'
+            def getter(self):
+                return getsub(self, sub)[key]
+            def setter(self, value):
+                getsub(self, sub)[key] = value
         elif key in ['geometry', 'special', 'meta', 'options', 'ions', 'elec']:
-            return super().__getitem__(key)
+            def getter(self):
+                return getsub(self, key)
+            def setter(self, value):
+                dict.__setitem__(self, key, value)
         elif key in Particle.in_args:
-            ionval = self['ions'].__getitem__(key)
-            elecval = self['elec'].__getitem__(key)
-            if ionval == elecval:
-                return elecval
-            else:
-                raise Exception('Unequal values for ion/elec key \''
-                                + key + '\'= ' + str((ionval, elecval)))
+            def getter(self):
+                ionval = getsub(self, 'ions')[key]
+                elecval = getsub(self, 'elec')[key]
+                if ionval == elecval:
+                    return elecval
+                else:
+                    raise Exception('Unequal values for ion/elec key \''
+                                    + key + '\'= ' + str((ionval, elecval)))
+            def setter(self, value):
+                getsub(self, 'ions')[key] = value
+                getsub(self, 'elec')[key] = value
         elif key.endswith('i') or (key[-1].isdigit() and key[-2] == 'i'):
             if key[-1].isdigit():
                 ionnumber = int(key[-1])
-                key = key[:-2]
-                return self['ions'][ionnumber].__getitem__(key)
+                name = key[:-2]
+                def getter(self):
+                    return getsub(self, 'ions')[ionnumber][name]
+                def set_ion(self, value):
+                    getsub(self, 'ions')[ionnumber][name] = value
+            else:
+                name = key[:-1]
+                def getter(self):
+                    return getsub(self, 'ions')[name]
+                def set_ion(self, value):
+                    getsub(self, 'ions')[name] = value
+            if (name not in Ion.in_args) and (name not in Particle.in_args):
+                def setter(self, value):
+                    set_ion(self, value)
+                    raise NotImplementedError('setting of ' + name + '=' + str(value))
             else:
-                key = key[:-1]
-                return self['ions'].__getitem__(key)
+                setter = set_ion
         elif key.endswith('e'):
-            key = key[:-1]
-            return self['elec'].__getitem__(key)
+            name = key[:-1]
+            def getter(self):
+                return getsub(self, 'elec')[name]
+            def setter(self, value):
+                getsub(self, 'elec')[name] = value
         else:
-            raise NotImplementedError('getting of ' + key)
+            def getter(self):
+                raise NotImplementedError('getting of ' + key)
+            def setter(self, value):
+                raise NotImplementedError('setting of ' + key + '=' + str(value))
+        cls._getters[key] = getter
+        cls._setters[key] = setter
+        return getter, setter
+
+    def __getitem__(self, key):
+        """ Get value from nested dict
+        Use this method to get a value in the QuaLiKizRun class.
+        It adds some extra abstraction for the multi-layered structure
+        of the QuaLiKizRun class. You can get a specific internal variable,
+        or get an Electron variable by appending 'e', or get all Ions
+        by appending 'i'. You can also get a specific Ion with
+        'i#', for example 'i1'
+        """
+        try:
+            getter = self._getters[key]
+        except KeyError:
+            getter = self._add_accessors(key)[0]
+        return getter(self)
 
     def __setitem__(self, key, value):
         """ Set value in nested dict
@@ -495,43 +568,11 @@ class QuaLiKizXpoint(dict):
         by appending 'i'. You can also set a specific Ion with
         'i#', for example 'i1'
         """
-        if key == 'Zeff':
-            self.match_zeff(value)
-        elif key == 'Nustar':
-            self.match_nustar(value)
-        elif key == 'Ti_Te_rel':
-            self.match_tite(value)
-        elif key == 'epsilon':
-            self.match_epsilon(value)
-        elif key in self.Geometry.in_args:
-            self['geometry'].__setitem__(key, value)
-        elif key in ['kthetarhos']:
-            self['special'].__setitem__(key, value)
-        elif key in self.Meta.in_args:
-            self['meta'].__setitem__(key, value)
-        elif key in self.Options.in_args:
-            self['options'].__setitem__(key, value)
-        elif key in ['geometry', 'special', 'meta', 'options', 'ions', 'elec']:
-            super().__setitem__(key, value)
-        elif key in Particle.in_args:
-            self['ions'].__setitem__(key, value)
-            self['elec'].__setitem__(key, value)
-        elif key.endswith('i') or (key[-1].isdigit() and key[-2] == 'i'):
-            if key[-1].isdigit():
-                ionnumber = int(key[-1])
-                key = key[:-2]
-                self['ions'][ionnumber][key] = value
-            else:
-                key = key[:-1]
-                self['ions'].__setitem__(key, value)
-
-            if (key not in Ion.in_args) and (key not in Particle.in_args):
-                raise NotImplementedError('setting of ' + key + '=' + str(value))
-        elif key.endswith('e'):
-            key = key[:-1]
-            self['elec'].__setitem__(key, value)
-        else:
-            raise NotImplementedError('setting of ' + key + '=' + str(value))
+        try:
+            setter = self._setters[key]
+        except KeyError:
+            setter = self._add_accessors(key)[1]
+        setter(self, value)
 
 
 class QuaLiKizPlan(dict):
@@ -541,22 +582,54 @@ class QuaLiKizPlan(dict):
     values will be scanned in the QuaLiKiz run. This is given in the form of
     a xpoint base and a strategy how the exact points will be generated
     from this base. Usually this is a line or its N-D equivalent the edges of
-    a hyperrectangle, or a hyperrectangle itself.
+    a hyperrectangle, or a hyperrectangle itself. For surrogate model
+    training the hyperrectangle can also be sampled with a (quasi-)random
+    sequence.
+
+    Attributes:
+        sampling_scan_types: scan_types that sample points within the ranges
+                             given in the scan_dict
+        npy_threshold:       Scan variables with at least this many values
+                             are stored as .npy by to_json
     """
-    def __init__(self, scan_dict, scan_type, xpoint_base):
+    __slots__ = ()
+    sampling_scan_types = ['sobol', 'halton', 'latin_hypercube',
+                           'uniform', 'loguniform']
+    npy_threshold = 10000
+
+    def __init__(self, scan_dict, scan_type, xpoint_base, sample_options=None):
         """ Initialize the QuaLiKizPlan
 
         args:
             scan_dict:   Dictionary with as keys the names of the variables to
                          be scanned and as values the values to be scanned.
-                         Use an OrderedDict to conserve ordering.
+                         Use an OrderedDict to conserve ordering. For the
+                         sampling scan_types the values are [low, high]
+                         pairs of the range to be sampled.
             scan_type:   How the points are generated. Currently accepts
-                         'hyperedge' and 'hyperrect'.
+                         'hyperedge', 'hyperrect', 'parallel' and the
+                         sampling types 'sobol', 'halton', 'latin_hypercube',
+                         'uniform' and 'loguniform'.
             xpoint_base: The QuaLiKizXpoint used as base for the generation
+
+        kwargs:
+            sample_options: Dictionary with options for the sampling
+                            scan_types. Needed for sampling scan_types only.
+                num_points: Amount of points to sample
+                seed:       Seed of the random number generator. Used
+                            for scrambling the quasi-random sequences.
+                            0 by default
+                scramble:   Scramble the quasi-random sequences. False
+                            by default
+                log_scale:  List of names of scan variables to sample
+                            uniformly in log-space. All variables for
+                            'loguniform', none for the others by default
         """
         self['scan_dict'] = scan_dict
         self['scan_type'] = scan_type
         self['xpoint_base'] = xpoint_base
+        if sample_options is not None:
+            self['sample_options'] = sample_options
 
     def calculate_dimx(self):
         """ Calculate the amount of xpoints, also known as dimx
@@ -573,6 +646,8 @@ class QuaLiKizPlan(dict):
                 dimx = int(lenlist[0])
             else:
                 raise Exception('scan_disc lists of unequal length: {!s}'.format(lenlist))
+        elif self['scan_type'] in self.sampling_scan_types:
+            dimx = int(self._get_sample_options()['num_points'])
         else:
             raise Exception('Unknown scan_type \'' + self['scan_type'] + '\'')
         return dimx
@@ -585,16 +660,191 @@ class QuaLiKizPlan(dict):
 
     def edge_generator(self):
         """ Generates the points on the edge of a hyperrectangle
+
+        Yields a tuple with the values of all scan variables per point
         """
-        intersec = [x[0] for x in self['scan_dict'].values()]
-        # yield intersec
-        for i, (__, values) in enumerate(self['scan_dict'].items()):
+        intersec = tuple(x[0] for x in self['scan_dict'].values())
+        for i, values in enumerate(self['scan_dict'].values()):
+            head = intersec[:i]
+            tail = intersec[i + 1:]
             for value in values:
-                point = copy.deepcopy(intersec)
-                point[i] = value
-                # if point != intersec:
-                yield point
+                yield head + (value, ) + tail
+
+    def __eq__(self, other):
+        """ Compare plans, scan values can be either lists or arrays """
+        if not isinstance(other, dict):
+            return NotImplemented
+        if self.keys() != other.keys():
+            return False
+        for key, value in self.items():
+            if key == 'scan_dict':
+                if value.keys() != other[key].keys():
+                    return False
+                for name, values in value.items():
+                    if not np.array_equal(values, other[key][name]):
+                        return False
+            elif value != other[key]:
+                return False
+        return True
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def get_xpoint(self, index):
+        """ Get the QuaLiKizXpoint of a single scan point
+
+        Only generates the requested point, so disjoint parts of a scan
+        can be generated independently.
+
+        Args:
+            index: Index of the point in the scan. Negative indices count
+                   from the end.
+
+        Returns:
+            The QuaLiKizXpoint as it would be written by setup
+        """
+        dimx = self.calculate_dimx()
+        if index < 0:
+            index += dimx
+        if not 0 <= index < dimx:
+            raise IndexError('Scan point {:d} out of range for dimx {:d}'.format(index, dimx))
+        scan_values = self.scan_array(index, index + 1)[0]
+        xpoint = copy.deepcopy(self['xpoint_base'])
+        self._apply_scan_values(xpoint, list(self['scan_dict'].keys()), scan_values)
+        return xpoint
+
+    def iter_scan(self, start=0, stop=None, chunksize=10000):
+        """ Iterate over the scan values of a range of points
 
+        The values are generated in chunks, so memory use is bounded
+        independent of the length of the scan.
+
+        Kwargs:
+            start:     Index of the first point
+            stop:      Index after the last point. dimx by default
+            chunksize: Amount of points generated at once
+
+        Yields:
+            Array with the values of the scan variables for a single point
+        """
+        if stop is None:
+            stop = self.calculate_dimx()
+        for chunk_start in range(start, stop, chunksize):
+            chunk = self.scan_array(chunk_start, min(chunk_start + chunksize, stop))
+            for scan_values in chunk:
+                yield scan_values
+
+    def _get_sample_options(self):
+        """ Get the sample_options, filled with defaults where needed """
+        try:
+            options = dict(self['sample_options'])
+        except KeyError:
+            raise Exception('scan_type \'' + self['scan_type'] + '\' needs '
+                            'sample_options with at least num_points')
+        if 'num_points' not in options:
+            raise Exception('sample_options should contain num_points')
+        options.setdefault('seed', 0)
+        options.setdefault('scramble', False)
+        if self['scan_type'] == 'loguniform':
+            options.setdefault('log_scale', list(self['scan_dict'].keys()))
+        else:
+            options.setdefault('log_scale', [])
+        return options
+
+    def sample_points(self, start=0, stop=None):
+        """ Sample the points of a sampling scan_type
+
+        The sequences are deterministic given the sample_options, so the
+        same plan always generates the same points. The quasi-random
+        sequences only generate the requested points, the random samples
+        are generated completely and sliced.
+
+        Kwargs:
+            start: Index of the first point
+            stop:  Index after the last point. num_points by default
+
+        Returns:
+            Array of shape (stop - start, len(scan_dict)) with the sampled points
+        """
+        options = self._get_sample_options()
+        names = list(self['scan_dict'].keys())
+        ranges = list(self['scan_dict'].values())
+        for name, range_ in zip(names, ranges):
+            if len(range_) != 2:
+                raise Exception('scan_dict values should be [low, high] for '
+                                'scan_type \'' + self['scan_type'] + '\', got '
+                                '{!s} for {!s}'.format(range_, name))
+        unknown = [name for name in options['log_scale'] if name not in names]
+        if len(unknown) != 0:
+            raise Exception('log_scale variables {!s} not in scan_dict'.format(unknown))
+
+        num_points = int(options['num_points'])
+        if stop is None:
+            stop = num_points
+        stop = min(stop, num_points)
+        ndims = len(names)
+        if self['scan_type'] == 'sobol':
+            unit_points = sampling.sobol(stop - start, ndims, skip=1 + start,
+                                         scramble=options['scramble'],
+                                         seed=options['seed'])
+        elif self['scan_type'] == 'halton':
+            unit_points = sampling.halton(stop - start, ndims, skip=1 + start,
+                                          scramble=options['scramble'],
+                                          seed=options['seed'])
+        elif self['scan_type'] == 'latin_hypercube':
+            unit_points = sampling.latin_hypercube(num_points, ndims,
+                                                   seed=options['seed'])[start:stop]
+        elif self['scan_type'] in ['uniform', 'loguniform']:
+            unit_points = sampling.uniform(num_points, ndims,
+                                           seed=options['seed'])[start:stop]
+        else:
+            raise Exception('Unknown scan_type \'' + self['scan_type'] + '\'')
+        log_scale = [name in options['log_scale'] for name in names]
+        return sampling.scale_to_ranges(unit_points, ranges, log_scale=log_scale)
+
+    def scan_array(self, start=0, stop=None):
+        """ Get the values of the scan variables for a range of points
+
+        The points are in the same order as generated by setup. Every point
+        is calculated from its index, so only the requested range is
+        generated.
+
+        Kwargs:
+            start: Index of the first point
+            stop:  Index after the last point. dimx by default
+
+        Returns:
+            Array of shape (stop - start, len(scan_dict)) with the scan values
+        """
+        dimx = self.calculate_dimx()
+        if stop is None or stop > dimx:
+            stop = dimx
+        start = min(start, stop)
+        if self['scan_type'] in self.sampling_scan_types:
+            return self.sample_points(start, stop)
+
+        values = [np.asarray(value, dtype='float64')
+                  for value in self['scan_dict'].values()]
+        index = np.arange(start, stop)
+        if self['scan_type'] == 'hyperedge':
+            # Every point is the intersection with one variable changed
+            offsets = np.cumsum([len(value) for value in values])
+            changed = np.searchsorted(offsets, index, side='right')
+            points = np.tile([value[0] for value in values], (len(index), 1))
+            points[np.arange(len(index)), changed] = np.concatenate(values)[index]
+        elif self['scan_type'] == 'hyperrect':
+            subs = np.unravel_index(index, [len(value) for value in values])
+            points = np.column_stack([value[sub] for value, sub in zip(values, subs)])
+        elif self['scan_type'] == 'parallel':
+            points = np.column_stack([value[start:stop] for value in values])
+        return points.reshape(len(index), len(values))
+
+    @instrumented('setup_plan')
     def setup(self):
         """ Set up the QuaLiKiz scan
 
@@ -611,10 +861,55 @@ class QuaLiKizPlan(dict):
         elif self['scan_type'] == 'parallel':
             names = list(self['scan_dict'].keys())
             bytes = self.setup_scan(names, zip(*self['scan_dict'].values()))
+        elif self['scan_type'] in self.sampling_scan_types:
+            names = list(self['scan_dict'].keys())
+            bytes = self.setup_scan(names, self.sample_points())
         else:
             raise Exception('Unknown scan_type \'' + self['scan_type'] + '\'')
         return bytes
 
+    @instrumented('setup_slice')
+    def setup_slice(self, start, stop):
+        """ Set up a part of the QuaLiKiz scan
+
+        Generates the same binaries as setup, but only for the points in
+        range(start, stop). The per-point binaries contain stop - start
+        values, the per-ion binaries stop - start values per ion. See
+        binary_names. Disjoint slices can be generated independently.
+
+        Args:
+            start: Index of the first point
+            stop:  Index after the last point
+        """
+        names = list(self['scan_dict'].keys())
+        return self.setup_scan(names, self.iter_scan(start, stop),
+                               num_points=stop - start)
+
+    @staticmethod
+    def binary_names():
+        """ Get the names of the input binaries that scale with dimx
+
+        Returns:
+            Tuple with the names of the binaries with a value per point, and
+            the names of the binaries with a value per ion per point. All
+            other binaries are constant for the whole scan
+        """
+        point_names = (QuaLiKizXpoint.Geometry.in_args +
+                       [name + 'e' for name in Electron.in_args if name != 'type'])
+        ion_names = [('normn' if name == 'n' else name) + 'i'
+                     for name in Electron.in_args + Ion.in_args]
+        return point_names, ion_names
+
+    @staticmethod
+    def constant_names():
+        """ Get the names of the input binaries that are constant for the scan
+
+        Returns:
+            List with the names of all binaries not in binary_names
+        """
+        return (['dimx', 'dimn', 'nions', 'typee', 'kthetarhos'] +
+                list(QuaLiKizXpoint.Meta.in_args))
+
     def _sanity_check_setup(self, scan_names):
         """ Check if the order of scan_names is correct """
         if len(scan_names) == 0:
@@ -645,13 +940,48 @@ class QuaLiKizPlan(dict):
             if any(name in scan_names[index:] for name in ['Te', 'Nustar']):
                 warn('Warning! Set Te before setting Ti_Te_rel')
 
-    def setup_scan(self, scan_names, scan_list):
+    def _apply_scan_values(self, dimxpoint, scan_names, scan_values):
+        """ Set the values of a single scan point on a xpoint
+
+        Also applies all options, like keeping the point quasineutral.
+
+        Args:
+            dimxpoint:   The QuaLiKizXpoint to modify in place
+            scan_names:  The names of the scanned variables
+            scan_values: The values of the scanned variables
+        """
+        if dimxpoint['options']['recalc_Nustar']:
+            nustar = dimxpoint.calc_nustar()
+        if dimxpoint['options']['recalc_Ti_Te_rel']:
+            Ti_Te_rel = dimxpoint.calc_tite()
+        for scan_name, scan_value in zip(scan_names, scan_values):
+            dimxpoint[scan_name] = scan_value
+        if dimxpoint['options']['assume_tor_rot']:
+            dimxpoint.set_puretor()
+        if dimxpoint['options']['x_eq_rho']:
+            dimxpoint['geometry'].__setitem__('rho', dimxpoint['x'])
+        if dimxpoint['options']['set_qn_normni']:
+            dimxpoint.set_qn_normni_ion_n()
+        if dimxpoint['options']['set_qn_An']:
+            dimxpoint.set_qn_An_ion_n()
+        if dimxpoint['options']['recalc_Nustar']:
+            dimxpoint.match_nustar(nustar)
+        if dimxpoint['options']['recalc_Ti_Te_rel']:
+            dimxpoint.match_tite(Ti_Te_rel)
+        if dimxpoint['options']['check_qn']:
+            dimxpoint.check_quasi()
+
+    def setup_scan(self, scan_names, scan_list, num_points=None):
         """ Set up a QuaLiKiz scan
 
         scan_names should be the names of the parameters being scanned over.
         This is a list with the same length of list-like objects generated
         by scan_list. Scan_list should be a generator (or list of lists)
         that generates the values matching the values of the scan_names.
+
+        Kwargs:
+            num_points: Amount of points generated by scan_list. Use when
+                        generating only a part of the scan. dimx by default
         """
         self._sanity_check_setup(scan_names)
         dimxpoint = copy.deepcopy(self['xpoint_base'])
@@ -664,13 +994,15 @@ class QuaLiKizPlan(dict):
         dimx = self.calculate_dimx()
         dimn = len(dimxpoint['special']['kthetarhos'])
         nions = len(dimxpoint['ions'])
+        if num_points is None:
+            num_points = dimx
 
         bytes = dict(zip(QuaLiKizXpoint.Geometry.in_args,
-                         [array.array('d', [0] * dimx) for i in range(13)]))
+                         [array.array('d', [0] * num_points) for i in range(13)]))
         bytes.update(dict(zip([x + 'e' for x in Electron.in_args],
-                              [array.array('d', [0] * dimx)
+                              [array.array('d', [0] * num_points)
                                for i in range(7)])))
-        dimxi = dimx * nions
+        dimxi = num_points * nions
         bytes.update(dict(zip([x + 'i' for x in Electron.in_args +
                                Ion.in_args],
                               [array.array('d', [0] * dimxi)
@@ -691,28 +1023,7 @@ class QuaLiKizPlan(dict):
         # object with as many entries as we have different parameters
         for scan_values in scan_list:
             numscan += 1
-            # Set the dimxn point value to the value in the list.
-            if dimxpoint['options']['recalc_Nustar']:
-                nustar = dimxpoint.calc_nustar()
-            if dimxpoint['options']['recalc_Ti_Te_rel']:
-                Ti_Te_rel = dimxpoint.calc_tite()
-            for scan_name, scan_value in zip(scan_names, scan_values):
-                dimxpoint[scan_name] = scan_value
-            if dimxpoint['options']['assume_tor_rot']:
-                dimxpoint.set_puretor()
-            if dimxpoint['options']['x_eq_rho']:
-                dimxpoint['geometry'].__setitem__('rho', dimxpoint['x'])
-            if dimxpoint['options']['set_qn_normni']:
-                dimxpoint.set_qn_normni_ion_n()
-            if dimxpoint['options']['set_qn_An']:
-                dimxpoint.set_qn_An_ion_n()
-            if dimxpoint['options']['recalc_Nustar']:
-                dimxpoint.match_nustar(nustar)
-            if dimxpoint['options']['recalc_Ti_Te_rel']:
-                dimxpoint.match_tite(Ti_Te_rel)
-            if dimxpoint['options']['check_qn']:
-                dimxpoint.check_quasi()
-
+            self._apply_scan_values(dimxpoint, scan_names, scan_values)
 
             # Now iterate over all the values in the xpoint dict and add them
             # to our array
@@ -726,7 +1037,7 @@ class QuaLiKizPlan(dict):
                 for name, value in ion.items():
                     if name == 'n':
                         name = 'normn'
-                    bytes[name + 'i'][j * dimx + numscan] = value
+                    bytes[name + 'i'][j * num_points + numscan] = value
 
         # Some magic because electron type is a QuaLiKizRun constant
         bytes['typee'] = array.array('d', [bytes['typee'][0]])
@@ -738,28 +1049,59 @@ class QuaLiKizPlan(dict):
             bytes[name] = array.array('d', [value])
         return bytes
 
-    def to_json(self, filename):
+    @instrumented('write_plan')
+    def to_json(self, filename, npy_threshold=None):
         """ Dump the QuaLiKiz plan to json file
 
         The QuaLiKiz plan, including the xpoint base, can be fully
-        recontructed later using the from_json function
+        recontructed later using the from_json function. Scan values
+        longer than npy_threshold are stored in a binary .npy file next
+        to the json file, named <json name>.<scan variable>.npy. The
+        json then contains a reference to this file.
+
+        Kwargs:
+            npy_threshold: Minimum amount of values to store a scan
+                           variable as .npy. By default
+                           QuaLiKizPlan.npy_threshold
         """
+        if npy_threshold is None:
+            npy_threshold = self.npy_threshold
+        dirname, basename = os.path.split(filename)
+        prefix = os.path.splitext(basename)[0]
+        plan = dict(self)
+        plan['scan_dict'] = OrderedDict(plan['scan_dict'])
+        for name, values in plan['scan_dict'].items():
+            if len(values) < npy_threshold:
+                continue
+            npy_name = '{!s}.{!s}.npy'.format(prefix, name)
+            npy_path = os.path.join(dirname, npy_name)
+            # Do not overwrite the file we are memory-mapping from
+            if not (isinstance(values, np.memmap) and
+                    os.path.abspath(values.filename) == os.path.abspath(npy_path)):
+                np.save(npy_path, np.asarray(values, dtype='float64'))
+            plan['scan_dict'][name] = {'npy': npy_name}
         with open(filename, 'w') as file_:
-            json.dump(self, file_, indent=4, default=json_serializer)
+            json.dump(plan, file_, indent=4, default=json_serializer)
 
     @classmethod
+    @instrumented('read_plan')
     def from_json(cls, filename):
         """ Load the QuaLiKiz plan from json
 
         Reconstruct the QuaLiKiz plan based on the given json file.
         Backwards compatibility is not guaranteed, so preferably
         generate the json with the same version as which you load it
-        with.
+        with. Scan values stored in .npy files are memory-mapped.
         """
         with open(filename, 'r') as file_:
             data = json.load(file_, object_pairs_hook=OrderedDict)
             scan_dict = data.pop('scan_dict')
             scan_type = data.pop('scan_type')
+            sample_options = data.pop('sample_options', None)
+            for name, values in scan_dict.items():
+                if isinstance(values, dict) and 'npy' in values:
+                    npy_path = os.path.join(os.path.dirname(filename), values['npy'])
+                    scan_dict[name] = np.load(npy_path, mmap_mode='r')
 
             kthetarhos = data['xpoint_base']['special'].pop('kthetarhos')
             data['xpoint_base'].pop('special')
@@ -774,7 +1116,8 @@ class QuaLiKizPlan(dict):
                 dict_.update(dicts)
 
             xpoint_base = QuaLiKizXpoint(kthetarhos, elec, ions, **dict_)
-            return QuaLiKizPlan(scan_dict, scan_type, xpoint_base)
+            return QuaLiKizPlan(scan_dict, scan_type, xpoint_base,
+                                sample_options=sample_options)
 
     @classmethod
     def from_defaults(cls):
@@ -0,0 +1,234 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Lightweight instrumentation of the stages of our own tooling, like input
+generation, reading the output, squeezing and gluing.
+
+Wrap a stage in `with stage('name'):` to record its wall time, CPU time,
+bytes read and written and the peak RSS of the process at its end. The
+run a stage belongs to is inherited by nested stages. Recording is off by
+default and then costs next to nothing. Enable it with `enable`, the
+`--instrument <path>` flag of qualikiz_tools or by setting the
+environment variable QUALIKIZ_INSTRUMENT to a path. The stages are then
+exported to that path when the process exits, as Chrome trace JSON
+(open in chrome://tracing or Perfetto) or, if the path ends in .sqlite,
+.sqlite3 or .db, as rows of the 'stages' table of a polling database.
+
+Stages run in worker processes are only recorded in that worker, so
+they are not exported. Instrument the stage around the pool instead, or
+use a single process.
+"""
+import os
+import time
+import json
+import atexit
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+instrument_env_var = 'QUALIKIZ_INSTRUMENT'
+sqlite_extensions = ('.sqlite', '.sqlite3', '.db')
+fields = ['name', 'run', 'pid', 'tid', 'start', 'walltime', 'cputime',
+          'read_bytes', 'write_bytes', 'max_rss']
+
+_state = {'enabled': False, 'exports': []}
+_events = []
+_local = threading.local()
+
+
+def io_counters():
+    """ Bytes read and written by this process, from /proc/self/io
+    rchar and wchar count all read and write calls, including those
+    served from the page cache. Zeros if /proc is not available.
+    """
+    try:
+        with open('/proc/self/io', 'rb') as file_:
+            counters = dict(line.split(b':') for line in file_.read().splitlines())
+        return int(counters[b'rchar']), int(counters[b'wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+def max_rss():
+    """ Peak resident set size of this process in bytes, 0 if unknown """
+    if resource is None:
+        return 0
+    # Linux reports kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def is_enabled():
+    return _state['enabled']
+
+def enable(path=None):
+    """ Start recording stages
+
+    Kwargs:
+        path: Export the recorded stages to this path when the process
+              exits. See export
+    """
+    _state['enabled'] = True
+    if path is not None and path not in _state['exports']:
+        if len(_state['exports']) == 0:
+            atexit.register(_export_at_exit)
+        _state['exports'].append(path)
+
+def disable():
+    """ Stop recording stages. Recorded stages are kept """
+    _state['enabled'] = False
+
+def events():
+    """ The recorded stages, as a list of dicts with the keys in `fields` """
+    return list(_events)
+
+def reset():
+    """ Forget all recorded stages """
+    del _events[:]
+
+@contextmanager
+def stage(name, run=None):
+    """ Record a stage of the tooling
+
+    Args:
+        name: Name of the stage, for example 'generate_input'
+
+    Kwargs:
+        run:  Run directory the stage works on. By default the run of
+              the enclosing stage
+    """
+    if not _state['enabled']:
+        yield
+        return
+    stack = getattr(_local, 'runs', None)
+    if stack is None:
+        stack = _local.runs = []
+    if run is None and len(stack) > 0:
+        run = stack[-1]
+    stack.append(run)
+    read_start, write_start = io_counters()
+    cpu_start = time.process_time()
+    start = time.time()
+    wall_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        walltime = time.perf_counter() - wall_start
+        cputime = time.process_time() - cpu_start
+        read_end, write_end = io_counters()
+        stack.pop()
+        _events.append(OrderedDict(zip(fields, [
+            name, run, os.getpid(), threading.get_ident(), start, walltime,
+            cputime, read_end - read_start, write_end - write_start, max_rss()])))
+
+def instrumented(name):
+    """ Decorator recording every call of a function as stage name """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return function(*args, **kwargs)
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def to_chrome_trace(path, events_=None):
+    """ Write stages as Chrome trace JSON
+
+    Args:
+        path:    Path of the JSON file
+
+    Kwargs:
+        events_: The stages to write. All recorded stages by default
+    """
+    if events_ is None:
+        events_ = events()
+    trace = []
+    for event in events_:
+        trace.append(OrderedDict([
+            ('name', event['name']),
+            ('cat', 'qualikiz_tools'),
+            ('ph', 'X'),
+            ('ts', event['start'] * 1e6),
+            ('dur', event['walltime'] * 1e6),
+            ('pid', event['pid']),
+            ('tid', event['tid']),
+            ('args', OrderedDict((field, event[field]) for field in
+                                 ['run', 'cputime', 'read_bytes', 'write_bytes',
+                                  'max_rss']))]))
+    with open(path, 'w') as file_:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file_)
+
+def to_sqlite(database_path, events_=None):
+    """ Append stages to the 'stages' table of a polling database
+
+    Args:
+        database_path: Path of the database. Created if it does not exist
+
+    Kwargs:
+        events_:       The stages to write. All recorded stages by default
+    """
+    if events_ is None:
+        events_ = events()
+    db = sqlite3.connect(database_path)
+    db.execute('PRAGMA journal_mode=WAL')
+    with db:
+        db.execute('''CREATE TABLE IF NOT EXISTS stages (
+            Name        TEXT,
+            Run         TEXT,
+            Pid         INTEGER,
+            Tid         INTEGER,
+            Start       REAL,
+            Walltime    REAL,
+            CPUtime     REAL,
+            Read_bytes  INTEGER,
+            Write_bytes INTEGER,
+            Max_RSS     INTEGER
+          )''')
+        db.executemany('INSERT INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       [list(event.values()) for event in events_])
+    db.close()
+
+def export(path, events_=None):
+    """ Write stages to path, as SQLite if it ends in one of
+    sqlite_extensions and as Chrome trace JSON otherwise """
+    if path.endswith(sqlite_extensions):
+        to_sqlite(path, events_=events_)
+    else:
+        to_chrome_trace(path, events_=events_)
+
+def summary(events_=None):
+    """ Totals per stage name
+
+    Returns:
+        OrderedDict of stage name: dict with the amount of calls, the
+        total walltime, cputime, read_bytes and write_bytes and the
+        largest max_rss. Ordered by total walltime, largest first
+    """
+    if events_ is None:
+        events_ = events()
+    totals = {}
+    for event in events_:
+        total = totals.setdefault(event['name'], OrderedDict(
+            [('calls', 0), ('walltime', 0.), ('cputime', 0.), ('read_bytes', 0),
+             ('write_bytes', 0), ('max_rss', 0)]))
+        total['calls'] += 1
+        for field in ['walltime', 'cputime', 'read_bytes', 'write_bytes']:
+            total[field] += event[field]
+        total['max_rss'] = max(total['max_rss'], event['max_rss'])
+    return OrderedDict(sorted(totals.items(), key=lambda item: -item[1]['walltime']))
+
+def _export_at_exit():
+    for path in _state['exports']:
+        export(path)
+
+
+if os.environ.get(instrument_env_var):
+    enable(os.environ[instrument_env_var])
@@ -2,14 +2,196 @@
 Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
 Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
 License: CeCILL v2.1
+
+The convert_* functions rename the input binaries of an existing run to
+the names of an older QuaLiKiz version. To write the binaries of an older
+version directly, use version_table or the version argument of
+QuaLiKizRun.generate_input.
 """
 import os
 import shutil
 import array
+from collections import OrderedDict
 from warnings import warn
+
+
+names_2_4_0 = {'qx': 'q',
+               'alphax': 'alpha'}
+
+names_2_3_2 = {'p1' : 'dimx',
+               'p2' : 'dimn',
+               'p3' : 'nions',
+               'p4' : 'phys_meth',
+               'p5' : 'coll_flag',
+               'p6' : 'rot_flag',
+               'p7' : 'verbose',
+               'p8' : 'separateflux',
+               'p9' : 'numsols',
+               'p10': 'relacc1',
+               'p11': 'relacc2',
+               'p12': 'maxruns',
+               'p13': 'maxpts',
+               'p14': 'timeout',
+               'p15': 'R0',
+               'p16': 'kthetarhos',
+               'p17': 'x',
+               'p18': 'rho',
+               'p19': 'Ro',
+               'p20': 'Rmin',
+               'p21': 'Bo',
+               'p22': 'qx',
+               'p23': 'smag',
+               'p24': 'alphax',
+               'p25': 'Machtor',
+               'p26': 'Autor',
+               'p27': 'Machpar',
+               'p28': 'Aupar',
+               'p29': 'gammaE',
+               'p30': 'Te',
+               'p31': 'ne',
+               'p32': 'Ate',
+               'p33': 'Ane',
+               'p34': 'typee',
+               'p35': 'anise',
+               'p36': 'danisdre',
+               'p37': 'Ti',
+               'p38': 'normni',
+               'p39': 'Ati',
+               'p40': 'Ani',
+               'p41': 'typei',
+               'p42': 'anisi',
+               'p43': 'danisdri',
+               'p44': 'Ai',
+               'p45': 'Zi'}
+
+names_2_3_1 = {'p8' : 'p9',
+               'p9' : 'p10',
+               'p10': 'p11',
+               'p11': 'p12',
+               'p12': 'p13',
+               'p13': 'p14',
+               'p14': 'p16',
+               'p15': 'p17',
+               'p16': 'p18',
+               'p17': 'p19',
+               'p18': 'p20',
+               'p19': 'p21',
+               'p20': 'p15',
+               'p21': 'p22',
+               'p22': 'p23',
+               'p23': 'p24',
+               'p24': 'p25',
+               'p25': 'p26',
+               'p26': 'p27',
+               'p27': 'p28',
+               'p28': 'p29',
+               'p29': 'p30',
+               'p30': 'p31',
+               'p31': 'p32',
+               'p32': 'p33',
+               'p33': 'p34',
+               'p34': 'p35',
+               'p35': 'p36',
+               'p36': 'p44',
+               'p37': 'p45',
+               'p38': 'p37',
+               'p39': 'p38',
+               'p40': 'p39',
+               'p41': 'p40',
+               'p42': 'p41',
+               'p43': 'p42',
+               'p44': 'p43'}
+
+names_CEA_QuaLiKiz = {'p16': 'p14',
+                      'p17': 'p15',
+                      'p18': 'p16',
+                      'p19': 'p17',
+                      'p20': 'p18',
+                      'p21': 'p19',
+                      'p22': 'p20',
+                      'p23': 'p21',
+                      'p24': 'p22',
+                      'p25': 'p23',
+                      'p26': 'p24',
+                      'p27': 'p25',
+                      'p28': 'p26',
+                      'p29': 'p27',
+                      'p30': 'p28',
+                      'p31': 'p29',
+                      'p32': 'p30',
+                      'p33': 'p31',
+                      'p34': 'p32',
+                      'p35': 'p33',
+                      'p36': 'p34',
+                      'p37': 'p35',
+                      'p38': 'p36',
+                      'p39': 'p37',
+                      'p40': 'p38',
+                      'p41': 'p39',
+                      'p42': 'p40',
+                      'p43': 'p41',
+                      'p44': 'p42',
+                      'p45': 'p43',
+                      'p46': 'p44'}
+
+versions = ['current', '2.4.0', '2.3.2', '2.3.1', 'CEA_QuaLiKiz']
+
+
+def version_table(names, target='current'):
+    """ Get the names of the input binaries of an older QuaLiKiz version
+
+    Applies the renames of the convert_* functions on the names instead of
+    on the files, so the binaries can be written with their final name
+    directly. Files that the conversion removes are not in the table.
+
+    Args:
+        names:  Names of the input binaries in the current version
+
+    Kwargs:
+        target: Version to get the names for. See versions
+
+    Returns:
+        Tuple of a dict with the target name per current name, and a dict
+        with the value per extra constant binary of the target version
+    """
+    if target not in versions:
+        raise Exception('Unknown version {!s}'.format(target))
+    files = OrderedDict((name, name) for name in names)
+    constants = OrderedDict()
+    for version in versions[1:versions.index(target) + 1]:
+        if version == '2.4.0':
+            input_table = names_2_4_0
+        elif version == '2.3.2':
+            input_table = names_2_3_2
+        elif version == '2.3.1':
+            input_table = names_2_3_1
+        elif version == 'CEA_QuaLiKiz':
+            input_table = names_CEA_QuaLiKiz
+        if version in ['2.4.0', '2.3.2']:
+            # Renamed in place
+            for old_name, new_name in input_table.items():
+                if new_name in files:
+                    files[old_name] = files.pop(new_name)
+        else:
+            # Renamed through a temporary folder
+            temp = files
+            files = OrderedDict()
+            for old_name, new_name in input_table.items():
+                if new_name in temp:
+                    files[old_name] = temp.pop(new_name)
+            if version == '2.3.1':
+                temp.pop('p8', None)
+            files.update(temp)
+        if version == 'CEA_QuaLiKiz':
+            for name in ['p14', 'p15']:
+                files.pop(name, None)
+                constants[name] = 1.
+    rename = OrderedDict((source, name) for name, source in files.items())
+    return rename, constants
+
+
 def convert_current_to_2_4_0(inputdir):
-    input_table = {'qx': 'q',
-                   'alphax': 'alpha'}
+    input_table = names_2_4_0
     for old_name, new_name in input_table.items():
         try:
             os.rename(os.path.join(inputdir, new_name + '.bin'),
@@ -33,51 +215,7 @@ def convert_current_to(inputdir, target='2.4.0'):
     raise Exception('Unknown target {!s}. Input files are now in CEA_QuaLiKiz style'.format(target))
 
 def convert_2_4_0_to_2_3_2(inputdir):
-    input_table = {'p1' : 'dimx',
-                   'p2' : 'dimn',
-                   'p3' : 'nions',
-                   'p4' : 'phys_meth',
-                   'p5' : 'coll_flag',
-                   'p6' : 'rot_flag',
-                   'p7' : 'verbose',
-                   'p8' : 'separateflux',
-                   'p9' : 'numsols',
-                   'p10': 'relacc1',
-                   'p11': 'relacc2',
-                   'p12': 'maxruns',
-                   'p13': 'maxpts',
-                   'p14': 'timeout',
-                   'p15': 'R0',
-                   'p16': 'kthetarhos',
-                   'p17': 'x',
-                   'p18': 'rho',
-                   'p19': 'Ro',
-                   'p20': 'Rmin',
-                   'p21': 'Bo',
-                   'p22': 'qx',
-                   'p23': 'smag',
-                   'p24': 'alphax',
-                   'p25': 'Machtor',
-                   'p26': 'Autor',
-                   'p27': 'Machpar',
-                   'p28': 'Aupar',
-                   'p29': 'gammaE',
-                   'p30': 'Te',
-                   'p31': 'ne',
-                   'p32': 'Ate',
-                   'p33': 'Ane',
-                   'p34': 'typee',
-                   'p35': 'anise',
-                   'p36': 'danisdre',
-                   'p37': 'Ti',
-                   'p38': 'normni',
-                   'p39': 'Ati',
-                   'p40': 'Ani',
-                   'p41': 'typei',
-                   'p42': 'anisi',
-                   'p43': 'danisdri',
-                   'p44': 'Ai',
-                   'p45': 'Zi'}
+    input_table = names_2_3_2
     for old_name, new_name in input_table.items():
         try:
             os.rename(os.path.join(inputdir, new_name + '.bin'),
@@ -86,43 +224,7 @@ def convert_2_4_0_to_2_3_2(inputdir):
             warn('File ' + os.path.join(inputdir, new_name + '.bin') + ' not found, skipping..')
 
 def convert_2_3_2_to_2_3_1(inputdir):
-    input_table = {'p8' : 'p9',
-                   'p9' : 'p10',
-                   'p10': 'p11',
-                   'p11': 'p12',
-                   'p12': 'p13',
-                   'p13': 'p14',
-                   'p14': 'p16',
-                   'p15': 'p17',
-                   'p16': 'p18',
-                   'p17': 'p19',
-                   'p18': 'p20',
-                   'p19': 'p21',
-                   'p20': 'p15',
-                   'p21': 'p22',
-                   'p22': 'p23',
-                   'p23': 'p24',
-                   'p24': 'p25',
-                   'p25': 'p26',
-                   'p26': 'p27',
-                   'p27': 'p28',
-                   'p28': 'p29',
-                   'p29': 'p30',
-                   'p30': 'p31',
-                   'p31': 'p32',
-                   'p32': 'p33',
-                   'p33': 'p34',
-                   'p34': 'p35',
-                   'p35': 'p36',
-                   'p36': 'p44',
-                   'p37': 'p45',
-                   'p38': 'p37',
-                   'p39': 'p38',
-                   'p40': 'p39',
-                   'p41': 'p40',
-                   'p42': 'p41',
-                   'p43': 'p42',
-                   'p44': 'p43'}
+    input_table = names_2_3_1
 
     tempdir = os.path.join(inputdir, 'temp')
     os.mkdir(tempdir)
@@ -146,37 +248,7 @@ def convert_2_3_2_to_2_3_1(inputdir):
     os.rmdir(tempdir)
 
 def convert_2_3_1_to_CEA_QuaLiKiz(inputdir):
-    input_table = {'p16': 'p14',
-                   'p17': 'p15',
-                   'p18': 'p16',
-                   'p19': 'p17',
-                   'p20': 'p18',
-                   'p21': 'p19',
-                   'p22': 'p20',
-                   'p23': 'p21',
-                   'p24': 'p22',
-                   'p25': 'p23',
-                   'p26': 'p24',
-                   'p27': 'p25',
-                   'p28': 'p26',
-                   'p29': 'p27',
-                   'p30': 'p28',
-                   'p31': 'p29',
-                   'p32': 'p30',
-                   'p33': 'p31',
-                   'p34': 'p32',
-                   'p35': 'p33',
-                   'p36': 'p34',
-                   'p37': 'p35',
-                   'p38': 'p36',
-                   'p39': 'p37',
-                   'p40': 'p38',
-                   'p41': 'p39',
-                   'p42': 'p40',
-                   'p43': 'p41',
-                   'p44': 'p42',
-                   'p45': 'p43',
-                   'p46': 'p44'}
+    input_table = names_CEA_QuaLiKiz
 
     tempdir = os.path.join(inputdir, 'temp')
     os.mkdir(tempdir)
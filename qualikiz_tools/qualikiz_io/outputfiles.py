@@ -9,13 +9,14 @@ from warnings import warn
 from collections import OrderedDict
 from itertools import chain
 import sys
-import array
 import gc
 
 import pandas as pd
 import numpy as np
 import xarray as xr
 
+from qualikiz_tools.qualikiz_io.instrumentation import instrumented
+
 output_meth_0_sep_0 = {
     'gam'               : None,
     'ome'               : None,
@@ -253,6 +254,40 @@ numecoefs = 13
 numicoefs = 7
 ntheta = 64
 
+def output_file_names(phys_meth=2, separateflux=False):
+    """ Names of the files QuaLiKiz writes to the output folder
+
+    Follows the same naming rules as convert_output.
+
+    Kwargs:
+        phys_meth:    The phys_meth flag of the run
+        separateflux: The separateflux flag of the run
+
+    Returns:
+        List with the file names without suffix
+    """
+    subsets = [output_meth_0_sep_0]
+    if separateflux:
+        subsets.append(output_meth_0_sep_1)
+    if phys_meth >= 1:
+        subsets.append(output_meth_1_sep_0)
+        if separateflux:
+            subsets.append(output_meth_1_sep_1)
+    if phys_meth >= 2:
+        subsets.append(output_meth_2_sep_0)
+        if separateflux:
+            subsets.append(output_meth_2_sep_1)
+    names = []
+    for name in chain(*subsets):
+        if (name not in ['cke', 'ceke', 'cki', 'ceki', 'ion_type', 'ecoefs', 'npol', 'cftrans']
+                and not name.endswith('_cm')):
+            names.extend([name + '_SI', name + '_GB'])
+        else:
+            names.append(name)
+    return names
+
+
+@instrumented('determine_sizes')
 def determine_sizes(rundir, folder='debug', keepfile=True):
     """ Determine the sizes needed for re-shaping arrays
 
@@ -326,6 +361,7 @@ def add_missing_dims(sizes, data, dims):
                     data = np.expand_dims(data, axis=di)
     return data
 
+@instrumented('convert_debug')
 def convert_debug(sizes, rundir, folder='debug', verbose=False,
                   genfromtxt=False, keepfile=True):
     """ Convert the debug folder to netcdf
@@ -377,6 +413,7 @@ def convert_debug(sizes, rundir, folder='debug', verbose=False,
     return ds
 
 
+@instrumented('convert_output')
 def convert_output(ds, sizes, rundir, folder='output', verbose=False,
                    genfromtxt=False, keepfile=True):
     """ Convert the output folder to netcdf
@@ -464,6 +501,7 @@ def convert_output(ds, sizes, rundir, folder='output', verbose=False,
     return ds
 
 
+@instrumented('convert_primitive')
 def convert_primitive(ds, sizes, rundir, folder='output/primitive', verbose=False,
                       genfromtxt=False, keepfile=True):
     """ Convert the output/primitive folder to netcdf
@@ -612,6 +650,7 @@ def remove_dependent_axes(ds, Te_var='Te'):
     return ds
 
 
+@instrumented('squeeze')
 def squeeze_dataset(ds, Te_var='Te', extra_squeeze=None):
     """ Remove Coordinates that depend on eachother and squeeze duplicates
 
@@ -737,6 +776,7 @@ def unsqueeze_dataset(ds):
 
     return ds
 
+@instrumented('orthogonalize')
 def orthogonalize_dataset(ds, verbose=False):
     """ Convert dataset depending on dimx to orthogonal dimensions
 
@@ -872,6 +912,7 @@ def add_dims(ds, newdims):
 
     return newds
 
+@instrumented('glue_snake')
 def merge_many_lazy_snakes(path, dss, datavars=None, verbose=False, netcdf_kwargs=None, **kwargs):
     if os.path.exists(path):
         raise OSError('{!s} exists! Refusing to overwrite')
@@ -894,6 +935,7 @@ def merge_many_lazy_snakes(path, dss, datavars=None, verbose=False, netcdf_kwarg
         gc.collect()
     return xr.open_dataset(path)
 
+@instrumented('glue_orthogonal')
 def merge_many_orthogonal(dss, datavars=None, verbose=False, **kwargs):
     newds = dss[0]
     newds.load()
@@ -974,63 +1016,240 @@ def sort_dims(ds):
         ds = ds.reindex(**{dim: np.sort(ds[dim])})
     return ds
 
-def to_input_json(ds, inputdir='input'):
-    """ Create an input json file from dataset
-    This functions created a input JSON file using the coordinates
-    as scan values. The cleanest JSON will be generated if a
-    squeezed dataset is used.
+# Names to look for in a dataset per input binary, in order of preference
+dataset_input_aliases = {'Ate': ['Ate', 'At'],
+                         'Ati': ['Ati', 'At'],
+                         'Ane': ['Ane', 'An'],
+                         'Ani': ['Ani', 'An'],
+                         'x': ['x', 'rho'],
+                         'rho': ['rho', 'x']}
+
+def _dataset_lookup(ds, name):
+    """ Find an input variable in a dataset, its coords or its attrs
+
+    Returns:
+        DataArray with the values or None if not found
     """
-    ignore = ['Zeff', 'Nustar']
-    conversion_dict = {'Tex': 'Te',
-                       'Nex': 'ne',
-                       'ion_type': 'typei',
-                       'ninorm': 'normni',
-                       'Tix': 'Ti'}
-    for name, item in ds.coords.items():
-        print(name)
-        dimx = len(ds['dimx'])
-        nions = len(ds['nions'])
-        if name in ['dimx', 'dimn', 'nions', 'numsols']:
-            bytevalues = [len(item)]
+    for alias in dataset_input_aliases.get(name, [name]):
+        if alias in ds.variables:
+            return ds[alias]
+        if alias in ds.attrs:
+            return xr.DataArray(ds.attrs[alias])
+    if name == 'Ti' and 'Ti_Te' in ds.variables:
+        Te = _dataset_lookup(ds, 'Te')
+        if Te is not None:
+            return ds['Ti_Te'] * Te
+    return None
+
+def _dataset_base_value(xpoint_base, name, nions):
+    """ Get the value of an input binary from a QuaLiKizXpoint """
+    from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+    point_names, ion_names = QuaLiKizPlan.binary_names()
+    if name in point_names or name == 'typee':
+        if name in xpoint_base['geometry']:
+            return xpoint_base['geometry'][name]
+        return xpoint_base['elec'][name[:-1]]
+    elif name in ion_names:
+        key = 'n' if name == 'normni' else name[:-1]
+        ions = xpoint_base['ions']
+        return np.array([ions[min(ii, len(ions) - 1)][key]
+                         for ii in range(nions)])[:, np.newaxis]
+    elif name == 'kthetarhos':
+        return np.array(xpoint_base['special']['kthetarhos'])
+    else:
+        return xpoint_base['meta'][name]
+
+def dataset_input_values(ds, points=None, xpoint_base=None):
+    """ Get the values of all QuaLiKiz input binaries from a dataset
+
+    The dataset should have a dimx dimension, like the ones created by
+    run_to_netcdf with runmode 'dimx'. Both squeezed and unsqueezed
+    datasets are supported. Variables are looked up in the data
+    variables, coordinates and attributes. Inputs that are not in the
+    dataset, like the anisotropy, are taken from xpoint_base.
+
+    Args:
+        ds:          Dataset to get the input from
+
+    Kwargs:
+        points:      Points to select. Either a boolean mask or an array of
+                     indices along dimx. All points by default
+        xpoint_base: QuaLiKizXpoint to take missing inputs from. The default
+                     QuaLiKizPlan template by default
+
+    Returns:
+        OrderedDict with a numpy array per input binary. Per-point binaries
+        have shape (npoints, ), per-ion binaries (nions, npoints)
+    """
+    from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+    if 'dimx' not in ds.dims:
+        raise Exception('Dataset has no dimx dimension. Convert the run with '
+                        'runmode \'dimx\'')
+    if xpoint_base is None:
+        xpoint_base = QuaLiKizPlan.from_defaults()['xpoint_base']
+    if points is None:
+        idx = np.arange(ds.sizes['dimx'])
+    else:
+        idx = np.arange(ds.sizes['dimx'])[np.asarray(points)]
+    npoints = len(idx)
+    if 'nions' in ds.dims:
+        nions = ds.sizes['nions']
+    else:
+        nions = len(xpoint_base['ions'])
+
+    point_names, ion_names = QuaLiKizPlan.binary_names()
+    values = OrderedDict()
+    from_base = []
+    for name in point_names + ion_names + QuaLiKizPlan.constant_names():
+        if name in ['dimx', 'dimn', 'nions']:
+            continue
+        if name == 'numsols' and 'numsols' in ds.dims:
+            values[name] = np.array([ds.sizes['numsols']], dtype='float64')
+            continue
+        da = _dataset_lookup(ds, name)
+        if da is None:
+            from_base.append(name)
+            value = np.array(_dataset_base_value(xpoint_base, name, nions),
+                             dtype='float64')
+        elif name in point_names or name in ion_names:
+            dims = ['nions', 'dimx'] if name in ion_names else ['dimx']
+            if any(dim not in dims for dim in da.dims):
+                raise Exception('Variable {!s} has dims {!s}, expected a subset '
+                                'of {!s}'.format(da.name, da.dims, dims))
+            da = da.transpose(*[dim for dim in dims if dim in da.dims])
+            value = da.values.astype('float64')
+            if 'dimx' in da.dims:
+                value = value[..., idx]
+            elif name in ion_names:
+                value = value[..., np.newaxis]
         else:
-            if 'nions' in item.dims:
-                bytevalues = item.stack(dim=('nions', 'dimx')).data
-            elif 'dimx' in item.dims or name == 'kthetarhos':
-                bytevalues = item.data
-            else:
-                bytevalues = [item.data]
-        print(bytevalues)
-        value = array.array('d', bytevalues)
-        if name  in conversion_dict:
-            name = conversion_dict[name]
-
-        if name not in ignore:
-            with open(os.path.join(inputdir, name + '.bin'), 'wb') as file_:
-                value.tofile(file_)
-    fake = {'alphax': 0.,
-            'danisdre': 0.,
-            'anise': 1.}
-
-    for name, value in fake.items():
-        with open(os.path.join(inputdir, name + '.bin'), 'wb') as file_:
-            array.array('d', np.full(dimx, value)).tofile(file_)
-
-    fake = {'danisdri': 0.,
-            'anisi': 1.}
-
-    for name, value in fake.items():
-        with open(os.path.join(inputdir, name + '.bin'), 'wb') as file_:
-            array.array('d', np.full(nions*dimx, value)).tofile(file_)
-    fake = {'phys_meth': 1.,
-            'typee': 1.,
-            'verbose': 1.}
-
-    for name, value in fake.items():
-        with open(os.path.join(inputdir, name + '.bin'), 'wb') as file_:
-            array.array('d', [value]).tofile(file_)
-
-    with open(os.path.join(inputdir, 'rho' + '.bin'), 'wb') as file_:
-        array.array('d', ds['x'].data).tofile(file_)
+            value = da.values.astype('float64')
+        if name in point_names:
+            value = np.broadcast_to(value, (npoints, ))
+        elif name in ion_names:
+            value = np.broadcast_to(value.reshape(-1, value.shape[-1]),
+                                    (nions, npoints))
+        else:
+            value = np.atleast_1d(value)
+        values[name] = value
+    if len(from_base) != 0:
+        warn('Not in dataset, using xpoint_base for {!s}'.format(', '.join(from_base)))
+
+    values['dimx'] = np.array([npoints], dtype='float64')
+    values['dimn'] = np.array([len(values['kthetarhos'])], dtype='float64')
+    values['nions'] = np.array([nions], dtype='float64')
+    return values
+
+def dataset_to_input(ds, inputdir='input', points=None, xpoint_base=None,
+                     version='current'):
+    """ Write QuaLiKiz input binaries from a dataset
+
+    Writes the input of the selected points directly with ndarray.tofile,
+    without going through a QuaLiKizPlan. See dataset_input_values.
+
+    Args:
+        ds:          Dataset to get the input from
+
+    Kwargs:
+        inputdir:    Folder to write the binaries to
+        points:      Points to select. Either a boolean mask or an array of
+                     indices along dimx. All points by default
+        xpoint_base: QuaLiKizXpoint to take missing inputs from
+        version:     QuaLiKiz version to write the binaries for. See
+                     legacy.version_table
+
+    Returns:
+        Amount of points written
+    """
+    from qualikiz_tools.qualikiz_io.legacy import version_table
+    values = dataset_input_values(ds, points=points, xpoint_base=xpoint_base)
+    rename, constants = version_table(values.keys(), version)
+    for name, value in constants.items():
+        values[name] = np.array([value], dtype='float64')
+        rename[name] = name
+    os.makedirs(inputdir, exist_ok=True)
+    for name, value in values.items():
+        if name in rename:
+            with open(os.path.join(inputdir, rename[name] + '.bin'), 'wb') as file_:
+                np.ascontiguousarray(value, dtype='float64').tofile(file_)
+    return int(values['dimx'][0])
+
+def dataset_to_plan(ds, points=None, xpoint_base=None):
+    """ Create a QuaLiKizPlan that reproduces the input of a dataset
+
+    The plan is a 'parallel' scan over all inputs that vary between the
+    selected points. All options that modify the points, like keeping
+    quasineutrality, are turned off, so the plan generates the input
+    exactly as stored in the dataset. See dataset_input_values.
+
+    Args:
+        ds:          Dataset to get the input from
+
+    Kwargs:
+        points:      Points to select. Either a boolean mask or an array of
+                     indices along dimx. All points by default
+        xpoint_base: QuaLiKizXpoint to take missing inputs from
+
+    Returns:
+        The QuaLiKizPlan
+    """
+    from qualikiz_tools.qualikiz_io.inputfiles import (QuaLiKizPlan, QuaLiKizXpoint,
+                                                       Electron, Ion, IonList)
+    values = dataset_input_values(ds, points=points, xpoint_base=xpoint_base)
+    if values['dimx'][0] == 0:
+        raise Exception('No points selected')
+    point_names, ion_names = QuaLiKizPlan.binary_names()
+    scan_dict = OrderedDict()
+    for name in point_names:
+        if not np.all(values[name] == values[name][0]):
+            scan_dict[name] = values[name]
+    for name in ion_names:
+        value = values[name]
+        key = ('n' if name == 'normni' else name[:-1]) + 'i'
+        if np.all(value == value[0, 0]):
+            continue
+        elif np.all(value == value[0]):
+            # Equal for all ions, scan them together
+            scan_dict[key] = value[0]
+        else:
+            for ii, ion_value in enumerate(value):
+                if not np.all(ion_value == ion_value[0]):
+                    scan_dict[key + str(ii)] = ion_value
+    if len(scan_dict) == 0:
+        scan_dict['x'] = values['x']
+
+    elec = Electron(**{name: float(values[name + 'e'][0])
+                       for name in Electron.in_args})
+    ions = IonList(*[Ion(**{name: float(values[('normn' if name == 'n' else name) + 'i'][ii, 0])
+                            for name in Ion.in_args + Electron.in_args})
+                     for ii in range(int(values['nions'][0]))])
+    kwargs = {name: float(values[name][0]) for name in QuaLiKizXpoint.Geometry.in_args}
+    kwargs.update({name: float(values[name][0]) for name in QuaLiKizXpoint.Meta.in_args})
+    kwargs.update({name: False for name, default in QuaLiKizXpoint.Options.in_args.items()
+                   if isinstance(default, bool)})
+    xpoint = QuaLiKizXpoint(values['kthetarhos'].tolist(), elec, ions, **kwargs)
+    scan_dict = OrderedDict((name, np.array(value)) for name, value in scan_dict.items())
+    return QuaLiKizPlan(scan_dict, 'parallel', xpoint)
+
+def to_input_json(ds, inputdir='input'):
+    """ Create the input binaries from dataset
+
+    Deprecated, use dataset_to_input to write the binaries, or
+    dataset_to_plan for a QuaLiKizPlan of the dataset.
+
+    Args:
+        ds:       Dataset to get the input from
+
+    Kwargs:
+        inputdir: Folder to write the binaries to
+
+    Returns:
+        Amount of points written
+    """
+    warn('to_input_json is deprecated, use dataset_to_input for the input '
+         'binaries or dataset_to_plan for a QuaLiKizPlan', DeprecationWarning,
+         stacklevel=2)
+    return dataset_to_input(ds, inputdir=inputdir)
 
 def xarray_to_pandas(ds):
     """ Convert xarray.DataSet to dict of pd.DataFrame
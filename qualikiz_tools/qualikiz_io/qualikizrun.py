@@ -4,22 +4,33 @@ Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
 License: CeCILL v2.1
 """
 import os
+import array
 import warnings
 from warnings import warn
 import shutil
+import sqlite3
 import multiprocessing as mp
 from logging import info
 from functools import partial
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
 
 import xarray as xr
 
 from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.legacy import version_table
+from qualikiz_tools.qualikiz_io.dir_index import DirIndex, index_enabled
+from qualikiz_tools.qualikiz_io.campaign import record_state
+from qualikiz_tools.qualikiz_io.instrumentation import stage
+from qualikiz_tools.qualikiz_io.walltime_model import load_model as load_walltime_model
+from qualikiz_tools.qualikiz_io.scaling import load_model as load_scaling_model
 from qualikiz_tools.qualikiz_io.outputfiles import (convert_debug, convert_output,
                                        convert_primitive, squeeze_dataset,
                                        orthogonalize_dataset, determine_sizes,
                                        merge_many_lazy_snakes, merge_many_orthogonal,
-                                       add_dims)
+                                       add_dims, output_file_names)
 from qualikiz_tools.qualikiz_io.outputfiles import (merge_orthogonal, sort_dims)
+from qualikiz_tools.qualikiz_io.outputfiles import suffix as output_suffix
 from qualikiz_tools import netcdf4_engine, HAS_NETCDF4, ModuleNotFoundError
 from . import __path__ as ROOT
 ROOT = ROOT[0]
@@ -35,6 +46,20 @@ class PathException(Exception):
         super().__init__(message)
 
 
+class InputGenerationError(Exception):
+    """ Exception thrown when generating the input of one or more runs failed
+
+    Attributes:
+        errors: Dictionary with the original exception per run directory
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        message = 'Generating input failed for {:d} run(s):\n'.format(len(errors))
+        message += '\n'.join('{!s}: {!r}'.format(rundir, error)
+                              for rundir, error in errors.items())
+        super().__init__(message)
+
+
 class QuaLiKizRun:
     """ Defines everything needed for a single run of QuaLiKiz
 
@@ -122,24 +147,27 @@ class QuaLiKizRun:
 
         rundir = self.rundir
 
-        create_folder_prompt(rundir, overwrite=overwrite)
-
-        self._create_output_folders(rundir)
-        os.makedirs(os.path.join(rundir, self.inputdir), exist_ok=True)
-        # Check if the binary we are trying to link to exists
-        absbindir = os.path.join(rundir, self.binaryrelpath)
-        if not os.path.exists(absbindir):
-            warn('Warning! Binary at ' + absbindir + ' does not ' +
-                 'exist! Run will fail!')
-        # Create link to binary
-        binarybasepath = os.path.basename(self.binaryrelpath)
-        try:
-            os.symlink(self.binaryrelpath,
-                       os.path.join(rundir, binarybasepath))
-        except FileExistsError:
-            pass
-        # Create a parameters file
-        self.qualikiz_plan.to_json(os.path.join(rundir, self.parameterspath))
+        with stage('prepare', run=rundir):
+            created = create_folder_prompt(rundir, overwrite=overwrite)
+
+            self._create_output_folders(rundir)
+            os.makedirs(os.path.join(rundir, self.inputdir), exist_ok=True)
+            # Check if the binary we are trying to link to exists
+            absbindir = os.path.join(rundir, self.binaryrelpath)
+            if not os.path.exists(absbindir):
+                warn('Warning! Binary at ' + absbindir + ' does not ' +
+                     'exist! Run will fail!')
+            # Create link to binary
+            binarybasepath = os.path.basename(self.binaryrelpath)
+            try:
+                os.symlink(self.binaryrelpath,
+                           os.path.join(rundir, binarybasepath))
+            except FileExistsError:
+                pass
+            # Create a parameters file
+            self.qualikiz_plan.to_json(os.path.join(rundir, self.parameterspath))
+            # A recreated run starts its lifecycle over
+            record_state([rundir], 'prepared', regress=created)
 
     def _create_output_folders(self, path):
         """ Create the output folders """
@@ -147,27 +175,84 @@ class QuaLiKizRun:
         os.makedirs(os.path.join(path, self.primitivedir), exist_ok=True)
         os.makedirs(os.path.join(path, self.debugdir), exist_ok=True)
 
-    def generate_input(self, dotprint=False, conversion=None):
+    def generate_input(self, dotprint=False, conversion=None,
+                       processes=1, chunksize=None, executor=None,
+                       version='current'):
         """ Generate the input binaries for a QuaLiKiz run
 
         Kwargs:
             dotprint:   Print a dot after each generation. Used for debugging.
             conversion: Function will be called as conversion(input_dir). Can
                         be used to convert input files to older version.
+                        Prefer version for the versions in legacy.versions
+            processes:  Amount of processes used to generate. Defaults to 1.
+                        Set this to 'max' to autodetect. See
+                        generate_input_parallel
+            chunksize:  Amount of points generated per task when generating
+                        in parallel
+            executor:   concurrent.futures executor to generate with. Created
+                        from processes by default
+            version:    QuaLiKiz version to write the input binaries for.
+                        The binaries are written with the names of that
+                        version directly. See legacy.version_table
         """
+        if processes != 1 or executor is not None:
+            generate_input_parallel([self], processes=processes,
+                                    chunksize=chunksize, executor=executor,
+                                    conversion=conversion, progress=dotprint,
+                                    version=version)
+            return
+
         parameterspath = os.path.join(self.rundir, self.parameterspath)
 
-        plan = QuaLiKizPlan.from_json(parameterspath)
-        input_binaries = plan.setup()
+        with stage('generate_input', run=self.rundir):
+            plan = QuaLiKizPlan.from_json(parameterspath)
+            rename, constants = version_table(input_binaries_names(), version)
+            input_binaries = plan.setup()
+            inputdir = os.path.join(self.rundir, self.inputdir)
+
+            if dotprint:
+                print('.', end='', flush=True)
+            with stage('write_input'):
+                os.makedirs(inputdir, exist_ok=True)
+                for name, value in input_binaries.items():
+                    if name in rename:
+                        with open(os.path.join(inputdir, rename[name] + '.bin'), 'wb') as file_:
+                            value.tofile(file_)
+                self._finish_input(conversion=conversion, constants=constants)
+            record_state([self.rundir], 'input_generated', regress=True)
+
+    def _allocate_input(self, plan, version='current'):
+        """ Create the input binaries that scale with dimx at their full size
+
+        Used when the input is generated in slices, see generate_input_slice.
+        """
         inputdir = os.path.join(self.rundir, self.inputdir)
-
-        if dotprint:
-            print('.', end='', flush=True)
         os.makedirs(inputdir, exist_ok=True)
-        for name, value in input_binaries.items():
-            with open(os.path.join(inputdir, name + '.bin'), 'wb') as file_:
-                value.tofile(file_)
+        dimx = plan.calculate_dimx()
+        nions = len(plan['xpoint_base']['ions'])
+        rename, __ = version_table(input_binaries_names(), version)
+        point_names, ion_names = QuaLiKizPlan.binary_names()
+        for names, size in [(point_names, dimx), (ion_names, nions * dimx)]:
+            for name in names:
+                if name in rename:
+                    with open(os.path.join(inputdir, rename[name] + '.bin'), 'wb') as file_:
+                        file_.truncate(size * input_itemsize)
+
+    def _remove_input(self):
+        """ Remove all input binaries """
+        inputdir = os.path.join(self.rundir, self.inputdir)
+        if os.path.isdir(inputdir):
+            self._clean_suffix(inputdir, '.bin')
 
+    def _finish_input(self, conversion=None, constants=None):
+        """ Write the constants of the version, convert the input binaries
+        and write the labels """
+        inputdir = os.path.join(self.rundir, self.inputdir)
+        if constants is not None:
+            for name, value in constants.items():
+                with open(os.path.join(inputdir, name + '.bin'), 'wb') as file_:
+                    array.array('d', [value]).tofile(file_)
         if conversion is not None:
             conversion(inputdir)
 
@@ -194,37 +279,85 @@ class QuaLiKizRun:
             exist = False
         return exist
 
-    def estimate_walltime(self, cores):
+    def estimate_walltime(self, cores, model=None):
         """ Estimate the walltime needed to run
         This directely depends on the CPU time needed and cores needed to run.
-        Currently uses worst-case estimate.
+        Uses the fitted walltime model if available, see walltime_model,
+        or else the fitted scaling model, see scaling. Otherwise uses a
+        worst-case estimate.
 
         Args:
             cores: The amount of physical cores to use
 
+        Kwargs:
+            model: The WalltimeModel or ScalingModel to use. By default the
+                   model configured with the QUALIKIZ_WALLTIME_MODEL or
+                   QUALIKIZ_SCALING_MODEL environment variable
+
         Returns:
             Estimated walltime in seconds
         """
+        if model is None:
+            model = load_walltime_model()
+        if model is None:
+            model = load_scaling_model()
+        if model is not None:
+            return model.predict_walltime(self.qualikiz_plan, cores)
         cputime = self.estimate_cputime(cores)
         return cputime / cores
 
-    def estimate_cputime(self, cores):
+    def estimate_cputime(self, cores, model=None):
         """ Estimate the cpu time needed to run
-        Currently just uses a worst-case assumtion. In reality cpus_per_dimxn
+        Uses the fitted walltime model if available, see estimate_walltime.
+        Otherwise just uses a worst-case assumtion. In reality cpus_per_dimxn
         should depend on the dimxn per core. It also depends on the amount of
         stable points in the run, which is not known a-priori.
 
         Args:
             cores: The amount of physical cores to use
 
+        Kwargs:
+            model: The WalltimeModel or ScalingModel to use
+
         Returns:
             Estimated cputime in seconds
         """
+        if model is None:
+            model = load_walltime_model()
+        if model is None:
+            model = load_scaling_model()
+        if model is not None:
+            return model.predict_walltime(self.qualikiz_plan, cores) * cores
         dimxn = self.qualikiz_plan.calculate_dimxn()
         rot_on = self.qualikiz_plan['xpoint_base']['rot_flag']
         cpus_per_dimxn = 0.8 * (1 + rot_on * 4)
         return dimxn * cpus_per_dimxn
 
+    def recommend_cores(self, max_walltime, candidates, model=None):
+        """ Recommend the amount of cores to run with
+        The amount of cores that runs within max_walltime at the least
+        CPU time according to the scaling model, see scaling. Pass the
+        result to calculate_tasks.
+
+        Args:
+            max_walltime: Walltime target in seconds
+            candidates:   Amounts of physical cores to choose from
+
+        Kwargs:
+            model: The ScalingModel to use. By default the model configured
+                   with the QUALIKIZ_SCALING_MODEL environment variable
+
+        Returns:
+            The recommended amount of cores
+        """
+        if model is None:
+            model = load_scaling_model()
+        if model is None:
+            raise Exception('No scaling model configured, set ' +
+                            'QUALIKIZ_SCALING_MODEL or pass a model')
+        return model.recommend_cores(self.qualikiz_plan.calculate_dimxn(),
+                                     max_walltime, candidates)
+
     def calculate_tasks(self, cores, HT=False, threads_per_core=2):
         """ Calulate the amount of MPI tasks needed based on the cores used
 
@@ -351,6 +484,37 @@ class QuaLiKizRun:
         last_output = os.path.join(self.rundir, 'output/vfi_GB.dat')
         return os.path.isfile(last_output)
 
+    def is_complete(self):
+        """ Check if the run has written all its output
+        Stronger than is_done: every output file expected from the
+        phys_meth and separateflux flags of the plan should exist and
+        be non-empty.
+
+        Returns:
+            True if all output is there
+        """
+        sizes = self.output_sizes()
+        return sizes is not None and all(size > 0 for size in sizes.values())
+
+    def output_sizes(self):
+        """ Sizes of the output files expected from the plan
+
+        Returns:
+            OrderedDict of output name: size in bytes, or None if any of
+            the expected files does not exist
+        """
+        xpoint_base = self.qualikiz_plan['xpoint_base']
+        names = output_file_names(phys_meth=xpoint_base['phys_meth'],
+                                  separateflux=xpoint_base['separateflux'])
+        outputdir = os.path.join(self.rundir, self.outputdir)
+        sizes = OrderedDict()
+        for name in names:
+            try:
+                sizes[name] = os.path.getsize(os.path.join(outputdir, name + output_suffix))
+            except OSError:
+                return None
+        return sizes
+
 
 class QuaLiKizBatch():
     """ A collection of QuaLiKiz Runs
@@ -363,6 +527,8 @@ class QuaLiKizBatch():
         batchinfofile:  The default name of batchinfo file. Used to store
                         batch metadata
         scriptname:     The default name of the sbatch scipt file.
+        resume_scriptname: The name of the script with only the incomplete
+                        runs, written when resuming the batch
         default_stdout: Default name to write STDOUT to
         default_stderr: Default name to write STDERR to
         run_class:      The class of the underlying QuaLiKiz run
@@ -370,6 +536,7 @@ class QuaLiKizBatch():
 
     batchinfofile = 'batchinfo.json'
     scriptname = 'qualikiz.batch'
+    resume_scriptname = 'qualikiz_resume.batch'
 
     default_stderr = 'stderr.batch'
     default_stdout = 'stdout.batch'
@@ -434,35 +601,40 @@ class QuaLiKizBatch():
         for run in self.runlist:
             run.prepare(overwrite=overwrite_runs)
 
-    def generate_input(self, dotprint=False, processes=1, conversion=None):
+    def generate_input(self, dotprint=False, processes=1, conversion=None,
+                       chunksize=None, executor=None, version='current'):
         """ Generate the input files for all runs
 
         Keyword arguments:
             dotprint:   Print a dot after each generation. Used for debugging.
+                        Prints the progress when generating in parallel.
             processes:  Amount of processes used to generate. Defaults to 1.
                         Set this to 'max' to autodetect.
             conversion: Function will be called as conversion(input_dir). Can
                         be used to convert input files to older version.
+            chunksize:  Amount of points generated per task when generating
+                        in parallel. See generate_input_parallel
+            executor:   concurrent.futures executor to generate with. Created
+                        from processes by default
+            version:    QuaLiKiz version to write the input binaries for.
+                        See QuaLiKizRun.generate_input
         """
-        if processes == 1:
+        if processes == 1 and executor is None:
             for run in self.runlist:
-                run.generate_input(dotprint=dotprint, conversion=conversion)
+                run.generate_input(dotprint=dotprint, conversion=conversion,
+                                   version=version)
         else:
-            if processes == 'max':
-                tasks = min((mp.cpu_count(), len(self.runlist)))
-            else:
-                tasks = processes
-
-            pool = mp.Pool(processes=tasks)
-            pool.map(partial(QuaLiKizRun.generate_input, dotprint=dotprint, conversion=conversion),
-                     self.runlist)
+            generate_input_parallel(self.runlist, processes=processes,
+                                    chunksize=chunksize, executor=executor,
+                                    conversion=conversion, progress=dotprint,
+                                    version=version)
 
     def inputbinaries_exist(self):
         return all([run.inputbinaries_exist() for run in self.runlist])
 
 
     @classmethod
-    def from_dir_recursive(cls, searchdir):
+    def from_dir_recursive(cls, searchdir, use_index=None, index_path=None):
         """ Reconstruct batch from directory tree
         Walks from the given path until it finds a file named
         QuaLiKizBatch.scriptname, and tries to reconstruct the
@@ -471,10 +643,31 @@ class QuaLiKizBatch():
         Args:
             searchdir: The path to search
 
+        Kwargs:
+            use_index:  Find the batches and runs with the persistent
+                        DirIndex, which only rescans the directories that
+                        changed since the last search. Falls back to
+                        os.walk if the index cannot be opened. By default
+                        only if QUALIKIZ_DIR_INDEX is set
+            index_path: Path of the index. See dir_index.default_index_path
+
         Returns:
             batchlist: A list of batches found
         """
         batchlist = []
+        if use_index is None:
+            use_index = index_enabled()
+        if use_index:
+            try:
+                with DirIndex(index_path, batch_file=QuaLiKizBatch.scriptname,
+                              run_file=cls.run_class.parameterspath) as index:
+                    batches = index.batches(searchdir)
+            except (OSError, sqlite3.Error) as ee:
+                warn('Could not use directory index: {!s}. Falling back to os.walk'.format(ee))
+            else:
+                for batchdir, rundirs in batches.items():
+                    batchlist.append(QuaLiKizBatch.from_subdirs(batchdir, rundirs=rundirs))
+                return batchlist
         for (dirpath, __, filenames) in os.walk(searchdir):
             if QuaLiKizBatch.scriptname in filenames:
                 batchlist.append(QuaLiKizBatch.from_subdirs(dirpath))
@@ -502,7 +695,8 @@ class QuaLiKizBatch():
         return cls.from_subdirs(dir, *args, **kwargs)
 
     @classmethod
-    def from_subdirs(cls, batchdir, *args, scriptname=None, verbose=False, run_kwargs=None, batch_kwargs=None):
+    def from_subdirs(cls, batchdir, *args, scriptname=None, verbose=False, run_kwargs=None, batch_kwargs=None,
+                     rundirs=None):
         """ Reconstruct batch from a directory
         This function assumes that the name of the batch can be
         determined by the given batchdir. If the batch was created
@@ -514,6 +708,8 @@ class QuaLiKizBatch():
 
         Kwargs:
             scriptname: name of the script to search for. Defaults to qualikiz.batch.
+            rundirs:    The run directories of the batch, if already known.
+                        See runlist_from_subdirs
 
         Returns:
             qualikizbatch: The reconstructed batch
@@ -545,13 +741,31 @@ class QuaLiKizBatch():
             elif isinstance(ee, NotImplementedError):
                 warn_msg = 'from_batch_file not implemented for {!s}'.format(cls)
             warn(warn_msg + ', falling back to subdirs')
-            runlist = cls.runlist_from_subdirs(batchdir, **run_kwargs)
+            runlist = cls.runlist_from_subdirs(batchdir, rundirs=rundirs, **run_kwargs)
             batch = cls(parent_dir, name, runlist)
 
         return batch
 
     @classmethod
-    def runlist_from_subdirs(cls, batchdir, verbose=False, **kwargs):
+    def runlist_from_subdirs(cls, batchdir, rundirs=None, verbose=False, **kwargs):
+        """ Reconstruct the runs of a batch from its directory
+
+        Args:
+            batchdir: The top directory of the batch
+
+        Kwargs:
+            rundirs:  The run directories, for example found by DirIndex.
+                      By default the batch directory itself and all its
+                      subdirectories are tried
+
+        Returns:
+            runlist:  The reconstructed runs
+        """
+        if rundirs is not None:
+            runlist = [cls.run_class.from_dir(rundir, **kwargs) for rundir in rundirs]
+            if len(runlist) == 0:
+                raise OSError('Could not reconstruct runlist from subdirs')
+            return runlist
         runlist = []
         # Try to find the contained runs, they are usually in one of the children
         try:
@@ -631,31 +845,34 @@ class QuaLiKizBatch():
         # we're missing and glue the datasets together
         if mode in ['glue_orthogonal', 'glue_snake']:
             if len(self.runlist) > 1:
-                dss = []
-                for run in self.runlist:
-                    name = os.path.basename(run.rundir)
-                    netcdf_path = os.path.join(run.rundir, name + '.nc')
-                    ds = xr.open_dataset(netcdf_path, engine=netcdf4_engine)
-                    if gluedim is not None:
-                        if gluedim in ds.attrs:
-                            ds.coords[gluedim] = ds.attrs[gluedim]
-                        ds = add_dims(ds, [gluedim])
-                    dss.append(ds)
-
-                if mode == 'glue_orthogonal':
-                    newds = merge_many_orthogonal(dss)
-                elif mode == 'glue_snake':
-                    if not overwrite_new_netcdf_path:
-                        raise Exception('Cannot use mode {!s} without overwriting {!s}'.format(mode, new_netcdf_path))
-                    newds = merge_many_lazy_snakes(new_netcdf_path, dss, verbose=verbose)
-
-                if overwrite_new_netcdf_path:
-                    newds.to_netcdf(new_netcdf_path,
-                                    engine=netcdf4_engine,
-                                    format='NETCDF4'
-                                    )
-                else:
-                    warn('User does not want to overwrite {!s}. Not dumping to disk!'.format(new_netcdf_path))
+                batchdir = os.path.join(self.parent_dir, self.name)
+                with stage('glue', run=batchdir):
+                    dss = []
+                    for run in self.runlist:
+                        name = os.path.basename(run.rundir)
+                        netcdf_path = os.path.join(run.rundir, name + '.nc')
+                        ds = xr.open_dataset(netcdf_path, engine=netcdf4_engine)
+                        if gluedim is not None:
+                            if gluedim in ds.attrs:
+                                ds.coords[gluedim] = ds.attrs[gluedim]
+                            ds = add_dims(ds, [gluedim])
+                        dss.append(ds)
+
+                    if mode == 'glue_orthogonal':
+                        newds = merge_many_orthogonal(dss)
+                    elif mode == 'glue_snake':
+                        if not overwrite_new_netcdf_path:
+                            raise Exception('Cannot use mode {!s} without overwriting {!s}'.format(mode, new_netcdf_path))
+                        newds = merge_many_lazy_snakes(new_netcdf_path, dss, verbose=verbose)
+
+                    if overwrite_new_netcdf_path:
+                        with stage('write_netcdf'):
+                            newds.to_netcdf(new_netcdf_path,
+                                            engine=netcdf4_engine,
+                                            format='NETCDF4'
+                                            )
+                    else:
+                        warn('User does not want to overwrite {!s}. Not dumping to disk!'.format(new_netcdf_path))
                 if clean and newds is not None:
                     for run in self.runlist:
                         name = os.path.basename(run.rundir)
@@ -674,6 +891,8 @@ class QuaLiKizBatch():
         else:
             raise NotImplementedError('Mode ' + mode)
 
+        if mode in ['glue_orthogonal', 'glue_snake'] and len(self.runlist) > 1:
+            record_state([run.rundir for run in self.runlist], 'glued')
         return newds
 
     def clean(self):
@@ -699,6 +918,15 @@ class QuaLiKizBatch():
             done &= run.is_done()
         return done
 
+    def incomplete_runs(self):
+        """ Get the runs that did not write all their output
+        See QuaLiKizRun.is_complete. Used to resume a batch.
+
+        Returns:
+            List of incomplete runs
+        """
+        return [run for run in self.runlist if not run.is_complete()]
+
     def __eq__(self, other):
         if isinstance(other, self.__class__):
             attrs = self.__dict__.copy()
@@ -765,9 +993,176 @@ def create_folder_prompt(path, overwrite=None):
     Kwargs:
         overwrite: If None, prompt user. If True, overwrite and if False,
                    throw Exception. None by default
+
+    Returns:
+        True if the folder was (re)created
     """
     if overwrite_prompt(path, overwrite=overwrite):
         os.makedirs(path)
+        return True
+    return False
+
+input_itemsize = 8  # Input binaries are float64
+_plan_cache = {}
+
+def input_binaries_names():
+    """ Get the names of all input binaries written by QuaLiKizPlan.setup """
+    point_names, ion_names = QuaLiKizPlan.binary_names()
+    return point_names + ion_names + QuaLiKizPlan.constant_names()
+
+def _load_plan_cached(parameterspath):
+    """ Load a QuaLiKizPlan from json, only once per process """
+    mtime = os.path.getmtime(parameterspath)
+    if parameterspath not in _plan_cache or _plan_cache[parameterspath][0] != mtime:
+        _plan_cache[parameterspath] = (mtime, QuaLiKizPlan.from_json(parameterspath))
+    return _plan_cache[parameterspath][1]
+
+def generate_input_slice(rundir, start, stop, version='current'):
+    """ Generate the input binaries of a part of a run
+
+    Writes the values of the points in range(start, stop) at their offset
+    in the input binaries. The binaries that scale with dimx should
+    already exist at their full size. The constant binaries are written
+    by the slice starting at 0.
+
+    Args:
+        rundir:  Directory of the run
+        start:   Index of the first point
+        stop:    Index after the last point
+
+    Kwargs:
+        version: QuaLiKiz version to write the input binaries for
+
+    Returns:
+        Amount of points generated
+    """
+    plan = _load_plan_cached(os.path.join(rundir, QuaLiKizRun.parameterspath))
+    dimx = plan.calculate_dimx()
+    num_points = stop - start
+    point_names, ion_names = QuaLiKizPlan.binary_names()
+    rename, __ = version_table(input_binaries_names(), version)
+    input_binaries = plan.setup_slice(start, stop)
+    inputdir = os.path.join(rundir, QuaLiKizRun.inputdir)
+    for name, value in input_binaries.items():
+        if name not in rename:
+            continue
+        path = os.path.join(inputdir, rename[name] + '.bin')
+        if name in point_names:
+            with open(path, 'r+b') as file_:
+                file_.seek(start * input_itemsize)
+                value.tofile(file_)
+        elif name in ion_names:
+            # Ion binaries are in C ordering, one block of dimx per ion
+            with open(path, 'r+b') as file_:
+                for ion in range(len(value) // num_points):
+                    file_.seek((ion * dimx + start) * input_itemsize)
+                    value[ion * num_points:(ion + 1) * num_points].tofile(file_)
+        elif start == 0:
+            with open(path, 'wb') as file_:
+                value.tofile(file_)
+    return num_points
+
+def _finished_future(function, *args, **kwargs):
+    """ Call function directly, wrapped in a finished Future """
+    future = Future()
+    try:
+        future.set_result(function(*args, **kwargs))
+    except Exception as ee:
+        future.set_exception(ee)
+    return future
+
+def generate_input_parallel(runlist, processes='max', chunksize=None,
+                            executor=None, conversion=None, progress=False,
+                            version='current'):
+    """ Generate the input binaries of QuaLiKizRuns in parallel
+
+    Every run is split in slices of chunksize points, so a single large
+    run is generated in parallel too. Every slice writes directly to its
+    offset in the input binaries. Errors are collected per run; the
+    input binaries of failed runs are removed.
+
+    Args:
+        runlist:    List of prepared QuaLiKizRuns
+
+    Kwargs:
+        processes:  Amount of processes to use if no executor is given.
+                    'max' or None to use all cores, 1 to generate serially
+                    in this process
+        chunksize:  Amount of points per task. By default every worker
+                    gets about four tasks
+        executor:   concurrent.futures executor to submit the slices to.
+                    Is not shut down, so it can be reused. By default a
+                    ProcessPoolExecutor is created and shut down afterwards
+        conversion: Function will be called as conversion(input_dir) for
+                    every run. Can be used to convert input files to older
+                    version
+        progress:   Print the amount of generated points
+        version:    QuaLiKiz version to write the input binaries for. See
+                    QuaLiKizRun.generate_input
+    """
+    if processes in ['max', None]:
+        processes = mp.cpu_count()
+    if executor is None and processes != 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return generate_input_parallel(runlist, processes=processes,
+                                           chunksize=chunksize,
+                                           executor=executor,
+                                           conversion=conversion,
+                                           progress=progress,
+                                           version=version)
+
+    __, constants = version_table(input_binaries_names(), version)
+    dimxs = []
+    for run in runlist:
+        with stage('allocate_input', run=run.rundir):
+            plan = QuaLiKizPlan.from_json(os.path.join(run.rundir, run.parameterspath))
+            run._allocate_input(plan, version=version)
+            dimxs.append(plan.calculate_dimx())
+    total = sum(dimxs)
+    if chunksize is None:
+        chunksize = max(1, -(-total // (4 * processes)))
+
+    # The stages in the worker processes are lost, so time the pool as a whole
+    with stage('generate_input_parallel'):
+        if executor is None:
+            # Serially, in this process. Every slice is done when yielded
+            results = ((run, _finished_future(generate_input_slice, run.rundir,
+                                              start, min(start + chunksize, dimx),
+                                              version=version))
+                       for run, dimx in zip(runlist, dimxs)
+                       for start in range(0, dimx, chunksize))
+        else:
+            futures = {}
+            for run, dimx in zip(runlist, dimxs):
+                for start in range(0, dimx, chunksize):
+                    future = executor.submit(generate_input_slice, run.rundir,
+                                             start, min(start + chunksize, dimx),
+                                             version=version)
+                    futures[future] = run
+            results = ((futures[future], future) for future in as_completed(futures))
+
+        errors = OrderedDict()
+        generated = 0
+        for run, future in results:
+            try:
+                generated += future.result()
+            except Exception as ee:
+                errors.setdefault(run.rundir, ee)
+            if progress:
+                print('\rGenerated {:d}/{:d} points'.format(generated, total),
+                      end='', flush=True)
+        if progress:
+            print()
+
+    for run in runlist:
+        if run.rundir in errors:
+            run._remove_input()
+        else:
+            run._finish_input(conversion=conversion, constants=constants)
+    record_state([run.rundir for run in runlist if run.rundir not in errors],
+                 'input_generated', regress=True)
+    if len(errors) != 0:
+        raise InputGenerationError(errors)
 
 def run_to_netcdf(path, runmode='dimx', overwrite=None,
                   genfromtxt=False, keepfile=True, encode=None,
@@ -797,41 +1192,44 @@ def run_to_netcdf(path, runmode='dimx', overwrite=None,
 
     name = os.path.basename(path)
     netcdf_path = os.path.join(path, name + '.nc')
-    if overwrite_prompt(netcdf_path, overwrite=overwrite):
-        sizes = determine_sizes(path, keepfile=keepfile)
-        ds = convert_debug(sizes, path, genfromtxt=genfromtxt, keepfile=keepfile)
-        ds = convert_output(ds, sizes, path, genfromtxt=genfromtxt, keepfile=keepfile)
-        ds = convert_primitive(ds, sizes, path, genfromtxt=genfromtxt, keepfile=keepfile)
-        llp = os.path.join(path, QuaLiKizRun.labellistpath)
-        if os.path.isfile(llp):
-            with open(llp) as f:
-                labellist = [line.strip() for line in f]
-            ds.coords['labels'] = xr.DataArray(labellist, dims=('dimx'))
-        if runmode == 'orthogonal':
-            ds = squeeze_dataset(ds, extra_squeeze=extra_squeeze, Te_var=Te_var)
-            ds = orthogonalize_dataset(ds)
-        elif runmode == 'dimx':
-            pass
+    with stage('run_to_netcdf', run=path):
+        if overwrite_prompt(netcdf_path, overwrite=overwrite):
+            sizes = determine_sizes(path, keepfile=keepfile)
+            ds = convert_debug(sizes, path, genfromtxt=genfromtxt, keepfile=keepfile)
+            ds = convert_output(ds, sizes, path, genfromtxt=genfromtxt, keepfile=keepfile)
+            ds = convert_primitive(ds, sizes, path, genfromtxt=genfromtxt, keepfile=keepfile)
+            llp = os.path.join(path, QuaLiKizRun.labellistpath)
+            if os.path.isfile(llp):
+                with open(llp) as f:
+                    labellist = [line.strip() for line in f]
+                ds.coords['labels'] = xr.DataArray(labellist, dims=('dimx'))
+            if runmode == 'orthogonal':
+                ds = squeeze_dataset(ds, extra_squeeze=extra_squeeze, Te_var=Te_var)
+                ds = orthogonalize_dataset(ds)
+            elif runmode == 'dimx':
+                pass
+            else:
+                raise NotImplementedError('Runmode {!s} not implemented'.format(runmode))
+
+            encoding = {}
+            # Encode all variables
+            for name, __ in ds.items():
+                encoding[name] = {}
+                for enc_name, enc in encode.items():
+                    encoding[name][enc_name] = enc
+            ds = sort_dims(ds)
+            with stage('write_netcdf'):
+                try:
+                    ds.to_netcdf(netcdf_path, engine='netcdf4',
+                                 format='NETCDF4', encoding=encoding)
+                except ModuleNotFoundError:
+                    warn('netCDF4 module not found! Please install by \'pip install ' +
+                         'netcdf4\'. Falling back to netCDF3')
+                    ds.to_netcdf(netcdf_path, encoding=encoding)
+            record_state([path], 'netcdf')
         else:
-            raise NotImplementedError('Runmode {!s} not implemented'.format(runmode))
-
-        encoding = {}
-        # Encode all variables
-        for name, __ in ds.items():
-            encoding[name] = {}
-            for enc_name, enc in encode.items():
-                encoding[name][enc_name] = enc
-        ds = sort_dims(ds)
-        try:
-            ds.to_netcdf(netcdf_path, engine='netcdf4',
-                         format='NETCDF4', encoding=encoding)
-        except ModuleNotFoundError:
-            warn('netCDF4 module not found! Please install by \'pip install ' +
-                 'netcdf4\'. Falling back to netCDF3')
-            ds.to_netcdf(netcdf_path, encoding=encoding)
-    else:
-        ds = xr.open_dataset(netcdf_path)
-    return ds
+            ds = xr.open_dataset(netcdf_path)
+        return ds
 
 def qlk_from_dir(dir, batch_class=QuaLiKizBatch, run_class=None, verbose=False, prioritize_batch=True, **kwargs):
     kwargs['verbose'] = verbose
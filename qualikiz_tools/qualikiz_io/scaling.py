@@ -0,0 +1,323 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Strong and weak scaling analysis of QuaLiKiz, fitted on the stdout table
+of a polling database (see 'qualikiz_tools poll basic').
+
+Every timing component of the QuaLiKiz profiling output is fitted with
+
+    t(N, p) = constant + serial * N + parallel * N / p + communication * log2(p)
+
+with N the amount of dimxn points and p the amount of cores. For a fixed
+N this is Amdahl's law with an extra communication term, for a fixed N
+per core it is Gustafson's. The coefficients are fitted non-negative, so
+the model extrapolates sensibly. The part of the Total not covered by
+the components is fitted as the 'Other' component.
+
+The fitted model can recommend the amount of cores that runs a dimxn
+within a walltime target at the least CPU time. Set the environment
+variable QUALIKIZ_SCALING_MODEL to the path of a model stored with
+ScalingModel.to_json to use it when creating runs and batches.
+"""
+import os
+import json
+import sqlite3
+from collections import OrderedDict
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import nnls
+
+from qualikiz_tools.qualikiz_io.walltime_model import default_quantile
+
+model_env_var = 'QUALIKIZ_SCALING_MODEL'
+# Timing components of the stdout table, see basicpoll.create_stdout_database
+components = ['First_MPI_AllReduce', 'Eigenmodes', 'Saturation',
+              'Second_MPI_AllReduce', 'Initialization', 'Output']
+terms = ['constant', 'serial', 'parallel', 'communication']
+
+
+def term_values(dimxn, cores):
+    """ Values of the terms of the scaling model
+
+    Args:
+        dimxn: Amount of dimxn points
+        cores: Amount of cores
+
+    Returns:
+        Array with the terms on the last axis
+    """
+    dimxn, cores = np.broadcast_arrays(np.asarray(dimxn, dtype='float64'),
+                                       np.asarray(cores, dtype='float64'))
+    return np.stack([np.ones_like(dimxn), dimxn, dimxn / cores, np.log2(cores)],
+                    axis=-1)
+
+def read_profiling(database_path):
+    """ Read the profiling of the runs in a polling database
+
+    Args:
+        database_path: Path of the database with the stdout table
+
+    Returns:
+        DataFrame with a row per run and the cores, dimx, dimn, dimxn, the
+        time per component and the Total in seconds
+    """
+    if not os.path.isfile(database_path):
+        raise Exception('Database ' + database_path + ' does not exist')
+    db = sqlite3.connect(database_path)
+    try:
+        table = pd.read_sql_query(
+            'SELECT Jobnumber, Runnumber, Numcores, Dimx, Dimn, {!s}, Total '
+            'FROM stdout'.format(', '.join(components)), db)
+    finally:
+        db.close()
+    table = table.rename(columns={'Jobnumber': 'jobnumber', 'Runnumber': 'runnumber',
+                                  'Numcores': 'cores', 'Dimx': 'dimx', 'Dimn': 'dimn'})
+    table['dimxn'] = table['dimx'] * table['dimn']
+    for column in components + ['Total']:
+        table[column] = table[column] / 1000
+    parts = table[components].sum(axis=1)
+    insane = parts > 1.01 * table['Total']
+    for __, row in table[insane].iterrows():
+        warn('Job {:d} run {!s} is insane! Sum of QuaLiKiz parts time > total time'.format(
+            int(row['jobnumber']), row['runnumber']))
+    table['Other'] = (table['Total'] - parts).clip(lower=0)
+    return table
+
+
+class ScalingModel():
+    """ Amdahl/Gustafson model of the walltime per timing component
+
+    Attributes:
+        coefficients: OrderedDict with the coefficients of the terms per
+                      component, in seconds
+        sigma:        Standard deviation of the relative residuals of
+                      the predicted walltime
+        num_samples:  Amount of runs used to fit
+    """
+    def __init__(self, coefficients=None, sigma=0., num_samples=0):
+        if coefficients is not None:
+            coefficients = OrderedDict(coefficients)
+        self.coefficients = coefficients
+        self.sigma = sigma
+        self.num_samples = num_samples
+
+    @property
+    def components(self):
+        return list(self.coefficients)
+
+    def fit(self, table):
+        """ Fit the model
+
+        Args:
+            table: DataFrame with the cores, dimxn and the time in seconds
+                   per component, as returned by read_profiling
+
+        Returns:
+            The fitted ScalingModel
+        """
+        if len(table) <= len(terms):
+            warn('Fitting {:d} coefficients on {:d} runs, model is '
+                 'underdetermined'.format(len(terms), len(table)))
+        X = term_values(table['dimxn'].values, table['cores'].values)
+        # Scale the terms, they differ orders of magnitude
+        scale = np.abs(X).max(axis=0)
+        scale[scale == 0] = 1
+        self.coefficients = OrderedDict()
+        for component in components + ['Other']:
+            if component not in table:
+                continue
+            coefficients = nnls(X / scale, table[component].values.astype('float64'))[0]
+            self.coefficients[component] = (coefficients / scale).tolist()
+        measured = table[self.components].sum(axis=1).values
+        relative = self.walltime(table['dimxn'].values, table['cores'].values) / measured - 1
+        dof = max(len(table) - len(terms), 1)
+        self.sigma = float(np.sqrt(np.sum(relative ** 2) / dof))
+        self.num_samples = len(table)
+        return self
+
+    @classmethod
+    def from_database(cls, database_path):
+        """ Fit the model on the stdout table of a polling database """
+        return cls().fit(read_profiling(database_path))
+
+    def predict(self, dimxn, cores):
+        """ Predict the walltime per component
+
+        Args:
+            dimxn: Amount of dimxn points
+            cores: Amount of cores
+
+        Returns:
+            OrderedDict with the walltime in seconds per component
+        """
+        if self.coefficients is None:
+            raise Exception('Model has not been fitted')
+        X = term_values(dimxn, cores)
+        return OrderedDict((component, X.dot(coefficients))
+                           for component, coefficients in self.coefficients.items())
+
+    def walltime(self, dimxn, cores):
+        """ Predict the walltime in seconds, the sum of all components """
+        return np.sum(list(self.predict(dimxn, cores).values()), axis=0)
+
+    def serial_fraction(self, dimxn):
+        """ Amdahl serial fraction of the work of a dimxn per component
+
+        The constant and serial terms over the single core walltime,
+        without the communication, which is zero on a single core.
+
+        Returns:
+            OrderedDict with the fraction per component. NaN for
+            components that take no time, compared to the largest
+            component. The fit leaves rounding residue in those
+        """
+        sequentials = OrderedDict()
+        totals = OrderedDict()
+        for component, (constant, serial, parallel, __) in self.coefficients.items():
+            sequentials[component] = constant + serial * dimxn
+            totals[component] = sequentials[component] + parallel * dimxn
+        tolerance = 1e-9 * max(list(totals.values()) + [0])
+        fractions = OrderedDict()
+        for component, total in totals.items():
+            if total > tolerance:
+                fractions[component] = sequentials[component] / total
+            else:
+                fractions[component] = np.nan
+        return fractions
+
+    def recommend_cores(self, dimxn, max_walltime, candidates):
+        """ Amount of cores that runs a dimxn in time at the least CPU time
+
+        Args:
+            dimxn:        Amount of dimxn points
+            max_walltime: Walltime target in seconds
+            candidates:   Amounts of cores to choose from
+
+        Returns:
+            The recommended amount of cores. If no candidate meets the
+            target the fastest one, with a warning
+        """
+        candidates = np.asarray(candidates)
+        walltime = self.walltime(dimxn, candidates)
+        fits = walltime <= max_walltime
+        if not np.any(fits):
+            warn('No amount of cores runs {:d} dimxn within {:.0f}s, using the '
+                 'fastest'.format(int(dimxn), max_walltime))
+            return int(candidates[np.argmin(walltime)])
+        cputime = np.where(fits, walltime * candidates, np.inf)
+        return int(candidates[np.argmin(cputime)])
+
+    def predict_walltime(self, plan, cores, quantile=default_quantile):
+        """ Predict the walltime of a QuaLiKizPlan run on cores
+
+        Can be used instead of a WalltimeModel, see
+        QuaLiKizRun.estimate_walltime
+
+        Args:
+            plan:     The QuaLiKizPlan
+            cores:    The amount of cores used to run
+
+        Kwargs:
+            quantile: Amount of standard deviations of the fit residuals
+                      to add. Use 0 for the median prediction
+
+        Returns:
+            Predicted walltime in seconds
+        """
+        walltime = self.walltime(plan.calculate_dimxn(), cores)
+        return float(walltime * (1 + quantile * self.sigma))
+
+    def to_json(self, path):
+        """ Store the model as json """
+        with open(path, 'w') as file_:
+            json.dump(OrderedDict([('coefficients', self.coefficients),
+                                   ('sigma', self.sigma),
+                                   ('num_samples', self.num_samples)]),
+                      file_, indent=4)
+
+    @classmethod
+    def from_json(cls, path):
+        """ Load a model stored with to_json """
+        with open(path, 'r') as file_:
+            return cls(**json.load(file_, object_pairs_hook=OrderedDict))
+
+
+_model_cache = {}
+
+def load_model(path=None):
+    """ Load the scaling model if available
+
+    The model is only read again if its file changed, so it can be
+    loaded for every run.
+
+    Kwargs:
+        path: Path of the model. By default the path in the
+              QUALIKIZ_SCALING_MODEL environment variable. An empty path
+              disables the model
+
+    Returns:
+        The ScalingModel, or None if no model is configured
+    """
+    if path is None:
+        path = os.environ.get(model_env_var)
+    if not path:
+        return None
+    mtime = os.path.getmtime(path)
+    if path not in _model_cache or _model_cache[path][0] != mtime:
+        _model_cache[path] = (mtime, ScalingModel.from_json(path))
+    return _model_cache[path][1]
+
+def plot_scaling(table, model=None):
+    """ Plot the strong scaling per timing component
+
+    Plots the measured walltime per component against the amount of
+    cores, one marker per dimxn, and the parallel efficiency of the
+    Total relative to the smallest amount of cores of every dimxn.
+
+    Args:
+        table: DataFrame as returned by read_profiling
+
+    Kwargs:
+        model: ScalingModel to draw the fitted curves of
+
+    Returns:
+        The matplotlib Figure
+    """
+    import matplotlib.pyplot as plt
+    markers = ('o', 'v', 's', 'p', '*', 'h', 'H', 'D', 'd')
+    # color scheme from http://colorbrewer2.org/?type=qualitative&scheme=Set1&n=9
+    colors = ['#ff7f00', '#e41a1c', '#377eb8', '#ffff33', '#4daf4a', '#984ea3',
+              '#a65628', '#f781bf', '#999999']
+    fig, (ax_time, ax_eff) = plt.subplots(2, 1, figsize=(8, 10))
+    names = [name for name in components + ['Other'] if name in table]
+    means = table.groupby(['dimxn', 'cores'])[names + ['Total']].mean()
+    for marker, dimxn in zip(markers, means.index.levels[0]):
+        per_dimxn = means.loc[dimxn]
+        cores = per_dimxn.index.values
+        fine_cores = np.geomspace(cores.min(), cores.max(), 50)
+        if model is not None:
+            predicted = model.predict(dimxn, fine_cores)
+        for color, name in zip(colors, names):
+            ax_time.loglog(cores, per_dimxn[name], marker=marker, color=color,
+                           linestyle='')
+            if model is not None and name in predicted:
+                ax_time.loglog(fine_cores, predicted[name], color=color)
+        efficiency = (per_dimxn['Total'].iloc[0] * cores[0]) / (per_dimxn['Total'] * cores)
+        ax_eff.semilogx(cores, efficiency, marker=marker, color='k',
+                        label='dimxn = {:d}'.format(int(dimxn)))
+        if model is not None:
+            walltime = model.walltime(dimxn, fine_cores)
+            ax_eff.semilogx(fine_cores, walltime[0] * fine_cores[0] / (walltime * fine_cores),
+                            color='k', linestyle='--')
+    ax_time.legend([plt.Line2D((0, 1), (0, 0), color=color) for color in colors[:len(names)]],
+                   names)
+    ax_time.set_xlabel('Cores')
+    ax_time.set_ylabel('Walltime [s]')
+    ax_eff.legend()
+    ax_eff.set_xlabel('Cores')
+    ax_eff.set_ylabel('Parallel efficiency')
+    return fig
@@ -0,0 +1,294 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Synthetic QuaLiKiz output, to test and benchmark the tools without the
+QuaLiKiz binary and MPI.
+
+write_output writes the debug, output and output/primitive folders of a
+run for a QuaLiKizPlan, with every file QuaLiKiz would write for the
+phys_meth, separateflux and write_primi flags of the plan. The files
+have the shape and text layout of the QuaLiKiz output: one row per line
+in columns of 16 characters, and for arrays with more than two
+dimensions the blocks of the outer dimensions below each other. The
+debug folder echoes the input of the plan, the output and primitive
+folders contain random or analytic values. Files are written in chunks
+of rows, so runs of many GB need little memory.
+
+install_stub writes a stand-in QuaLiKiz executable that writes the
+synthetic output for the parameters.json in its working directory, to
+test the launchers:
+
+    install_stub(os.path.join(batchdir, 'QuaLiKiz'))
+
+It can also be called directly with
+python -m qualikiz_tools.qualikiz_io.synthetic [--sleep <seconds>]
+"""
+import os
+import sys
+import stat
+import time
+import shlex
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+from qualikiz_tools.misc.conversion import calc_nustar_from_parts
+from qualikiz_tools.misc.mpi import rank_env_vars
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.outputfiles import (
+    output_file_names, primi_meth_0, primi_meth_1, primi_meth_2, debug_eleclike,
+    debug_ionlike, debug_single, debug_special, numecoefs, numicoefs, ntheta,
+    suffix)
+
+module = 'qualikiz_tools.qualikiz_io.synthetic'
+float_format = '%16.7E'
+# Amount of rows written at once
+chunk_rows = 2 ** 16
+
+stub_wrapper = """#!/bin/sh
+exec {python!s} -m {module!s} "$@"
+"""
+
+
+def output_shape(name, sizes):
+    """ Shape of an output file as convert_output reads it
+
+    Args:
+        name:  Name of the file without suffix
+        sizes: Dict with dimx, dimn, nions and numsols
+
+    Returns:
+        Tuple of the amount of rows and columns
+    """
+    dimx, dimn, nions, numsols = [sizes[dim] for dim in ['dimx', 'dimn', 'nions', 'numsols']]
+    if name == 'ecoefs':
+        return (dimx * (nions + 1), numecoefs)
+    elif name.startswith('gam') or name.startswith('ome'):
+        return (numsols * dimx, dimn)
+    elif name in ['cke', 'ceke']:
+        return (dimx, 1)
+    elif name in ['cki', 'ceki']:
+        return (dimx, nions)
+    elif name.endswith('i_cm'):
+        return (nions * dimx, dimn)
+    elif name.endswith('e_cm'):
+        return (dimx, dimn)
+    elif name == 'npol':
+        return (dimx * ntheta, nions)
+    elif name == 'cftrans':
+        return (dimx * nions, numicoefs)
+    basename = name[:-3]
+    if any(basename.endswith(mode) for mode in ['ETG', 'ITG', 'TEM']):
+        basename = basename[:-3]
+    if basename.endswith('e'):
+        return (dimx, 1)
+    elif basename.endswith('i'):
+        return (dimx, nions)
+    raise Exception('Unknown output file \'' + name + '\'')
+
+def primitive_shape(name, sizes):
+    """ Shape of a primitive file as convert_primitive reads it. See output_shape """
+    dimx, dimn, nions, numsols = [sizes[dim] for dim in ['dimx', 'dimn', 'nions', 'numsols']]
+    if name.endswith('i'):
+        return (numsols * nions * dimx, dimn)
+    elif name.endswith('e') or name in ['rfdsol', 'ifdsol', 'isol', 'rsol']:
+        return (numsols * dimx, dimn)
+    elif name in ['kymaxETG', 'kymaxITG']:
+        return (dimx, 1)
+    return (dimx, dimn)
+
+def primitive_file_names(phys_meth=2):
+    """ Names of the files QuaLiKiz writes to the output/primitive folder
+
+    Follows the same naming rules as convert_primitive.
+    """
+    subsets = [primi_meth_0]
+    if phys_meth >= 1:
+        subsets.append(primi_meth_1)
+    if phys_meth >= 2:
+        subsets.append(primi_meth_2)
+    names = []
+    for subset in subsets:
+        for name in subset:
+            if name in ['fdsol', 'jonsolflu', 'modeshift', 'modewidth', 'sol', 'solflu']:
+                names.extend(['r' + name, 'i' + name])
+            else:
+                names.append(name)
+    return names
+
+def debug_values(plan):
+    """ Values of the debug files, echoing the input of the plan
+
+    Args:
+        plan: The QuaLiKizPlan of the run
+
+    Returns:
+        OrderedDict of file name: array with the rows and columns of the file
+    """
+    values = OrderedDict((name, np.frombuffer(value, dtype='float64'))
+                         for name, value in plan.setup().items())
+    dimx = int(values['dimx'][0])
+    nions = int(values['nions'][0])
+    ions = OrderedDict((name, values[name].reshape(nions, dimx).T)
+                       for name in debug_ionlike)
+    zeff = np.sum(ions['normni'] * ions['Zi'] ** 2, axis=1)
+    debug = OrderedDict()
+    for name in debug_eleclike:
+        if name == 'Zeff':
+            value = zeff
+        elif name == 'Nustar':
+            value = calc_nustar_from_parts(zeff, values['ne'], values['Te'], values['q'],
+                                           values['Ro'], values['Rmin'], values['x'])
+        elif name == 'modeflag':
+            value = np.zeros(dimx)
+        else:
+            value = values[name]
+        debug[name] = value.reshape(dimx, 1)
+    debug.update(ions)
+    for name in debug_single:
+        if name == 'numsols':
+            value = plan['xpoint_base']['meta']['numsols']
+        else:
+            value = values[name][0]
+        debug[name] = np.array([[value]])
+    for name in debug_special:
+        if name == 'kthetarhos':
+            debug[name] = values[name].reshape(-1, 1)
+    return debug
+
+def output_files(plan):
+    """ All files QuaLiKiz writes for a plan, except the debug files
+
+    Returns:
+        OrderedDict of (folder, name): (rows, columns)
+    """
+    meta = plan['xpoint_base']['meta']
+    sizes = {'dimx': plan.calculate_dimx(),
+             'dimn': len(plan['xpoint_base']['special']['kthetarhos']),
+             'nions': len(plan['xpoint_base']['ions']),
+             'numsols': meta['numsols']}
+    files = OrderedDict()
+    files[('debug', 'phi')] = (ntheta, sizes['dimx'])
+    for name in output_file_names(phys_meth=meta['phys_meth'],
+                                  separateflux=meta['separateflux']):
+        files[('output', name)] = output_shape(name, sizes)
+    if meta['write_primi']:
+        for name in primitive_file_names(phys_meth=meta['phys_meth']):
+            files[('output/primitive', name)] = primitive_shape(name, sizes)
+    return files
+
+def write_dat(path, chunks, columns):
+    """ Write rows of values in the QuaLiKiz text format
+
+    Args:
+        path:    Path of the file
+        chunks:  Iterable of 2D arrays with the rows to write
+        columns: Amount of columns of the rows
+    """
+    row_format = float_format * columns + '\n'
+    with open(path, 'w') as file_:
+        for chunk in chunks:
+            file_.write((row_format * len(chunk)) % tuple(chunk.ravel()))
+
+def random_chunks(shape, rng):
+    """ Uniform random values in [0, 1) for a file, in chunks of rows """
+    rows, columns = shape
+    for start in range(0, rows, chunk_rows):
+        yield rng.random_sample((min(chunk_rows, rows - start), columns))
+
+def analytic_chunks(shape, offset):
+    """ Smooth, reproducible values for a file, in chunks of rows
+
+    Value number i of the file is sin(1e-3 * i + offset), so every file
+    differs by its offset.
+    """
+    rows, columns = shape
+    for start in range(0, rows, chunk_rows):
+        stop = min(start + chunk_rows, rows)
+        index = np.arange(start * columns, stop * columns, dtype='float64')
+        yield np.sin(1e-3 * index + offset).reshape(stop - start, columns)
+
+def write_output(rundir, plan=None, data='random', seed=0):
+    """ Write synthetic QuaLiKiz output for a run
+
+    Args:
+        rundir: Directory to write the debug, output and output/primitive
+                folders in
+
+    Kwargs:
+        plan:   QuaLiKizPlan to write the output of. Read from the
+                parameters.json in rundir by default
+        data:   'random' for uniform random values in [0, 1), 'analytic'
+                for reproducible values that do not depend on seed
+        seed:   Seed of the random values
+
+    Returns:
+        The paths of the written files
+    """
+    if data not in ['random', 'analytic']:
+        raise Exception('Unknown data \'' + str(data) + '\', should be random or analytic')
+    if plan is None:
+        from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun
+        plan = QuaLiKizPlan.from_json(os.path.join(rundir, QuaLiKizRun.parameterspath))
+    rng = np.random.RandomState(seed)
+    paths = []
+    for folder in ['debug', 'output', 'output/primitive']:
+        os.makedirs(os.path.join(rundir, folder), exist_ok=True)
+    for name, value in debug_values(plan).items():
+        path = os.path.join(rundir, 'debug', name + suffix)
+        write_dat(path, [value], value.shape[1])
+        paths.append(path)
+    for ii, ((folder, name), shape) in enumerate(output_files(plan).items()):
+        path = os.path.join(rundir, folder, name + suffix)
+        if data == 'random':
+            chunks = random_chunks(shape, rng)
+        else:
+            chunks = analytic_chunks(shape, ii)
+        write_dat(path, chunks, shape[1])
+        paths.append(path)
+    return paths
+
+def install_stub(path):
+    """ Write a stand-in QuaLiKiz executable
+
+    The stub writes the synthetic output for the parameters.json in its
+    working directory. When started with mpirun only rank 0 writes.
+
+    Args:
+        path: Path of the executable, usually the binary of a batch
+
+    Returns:
+        The absolute path of the executable
+    """
+    path = os.path.abspath(path)
+    if os.path.dirname(path) != '':
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file_:
+        file_.write(stub_wrapper.format(python=shlex.quote(sys.executable),
+                                        module=module))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+def main(argv):
+    """ Act like QuaLiKiz in the current directory """
+    parser = argparse.ArgumentParser(prog='QuaLiKiz',
+                                     description='Write synthetic QuaLiKiz output')
+    parser.add_argument('--sleep', type=float, default=0,
+                        help='Seconds to wait before writing, like a real run')
+    parser.add_argument('--data', default='random', choices=['random', 'analytic'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    for env_var in rank_env_vars:
+        if os.environ.get(env_var, '0') != '0':
+            return 0
+    time.sleep(args.sleep)
+    paths = write_output(os.curdir, data=args.data, seed=args.seed)
+    print('Synthetic QuaLiKiz wrote {:d} files'.format(len(paths)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
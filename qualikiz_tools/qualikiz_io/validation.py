@@ -0,0 +1,190 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Vectorised pre-flight checks of a QuaLiKizPlan
+
+QuaLiKizPlan.setup_scan raises on the first unphysical point, after all
+previous points have been generated. The functions here mimic the
+QuaLiKizXpoint setters for all points of a plan at once, and collect all
+violations instead of raising.
+"""
+import numpy as np
+import pandas as pd
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizXpoint, Particle
+from qualikiz_tools.misc.conversion import calc_c1, calc_c2
+
+quasitol = 1e-5
+checks = ['normni', 'quasineutrality', 'quasineutrality_gradient', 'Zeff',
+          'Nustar', 'An']
+
+
+class PlanState():
+    """ The state of all xpoints of a plan, one array per variable
+
+    Only the variables needed for the checks are tracked: the geometry,
+    and the electron and ion parameters.
+    """
+    def __init__(self, xpoint_base, dimx):
+        self.dimx = dimx
+        self.options = xpoint_base['options']
+        self.geometry = {name: np.full(dimx, float(value))
+                         for name, value in xpoint_base['geometry'].items()}
+        self.elec = {name: np.full(dimx, float(value))
+                     for name, value in xpoint_base['elec'].items()}
+        self.ions = [{name: np.full(dimx, float(value))
+                      for name, value in ion.items()}
+                     for ion in xpoint_base['ions']]
+        self.violations = []
+
+    def flag(self, check, mask, value):
+        """ Store the points in mask as violating check """
+        mask = np.broadcast_to(mask, (self.dimx, ))
+        value = np.broadcast_to(value, (self.dimx, ))
+        idx = np.flatnonzero(mask)
+        if len(idx) != 0:
+            self.violations.append((check, idx, value[idx]))
+
+    def active(self, ion):
+        """ Mask of points where the ion is not a trace ion """
+        return ion['type'] != 3
+
+    def calc_zeff(self):
+        return sum(ion['n'] * ion['Z'] ** 2 * self.active(ion)
+                   for ion in self.ions)
+
+    def get_other_non_trace_ions(self, ion_index):
+        ion_index = min(ion_index, len(self.ions) - 1)
+        ions = [ion for ii, ion in enumerate(self.ions) if ii != ion_index]
+        return ion_index, ions
+
+    def set_qn_normni_ion_n(self):
+        var_ion, ions = self.get_other_non_trace_ions(self.options['set_qn_normni_ion'])
+        var_normni = ((1 - sum(ion['n'] * ion['Z'] * self.active(ion)
+                               for ion in ions)) /
+                      self.ions[var_ion]['Z'])
+        self.flag('normni', (var_normni <= 0) | (var_normni > 1), var_normni)
+        self.ions[var_ion]['n'] = var_normni
+
+    def set_qn_An_ion_n(self):
+        var_ion, ions = self.get_other_non_trace_ions(self.options['set_qn_An_ion'])
+        Z_var_ion = self.ions[var_ion]['Z']
+        n_var_ion = self.ions[var_ion]['n']
+        invalid = (Z_var_ion == 0) | (n_var_ion == 0)
+        self.flag('An', invalid, Z_var_ion * n_var_ion)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var_An = ((self.elec['An'] -
+                       sum(ion['n'] * ion['An'] * ion['Z'] * self.active(ion)
+                           for ion in ions)) /
+                      (Z_var_ion * n_var_ion))
+        self.ions[var_ion]['An'] = var_An
+
+    def match_zeff(self, zeff):
+        if len(self.ions) > 1:
+            ions = self.ions[2:]
+            sum1 = sum(ion['n'] * ion['Z'] ** 2 * self.active(ion)
+                       for ion in ions)
+            sum2 = (sum(ion['n'] * ion['Z'] * self.active(ion)
+                        for ion in ions) * self.ions[0]['Z'])
+            n1 = ((zeff - self.ions[0]['Z'] - sum1 + sum2) /
+                  (self.ions[1]['Z'] ** 2 - self.ions[1]['Z'] * self.ions[0]['Z']))
+            self.flag('Zeff', (n1 < 0) | (n1 > 1), n1)
+            self.ions[1]['n'] = n1
+            self.set_qn_normni_ion_n()
+
+    def check_nustar(self, nustar):
+        """ Flag points without a real solution for Te. See calc_te_from_nustar """
+        g = self.geometry
+        c1 = calc_c1(self.calc_zeff(), self.elec['n'], g['q'], g['Ro'],
+                     g['Rmin'], g['x'])
+        c2 = calc_c2(self.elec['n'])
+        z = -2 * np.exp(-2 * c2) * nustar / c1
+        self.flag('Nustar', ~(z > -1 / np.e), z)
+
+    def check_quasi(self):
+        quasicheck = sum(ion['n'] * ion['Z'] * self.active(ion)
+                         for ion in self.ions) - 1
+        quasicheck_grad = (sum(ion['n'] * ion['An'] * ion['Z'] * self.active(ion)
+                               for ion in self.ions) - self.elec['An'])
+        self.flag('quasineutrality', ~(np.abs(quasicheck) <= quasitol), quasicheck)
+        self.flag('quasineutrality_gradient', ~(np.abs(quasicheck_grad) <= quasitol),
+                  quasicheck_grad)
+
+    def __setitem__(self, key, value):
+        """ Mirrors QuaLiKizXpoint.__setitem__ for the tracked variables """
+        if key == 'Zeff':
+            self.match_zeff(value)
+        elif key == 'Nustar':
+            self.check_nustar(value)
+        elif key == 'Ti_Te_rel':
+            for ion in self.ions:
+                ion['T'] = value * self.elec['T']
+        elif key == 'epsilon':
+            self.geometry['x'] = self.geometry['Ro'] * value / self.geometry['Rmin']
+        elif key in QuaLiKizXpoint.Geometry.in_args:
+            self.geometry[key] = value
+        elif key in Particle.in_args:
+            self.elec[key] = value
+            for ion in self.ions:
+                ion[key] = value
+        elif key.endswith('i') or (key[-1].isdigit() and key[-2] == 'i'):
+            if key[-1].isdigit():
+                self.ions[int(key[-1])][key[:-2]] = value
+            else:
+                for ion in self.ions:
+                    ion[key[:-1]] = value
+        elif key.endswith('e') and key[:-1] in Particle.in_args:
+            self.elec[key[:-1]] = value
+
+
+def validate_plan(plan):
+    """ Check all points of a QuaLiKizPlan for unphysical input
+
+    Evaluates the same options as QuaLiKizPlan.setup_scan, but for all
+    points at once. Checks for quasineutrality and its gradient,
+    unphysical normni, Zeff values that cannot be matched with ion 1
+    and Nustar values without a real Te solution.
+
+    Args:
+        plan: The QuaLiKizPlan to check
+
+    Returns:
+        DataFrame with a row per violation. Contains the dimx index of the
+        point, the violated check, the offending value and the values of
+        the scan variables. Empty if all points are valid
+    """
+    points = plan.scan_array()
+    names = list(plan['scan_dict'].keys())
+    xpoint_base = plan['xpoint_base']
+    state = PlanState(xpoint_base, len(points))
+    options = state.options
+
+    if options['recalc_Nustar']:
+        nustar = xpoint_base.calc_nustar()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for ii, name in enumerate(names):
+            state[name] = points[:, ii]
+        if options['set_qn_normni']:
+            state.set_qn_normni_ion_n()
+        if options['set_qn_An']:
+            state.set_qn_An_ion_n()
+        if options['recalc_Nustar']:
+            state.check_nustar(nustar)
+        if options['check_qn']:
+            state.check_quasi()
+
+    columns = ['dimx', 'check', 'value'] + names
+    tables = []
+    for check, idx, value in state.violations:
+        table = pd.DataFrame(points[idx], columns=names)
+        table.insert(0, 'value', value)
+        table.insert(0, 'check', check)
+        table.insert(0, 'dimx', idx)
+        tables.append(table)
+    if len(tables) == 0:
+        return pd.DataFrame(columns=columns)
+    table = pd.concat(tables, ignore_index=True)[columns]
+    # normni is checked by both match_zeff and set_qn_normni
+    return table.drop_duplicates(['dimx', 'check']).reset_index(drop=True)
@@ -0,0 +1,236 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Walltime model fitted on the profiling output of earlier QuaLiKiz runs
+
+The model is a linear least-squares fit of the logarithm of the walltime
+on features of the QuaLiKizPlan and the amount of cores. It is stored as
+a small json file. Set the environment variable QUALIKIZ_WALLTIME_MODEL
+to the path of this file to use it in QuaLiKizRun.estimate_walltime.
+"""
+import os
+import json
+from collections import OrderedDict
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+
+model_env_var = 'QUALIKIZ_WALLTIME_MODEL'
+default_features = ['log_dimx', 'log_dimn', 'log_cores', 'nions', 'numsols',
+                    'rot_flag']
+# Quantile of the residuals added to the prediction by default, ~95%
+default_quantile = 1.645
+
+
+def plan_features(plan, cores, names=None):
+    """ Calculate the features of a QuaLiKizPlan run on cores
+
+    Besides the fixed features (dimx, dimn, nions, numsols, rot_flag and
+    cores, also in log-scale) any QuaLiKizXpoint variable can be used as
+    feature. Its value is the mean over the scan if it is scanned, and
+    the value of the xpoint base otherwise.
+
+    Args:
+        plan:  The QuaLiKizPlan
+        cores: The amount of cores used to run
+
+    Kwargs:
+        names: Names of the features to calculate. default_features
+               by default
+
+    Returns:
+        OrderedDict with the value per feature
+    """
+    if names is None:
+        names = default_features
+    xpoint = plan['xpoint_base']
+    dimx = plan.calculate_dimx()
+    dimn = len(xpoint['special']['kthetarhos'])
+    fixed = {'dimx': dimx,
+             'dimn': dimn,
+             'dimxn': dimx * dimn,
+             'nions': len(xpoint['ions']),
+             'numsols': xpoint['numsols'],
+             'rot_flag': xpoint['rot_flag'],
+             'cores': cores}
+    features = OrderedDict()
+    for name in names:
+        if name.startswith('log_'):
+            value = np.log(fixed[name[4:]])
+        elif name in fixed:
+            value = fixed[name]
+        elif name in plan['scan_dict']:
+            value = np.mean(plan['scan_dict'][name])
+        else:
+            value = xpoint[name]
+        features[name] = float(value)
+    return features
+
+
+def run_walltime(run):
+    """ Read the profiled walltime of a finished QuaLiKizRun
+
+    Uses the profiling table in the STDOUT of QuaLiKiz, see
+    basicpoll.poll_stdout
+
+    Args:
+        run: The QuaLiKizRun
+
+    Returns:
+        Tuple with the amount of cores and the total walltime in seconds
+    """
+    from qualikiz_tools.machine_specific.basicpoll import poll_stdout
+    header, values = poll_stdout(os.path.join(run.rundir, run.stdout))
+    cores = values[0]
+    total = [value for name, value in zip(header, values)
+             if 'total' in name.lower()]
+    if len(total) == 0:
+        total = values[-1:]
+    sec, msec = total[0]
+    return cores, sec + msec / 1000
+
+
+class WalltimeModel():
+    """ Log-linear model of the walltime of a QuaLiKiz run
+
+    log(walltime) = intercept + sum(coefficient * feature)
+
+    Attributes:
+        features:     Names of the features, see plan_features
+        coefficients: Fitted coefficients, starting with the intercept
+        sigma:        Standard deviation of the residuals of the fit
+        num_samples:  Amount of runs used to fit
+    """
+    def __init__(self, features=None, coefficients=None, sigma=0.,
+                 num_samples=0):
+        if features is None:
+            features = default_features
+        self.features = list(features)
+        self.coefficients = coefficients
+        self.sigma = sigma
+        self.num_samples = num_samples
+
+    def fit(self, table):
+        """ Fit the model
+
+        Args:
+            table: DataFrame with a column per feature and the measured
+                   walltime in seconds in the 'walltime' column
+        """
+        if len(table) <= len(self.features):
+            warn('Fitting {:d} coefficients on {:d} runs, model is '
+                 'underdetermined'.format(len(self.features) + 1, len(table)))
+        X = np.hstack([np.ones((len(table), 1)),
+                       table[self.features].values.astype('float64')])
+        y = np.log(table['walltime'].values.astype('float64'))
+        coefficients = np.linalg.lstsq(X, y, rcond=None)[0]
+        residuals = y - X.dot(coefficients)
+        dof = max(len(table) - len(coefficients), 1)
+        self.coefficients = coefficients.tolist()
+        self.sigma = float(np.sqrt(np.sum(residuals ** 2) / dof))
+        self.num_samples = len(table)
+        return self
+
+    @classmethod
+    def from_runs(cls, runlist, features=None):
+        """ Fit the model on finished runs
+
+        Args:
+            runlist: List of finished QuaLiKizRuns with profiling output
+                     in their STDOUT
+
+        Kwargs:
+            features: Names of the features, see plan_features
+
+        Returns:
+            The fitted WalltimeModel
+        """
+        model = cls(features=features)
+        model.fit(cls.table_from_runs(runlist, features=model.features))
+        return model
+
+    @staticmethod
+    def table_from_runs(runlist, features=None):
+        """ Collect the features and walltime of finished runs
+
+        Runs without readable profiling output are skipped with a warning
+
+        Returns:
+            DataFrame with a row per run
+        """
+        rows = []
+        for run in runlist:
+            try:
+                cores, walltime = run_walltime(run)
+            except (OSError, IndexError, ValueError) as ee:
+                warn('Could not read profiling of {!s}: {!s}'.format(run.rundir, ee))
+                continue
+            row = plan_features(run.qualikiz_plan, cores, names=features)
+            row['walltime'] = walltime
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def predict_walltime(self, plan, cores, quantile=default_quantile):
+        """ Predict the walltime of a QuaLiKizPlan run on cores
+
+        Args:
+            plan:     The QuaLiKizPlan
+            cores:    The amount of cores used to run
+
+        Kwargs:
+            quantile: Amount of standard deviations of the fit residuals
+                      to add. Use 0 for the median prediction
+
+        Returns:
+            Predicted walltime in seconds
+        """
+        if self.coefficients is None:
+            raise Exception('Model has not been fitted')
+        features = plan_features(plan, cores, names=self.features)
+        log_walltime = (self.coefficients[0] +
+                        np.dot(self.coefficients[1:], list(features.values())))
+        return float(np.exp(log_walltime + quantile * self.sigma))
+
+    def to_json(self, path):
+        """ Store the model as json """
+        with open(path, 'w') as file_:
+            json.dump(OrderedDict([('features', self.features),
+                                   ('coefficients', self.coefficients),
+                                   ('sigma', self.sigma),
+                                   ('num_samples', self.num_samples)]),
+                      file_, indent=4)
+
+    @classmethod
+    def from_json(cls, path):
+        """ Load a model stored with to_json """
+        with open(path, 'r') as file_:
+            return cls(**json.load(file_))
+
+
+_model_cache = {}
+
+def load_model(path=None):
+    """ Load the walltime model if available
+
+    The model is only read again if its file changed, so it can be
+    loaded for every run.
+
+    Kwargs:
+        path: Path of the model. By default the path in the
+              QUALIKIZ_WALLTIME_MODEL environment variable. An empty path
+              disables the model
+
+    Returns:
+        The WalltimeModel, or None if no model is configured
+    """
+    if path is None:
+        path = os.environ.get(model_env_var)
+    if not path:
+        return None
+    mtime = os.path.getmtime(path)
+    if path not in _model_cache or _model_cache[path][0] != mtime:
+        _model_cache[path] = (mtime, WalltimeModel.from_json(path))
+    return _model_cache[path][1]
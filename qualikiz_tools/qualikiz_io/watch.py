@@ -0,0 +1,154 @@
+"""
+Copyright Dutch Institute for Fundamental Energy Research (2016-2017)
+Contributors: Karel van de Plassche (karelvandeplassche@gmail.com)
+License: CeCILL v2.1
+
+Watch running QuaLiKiz runs and convert them to netCDF as soon as they
+finish, so post-processing overlaps with the runs still computing.
+
+A run counts as finished when all output files expected from its plan
+exist, are non-empty and did not change size for a few polls in a row.
+QuaLiKiz writes its output at the very end, so a size that is stable
+over a poll interval means the file is no longer being written. Runs
+that already have a netCDF file, or are recorded as converted in the
+campaign database, are not converted again.
+"""
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizBatch, run_to_netcdf
+from qualikiz_tools.qualikiz_io.campaign import record_state, lookup_states, state_index
+
+
+def watch(targets, poll_interval=10, stable_polls=2, processes=1,
+          executor=None, glue=None, timeout=None, convert=run_to_netcdf,
+          run_kwargs=None, batch_kwargs=None, verbose=False):
+    """ Convert runs to netCDF as they finish
+
+    Args:
+        targets:       List of QuaLiKizBatches and QuaLiKizRuns to watch
+
+    Kwargs:
+        poll_interval: Time in seconds between checking the output
+        stable_polls:  Amount of polls in a row all output should be
+                       complete with the same sizes before converting
+        processes:     Amount of processes to convert with if no executor
+                       is given
+        executor:      concurrent.futures executor to convert with. Is not
+                       shut down, so it can be reused. By default a
+                       ProcessPoolExecutor is created and shut down afterwards
+        glue:          Mode to glue the runs of a batch with once all are
+                       converted, for example 'glue_orthogonal'. See
+                       QuaLiKizBatch.to_netcdf. By default batches are not glued
+        timeout:       Stop watching after this many seconds. Runs that
+                       did not finish by then are left alone
+        convert:       Function called as convert(rundir, **run_kwargs)
+                       to convert a run. run_to_netcdf by default
+        run_kwargs:    Keyword arguments passed to convert. overwrite is
+                       True by default, as a finished run has no netCDF
+        batch_kwargs:  Keyword arguments passed to QuaLiKizBatch.to_netcdf
+                       when gluing. overwrite_batch is True by default
+        verbose:       Print every conversion
+
+    Returns:
+        results: OrderedDict of run directory: None if it was converted,
+                 the exception if converting failed. Runs that did not
+                 finish before the timeout are not included. A batch
+                 that failed to glue is included by its directory
+    """
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return watch(targets, poll_interval=poll_interval,
+                         stable_polls=stable_polls, executor=executor,
+                         glue=glue, timeout=timeout, convert=convert,
+                         run_kwargs=run_kwargs, batch_kwargs=batch_kwargs,
+                         verbose=verbose)
+    run_kwargs = dict(run_kwargs or {})
+    run_kwargs.setdefault('overwrite', True)
+    batch_kwargs = dict(batch_kwargs or {})
+    # Nobody is there to answer the prompt
+    batch_kwargs.setdefault('overwrite_batch', True)
+
+    pending = OrderedDict()
+    unglued = []
+    for target in targets:
+        if isinstance(target, QuaLiKizBatch):
+            for run in target.runlist:
+                pending[run.rundir] = run
+            unglued.append(target)
+        else:
+            pending[target.rundir] = target
+
+    results = OrderedDict()
+    converted_state = state_index('netcdf')
+    recorded = lookup_states(list(pending))
+    for rundir in list(pending):
+        netcdf_path = os.path.join(rundir, os.path.basename(rundir) + '.nc')
+        if (os.path.isfile(netcdf_path) or
+                (rundir in recorded and state_index(recorded[rundir]) >= converted_state)):
+            del pending[rundir]
+            results[rundir] = None
+            if verbose:
+                print('Already converted {!s}'.format(rundir))
+
+    sizes = {}
+    stable = {}
+    futures = OrderedDict()
+    start = time.time()
+    while len(pending) > 0 or len(futures) > 0:
+        for rundir, run in list(pending.items()):
+            new_sizes = run.output_sizes()
+            if new_sizes is None or not all(size > 0 for size in new_sizes.values()):
+                stable[rundir] = 0
+            elif new_sizes == sizes.get(rundir):
+                stable[rundir] += 1
+            else:
+                stable[rundir] = 1
+            sizes[rundir] = new_sizes
+            if stable[rundir] >= stable_polls:
+                record_state([rundir], 'done')
+                futures[rundir] = executor.submit(convert, rundir, **run_kwargs)
+                del pending[rundir]
+
+        for rundir, future in list(futures.items()):
+            if not future.done():
+                continue
+            del futures[rundir]
+            results[rundir] = future.exception()
+            if verbose:
+                if results[rundir] is None:
+                    print('Converted {!s}'.format(rundir))
+                else:
+                    print('Failed to convert {!s}: {!s}'.format(rundir, results[rundir]))
+
+        if glue is not None:
+            for ii, batch in enumerate(unglued):
+                if batch is None:
+                    continue
+                rundirs = [run.rundir for run in batch.runlist]
+                if all(rundir in results for rundir in rundirs):
+                    unglued[ii] = None
+                    if any(results[rundir] is not None for rundir in rundirs):
+                        print('Not gluing {!s}, some runs failed to convert'.format(batch.name))
+                        continue
+                    if verbose:
+                        print('Gluing {!s}'.format(batch.name))
+                    try:
+                        batch.to_netcdf(mode=glue, overwrite_runs=False,
+                                        **batch_kwargs)
+                    except Exception as ee:
+                        batchdir = os.path.join(batch.parent_dir, batch.name)
+                        results[batchdir] = ee
+                        if verbose:
+                            print('Failed to glue {!s}: {!s}'.format(batchdir, ee))
+
+        if timeout is not None and time.time() - start > timeout:
+            if len(futures) == 0:
+                break
+            # Do not leave conversions behind half-done
+            pending.clear()
+        if len(pending) > 0 or len(futures) > 0:
+            time.sleep(poll_interval)
+    return results
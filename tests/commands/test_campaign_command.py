@@ -0,0 +1,49 @@
+"""Tests for our `qualikiz_tools campaign` subcommand."""
+
+
+from subprocess import PIPE, Popen as popen
+from unittest import TestCase
+import os
+import shutil
+
+from qualikiz_tools.qualikiz_io.campaign import CampaignDB, campaign_env_var
+
+
+class TestCampaign(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_campaign_command')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        os.makedirs(self.testdir)
+        self.dbpath = os.path.join(self.testdir, 'campaign.sqlite')
+        self.env = dict(os.environ)
+        self.env[campaign_env_var] = self.dbpath
+
+    def campaign(self, *args):
+        output = popen(['qualikiz_tools', 'campaign'] + list(args),
+                       stdout=PIPE, env=self.env).communicate()[0]
+        return output.decode('UTF-8')
+
+    def test_returns_usage_information(self):
+        self.assertTrue('Usage:' in self.campaign('help'))
+
+    def test_status_and_list(self):
+        rundirs = [os.path.join(self.testdir, 'run' + str(ii)) for ii in range(3)]
+        with CampaignDB(self.dbpath) as db:
+            db.record(rundirs, 'done')
+            db.record(rundirs[:1], 'netcdf')
+        status = self.campaign('status', self.testdir)
+        self.assertIn('done', status)
+        self.assertEqual(status.split()[-1], '3')
+        listed = self.campaign('--state', 'done', 'list', self.testdir).splitlines()
+        self.assertEqual([line.split()[-1] for line in listed], rundirs[1:])
+
+    def test_db_option(self):
+        del self.env[campaign_env_var]
+        with CampaignDB(self.dbpath) as db:
+            db.record([os.path.join(self.testdir, 'run0')], 'done')
+        self.assertEqual(self.campaign('status', self.testdir), '')
+        status = self.campaign('--db', self.dbpath, 'status', self.testdir)
+        self.assertEqual(status.split()[-1], '1')
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir, ignore_errors=True)
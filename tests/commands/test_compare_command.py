@@ -0,0 +1,44 @@
+"""Tests for our `qualikiz_tools compare` subcommand."""
+
+
+from subprocess import PIPE, Popen as popen
+from unittest import TestCase
+import os
+import json
+import shutil
+
+import numpy as np
+import xarray as xr
+
+
+class TestCompare(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_compare_command')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        os.makedirs(self.testdir)
+
+    def compare(self, *args):
+        process = popen(['qualikiz_tools', 'compare'] + list(args), stdout=PIPE, stderr=PIPE)
+        output = process.communicate()[0]
+        return process.returncode, output.decode('UTF-8')
+
+    def test_returns_usage_information(self):
+        self.assertTrue('Usage:' in self.compare('help')[1])
+
+    def test_compare_netcdf(self):
+        ds = xr.Dataset({'efe_GB': (['dimx'], np.linspace(0, 1, 5))})
+        paths = [os.path.join(self.testdir, name) for name in ['ds.nc', 'reference.nc']]
+        ds.to_netcdf(paths[0])
+        ds.to_netcdf(paths[1])
+        returncode, output = self.compare(*paths)
+        self.assertEqual(returncode, 0)
+        self.assertEqual(output.strip(), '0 of 1 different')
+
+        ds['efe_GB'][0] = 1
+        ds.to_netcdf(paths[0])
+        returncode, output = self.compare('--json', *paths)
+        self.assertEqual(returncode, 1)
+        self.assertEqual(json.loads(output)[0]['mismatches'], 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir, ignore_errors=True)
@@ -0,0 +1,69 @@
+"""Tests for our `qualikiz_tools scaling` subcommand."""
+
+
+from subprocess import PIPE, Popen as popen
+from unittest import TestCase
+import os
+import shutil
+import sqlite3
+
+from qualikiz_tools.qualikiz_io.scaling import ScalingModel, model_env_var
+
+
+def write_database(path):
+    """ Write a stdout table with Eigenmodes = 0.1 s N / p and a log2(p) AllReduce, in ms """
+    db = sqlite3.connect(path)
+    db.execute('''CREATE TABLE stdout (
+        Jobnumber INTEGER, Runnumber INTEGER, Numcores INTEGER, Dimx INTEGER,
+        Dimn INTEGER, First_MPI_AllReduce INTEGER, Eigenmodes INTEGER,
+        Saturation INTEGER, Second_MPI_AllReduce INTEGER, Initialization INTEGER,
+        Output INTEGER, Total INTEGER)''')
+    for dimx in [100, 1000, 10000]:
+        for cores in [1, 4, 16, 64, 256]:
+            allreduce = 50 * cores.bit_length()
+            eigenmodes = 100 * dimx * 8 // cores
+            db.execute('INSERT INTO stdout VALUES (' + ', '.join(12 * ['?']) + ')',
+                       [dimx + cores, 0, cores, dimx, 8, allreduce, eigenmodes, 0, 0, 200, 100,
+                        allreduce + eigenmodes + 300])
+    db.commit()
+    db.close()
+
+
+class TestScaling(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_scaling_command')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        os.makedirs(self.testdir)
+        self.dbpath = os.path.join(self.testdir, 'polldb.sqlite3')
+        self.modelpath = os.path.join(self.testdir, 'scaling.json')
+        write_database(self.dbpath)
+        self.env = dict(os.environ)
+        self.env.pop(model_env_var, None)
+
+    def scaling(self, *args):
+        output = popen(['qualikiz_tools', 'scaling'] + list(args),
+                       stdout=PIPE, stderr=PIPE, env=self.env).communicate()[0]
+        return output.decode('UTF-8')
+
+    def test_returns_usage_information(self):
+        self.assertTrue('Usage:' in self.scaling('help'))
+
+    def test_fit_and_recommend(self):
+        plotpath = os.path.join(self.testdir, 'scaling.png')
+        output = self.scaling('--model', self.modelpath, '--plot', plotpath,
+                              'fit', self.dbpath)
+        self.assertIn('Eigenmodes', output)
+        self.assertTrue(os.path.isfile(plotpath))
+        model = ScalingModel.from_json(self.modelpath)
+        self.assertEqual(model.num_samples, 15)
+
+        self.env[model_env_var] = self.modelpath
+        candidates = [1, 4, 16, 64]
+        output = self.scaling('--cores', ','.join(str(cores) for cores in candidates),
+                              'recommend', '8000', '60')
+        self.assertEqual(int(output.split()[-1]), 16)
+        self.assertEqual(int(output.split()[-1]),
+                         model.recommend_cores(8000, 60, candidates))
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir, ignore_errors=True)
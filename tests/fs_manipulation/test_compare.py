@@ -0,0 +1,115 @@
+from unittest import TestCase
+import os
+import json
+import shutil
+import warnings
+
+import numpy as np
+import xarray as xr
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.synthetic import write_output
+from qualikiz_tools.fs_manipulation.compare import *
+
+class TestCompare(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_compare')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        os.makedirs(self.testdir)
+
+    def write_runs(self):
+        plan = QuaLiKizPlan.from_defaults()
+        rundirs = [os.path.join(self.testdir, name) for name in ['run', 'reference']]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for rundir in rundirs:
+                write_output(rundir, plan=plan, data='analytic')
+        return rundirs
+
+    def test_read_dat(self):
+        path = os.path.join(self.testdir, 'efe_GB.dat')
+        with open(path, 'w') as file_:
+            file_.write('  1.0000000E+00             NaN\n'
+                        ' -2.0000000E+00 ***************\n'
+                        '        Infinity  3.0000000E+00\n')
+        data = read_dat(path)
+        np.testing.assert_array_equal(data, [[1, np.nan], [-2, np.nan], [np.inf, 3]])
+        self.assertTrue(data.flags.writeable)
+        with open(path, 'w') as file_:
+            file_.write('1. 2.\n3. 4.\n')
+        data = read_dat(path)
+        np.testing.assert_array_equal(data, [[1, 2], [3, 4]])
+        self.assertTrue(data.flags.writeable)
+        with open(path, 'w'):
+            pass
+        self.assertEqual(read_dat(path).shape, (0, 0))
+
+    def test_compare_arrays(self):
+        reference = np.array([[1., 2., np.nan], [0., 5., 6.]])
+        stats = compare_arrays(reference.copy(), reference, name='same')
+        self.assertEqual(stats['status'], 'identical')
+        self.assertEqual(stats['max_abs_err'], 0)
+        self.assertIsNone(stats['first_mismatch'])
+
+        changed = reference.copy()
+        changed[0, 1] = 2.01
+        changed[1, 0] = np.nan
+        changed[1, 2] = 6.6
+        stats = compare_arrays(changed, reference, rtol=1e-2)
+        self.assertEqual(stats['status'], 'different')
+        self.assertEqual(stats['mismatches'], 2)
+        self.assertEqual(stats['first_mismatch'], [1, 0])
+        self.assertAlmostEqual(stats['max_abs_err'], .6)
+        self.assertAlmostEqual(stats['max_rel_err'], .6 / 6.6)
+
+        stats = compare_arrays(reference[:1], reference)
+        self.assertEqual(stats['status'], 'shape')
+        self.assertEqual(stats['shape1'], [1, 3])
+
+    def test_compare_runs(self):
+        rundirs = self.write_runs()
+        stats = compare_run_folders(*rundirs, processes=2)
+        self.assertFalse(is_different(stats))
+        self.assertIn('output/efe_GB.dat', [row['name'] for row in stats])
+
+        path = os.path.join(rundirs[0], 'output', 'efe_GB.dat')
+        data = read_dat(path)
+        data[3, 0] += 1
+        np.savetxt(path, data, fmt='%16.7E', delimiter='')
+        os.remove(os.path.join(rundirs[0], 'output', 'gam_GB.dat'))
+        stats = compare_run_folders(*rundirs)
+        different = dict((row['name'], row) for row in stats if row['status'] != 'identical')
+        self.assertEqual(set(different), {'output/efe_GB.dat', 'output/gam_GB.dat'})
+        self.assertEqual(different['output/gam_GB.dat']['status'], 'missing1')
+        self.assertEqual(different['output/efe_GB.dat']['first_mismatch'], [3, 0])
+        self.assertAlmostEqual(different['output/efe_GB.dat']['max_abs_err'], 1, places=5)
+
+        table = report_table(stats)
+        self.assertEqual(len(table.splitlines()), 5)
+        self.assertTrue(table.endswith('2 of {:d} different'.format(len(stats))))
+        self.assertEqual(json.loads(report_json(stats)), stats)
+
+    def test_compare_datasets(self):
+        ds = xr.Dataset({'efe_GB': (['dimx'], np.linspace(0, 1, 5)),
+                         'gam_GB': (['dimx', 'numsols'], np.ones((5, 2)))},
+                        coords={'dimx': np.arange(5), 'Ate': ('dimx', np.linspace(2, 6, 5))})
+        other = ds.copy(deep=True)
+        other['efe_GB'][2] = 2
+        other = other.drop('gam_GB')
+        other['pfe_GB'] = ('dimx', np.zeros(5))
+        paths = [os.path.join(self.testdir, name) for name in ['ds.nc', 'reference.nc']]
+        other.to_netcdf(paths[0])
+        ds.to_netcdf(paths[1])
+        stats = dict((row['name'], row) for row in compare_datasets(*paths))
+        self.assertEqual(stats['Ate']['status'], 'identical')
+        self.assertEqual(stats['efe_GB']['first_mismatch'], [2])
+        self.assertEqual(stats['gam_GB']['status'], 'missing1')
+        self.assertEqual(stats['pfe_GB']['status'], 'missing2')
+
+        transposed = ds.copy()
+        transposed['gam_GB'] = ds['gam_GB'].T
+        stats = dict((row['name'], row) for row in compare_datasets(transposed, ds))
+        self.assertEqual(stats['gam_GB']['status'], 'dims')
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir, ignore_errors=True)
@@ -0,0 +1,208 @@
+from unittest import TestCase
+import os
+import shutil
+import stat
+import json
+import time
+import warnings
+from unittest.mock import patch
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.outputfiles import output_file_names
+from qualikiz_tools.machine_specific.bash import Run, Batch, schedule_runs
+
+stub_mpirun = """#!/bin/bash
+# Stub of mpirun: log the arguments and pretend to work
+echo "$OMP_NUM_THREADS $@" > mpirun.log
+sleep {sleep!s}
+exit {exitcode!s}
+"""
+
+class TestConcurrentBatch(TestCase):
+    sleep = .4
+
+    def setUp(self):
+        self.testdir = os.path.abspath('test_bash_concurrent')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        self.bindir = os.path.join(self.testdir, 'bin')
+        os.makedirs(self.bindir)
+        self.write_stub(0)
+        self.old_path = os.environ['PATH']
+        os.environ['PATH'] = self.bindir + os.pathsep + self.old_path
+
+        plan = QuaLiKizPlan.from_defaults()
+        tasks = [2, 2, 3, 1]
+        runlist = [Run(os.path.join(self.testdir, 'batch'), 'run' + str(ii),
+                       '../../bin/QuaLiKiz', qualikiz_plan=plan,
+                       tasks=num_tasks)
+                   for ii, num_tasks in enumerate(tasks)]
+        self.batch = Batch(self.testdir, 'batch', runlist,
+                           style='concurrent', cores=4)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.batch.prepare(overwrite_batch=True)
+
+    def write_stub(self, exitcode):
+        path = os.path.join(self.bindir, 'mpirun')
+        with open(path, 'w') as file_:
+            file_.write(stub_mpirun.format(sleep=self.sleep, exitcode=exitcode))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+    def launch(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return self.batch.launch_concurrent(poll_interval=.02)
+
+    def test_packing(self):
+        start = time.time()
+        info = self.launch()
+        elapsed = time.time() - start
+        # 2 + 2 fit together, 3 + 1 fit together after that
+        self.assertLess(elapsed, 3.5 * self.sleep)
+        runs = list(info.values())
+        for run in runs:
+            self.assertEqual(run['returncode'], 0)
+            self.assertGreaterEqual(run['end'] - run['start'], self.sleep)
+        self.assertLess(runs[1]['start'], runs[0]['end'])
+        self.assertGreaterEqual(runs[2]['start'], min(runs[0]['end'], runs[1]['end']))
+        # Never more tasks running than cores
+        events = sorted([(run['start'], run['tasks']) for run in runs] +
+                        [(run['end'], -run['tasks']) for run in runs])
+        used = 0
+        for __, tasks in events:
+            used += tasks
+            self.assertLessEqual(used, 4)
+
+    def test_batchinfo(self):
+        info = self.launch()
+        path = os.path.join(self.testdir, 'batch', Batch.batchinfofile)
+        with open(path) as file_:
+            batchinfo = json.load(file_)
+        self.assertEqual(batchinfo['style'], 'concurrent')
+        self.assertEqual(batchinfo['cores'], 4)
+        self.assertEqual(batchinfo['runs'], json.loads(json.dumps(info)))
+
+    def test_from_dir_keeps_style(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            batch = Batch.from_dir(os.path.join(self.testdir, 'batch'))
+        self.assertEqual(batch.style, 'concurrent')
+        self.assertEqual(batch.cores, 4)
+
+    def test_from_dir_round_trip(self):
+        batchdir = os.path.join(self.testdir, 'batch')
+        for batchfile in [True, False]:
+            if not batchfile:
+                os.remove(os.path.join(batchdir, Batch.scriptname))
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                self.batch = Batch.from_dir(batchdir)
+            self.assertEqual([run.tasks for run in self.batch.runlist], [2, 2, 3, 1])
+            self.assertEqual(self.batch.style, 'concurrent')
+            start = time.time()
+            runs = list(self.launch().values())
+            self.assertLess(time.time() - start, 3.5 * self.sleep)
+            self.assertLess(runs[1]['start'], runs[0]['end'])
+
+    def test_interrupt(self):
+        with patch('time.sleep', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.launch()
+        path = os.path.join(self.testdir, 'batch', Batch.batchinfofile)
+        with open(path) as file_:
+            runs = json.load(file_)['runs']
+        # The first two runs were started and terminated
+        self.assertNotEqual(runs['run0']['returncode'], 0)
+        self.assertIsNotNone(runs['run1']['returncode'])
+        self.assertIsNone(runs['run2']['start'])
+
+    def test_mpirun_call(self):
+        self.launch()
+        rundir = self.batch.runlist[2].rundir
+        with open(os.path.join(rundir, 'mpirun.log')) as file_:
+            self.assertEqual(file_.read().split(), ['2', '-n', '3', './QuaLiKiz'])
+
+    def test_too_many_tasks(self):
+        self.batch.runlist[0].tasks = 6
+        with self.assertWarns(UserWarning):
+            info = schedule_runs(self.batch.runlist, 4, poll_interval=.02)
+        self.assertTrue(all(run['returncode'] == 0 for run in info.values()))
+        first = info['run0']
+        for name in ['run1', 'run2', 'run3']:
+            self.assertGreaterEqual(info[name]['start'], first['end'])
+
+    def test_failure(self):
+        self.write_stub(1)
+        with self.assertRaises(Exception):
+            self.launch()
+
+    def test_unknown_style(self):
+        with self.assertRaises(NotImplementedError):
+            Batch(self.testdir, 'batch', self.batch.runlist, style='random')
+
+    def complete_run(self, run):
+        """ Fake the output of a finished run """
+        xpoint_base = run.qualikiz_plan['xpoint_base']
+        for name in output_file_names(phys_meth=xpoint_base['phys_meth'],
+                                      separateflux=xpoint_base['separateflux']):
+            with open(os.path.join(run.rundir, run.outputdir, name + '.dat'), 'w') as file_:
+                file_.write('1.0\n')
+
+    def test_resume_concurrent(self):
+        complete = self.batch.runlist[1]
+        self.complete_run(complete)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            info = self.batch.launch_concurrent(poll_interval=.02, resume=True)
+        self.assertEqual(list(info), ['run0', 'run2', 'run3'])
+        self.assertFalse(os.path.exists(os.path.join(complete.rundir, 'mpirun.log')))
+        self.assertTrue(complete.is_complete())
+
+    def test_resume_merges_batchinfo(self):
+        first = self.launch()
+        self.complete_run(self.batch.runlist[1])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            resumed = self.batch.launch_concurrent(poll_interval=.02, resume=True)
+        path = os.path.join(self.testdir, 'batch', Batch.batchinfofile)
+        with open(path) as file_:
+            batchinfo = json.load(file_)
+        self.assertEqual(batchinfo['style'], 'concurrent')
+        self.assertEqual(list(batchinfo['runs']), ['run0', 'run1', 'run2', 'run3'])
+        self.assertEqual(batchinfo['runs']['run1'], json.loads(json.dumps(first['run1'])))
+        for name in resumed:
+            self.assertEqual(batchinfo['runs'][name], json.loads(json.dumps(resumed[name])))
+
+    def test_resume_nothing(self):
+        for run in self.batch.runlist:
+            self.complete_run(run)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.assertIsNone(self.batch.launch_concurrent(resume=True))
+        self.assertFalse(any(os.path.exists(os.path.join(run.rundir, 'mpirun.log'))
+                             for run in self.batch.runlist))
+
+    def test_resume_sequential(self):
+        self.batch.style = 'sequential'
+        for run in self.batch.runlist[:3]:
+            self.complete_run(run)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.batch.launch(resume=True)
+        batchdir = os.path.join(self.testdir, 'batch')
+        with open(os.path.join(batchdir, Batch.resume_scriptname)) as file_:
+            script = file_.read()
+        self.assertIn('-wdir run3 ', script)
+        self.assertNotIn('run0', script)
+        self.assertTrue(all(run.is_complete() for run in self.batch.runlist[:3]))
+
+        self.complete_run(self.batch.runlist[3])
+        os.remove(os.path.join(batchdir, Batch.resume_scriptname))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.batch.launch(resume=True)
+        self.assertFalse(os.path.exists(os.path.join(batchdir, Batch.resume_scriptname)))
+
+    def tearDown(self):
+        os.environ['PATH'] = self.old_path
+        shutil.rmtree(self.testdir, ignore_errors=True)
@@ -0,0 +1,82 @@
+from unittest import TestCase
+import os
+import json
+import shutil
+import sqlite3
+import warnings
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun, QuaLiKizBatch
+from qualikiz_tools.machine_specific.basicpoll import (parallel_map, stdout_row,
+                                                       create_stdout_database,
+                                                       create_jobdata_database)
+
+stdout_template = """QuaLiKiz started
+Profiling: MPI tasks = 4
+Profiling: OpenMP threads = 1
+Profiling: points per task = {points:d}
+Profiling: input time = 0.012 s
+Profiling: dispersion relation time = 2.500 s
+Profiling: eigenvalue time = 1.000 s
+Profiling: integration time = 1.000 s
+Profiling: flux time = 0.100 s
+Profiling: output time = 0.010 s
+Profiling: Total time = {points:d}.000 s
+"""
+
+class TestBasicPoll(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_basicpoll')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        plan = QuaLiKizPlan.from_defaults()
+        batchlist = []
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for ii in range(2):
+                name = 'batch' + str(ii)
+                runlist = [QuaLiKizRun(os.path.join(self.testdir, name), 'run' + str(jj),
+                                       '../../QuaLiKiz', qualikiz_plan=plan)
+                           for jj in range(3)]
+                batch = QuaLiKizBatch(self.testdir, name, runlist)
+                batch.prepare(overwrite_batch=True)
+                with open(os.path.join(self.testdir, name, batch.batchinfofile), 'w') as file_:
+                    json.dump({'jobnumber': str(100 + ii)}, file_)
+                for jj, run in enumerate(runlist):
+                    with open(os.path.join(run.rundir, run.stdout), 'w') as file_:
+                        file_.write(stdout_template.format(points=jj + 1))
+                    with open(os.path.join(run.rundir, 'output', 'vfi_GB.dat'), 'w'):
+                        pass
+                batchlist.append(batch)
+        # Runs that are not done are skipped
+        os.remove(os.path.join(batchlist[1].runlist[2].rundir, 'output', 'vfi_GB.dat'))
+        self.batchlist = batchlist
+        self.dbpath = os.path.join(self.testdir, 'poll.sqlite3')
+
+    def test_stdout_row(self):
+        run = self.batchlist[0].runlist[1]
+        row = stdout_row(('100', 1, os.path.join(run.rundir, run.stdout)))
+        self.assertEqual(row, [100, 1, 4, 1, 2, 12, 2500, 1000, 1000, 100, 10, 2000])
+
+    def test_parallel_map(self):
+        self.assertEqual(parallel_map(abs, range(-20, 20), processes=2),
+                         parallel_map(abs, range(-20, 20)))
+
+    def test_stdout_database(self):
+        create_stdout_database(self.batchlist, self.dbpath, overwrite=True,
+                               append=False, processes=2)
+        db = sqlite3.connect(self.dbpath)
+        rows = db.execute('SELECT Jobnumber, Runnumber, Total FROM stdout').fetchall()
+        self.assertEqual(rows, [(100, 0, 1000), (100, 1, 2000), (100, 2, 3000),
+                                (101, 0, 1000), (101, 1, 2000)])
+        self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        db.close()
+
+    def test_jobdata_database(self):
+        create_jobdata_database(self.batchlist, self.dbpath, overwrite=True, append=False)
+        db = sqlite3.connect(self.dbpath)
+        rows = db.execute('SELECT Jobnumber, Nodes FROM jobdata').fetchall()
+        self.assertEqual(rows, [(100, None), (101, None)])
+        db.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir, ignore_errors=True)
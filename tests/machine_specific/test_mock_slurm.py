@@ -0,0 +1,191 @@
+from unittest import TestCase
+import os
+import shutil
+import stat
+import json
+import time
+import sqlite3
+import subprocess
+import warnings
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.machine_specific.mock_slurm import install, connect
+from qualikiz_tools.machine_specific.slurm import Run, Batch
+from qualikiz_tools.machine_specific.sacct import poll_sacct, create_sacct_database
+
+job_script = """#!/bin/bash -l
+#SBATCH --job-name={name!s}
+#SBATCH --output=out_%j.txt
+{directives!s}
+echo "job $SLURM_JOB_ID task $SLURM_ARRAY_TASK_ID"
+sleep {sleep!s}
+exit {exitcode!s}
+"""
+
+stub_mpirun = """#!/bin/bash
+# Stub of mpirun: pretend to work
+printf '%s\\n' "$@"
+"""
+
+class TestMockSlurm(TestCase):
+    max_jobs = 2
+
+    def setUp(self):
+        self.testdir = os.path.abspath('test_mock_slurm')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        self.spooldir = os.path.join(self.testdir, 'spool')
+        bindir = install(os.path.join(self.testdir, 'bin'), self.spooldir,
+                         max_jobs=self.max_jobs)
+        self.old_path = os.environ['PATH']
+        os.environ['PATH'] = bindir + os.pathsep + self.old_path
+
+    def submit(self, name='test', directives='', sleep=0, exitcode=0):
+        path = os.path.join(self.testdir, name + '.sh')
+        with open(path, 'w') as file_:
+            file_.write(job_script.format(name=name, directives=directives,
+                                          sleep=sleep, exitcode=exitcode))
+        out = subprocess.check_output(['sbatch', '--parsable', path],
+                                      cwd=self.testdir)
+        return int(out)
+
+    def wait(self, timeout=20):
+        start = time.time()
+        while time.time() - start < timeout:
+            if subprocess.check_output(['squeue', '-h']).strip() == b'':
+                return
+            time.sleep(.05)
+        raise Exception('Jobs did not finish in time')
+
+    def sacct(self, *args):
+        out = subprocess.check_output(['sacct', '-P'] + list(args)).decode('UTF-8')
+        lines = out.splitlines()
+        header = lines[0].split('|')
+        return [dict(zip(header, line.split('|'))) for line in lines[1:]]
+
+    def times(self):
+        db = connect(self.spooldir)
+        times = db.execute('SELECT start_time, end_time FROM jobs').fetchall()
+        db.close()
+        return times
+
+    def assertMaxOverlap(self, times, max_overlap):
+        events = sorted([(start, 1) for start, __ in times] +
+                        [(end, -1) for __, end in times])
+        running = 0
+        for __, change in events:
+            running += change
+            self.assertLessEqual(running, max_overlap)
+
+    def test_submit(self):
+        first = self.submit()
+        second = self.submit(name='failing', exitcode=3)
+        self.assertEqual(second, first + 1)
+        self.wait()
+        jobs = self.sacct('-o', 'JobID,JobName,State,ExitCode,CPUTimeRAW')
+        self.assertEqual(jobs[0], {'JobID': str(first), 'JobName': 'test',
+                                   'State': 'COMPLETED', 'ExitCode': '0:0',
+                                   'CPUTimeRAW': '0'})
+        self.assertEqual(jobs[1]['State'], 'FAILED')
+        self.assertEqual(jobs[1]['ExitCode'], '3:0')
+        with open(os.path.join(self.testdir, 'out_{:d}.txt'.format(first))) as file_:
+            self.assertEqual(file_.read().strip(), 'job {:d} task'.format(first))
+
+    def test_start_failure(self):
+        # The output folder does not exist, so the job cannot start
+        jobid = self.submit(directives='#SBATCH --error=missing/err_%j.txt')
+        self.wait()
+        jobs = self.sacct('-j', str(jobid), '-o', 'JobID,State,ExitCode')
+        self.assertEqual(jobs[0]['State'], 'FAILED')
+        self.assertEqual(jobs[0]['ExitCode'], '1:0')
+
+    def test_long_format(self):
+        jobid = self.submit()
+        self.wait()
+        out = subprocess.check_output(
+            'sacct -o submit,CPUTime,CPUTimeRAW,NNodes -lXP --noconvert -j ' + str(jobid),
+            shell=True).decode('UTF-8')
+        header, line = out.splitlines()
+        self.assertEqual(header.split('|')[:6],
+                         ['Submit', 'CPUTime', 'CPUTimeRAW', 'NNodes', 'JobID', 'JobIDRaw'])
+        self.assertEqual(len(header.split('|')), 47)
+        self.assertEqual(len(line.split('|')), 47)
+
+    def test_concurrency(self):
+        for __ in range(4):
+            self.submit(sleep=.3)
+        self.wait()
+        times = self.times()
+        self.assertEqual(len(times), 4)
+        self.assertMaxOverlap(times, self.max_jobs)
+
+    def test_array(self):
+        jobid = self.submit(directives='#SBATCH --array=0-3%1', sleep=.1)
+        self.wait()
+        jobs = self.sacct('-j', str(jobid), '-o', 'JobID,State')
+        self.assertEqual([job['JobID'] for job in jobs],
+                         ['{:d}_{:d}'.format(jobid, ii) for ii in range(4)])
+        self.assertMaxOverlap(self.times(), 1)
+        with open(os.path.join(self.testdir, 'out_{:d}.txt'.format(jobid))) as file_:
+            self.assertEqual(file_.read().split()[-1], '3')
+
+    def test_squeue(self):
+        jobid = self.submit(sleep=.5)
+        out = subprocess.check_output(['squeue']).decode('UTF-8').splitlines()
+        self.assertEqual(out[0].split()[0], 'JOBID')
+        self.assertEqual(out[1].split()[0], str(jobid))
+        self.wait()
+
+    def test_srun(self):
+        os.makedirs(os.path.join(self.testdir, 'sub'))
+        out = subprocess.check_output(['srun', '--exclusive', '-n', '2',
+                                       '--chdir', 'sub', 'pwd'], cwd=self.testdir)
+        self.assertEqual(out.decode('UTF-8').strip(), os.path.join(self.testdir, 'sub'))
+
+    def make_batch(self, name='batch'):
+        mpirun = os.path.join(self.testdir, 'bin', 'mpirun')
+        if not os.path.exists(mpirun):
+            with open(mpirun, 'w') as file_:
+                file_.write(stub_mpirun)
+            os.chmod(mpirun, os.stat(mpirun).st_mode | stat.S_IXUSR)
+        run = Run(os.path.join(self.testdir, name), 'run0', '../../QuaLiKiz',
+                  qualikiz_plan=QuaLiKizPlan.from_defaults(), tasks=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            batch = Batch(self.testdir, name, [run])
+            batch.prepare(overwrite_batch=True)
+        with open(os.path.join(run.rundir, run.inputdir, 'R0.bin'), 'w'):
+            pass
+        return batch
+
+    def test_slurm_batch(self):
+        batch = self.make_batch()
+        run = batch.runlist[0]
+        batch.launch()
+        batchdir = os.path.join(self.testdir, 'batch')
+        with open(os.path.join(batchdir, Batch.batchinfofile)) as file_:
+            jobnumber = json.load(file_)['jobnumber']
+        self.wait()
+        header, table = poll_sacct(batch)
+        self.assertEqual(len(table), 1)
+        job = dict(zip(header, table[0]))
+        self.assertEqual(job['JobID'], jobnumber)
+        self.assertEqual(job['JobName'], 'batch')
+        self.assertEqual(job['State'], 'COMPLETED')
+        with open(os.path.join(run.rundir, run.stdout)) as file_:
+            self.assertEqual(file_.read().split(), ['-n', '1', '-wdir', 'run0', './QuaLiKiz'])
+
+    def test_sacct_database(self):
+        batchlist = [self.make_batch('batch' + str(ii)) for ii in range(3)]
+        for batch in batchlist:
+            batch.launch()
+        self.wait()
+        dbpath = os.path.join(self.testdir, 'poll.sqlite3')
+        create_sacct_database(batchlist, dbpath, overwrite=True, append=False)
+        db = sqlite3.connect(dbpath)
+        rows = db.execute('SELECT JobName, State FROM sacct').fetchall()
+        db.close()
+        self.assertEqual(rows, [('batch' + str(ii), 'COMPLETED') for ii in range(3)])
+
+    def tearDown(self):
+        os.environ['PATH'] = self.old_path
+        shutil.rmtree(self.testdir, ignore_errors=True)
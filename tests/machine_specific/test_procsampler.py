@@ -0,0 +1,119 @@
+from unittest import TestCase
+import os
+import sys
+import stat
+import shutil
+import sqlite3
+import subprocess
+import warnings
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizBatch
+from qualikiz_tools.qualikiz_io.campaign import campaign_env_var
+from qualikiz_tools.qualikiz_io.synthetic import install_stub
+from qualikiz_tools.machine_specific.bash import Run
+from qualikiz_tools.machine_specific.procsampler import *
+
+# Allocates 64MB, then starts a child that only sleeps
+parent_code = """
+import subprocess, sys, time
+data = bytearray(64 * 2 ** 20)
+child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(.5)'])
+end = time.time() + .3
+while time.time() < end:
+    pass
+child.wait()
+"""
+
+stub_mpirun = """#!/bin/sh
+# Stub of mpirun: start the binary once, without MPI
+shift 2
+OMPI_COMM_WORLD_RANK=0 exec "$@"
+"""
+
+class TestProcSampler(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_procsampler')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        os.makedirs(self.testdir)
+        self.old_env = {name: os.environ.get(name) for name in [campaign_env_var, sample_env_var]}
+        os.environ[campaign_env_var] = ''
+        os.environ.pop(sample_env_var, None)
+
+    def test_sampler(self):
+        env = dict(os.environ, OMPI_COMM_WORLD_RANK='3')
+        process = subprocess.Popen([sys.executable, '-c', parent_code], env=env)
+        with ProcessSampler(process.pid, interval=.05) as sampler:
+            process.wait()
+        pids = set(sample['pid'] for sample in sampler.samples)
+        self.assertIn(process.pid, pids)
+        self.assertEqual(len(pids), 2)
+        self.assertEqual(set(sample['rank'] for sample in sampler.samples), {3})
+        self.assertTrue(all(sample['cpu'] is not None for sample in sampler.samples))
+        parent = [sample for sample in sampler.samples if sample['pid'] == process.pid]
+        self.assertGreater(max(sample['rss'] for sample in parent), 64 * 2 ** 20)
+        self.assertGreater(max(sample['cpu'] for sample in parent), .1)
+        self.assertTrue(all(b['time'] >= a['time'] for a, b in zip(parent, parent[1:])))
+
+        path = os.path.join(self.testdir, samples_file)
+        sampler.to_csv(path)
+        rows = read_samples(path)
+        self.assertEqual(len(rows), len(sampler.samples))
+        self.assertEqual(rows[0], [sampler.samples[0][field] for field in fields])
+
+    def test_launch(self):
+        bindir = os.path.join(self.testdir, 'bin')
+        install_stub(os.path.join(bindir, 'QuaLiKiz'))
+        mpirun = os.path.join(bindir, 'mpirun')
+        with open(mpirun, 'w') as file_:
+            file_.write(stub_mpirun)
+        os.chmod(mpirun, os.stat(mpirun).st_mode | stat.S_IXUSR)
+        plan = QuaLiKizPlan.from_defaults()
+        plan['xpoint_base']['meta']['phys_meth'] = 2
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            runs = [Run(self.testdir, name, '../bin/QuaLiKiz', qualikiz_plan=plan, tasks=1)
+                    for name in ['run0', 'run1']]
+            for run in runs:
+                run.prepare(overwrite=True)
+        old_path = os.environ['PATH']
+        os.environ['PATH'] = bindir + os.pathsep + old_path
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                runs[0].launch(sample_interval=.05)
+                runs[1].launch()
+        finally:
+            os.environ['PATH'] = old_path
+        self.assertTrue(runs[0].is_complete())
+        self.assertTrue(os.path.isfile(os.path.join(runs[0].rundir, samples_file)))
+        self.assertFalse(os.path.isfile(os.path.join(runs[1].rundir, samples_file)))
+
+        dbpath = os.path.join(self.testdir, 'poll.sqlite3')
+        batch = QuaLiKizBatch(self.testdir, 'batch0', runs)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            create_samples_database([batch], dbpath, append=False, overwrite=True)
+        self.assertEqual(len(caught), 1)
+        db = sqlite3.connect(dbpath)
+        self.assertEqual(db.execute('SELECT DISTINCT Run, Rank FROM samples').fetchall(),
+                         [(runs[0].rundir, 0)])
+        (run, duration, rss, rank_rss, imbalance), = summarize(db)
+        db.close()
+        self.assertEqual(run, runs[0].rundir)
+        self.assertGreater(rss, 0)
+        self.assertEqual(rss, rank_rss)
+        self.assertEqual(imbalance, 1)
+
+    def test_default_interval(self):
+        self.assertIsNone(default_interval())
+        os.environ[sample_env_var] = '0.5'
+        self.assertEqual(default_interval(), .5)
+
+    def tearDown(self):
+        for name, value in self.old_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(self.testdir, ignore_errors=True)
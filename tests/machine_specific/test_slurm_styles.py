@@ -0,0 +1,186 @@
+from unittest import TestCase
+from collections import OrderedDict
+import os
+import shutil
+import warnings
+
+import numpy as np
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.walltime_model import WalltimeModel
+from qualikiz_tools.machine_specific.slurm import Run, Batch, pack_runs
+
+class TestBatchStyles(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_slurm_styles')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        plan = QuaLiKizPlan.from_defaults()
+        self.runlist = [Run(os.path.join(self.testdir, 'batch'), 'run' + str(ii),
+                            '../../QuaLiKiz', qualikiz_plan=plan, tasks=tasks)
+                        for ii, tasks in enumerate([2, 2, 3, 1])]
+        # Every run takes an hour, whatever the amount of cores
+        self.model = WalltimeModel(features=['log_cores'],
+                                   coefficients=[np.log(3600), 0.])
+
+    def make_batch(self, style, **kwargs):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return Batch(self.testdir, 'batch', self.runlist, style=style,
+                         tasks_per_node=4, walltime_model=self.model,
+                         **kwargs)
+
+    def assertMaxtime(self, batch, maxtime):
+        def to_seconds(string):
+            h, m, s = [int(part) for part in string.split(':')]
+            return 3600 * h + 60 * m + s
+        self.assertAlmostEqual(to_seconds(batch.maxtime), to_seconds(maxtime),
+                               delta=1)
+
+    def prepare(self, batch):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            batch.prepare(overwrite_batch=True)
+        path = os.path.join(self.testdir, 'batch', batch.scriptname)
+        with open(path) as file_:
+            script = file_.read()
+        return path, script
+
+    def test_sequential(self):
+        batch = self.make_batch('sequential')
+        self.assertEqual(batch.nodes, 1)
+        self.assertMaxtime(batch, '6:01:00')
+
+    def test_job_array(self):
+        batch = self.make_batch('job_array', array_throttle=2)
+        self.assertEqual(batch.nodes, 1)
+        self.assertMaxtime(batch, '1:31:00')
+        path, script = self.prepare(batch)
+        self.assertIn('#SBATCH --array=0-3%2\n', script)
+        self.assertIn('#SBATCH --output=stdout.batch_%a\n', script)
+        self.assertIn('    2) mpirun -n 3 -wdir run2 ./QuaLiKiz', script)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            new = Batch.from_batch_file(path)
+        self.assertEqual(new.style, 'job_array')
+        self.assertEqual(new.array_throttle, 2)
+        self.assertEqual(new.stdout, 'stdout.batch')
+        self.assertEqual([run.tasks for run in new.runlist], [2, 2, 3, 1])
+        self.assertEqual(new.runlist[2].rundir, self.runlist[2].rundir)
+
+    def test_packed(self):
+        batch = self.make_batch('packed')
+        self.assertEqual(batch.nodes, 2)
+        self.assertEqual(len(batch.pack_waves()), 1)
+        self.assertMaxtime(batch, '1:31:00')
+        __, script = self.prepare(batch)
+        self.assertEqual(script.count('&\n'), 4)
+        self.assertEqual(script.count('\nwait'), 1)
+
+    def test_packed_nodes(self):
+        batch = self.make_batch('packed', packed_nodes=1)
+        self.assertEqual(batch.nodes, 1)
+        waves = batch.pack_waves()
+        self.assertEqual([[run.tasks for run in wave] for wave in waves],
+                         [[2, 2], [3, 1]])
+        self.assertMaxtime(batch, '3:01:00')
+        path, script = self.prepare(batch)
+        self.assertIn('srun --exclusive -n 3 --chdir run2 ./QuaLiKiz '
+                      '> run2/stdout.run 2> run2/stderr.run &', script)
+        self.assertEqual(script.count('\nwait'), 2)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            new = Batch.from_batch_file(path)
+        self.assertEqual(new.style, 'packed')
+        self.assertEqual(new.packed_nodes, 1)
+        self.assertEqual([run.tasks for run in new.runlist], [2, 2, 3, 1])
+        self.assertEqual(new.runlist[0].stdout, 'stdout.run')
+
+    def test_resume_script(self):
+        batch = self.make_batch('job_array')
+        path = os.path.join(self.testdir, 'resume.batch')
+        os.makedirs(self.testdir)
+        batch.to_batch_file(path, runlist=self.runlist[2:])
+        with open(path) as file_:
+            script = file_.read()
+        self.assertIn('#SBATCH --array=0-1\n', script)
+        self.assertIn('    1) mpirun -n 1 -wdir run3', script)
+
+    def test_unknown_style(self):
+        with self.assertRaises(NotImplementedError):
+            self.make_batch('random')
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir, ignore_errors=True)
+
+
+class TestPackRuns(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_slurm_pack')
+        # Walltime in minutes is dimx, whatever the amount of cores
+        self.model = WalltimeModel(features=['log_dimx'],
+                                   coefficients=[np.log(60), 1.])
+
+    def make_runs(self, dimxs, tasks=None):
+        if tasks is None:
+            tasks = [1] * len(dimxs)
+        runlist = []
+        for ii, (dimx, num_tasks) in enumerate(zip(dimxs, tasks)):
+            plan = QuaLiKizPlan.from_defaults()
+            plan['scan_type'] = 'parallel'
+            plan['scan_dict'] = OrderedDict([('Ati', np.linspace(1, 2, dimx))])
+            runlist.append(Run(self.testdir, 'run' + str(ii), '../QuaLiKiz',
+                               qualikiz_plan=plan, tasks=num_tasks))
+        return runlist
+
+    def pack(self, runlist, **kwargs):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return pack_runs(self.testdir, 'batch', runlist, safetytime=1,
+                             walltime_model=self.model, tasks_per_node=4,
+                             **kwargs)
+
+    def assertPacked(self, batches, runlist, expected):
+        packed = [[runlist.index(run) for run in batch.runlist]
+                  for batch in batches]
+        self.assertEqual(packed, expected)
+
+    def test_first_fit_decreasing(self):
+        runlist = self.make_runs([50, 40, 30, 30, 20, 10, 10])
+        # 62 minutes per batch leaves 61 minutes for the runs
+        batches = self.pack(runlist, max_walltime=62 * 60)
+        self.assertPacked(batches, runlist, [[0, 5], [1, 4], [2, 3], [6]])
+        self.assertEqual([batch.name for batch in batches],
+                         ['batch_0', 'batch_1', 'batch_2', 'batch_3'])
+        for batch in batches:
+            self.assertEqual(batch.style, 'sequential')
+            hours, minutes, __ = batch.maxtime.split(':')
+            self.assertLessEqual(60 * int(hours) + int(minutes), 62)
+
+    def test_node_groups(self):
+        runlist = self.make_runs([10, 10, 10, 10], tasks=[8, 2, 8, 4])
+        batches = self.pack(runlist, max_walltime=24 * 3600)
+        self.assertPacked(batches, runlist, [[0, 2], [1, 3]])
+        self.assertEqual([batch.nodes for batch in batches], [2, 1])
+
+    def test_partition_limits(self):
+        runlist = self.make_runs([20, 20, 20])
+        batches = self.pack(runlist, partition='debug')
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(batches[0].partition, 'debug')
+        with self.assertRaises(Exception):
+            self.pack(self.make_runs([1], tasks=[4 * 513]), partition='debug')
+
+    def test_unlimited(self):
+        runlist = self.make_runs([50, 40, 30])
+        batches = self.pack(runlist)
+        self.assertPacked(batches, runlist, [[0, 1, 2]])
+
+    def test_too_long(self):
+        runlist = self.make_runs([90, 10])
+        with self.assertWarns(UserWarning):
+            batches = pack_runs(self.testdir, 'batch', runlist, safetytime=1,
+                                walltime_model=self.model, tasks_per_node=1,
+                                max_walltime=61 * 60)
+        self.assertPacked(batches, runlist, [[0], [1]])
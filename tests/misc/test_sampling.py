@@ -0,0 +1,70 @@
+import unittest
+from unittest import TestCase, skip
+
+import numpy as np
+from numpy.testing import assert_almost_equal, assert_array_equal
+
+from qualikiz_tools.misc.sampling import *
+
+class TestSobol(TestCase):
+    def test_first_points(self):
+        points = sobol(4, 2, skip=0)
+        assert_almost_equal(points, [[0., 0.],
+                                     [.5, .5],
+                                     [.75, .25],
+                                     [.25, .75]])
+
+    def test_skip(self):
+        points = sobol(8, 3, skip=0)
+        assert_almost_equal(sobol(7, 3), points[1:])
+
+    def test_balanced(self):
+        points = sobol(2 ** 6, 5, skip=0)
+        for dim in range(5):
+            counts = np.histogram(points[:, dim], bins=8, range=(0, 1))[0]
+            assert_array_equal(counts, 8)
+
+    def test_scramble(self):
+        points = sobol(16, 3, scramble=True, seed=1)
+        assert_almost_equal(points, sobol(16, 3, scramble=True, seed=1))
+        self.assertFalse(np.allclose(points, sobol(16, 3)))
+        self.assertTrue(np.all((points >= 0) & (points < 1)))
+
+    def test_too_many_dims(self):
+        with self.assertRaises(ValueError):
+            sobol(4, max_sobol_dims + 1)
+
+class TestHalton(TestCase):
+    def test_first_points(self):
+        points = halton(3, 2)
+        assert_almost_equal(points, [[1/2, 1/3],
+                                     [1/4, 2/3],
+                                     [3/4, 1/9]])
+
+    def test_scramble(self):
+        points = halton(16, 3, scramble=True, seed=1)
+        self.assertTrue(np.all((points >= 0) & (points < 1)))
+        self.assertFalse(np.allclose(points, halton(16, 3)))
+
+class TestLatinHypercube(TestCase):
+    def test_strata(self):
+        points = latin_hypercube(10, 3, seed=2)
+        for dim in range(3):
+            assert_array_equal(np.sort(np.floor(points[:, dim] * 10)),
+                               np.arange(10))
+
+class TestScaleToRanges(TestCase):
+    def test_linear(self):
+        points = scale_to_ranges(np.array([[0., .5], [.5, 1.]]),
+                                 [[1, 3], [-2, 2]])
+        assert_almost_equal(points, [[1, 0], [2, 2]])
+
+    def test_log(self):
+        points = scale_to_ranges(np.array([[.5, .5]]),
+                                 [[1, 100], [1, 100]],
+                                 log_scale=[True, False])
+        assert_almost_equal(points, [[10, 50.5]])
+
+    def test_log_negative(self):
+        with self.assertRaises(ValueError):
+            scale_to_ranges(np.array([[.5]]), [[-1, 1]], log_scale=[True])
@@ -0,0 +1,123 @@
+from unittest import TestCase
+from collections import OrderedDict
+import os
+import stat
+import shutil
+import warnings
+
+import numpy as np
+import xarray as xr
+from numpy.testing import assert_almost_equal, assert_array_equal
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.adaptive import *
+from qualikiz_tools.qualikiz_io.campaign import campaign_env_var
+from qualikiz_tools.qualikiz_io.synthetic import install_stub
+
+def critical_gradient(plan, name):
+    """ Stub QuaLiKiz with a critical gradient at Ati = 4 """
+    ati = np.array(plan['scan_dict']['Ati'])
+    ate = np.array(plan['scan_dict']['Ate'])
+    efi = np.maximum(ati - 4, 0)
+    return {'efe_GB': 1 + .01 * ate,
+            'efi_GB': efi,
+            'gam_GB': efi / 10}
+
+stub_mpirun = """#!/bin/sh
+# Stub of mpirun: start the binary once, without MPI
+shift 2
+exec "$@"
+"""
+
+class TestReduceFlux(TestCase):
+    def test_reduce(self):
+        da = xr.DataArray([[1, -3], [2, np.nan]], dims=['dimx', 'nions'])
+        assert_array_equal(reduce_flux(da), [-3, 2])
+
+    def test_reduce_transposed(self):
+        da = xr.DataArray([[1, -3], [2, 0]], dims=['nions', 'dimx'])
+        assert_array_equal(reduce_flux(da), [2, -3])
+
+class TestFlagSegments(TestCase):
+    def test_flags(self):
+        left = [[0], [1], [1], [1], [1e-6]]
+        right = [[1], [-1], [1.1], [3], [0]]
+        assert_array_equal(flag_segments(left, right),
+                           [True, True, False, True, False])
+
+class TestAdaptiveScan(TestCase):
+    def setUp(self):
+        xpoint_base = QuaLiKizPlan.from_defaults()['xpoint_base']
+        scan_dict = OrderedDict([('Ati', np.linspace(0, 12, 4)),
+                                 ('Ate', [2, 6])])
+        self.scan = AdaptiveScan('.', 'adaptive', 'QuaLiKiz', xpoint_base,
+                                 scan_dict, {'Ati': .1, 'Ate': 1},
+                                 max_iterations=10,
+                                 evaluate=critical_gradient)
+
+    def test_coarse_grid(self):
+        points, segments = self.scan.coarse_grid()
+        self.assertEqual(len(points), 8)
+        # 3 segments along Ati for 2 Ate values, 1 along Ate for 4 Ati
+        self.assertEqual(len(segments), 10)
+
+    def test_run(self):
+        df = self.scan.run()
+        ati = np.unique(df['Ati'])
+        # Threshold is resolved up to the target resolution
+        below = ati[ati <= 4].max()
+        above = ati[ati > 4].min()
+        self.assertLess(above - below, .2)
+        self.assertLess(len(df), self.scan.uniform_points())
+        # Refinement does not add points along the linear Ate direction
+        assert_array_equal(np.unique(df['Ate']), [2, 6])
+
+    def test_max_iterations(self):
+        self.scan.max_iterations = 1
+        with warnings.catch_warnings(record=True) as ww:
+            warnings.simplefilter('always')
+            self.scan.run()
+        self.assertEqual(self.scan.iterations, 1)
+        self.assertTrue(any('max_iterations' in str(w.message) for w in ww))
+
+class TestAdaptiveQuaLiKiz(TestCase):
+    """ Run the scan through the bash machine with the synthetic QuaLiKiz stub """
+    def setUp(self):
+        self.testdir = os.path.abspath('test_adaptive')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        bindir = os.path.join(self.testdir, 'bin')
+        install_stub(os.path.join(bindir, 'QuaLiKiz'))
+        mpirun = os.path.join(bindir, 'mpirun')
+        with open(mpirun, 'w') as file_:
+            file_.write(stub_mpirun)
+        os.chmod(mpirun, os.stat(mpirun).st_mode | stat.S_IXUSR)
+        self.old_path = os.environ['PATH']
+        os.environ['PATH'] = bindir + os.pathsep + self.old_path
+        self.old_env = os.environ.get(campaign_env_var)
+        os.environ[campaign_env_var] = ''
+
+    def test_run_qualikiz(self):
+        xpoint_base = QuaLiKizPlan.from_defaults()['xpoint_base']
+        scan_dict = OrderedDict([('Ati', [0, 6, 12]), ('Ate', [2, 6])])
+        scan = AdaptiveScan(self.testdir, 'adaptive', '../../bin/QuaLiKiz', xpoint_base,
+                            scan_dict, 3, run_kwargs={'tasks': 1}, max_iterations=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            df = scan.run()
+        self.assertEqual(scan.iterations, 1)
+        # Every iteration is a run that was prepared, launched and read back
+        for name in os.listdir(scan.scandir):
+            rundir = os.path.join(scan.scandir, name)
+            self.assertTrue(os.path.isfile(os.path.join(rundir, 'input', 'Ati.bin')))
+            self.assertTrue(os.path.isfile(os.path.join(rundir, name + '.nc')))
+        self.assertGreaterEqual(len(df), 6)
+        for flux in default_fluxes:
+            self.assertTrue(np.all(np.isfinite(df[flux])))
+
+    def tearDown(self):
+        os.environ['PATH'] = self.old_path
+        if self.old_env is None:
+            del os.environ[campaign_env_var]
+        else:
+            os.environ[campaign_env_var] = self.old_env
+        shutil.rmtree(self.testdir, ignore_errors=True)
@@ -0,0 +1,128 @@
+from unittest import TestCase
+import os
+import shutil
+import warnings
+from unittest.mock import patch
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.outputfiles import output_file_names
+from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun
+from qualikiz_tools.qualikiz_io.campaign import (CampaignDB, campaign_env_var, record_state,
+                                                 default_campaign_path)
+from qualikiz_tools.qualikiz_io.dir_index import index_env_var
+
+class TestCampaignDB(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_campaign')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        os.makedirs(self.testdir)
+        self.dbpath = os.path.join(self.testdir, 'campaign.sqlite')
+        self.old_env = os.environ.get(campaign_env_var)
+        os.environ[campaign_env_var] = self.dbpath
+        self.db = CampaignDB()
+        self.rundirs = [os.path.join(self.testdir, 'batch', 'run' + str(ii))
+                        for ii in range(3)]
+
+    def make_run(self, name, overwrite=True):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            run = QuaLiKizRun(os.path.join(self.testdir, 'batch'), name,
+                              '../../QuaLiKiz', qualikiz_plan=QuaLiKizPlan.from_defaults())
+            run.prepare(overwrite=overwrite)
+        return run
+
+    def write_output(self, run):
+        xpoint_base = run.qualikiz_plan['xpoint_base']
+        for name in output_file_names(phys_meth=xpoint_base['phys_meth'],
+                                      separateflux=xpoint_base['separateflux']):
+            with open(os.path.join(run.rundir, run.outputdir, name + '.dat'), 'w') as file_:
+                file_.write('1.\n')
+
+    def test_record(self):
+        self.db.record(self.rundirs, 'launched')
+        self.db.record(self.rundirs[:1], 'done')
+        self.db.record(self.rundirs[:2], 'prepared')
+        self.assertEqual(list(self.db.runs().values()), ['done', 'launched', 'launched'])
+        self.db.record(self.rundirs[:1], 'prepared', regress=True)
+        self.assertEqual(self.db.runs(state='prepared'), {self.rundirs[0]: 'prepared'})
+        self.assertEqual(self.db.states(self.rundirs[1:] + [self.testdir]),
+                         {self.rundirs[1]: 'launched', self.rundirs[2]: 'launched'})
+
+    def test_counts(self):
+        self.db.record(self.rundirs, 'netcdf')
+        self.db.record([os.path.join(self.testdir, 'batch_other', 'run0')], 'done')
+        counts = self.db.counts(os.path.join(self.testdir, 'batch'))
+        self.assertEqual(counts['netcdf'], 3)
+        self.assertEqual(sum(counts.values()), 3)
+        self.assertEqual(list(counts), ['prepared', 'input_generated', 'launched',
+                                        'done', 'netcdf', 'glued'])
+
+    def test_unknown_state(self):
+        with self.assertRaises(Exception):
+            self.db.record(self.rundirs, 'finished')
+
+    def test_lifecycle(self):
+        run = self.make_run('run0')
+        self.assertEqual(self.db.runs(), {run.rundir: 'prepared'})
+        run.generate_input()
+        self.assertEqual(self.db.runs(), {run.rundir: 'input_generated'})
+        record_state([run.rundir], 'launched', regress=True)
+        self.assertEqual(self.db.refresh(self.testdir), [])
+        self.write_output(run)
+        self.assertEqual(self.db.refresh(self.testdir), [run.rundir])
+        self.assertEqual(self.db.runs(), {run.rundir: 'done'})
+        # Preparing again in place does not move the run back
+        self.make_run('run0', overwrite=False)
+        self.assertEqual(self.db.runs(), {run.rundir: 'done'})
+        # Recreating the run folder does
+        self.make_run('run0')
+        self.assertEqual(self.db.runs(), {run.rundir: 'prepared'})
+
+    def test_disabled_by_default(self):
+        del os.environ[campaign_env_var]
+        self.assertIsNone(default_campaign_path())
+        with self.assertRaises(Exception):
+            CampaignDB()
+        os.environ[campaign_env_var] = ''
+        self.assertIsNone(default_campaign_path())
+
+    def test_refresh_forgets_removed(self):
+        run = self.make_run('run0')
+        record_state([run.rundir], 'launched', regress=True)
+        shutil.rmtree(run.rundir)
+        self.db.refresh(self.testdir)
+        self.assertEqual(self.db.runs(), {})
+
+    def test_sync(self):
+        os.environ[campaign_env_var] = ''
+        prepared = self.make_run('run0')
+        generated = self.make_run('run1')
+        generated.generate_input()
+        done = self.make_run('run2')
+        self.write_output(done)
+        self.assertEqual(self.db.runs(), {})
+        added = self.db.sync(self.testdir,
+                             index_path=os.path.join(self.testdir, 'index.sqlite'))
+        self.assertEqual(added, {prepared.rundir: 'prepared',
+                                 generated.rundir: 'input_generated',
+                                 done.rundir: 'done'})
+        self.assertEqual(self.db.counts(self.testdir)['done'], 1)
+
+    def test_sync_without_index(self):
+        prepared = self.make_run('run0')
+        done = self.make_run('run1')
+        self.write_output(done)
+        with patch.dict(os.environ, {index_env_var: ''}), \
+             patch('qualikiz_tools.qualikiz_io.dir_index.DirIndex',
+                   side_effect=AssertionError('DirIndex used')):
+            added = self.db.sync(self.testdir)
+        self.assertEqual(added, {prepared.rundir: 'prepared',
+                                 done.rundir: 'done'})
+
+    def tearDown(self):
+        self.db.close()
+        if self.old_env is None:
+            del os.environ[campaign_env_var]
+        else:
+            os.environ[campaign_env_var] = self.old_env
+        shutil.rmtree(self.testdir, ignore_errors=True)
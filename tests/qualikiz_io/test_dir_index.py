@@ -0,0 +1,92 @@
+from unittest import TestCase
+from unittest.mock import patch
+import os
+import time
+import shutil
+
+from qualikiz_tools.qualikiz_io import dir_index
+from qualikiz_tools.qualikiz_io.dir_index import DirIndex
+
+class TestDirIndex(TestCase):
+    tree = ['batch0/run0/output', 'batch0/run0/debug', 'batch0/run1',
+            'batch0/notes', 'batch1', 'other/deeper']
+    files = ['batch0/qualikiz.batch', 'batch0/run0/parameters.json',
+             'batch0/run1/parameters.json', 'batch1/qualikiz.batch',
+             'batch1/parameters.json', 'other/deeper/parameters.json']
+
+    def setUp(self):
+        self.testdir = os.path.abspath('test_dir_index')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        for path in self.tree:
+            os.makedirs(os.path.join(self.testdir, 'campaign', path))
+        for path in self.files:
+            with open(os.path.join(self.testdir, 'campaign', path), 'w'):
+                pass
+        self.searchdir = os.path.join(self.testdir, 'campaign')
+        self.age_tree()
+        self.index = DirIndex(os.path.join(self.testdir, 'index.sqlite'))
+
+    def age_tree(self, age=100, paths=None):
+        """ Move the modification times out of the racy window """
+        old = time.time() - age
+        if paths is None:
+            paths = [dirpath for dirpath, __, __ in os.walk(self.searchdir)]
+        for path in paths:
+            os.utime(path, (old, old))
+
+    def count_listings(self):
+        return patch.object(dir_index.os, 'scandir', wraps=os.scandir)
+
+    def test_batches(self):
+        batches = self.index.batches(self.searchdir)
+        join = lambda *paths: os.path.join(self.searchdir, *paths)
+        self.assertEqual(list(batches), [join('batch0'), join('batch1')])
+        self.assertEqual(batches[join('batch0')], [join('batch0', 'run0'),
+                                                   join('batch0', 'run1')])
+        self.assertEqual(batches[join('batch1')], [join('batch1')])
+
+    def test_runs_not_descended(self):
+        records = self.index.scan(self.searchdir)
+        self.assertNotIn(os.path.join(self.searchdir, 'batch0/run0/output'), records)
+        self.assertIn(os.path.join(self.searchdir, 'other/deeper'), records)
+
+    def test_rescan_unchanged(self):
+        self.index.scan(self.searchdir)
+        with self.count_listings() as scandir:
+            records = self.index.scan(self.searchdir)
+        self.assertEqual(scandir.call_count, 0)
+        self.assertEqual(len(records), 8)
+
+    def test_rescan_changed(self):
+        self.index.scan(self.searchdir)
+        newrun = os.path.join(self.searchdir, 'batch0', 'run2')
+        os.makedirs(newrun)
+        with open(os.path.join(newrun, 'parameters.json'), 'w'):
+            pass
+        shutil.rmtree(os.path.join(self.searchdir, 'other'))
+        self.age_tree(age=50, paths=[self.searchdir, os.path.dirname(newrun), newrun])
+        with self.count_listings() as scandir:
+            batches = self.index.batches(self.searchdir)
+        listed = sorted(call[0][0] for call in scandir.call_args_list)
+        self.assertEqual(listed, [self.searchdir, os.path.join(self.searchdir, 'batch0'),
+                                  newrun])
+        self.assertIn(newrun, batches[os.path.join(self.searchdir, 'batch0')])
+        self.assertEqual(len(self.index.cached(self.searchdir)), 7)
+
+    def test_racy_mtime(self):
+        os.utime(self.searchdir)
+        self.index.scan(self.searchdir)
+        with self.count_listings() as scandir:
+            self.index.scan(self.searchdir)
+        self.assertEqual([call[0][0] for call in scandir.call_args_list],
+                         [self.searchdir])
+
+    def test_cached_subtree(self):
+        for sibling in ['batch0_old', 'batch00']:
+            os.makedirs(os.path.join(self.searchdir, sibling))
+        self.index.scan(self.searchdir)
+        self.assertEqual(len(self.index.cached(os.path.join(self.searchdir, 'batch0'))), 4)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.testdir, ignore_errors=True)
@@ -4,6 +4,8 @@ from unittest import TestCase, skip
 import copy
 import os
 
+from numpy.testing import assert_array_equal
+
 from qualikiz_tools.qualikiz_io.inputfiles import *
 
 
@@ -485,3 +487,207 @@ class TestQuaLiKizPlan_hyperrect_files(TestCase):
             os.remove('test.json')
         except FileNotFoundError:
             pass
+
+class TestQuaLiKizPlan_sobol(TestCase):
+    def setUp(self):
+        TestQuaLiKizXpoint.setUp(self)
+        scan_dict = OrderedDict([('Ati', [2, 10]),
+                                 ('Ate', [2, 10]),
+                                 ('smag', [.1, 3])])
+        sample_options = {'num_points': 16}
+        self.qualikizplan = QuaLiKizPlan(scan_dict, 'sobol', self.baseXpoint,
+                                         sample_options=sample_options)
+
+    def test_calculate_dimx(self):
+        self.assertEqual(self.qualikizplan.calculate_dimx(), 16)
+
+    def test_calculate_dimxn(self):
+        self.assertEqual(self.qualikizplan.calculate_dimxn(), 256)
+
+    def test_no_num_points(self):
+        del self.qualikizplan['sample_options']
+        with self.assertRaisesRegex(Exception, 'sample_options*'):
+            self.qualikizplan.calculate_dimx()
+
+    def test_sample_points(self):
+        points = self.qualikizplan.sample_points()
+        self.assertEqual(points.shape, (16, 3))
+        self.assertTrue(np.all((points[:, 0] >= 2) & (points[:, 0] < 10)))
+        self.assertTrue(np.all((points[:, 2] >= .1) & (points[:, 2] < 3)))
+
+    def test_wrong_range(self):
+        self.qualikizplan['scan_dict']['Ati'] = [2, 4, 6]
+        with self.assertRaisesRegex(Exception, 'scan_dict values*'):
+            self.qualikizplan.sample_points()
+
+    def test_setup(self):
+        points = self.qualikizplan.sample_points()
+        byte_arrays = self.qualikizplan.setup()
+        self.assertEqual(byte_arrays['Ati'],
+                         array.array('d', np.tile(points[:, 0], 3)))
+        self.assertEqual(byte_arrays['Ate'], array.array('d', points[:, 1]))
+        self.assertEqual(byte_arrays['smag'], array.array('d', points[:, 2]))
+
+class TestQuaLiKizPlan_loguniform(TestCase):
+    def setUp(self):
+        TestQuaLiKizXpoint.setUp(self)
+        scan_dict = OrderedDict([('Ati', [1, 100]),
+                                 ('Nustar', [1e-3, 1e-1])])
+        sample_options = {'num_points': 1000, 'seed': 3}
+        self.qualikizplan = QuaLiKizPlan(scan_dict, 'loguniform',
+                                         self.baseXpoint,
+                                         sample_options=sample_options)
+
+    def test_sample_points(self):
+        points = self.qualikizplan.sample_points()
+        self.assertTrue(np.all((points[:, 0] >= 1) & (points[:, 0] < 100)))
+        # Half of a log-uniform sample is below the geometric mean
+        self.assertAlmostEqual(np.mean(points[:, 0] < 10), .5, delta=.05)
+        self.assertAlmostEqual(np.mean(points[:, 1] < 1e-2), .5, delta=.05)
+
+    def test_seed(self):
+        points = self.qualikizplan.sample_points()
+        self.qualikizplan['sample_options']['seed'] = 4
+        self.assertFalse(np.allclose(points, self.qualikizplan.sample_points()))
+
+class TestQuaLiKizPlan_sobol_files(TestCase):
+    def setUp(self):
+        TestQuaLiKizPlan_sobol.setUp(self)
+
+    def test_from_json(self):
+        self.qualikizplan.to_json('test.json')
+        newplan = QuaLiKizPlan.from_json('test.json')
+        self.assertEqual(self.qualikizplan, newplan)
+
+    def tearDown(self):
+        try:
+            os.remove('test.json')
+        except FileNotFoundError:
+            pass
+
+class TestQuaLiKizPlan_scan_array(TestCase):
+    def setUp(self):
+        TestQuaLiKizXpoint.setUp(self)
+        scan_dict = OrderedDict([('Ati', [0, 2, 4]),
+                                 ('Ate', [1, 3]),
+                                 ('Ane', [6, 9, 12])])
+        self.qualikizplan = QuaLiKizPlan(scan_dict, 'hyperedge', self.baseXpoint)
+
+    def check_setup(self):
+        points = self.qualikizplan.scan_array()
+        byte_arrays = self.qualikizplan.setup()
+        self.assertEqual(points.shape, (self.qualikizplan.calculate_dimx(), 3))
+        self.assertEqual(byte_arrays['Ati'][:len(points)],
+                         array.array('d', points[:, 0]))
+        self.assertEqual(byte_arrays['Ate'], array.array('d', points[:, 1]))
+        self.assertEqual(byte_arrays['Ane'], array.array('d', points[:, 2]))
+
+    def test_hyperedge(self):
+        self.check_setup()
+
+    def test_hyperrect(self):
+        self.qualikizplan['scan_type'] = 'hyperrect'
+        self.check_setup()
+
+    def test_parallel(self):
+        self.qualikizplan['scan_dict']['Ate'] = [1, 3, 5]
+        self.qualikizplan['scan_type'] = 'parallel'
+        self.check_setup()
+
+class TestQuaLiKizPlan_random_access(TestCase):
+    def setUp(self):
+        TestQuaLiKizPlan_scan_array.setUp(self)
+        self.qualikizplan['xpoint_base']['options']['set_qn_normni'] = True
+        self.qualikizplan['scan_dict']['ni1'] = [.01, .02]
+
+    def check_slices(self):
+        points = self.qualikizplan.scan_array()
+        for start, stop in [(0, 1), (2, 7), (5, len(points))]:
+            assert_array_equal(self.qualikizplan.scan_array(start, stop),
+                               points[start:stop])
+        assert_array_equal(np.vstack(list(self.qualikizplan.iter_scan(chunksize=3))),
+                           points)
+
+    def test_slices_hyperedge(self):
+        self.check_slices()
+
+    def test_slices_hyperrect(self):
+        self.qualikizplan['scan_type'] = 'hyperrect'
+        self.check_slices()
+
+    def test_slices_sobol(self):
+        self.qualikizplan['scan_dict'] = OrderedDict([('Ati', [0, 2]),
+                                                      ('Ate', [1, 3])])
+        self.qualikizplan['scan_type'] = 'sobol'
+        self.qualikizplan['sample_options'] = {'num_points': 10}
+        self.check_slices()
+
+    def test_edge_generator(self):
+        points = list(self.qualikizplan.edge_generator())
+        self.assertEqual(points[0], (0, 1, 6, .01))
+        self.assertEqual(points[4], (0, 3, 6, .01))
+        assert_array_equal(points, self.qualikizplan.scan_array())
+
+    def test_get_xpoint(self):
+        byte_arrays = self.qualikizplan.setup()
+        dimx = self.qualikizplan.calculate_dimx()
+        for ii in range(dimx):
+            xpoint = self.qualikizplan.get_xpoint(ii)
+            self.assertEqual(xpoint['Ati'], byte_arrays['Ati'][ii])
+            self.assertEqual(xpoint['Ane'], byte_arrays['Ane'][ii])
+            for jj, ion in enumerate(xpoint['ions']):
+                self.assertEqual(ion['n'], byte_arrays['normni'][jj * dimx + ii])
+        self.assertEqual(self.qualikizplan.get_xpoint(-1)['ni1'], .02)
+
+    def test_get_xpoint_out_of_range(self):
+        with self.assertRaises(IndexError):
+            self.qualikizplan.get_xpoint(10)
+
+    def test_dict_protocol(self):
+        self.assertEqual(len(self.qualikizplan), len(self.qualikizplan.keys()))
+        self.assertTrue(self.qualikizplan)
+        with self.assertRaises(KeyError):
+            self.qualikizplan[0]
+
+class TestQuaLiKizPlan_npy_files(TestCase):
+    def setUp(self):
+        TestQuaLiKizXpoint.setUp(self)
+        scan_dict = OrderedDict([('Ati', np.linspace(1, 10, 50).tolist()),
+                                 ('Ate', np.linspace(2, 5, 50).tolist()),
+                                 ('smag', [1, 2])])
+        self.qualikizplan = QuaLiKizPlan(scan_dict, 'hyperedge', self.baseXpoint)
+
+    def test_to_json(self):
+        self.qualikizplan.to_json('test.json', npy_threshold=10)
+        self.assertTrue(os.path.isfile('test.Ati.npy'))
+        self.assertTrue(os.path.isfile('test.Ate.npy'))
+        self.assertFalse(os.path.isfile('test.smag.npy'))
+        with open('test.json') as file_:
+            data = json.load(file_)
+        self.assertEqual(data['scan_dict']['Ati'], {'npy': 'test.Ati.npy'})
+        self.assertEqual(data['scan_dict']['smag'], [1, 2])
+
+    def test_from_json(self):
+        self.qualikizplan.to_json('test.json', npy_threshold=10)
+        newplan = QuaLiKizPlan.from_json('test.json')
+        self.assertIsInstance(newplan['scan_dict']['Ati'], np.memmap)
+        self.assertEqual(self.qualikizplan, newplan)
+        self.assertEqual(self.qualikizplan.setup(), newplan.setup())
+
+    def test_roundtrip_memmap(self):
+        self.qualikizplan.to_json('test.json', npy_threshold=10)
+        newplan = QuaLiKizPlan.from_json('test.json')
+        newplan.to_json('test.json', npy_threshold=10)
+        self.assertEqual(self.qualikizplan, QuaLiKizPlan.from_json('test.json'))
+
+    def test_not_equal(self):
+        newplan = copy.deepcopy(self.qualikizplan)
+        newplan['scan_dict']['Ati'] = np.array(newplan['scan_dict']['Ati']) + 1
+        self.assertNotEqual(self.qualikizplan, newplan)
+
+    def tearDown(self):
+        for path in ['test.json', 'test.Ati.npy', 'test.Ate.npy']:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
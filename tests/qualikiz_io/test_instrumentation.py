@@ -0,0 +1,100 @@
+from unittest import TestCase
+import os
+import json
+import shutil
+import sqlite3
+import warnings
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun
+from qualikiz_tools.qualikiz_io.campaign import campaign_env_var
+from qualikiz_tools.qualikiz_io import instrumentation
+from qualikiz_tools.qualikiz_io.instrumentation import stage, instrumented
+
+class TestInstrumentation(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_instrumentation')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        os.makedirs(self.testdir)
+        self.old_env = os.environ.get(campaign_env_var)
+        os.environ[campaign_env_var] = ''
+        self.was_enabled = instrumentation.is_enabled()
+        instrumentation.reset()
+        instrumentation.enable()
+
+    def test_disabled(self):
+        instrumentation.disable()
+        with stage('nothing'):
+            pass
+        self.assertEqual(instrumentation.events(), [])
+
+    def test_stage(self):
+        @instrumented('inner')
+        def write(path):
+            with open(path, 'wb') as file_:
+                file_.write(b'0' * 10000)
+            return 'written'
+
+        with stage('outer', run='run0'):
+            self.assertEqual(write(os.path.join(self.testdir, 'file')), 'written')
+        inner, outer = instrumentation.events()
+        self.assertEqual(inner['name'], 'inner')
+        self.assertEqual(inner['run'], 'run0')
+        self.assertEqual(outer['name'], 'outer')
+        self.assertGreaterEqual(outer['walltime'], inner['walltime'])
+        self.assertGreaterEqual(outer['start'], 0)
+        if os.path.isfile('/proc/self/io'):
+            self.assertGreaterEqual(inner['write_bytes'], 10000)
+        self.assertEqual(list(instrumentation.summary()), ['outer', 'inner'])
+
+    def test_stage_exception(self):
+        with self.assertRaises(ValueError):
+            with stage('failing'):
+                raise ValueError()
+        self.assertEqual(instrumentation.events()[0]['name'], 'failing')
+        with stage('after'):
+            pass
+        self.assertIsNone(instrumentation.events()[1]['run'])
+
+    def test_generate_input(self):
+        plan = QuaLiKizPlan.from_defaults()
+        self.assertEqual(instrumentation.events()[0]['name'], 'read_plan')
+        instrumentation.reset()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            run = QuaLiKizRun(self.testdir, 'run0', '../QuaLiKiz', qualikiz_plan=plan)
+            run.prepare(overwrite=True)
+        run.generate_input()
+        events = instrumentation.events()
+        names = [event['name'] for event in events]
+        for name in ['write_plan', 'prepare', 'read_plan', 'setup_plan',
+                     'write_input', 'generate_input']:
+            self.assertIn(name, names)
+        self.assertTrue(all(event['run'] == run.rundir for event in events))
+        self.assertTrue(all(event['max_rss'] >= 0 for event in events))
+
+        tracepath = os.path.join(self.testdir, 'trace.json')
+        instrumentation.export(tracepath)
+        with open(tracepath) as file_:
+            trace = json.load(file_)['traceEvents']
+        self.assertEqual([event['name'] for event in trace], names)
+        self.assertEqual(trace[0]['ph'], 'X')
+        self.assertEqual(trace[0]['args']['run'], run.rundir)
+
+        dbpath = os.path.join(self.testdir, 'poll.sqlite3')
+        instrumentation.export(dbpath)
+        instrumentation.export(dbpath)
+        db = sqlite3.connect(dbpath)
+        rows = db.execute('SELECT Name, Run FROM stages').fetchall()
+        db.close()
+        self.assertEqual(rows, 2 * [(name, run.rundir) for name in names])
+
+    def tearDown(self):
+        instrumentation.reset()
+        if not self.was_enabled:
+            instrumentation.disable()
+        if self.old_env is None:
+            del os.environ[campaign_env_var]
+        else:
+            os.environ[campaign_env_var] = self.old_env
+        shutil.rmtree(self.testdir, ignore_errors=True)
@@ -0,0 +1,146 @@
+from unittest import TestCase
+from collections import OrderedDict
+import os
+import shutil
+import warnings
+
+import numpy as np
+import xarray as xr
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.outputfiles import *
+from qualikiz_tools.qualikiz_io.legacy import version_table
+
+def plan_to_dataset(plan, input_binaries):
+    """ Mimic the dataset convert_debug creates from the input binaries """
+    point_names, ion_names = QuaLiKizPlan.binary_names()
+    nions = int(input_binaries['nions'][0])
+    ds = xr.Dataset()
+    for name, value in input_binaries.items():
+        value = np.array(value)
+        # The anisotropy is not in the debug output
+        if name.startswith('anis') or name.startswith('danisdr'):
+            continue
+        elif name in point_names:
+            ds.coords[name] = xr.DataArray(value, dims=['dimx'])
+        elif name in ion_names:
+            ds.coords[name] = xr.DataArray(value.reshape(nions, -1).T,
+                                           dims=['dimx', 'nions'])
+        elif name == 'kthetarhos':
+            ds.coords[name] = xr.DataArray(value, dims=['dimn'])
+        elif name == 'numsols':
+            ds.coords[name] = xr.DataArray(np.arange(value[0]), dims=['numsols'])
+        elif name not in ['dimx', 'dimn', 'nions']:
+            ds.coords[name] = xr.DataArray(value[0])
+    ds['efe_GB'] = xr.DataArray(np.linspace(-1, 1, len(ds['dimx'])), dims=['dimx'])
+    return ds
+
+class TestDatasetToInput(TestCase):
+    def setUp(self):
+        self.plan = QuaLiKizPlan.from_defaults()
+        self.plan['scan_type'] = 'hyperrect'
+        self.plan['scan_dict'] = OrderedDict([('Ati', [2., 4., 6.]),
+                                              ('Ane', [1., 2.]),
+                                              ('Zeff', [1., 1.5])])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.input_binaries = {name: np.array(value) for name, value
+                                   in self.plan.setup().items()}
+        self.ds = plan_to_dataset(self.plan, self.input_binaries)
+        self.inputdir = os.path.abspath('test_dataset_input')
+
+    def read_input(self):
+        return {name[:-4]: np.fromfile(os.path.join(self.inputdir, name))
+                for name in os.listdir(self.inputdir)}
+
+    def select(self, idx):
+        """ The input binaries of a selection of points """
+        point_names, ion_names = QuaLiKizPlan.binary_names()
+        nions = int(self.input_binaries['nions'][0])
+        selected = {}
+        for name, value in self.input_binaries.items():
+            if name in point_names:
+                value = value[idx]
+            elif name in ion_names:
+                value = value.reshape(nions, -1)[:, idx].ravel()
+            selected[name] = value
+        selected['dimx'] = np.array([len(idx)], dtype='float64')
+        return selected
+
+    def assertInputEqual(self, binaries, expected):
+        self.assertEqual(set(binaries), set(expected))
+        for name, value in expected.items():
+            np.testing.assert_array_equal(binaries[name], value, err_msg=name)
+
+    def test_all_points(self):
+        with self.assertWarns(UserWarning):
+            num_points = dataset_to_input(self.ds, inputdir=self.inputdir)
+        self.assertEqual(num_points, 12)
+        self.assertInputEqual(self.read_input(), self.input_binaries)
+
+    def test_selection(self):
+        mask = self.ds['efe_GB'] > 0
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            dataset_to_input(self.ds, inputdir=self.inputdir, points=mask)
+        self.assertInputEqual(self.read_input(),
+                              self.select(np.flatnonzero(mask.values)))
+
+    def test_squeezed(self):
+        ds = self.ds.reset_coords().drop('rho')
+        ds['Ate'] = ds['Ate'].isel(dimx=0, drop=True)
+        ds['Zi'] = ds['Zi'].isel(dimx=0, drop=True)
+        ds = to_meta_0d(ds)
+        self.assertIn('Ate', ds.attrs)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            dataset_to_input(ds, inputdir=self.inputdir)
+        self.assertInputEqual(self.read_input(), self.input_binaries)
+
+    def test_version(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            dataset_to_input(self.ds, inputdir=self.inputdir,
+                             version='CEA_QuaLiKiz')
+        binaries = self.read_input()
+        rename, constants = version_table(self.input_binaries, 'CEA_QuaLiKiz')
+        self.assertEqual(set(binaries), set(rename.values()) | set(constants))
+        np.testing.assert_array_equal(binaries['p14'], [1.])
+        np.testing.assert_array_equal(binaries['p1'], self.input_binaries['dimx'])
+
+    def test_no_dimx(self):
+        with self.assertRaises(Exception):
+            dataset_to_input(self.ds.isel(dimx=0), inputdir=self.inputdir)
+
+    def test_plan(self):
+        idx = np.array([1, 4, 5, 11])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            plan = dataset_to_plan(self.ds, points=idx)
+            self.assertEqual(plan['scan_type'], 'parallel')
+            self.assertEqual(plan.calculate_dimx(), 4)
+            binaries = {name: np.array(value)
+                        for name, value in plan.setup().items()}
+        self.assertInputEqual(binaries, self.select(idx))
+        self.assertIn('Ati', plan['scan_dict'])
+        self.assertNotIn('q', plan['scan_dict'])
+
+    def test_plan_json(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            plan = dataset_to_plan(self.ds)
+        os.makedirs(self.inputdir)
+        path = os.path.join(self.inputdir, 'parameters.json')
+        plan.to_json(path)
+        self.assertEqual(QuaLiKizPlan.from_json(path), plan)
+
+    def test_to_input_json(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            num_points = to_input_json(self.ds, inputdir=self.inputdir)
+        self.assertIn(DeprecationWarning, [warning.category for warning in caught])
+        self.assertEqual(num_points, 12)
+        self.assertInputEqual(self.read_input(), self.input_binaries)
+
+    def tearDown(self):
+        shutil.rmtree(self.inputdir, ignore_errors=True)
@@ -2,13 +2,18 @@
 from subprocess import PIPE, Popen as popen
 import unittest
 from unittest import TestCase
+from unittest.mock import patch
 import pytest
 import copy
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 from qualikiz_tools.qualikiz_io.inputfiles import *
 from qualikiz_tools.qualikiz_io.qualikizrun import *
+from qualikiz_tools.qualikiz_io.legacy import versions, convert_current_to
+from qualikiz_tools.qualikiz_io.outputfiles import output_file_names
+from qualikiz_tools.qualikiz_io.dir_index import index_env_var
 
 class TestPathException(TestCase):
     def test(self):
@@ -143,6 +148,80 @@ class TestQuaLiKizRun(TestCase):
         in_input = os.listdir(os.path.join(rundir, 'input'))
         self.assertEqual(len(in_input), 48)
 
+    def read_input(self):
+        inputdir = os.path.join(self.qualikizrun.rundir, 'input')
+        binaries = {}
+        for name in os.listdir(inputdir):
+            with open(os.path.join(inputdir, name), 'rb') as file_:
+                binaries[name] = file_.read()
+        return binaries
+
+    def test_generate_input_parallel(self):
+        self.qualikizrun.prepare()
+        self.qualikizrun.generate_input()
+        serial = self.read_input()
+        shutil.rmtree(os.path.join(self.qualikizrun.rundir, 'input'))
+        self.qualikizrun.generate_input(processes=2, chunksize=5)
+        self.assertEqual(self.read_input(), serial)
+
+    def test_generate_input_serial_slices(self):
+        self.qualikizrun.prepare()
+        self.qualikizrun.generate_input()
+        serial = self.read_input()
+        shutil.rmtree(os.path.join(self.qualikizrun.rundir, 'input'))
+        with patch('qualikiz_tools.qualikiz_io.qualikizrun.ProcessPoolExecutor') as pool:
+            generate_input_parallel([self.qualikizrun], processes=1, chunksize=5)
+        pool.assert_not_called()
+        self.assertEqual(self.read_input(), serial)
+
+    def test_generate_input_executor(self):
+        self.qualikizrun.prepare()
+        self.qualikizrun.generate_input()
+        serial = self.read_input()
+        shutil.rmtree(os.path.join(self.qualikizrun.rundir, 'input'))
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            self.qualikizrun.generate_input(executor=executor, chunksize=7)
+            self.assertEqual(self.read_input(), serial)
+            # The executor can be reused
+            self.qualikizrun.generate_input(executor=executor, chunksize=36)
+        self.assertEqual(self.read_input(), serial)
+
+    def test_generate_input_version(self):
+        self.qualikizrun.prepare()
+        inputdir = os.path.join(self.qualikizrun.rundir, 'input')
+        for version in versions[1:]:
+            shutil.rmtree(inputdir)
+            self.qualikizrun.generate_input()
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                convert_current_to(inputdir, target=version)
+            converted = self.read_input()
+            shutil.rmtree(inputdir)
+            self.qualikizrun.generate_input(version=version)
+            self.assertEqual(self.read_input(), converted)
+            shutil.rmtree(inputdir)
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                self.qualikizrun.generate_input(executor=executor, chunksize=9,
+                                                version=version)
+            self.assertEqual(self.read_input(), converted)
+
+    def test_generate_input_unknown_version(self):
+        self.qualikizrun.prepare()
+        with self.assertRaises(Exception):
+            self.qualikizrun.generate_input(version='1.0')
+
+    def test_generate_input_error(self):
+        self.qualikizrun.qualikiz_plan = copy.deepcopy(self.qualikizrun.qualikiz_plan)
+        self.qualikizrun.qualikiz_plan['scan_dict']['Zeff'] = [1, 8]
+        self.qualikizrun.prepare()
+        with self.assertRaises(InputGenerationError) as cm:
+            self.qualikizrun.generate_input(processes=2, chunksize=4)
+        self.assertIn(self.qualikizrun.rundir, cm.exception.errors)
+        self.assertEqual(os.listdir(os.path.join(self.qualikizrun.rundir, 'input')), [])
+        with self.assertRaises(InputGenerationError) as cm:
+            generate_input_parallel([self.qualikizrun], processes=1, chunksize=4)
+        self.assertIn(self.qualikizrun.rundir, cm.exception.errors)
+
     def test_inputbinaries_exist(self):
          self.qualikizrun.prepare()
          with warnings.catch_warnings():
@@ -180,6 +259,30 @@ class TestQuaLiKizRun(TestCase):
         for testfile in testfiles:
             self.assertFalse(os.path.exists(testfile))
 
+    def test_is_complete(self):
+        self.qualikizrun.prepare()
+        self.assertFalse(self.qualikizrun.is_complete())
+        outputdir = os.path.join(self.qualikizrun.rundir,
+                                 self.qualikizrun.outputdir)
+        names = output_file_names(phys_meth=2, separateflux=False)
+        self.assertIn('vfi_GB', names)
+        self.assertIn('chiee_SI', names)
+        self.assertNotIn('efeITG_GB', names)
+        self.assertIn('efeITG_GB', output_file_names(phys_meth=0, separateflux=True))
+        self.qualikizrun.qualikiz_plan = copy.deepcopy(self.qualikizrun.qualikiz_plan)
+        self.qualikizrun.qualikiz_plan['xpoint_base']['phys_meth'] = 2
+        self.qualikizrun.qualikiz_plan['xpoint_base']['separateflux'] = False
+        for name in names:
+            with open(os.path.join(outputdir, name + '.dat'), 'w') as file_:
+                file_.write('1.0\n')
+        self.assertTrue(self.qualikizrun.is_complete())
+        self.assertTrue(self.qualikizrun.is_done())
+        # Truncated output
+        with open(os.path.join(outputdir, 'efe_GB.dat'), 'w') as __:
+            pass
+        self.assertFalse(self.qualikizrun.is_complete())
+        self.assertTrue(self.qualikizrun.is_done())
+
     def tearDown(self):
         os.remove('./testQuaLiKiz')
         try:
@@ -221,6 +324,13 @@ class TestQuaLiKizBatch(TestCase):
             self.qualikizbatch.prepare()
         self.qualikizbatch.generate_input()
 
+    def test_generate_input_parallel(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.qualikizbatch.prepare()
+        self.qualikizbatch.generate_input(processes=2)
+        self.assertTrue(self.qualikizbatch.inputbinaries_exist())
+
     def test_runlist_from_subdirs(self):
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
@@ -255,6 +365,42 @@ class TestQuaLiKizBatch(TestCase):
         self.assertEqual(len(newbatchs), 1)
         self.assertEqual(self.qualikizbatch, newbatchs[0])
 
+    def test_from_dir_recursive_index(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.qualikizbatch.prepare()
+        self.qualikizbatch.generate_input()
+        searchdir = self.qualikizbatch.parent_dir
+        index_path = os.path.join(searchdir, 'index.sqlite')
+        for __ in range(2):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                newbatchs = QuaLiKizBatch.from_dir_recursive(searchdir, use_index=True,
+                                                             index_path=index_path)
+            self.assertEqual(len(newbatchs), 1)
+            self.assertEqual(self.qualikizbatch, newbatchs[0])
+        self.assertTrue(os.path.isfile(index_path))
+
+    def test_from_dir_recursive_no_index(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.qualikizbatch.prepare()
+        searchdir = self.qualikizbatch.parent_dir
+        old_env = {name: os.environ.pop(name, None) for name in ['XDG_CACHE_HOME', index_env_var]}
+        os.environ['XDG_CACHE_HOME'] = os.path.join(searchdir, 'cache')
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                newbatchs = QuaLiKizBatch.from_dir_recursive(searchdir)
+        finally:
+            for name, value in old_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        self.assertEqual(len(newbatchs), 1)
+        self.assertFalse(os.path.exists(os.path.join(searchdir, 'cache')))
+
     def test_clean(self):
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
@@ -272,6 +418,19 @@ class TestQuaLiKizBatch(TestCase):
         for testfile in testfiles:
             self.assertFalse(os.path.exists(testfile))
 
+    def test_incomplete_runs(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.qualikizbatch.prepare()
+        run = self.qualikizbatch.runlist[1]
+        xpoint_base = run.qualikiz_plan['xpoint_base']
+        for name in output_file_names(phys_meth=xpoint_base['phys_meth'],
+                                      separateflux=xpoint_base['separateflux']):
+            with open(os.path.join(run.rundir, run.outputdir, name + '.dat'), 'w') as file_:
+                file_.write('1.0\n')
+        self.assertEqual(self.qualikizbatch.incomplete_runs(),
+                         self.qualikizbatch.runlist[:1])
+
     def tearDown(self):
         try:
             shutil.rmtree('testbatchsdir')
@@ -0,0 +1,155 @@
+from unittest import TestCase
+from collections import OrderedDict
+import os
+import shutil
+import sqlite3
+import warnings
+
+import numpy as np
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun
+from qualikiz_tools.qualikiz_io.campaign import campaign_env_var
+from qualikiz_tools.qualikiz_io.walltime_model import model_env_var as walltime_env_var
+from qualikiz_tools.qualikiz_io.scaling import *
+from qualikiz_tools.machine_specific.bash import Run
+
+# Coefficients in seconds of the constant, serial, parallel and
+# communication terms
+true_coefficients = OrderedDict([
+    ('First_MPI_AllReduce', [0., 0., 0., .05]),
+    ('Eigenmodes', [.1, 1e-5, .5, 0.]),
+    ('Saturation', [0., 1e-4, .05, 0.]),
+    ('Second_MPI_AllReduce', [0., 0., 0., .02]),
+    ('Initialization', [.2, 0., 0., 0.]),
+    ('Output', [.1, 1e-5, 0., 0.]),
+    ('Other', [.01, 0., 0., 0.])])
+
+def write_database(path):
+    model = ScalingModel(coefficients=true_coefficients)
+    db = sqlite3.connect(path)
+    db.execute('''CREATE TABLE stdout (
+        Jobnumber INTEGER, Runnumber INTEGER, Numcores INTEGER, Dimx INTEGER,
+        Dimn INTEGER, First_MPI_AllReduce INTEGER, Eigenmodes INTEGER,
+        Saturation INTEGER, Second_MPI_AllReduce INTEGER, Initialization INTEGER,
+        Output INTEGER, Total INTEGER)''')
+    rows = []
+    for dimx in [100, 1000, 10000]:
+        for cores in [1, 4, 16, 64, 256]:
+            times = model.predict(dimx * 8, cores)
+            row = [len(rows), 0, cores, dimx, 8]
+            row.extend(int(round(1000 * time)) for time in list(times.values())[:-1])
+            row.append(int(round(1000 * sum(times.values()))))
+            rows.append(row)
+    db.executemany('INSERT INTO stdout VALUES (' + ', '.join(12 * ['?']) + ')', rows)
+    db.commit()
+    db.close()
+    return model
+
+class TestScaling(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_scaling')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        os.makedirs(self.testdir)
+        self.dbpath = os.path.join(self.testdir, 'polldb.sqlite3')
+        self.true_model = write_database(self.dbpath)
+        self.old_env = {name: os.environ.get(name)
+                        for name in [campaign_env_var, walltime_env_var, model_env_var]}
+        os.environ[campaign_env_var] = ''
+        os.environ.pop(walltime_env_var, None)
+        os.environ.pop(model_env_var, None)
+
+    def test_read_profiling(self):
+        table = read_profiling(self.dbpath)
+        self.assertEqual(len(table), 15)
+        self.assertEqual(set(table['dimxn']), {800, 8000, 80000})
+        np.testing.assert_allclose(table['Other'], .01, atol=2e-3)
+        with self.assertRaises(Exception):
+            read_profiling(os.path.join(self.testdir, 'missing.sqlite3'))
+
+    def test_fit(self):
+        model = ScalingModel.from_database(self.dbpath)
+        self.assertEqual(model.components, list(true_coefficients))
+        self.assertEqual(model.num_samples, 15)
+        self.assertLess(model.sigma, 1e-2)
+        for component, coefficients in model.coefficients.items():
+            self.assertTrue(all(coefficient >= 0 for coefficient in coefficients))
+        # Predict a dimxn the model was not fitted on
+        np.testing.assert_allclose(model.walltime(4000, [2, 32, 128]),
+                                   self.true_model.walltime(4000, [2, 32, 128]),
+                                   rtol=1e-2)
+        fractions = model.serial_fraction(8000)
+        self.assertTrue(np.isnan(fractions['First_MPI_AllReduce']))
+        self.assertAlmostEqual(fractions['Initialization'], 1, places=2)
+        self.assertLess(fractions['Eigenmodes'], 1e-3)
+
+    def test_serial_fraction_residue(self):
+        # Rounding residue of nnls in a component that takes no time
+        model = ScalingModel(OrderedDict([('First_MPI_AllReduce', [3e-17, 1e-20, 2e-18, .05]),
+                                          ('Eigenmodes', [.1, 0., .5, 0.])]))
+        fractions = model.serial_fraction(8000)
+        self.assertTrue(np.isnan(fractions['First_MPI_AllReduce']))
+        self.assertAlmostEqual(fractions['Eigenmodes'], .1 / 4000.1)
+
+    def test_recommend_cores(self):
+        model = self.true_model
+        candidates = [2 ** ii for ii in range(13)]
+        cores = model.recommend_cores(8000, 60, candidates)
+        walltime = model.walltime(8000, candidates)
+        self.assertLessEqual(model.walltime(8000, cores), 60)
+        fits = [candidate for candidate, time in zip(candidates, walltime) if time <= 60]
+        self.assertEqual(cores * model.walltime(8000, cores),
+                         min(candidate * model.walltime(8000, candidate)
+                             for candidate in fits))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            fastest = model.recommend_cores(8000, 1, candidates)
+        self.assertEqual(fastest, candidates[int(np.argmin(walltime))])
+        self.assertEqual(len(caught), 1)
+
+    def test_json(self):
+        path = os.path.join(self.testdir, 'scaling.json')
+        model = ScalingModel.from_database(self.dbpath)
+        model.to_json(path)
+        os.environ[model_env_var] = path
+        loaded = load_model()
+        self.assertEqual(loaded.__dict__, model.__dict__)
+        os.environ[model_env_var] = ''
+        self.assertIsNone(load_model())
+
+    def test_run(self):
+        path = os.path.join(self.testdir, 'scaling.json')
+        self.true_model.to_json(path)
+        os.environ[model_env_var] = path
+        plan = QuaLiKizPlan.from_defaults()
+        cores_per_node = Run.defaults['cores_per_node']
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            run = QuaLiKizRun(self.testdir, 'run0', '../QuaLiKiz', qualikiz_plan=plan)
+            # The model of QUALIKIZ_SCALING_MODEL is used without a walltime model
+            self.assertAlmostEqual(run.estimate_walltime(4),
+                                   float(self.true_model.walltime(plan.calculate_dimxn(), 4)))
+            cores = run.recommend_cores(1e6, [1, 2, 4])
+            self.assertEqual(cores, 1)
+            # A target the model can just make with 2 nodes
+            max_walltime = self.true_model.walltime(plan.calculate_dimxn(), 2 * cores_per_node)
+            bash_run = Run(self.testdir, 'run1', '../QuaLiKiz', qualikiz_plan=plan,
+                           nodes=4, max_walltime=max_walltime * 1.0001)
+        self.assertEqual(bash_run.nodes, 2)
+        self.assertEqual(bash_run.tasks, 2 * cores_per_node)
+
+    def test_plot(self):
+        import matplotlib
+        matplotlib.use('Agg')
+        table = read_profiling(self.dbpath)
+        fig = plot_scaling(table, model=ScalingModel().fit(table))
+        self.assertEqual(len(fig.axes), 2)
+        fig.savefig(os.path.join(self.testdir, 'scaling.png'))
+
+    def tearDown(self):
+        for name, value in self.old_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        shutil.rmtree(self.testdir, ignore_errors=True)
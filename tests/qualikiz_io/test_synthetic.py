@@ -0,0 +1,115 @@
+from unittest import TestCase
+import os
+import stat
+import shutil
+import filecmp
+import subprocess
+import warnings
+
+import numpy as np
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun, run_to_netcdf
+from qualikiz_tools.qualikiz_io.campaign import campaign_env_var
+from qualikiz_tools.qualikiz_io.synthetic import write_output, install_stub
+from qualikiz_tools.machine_specific.bash import Run
+
+stub_mpirun = """#!/bin/sh
+# Stub of mpirun: start the binary once, without MPI
+shift 2
+exec "$@"
+"""
+
+class TestSynthetic(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_synthetic')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        os.makedirs(self.testdir)
+        self.old_env = os.environ.get(campaign_env_var)
+        os.environ[campaign_env_var] = ''
+        self.plan = QuaLiKizPlan.from_defaults()
+        self.plan['xpoint_base']['meta']['phys_meth'] = 2
+
+    def make_run(self, name, run_class=QuaLiKizRun, **kwargs):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            run = run_class(self.testdir, name, '../bin/QuaLiKiz',
+                            qualikiz_plan=self.plan, **kwargs)
+            run.prepare(overwrite=True)
+        return run
+
+    def test_convert(self):
+        run = self.make_run('run0')
+        write_output(run.rundir)
+        self.assertTrue(run.is_complete())
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            ds = run_to_netcdf(run.rundir, overwrite=True)
+        dimx = self.plan.calculate_dimx()
+        self.assertEqual(ds.dims['dimx'], dimx)
+        self.assertEqual(ds.dims['dimn'], len(self.plan['xpoint_base']['special']['kthetarhos']))
+        self.assertEqual(ds.dims['numsols'], self.plan['xpoint_base']['meta']['numsols'])
+        self.assertEqual(ds['gam_GB'].dims, ('dimx', 'dimn', 'numsols'))
+        self.assertEqual(ds['Lecircgne'].dims, ('dimx', 'dimn', 'numsols'))
+        # The debug output echoes the scan
+        np.testing.assert_allclose(ds['Ati'].sel(nions=0), self.plan['scan_dict']['Ati'])
+        self.assertEqual(ds.dims['nions'], len(self.plan['xpoint_base']['ions']))
+        self.assertTrue(np.all((ds['efe_GB'] >= 0) & (ds['efe_GB'] < 1)))
+
+    def test_data(self):
+        runs = [self.make_run('run' + str(ii)) for ii in range(3)]
+        write_output(runs[0].rundir, data='analytic', seed=1)
+        write_output(runs[1].rundir, data='analytic', seed=2)
+        write_output(runs[2].rundir, data='random', seed=1)
+        path = os.path.join(QuaLiKizRun.outputdir, 'efi_GB.dat')
+        self.assertTrue(filecmp.cmp(os.path.join(runs[0].rundir, path),
+                                    os.path.join(runs[1].rundir, path), shallow=False))
+        self.assertFalse(filecmp.cmp(os.path.join(runs[0].rundir, path),
+                                     os.path.join(runs[2].rundir, path), shallow=False))
+        with open(os.path.join(runs[0].rundir, path)) as file_:
+            line = file_.readline()
+        self.assertEqual(len(line), 16 * len(self.plan['xpoint_base']['ions']) + 1)
+        with self.assertRaises(Exception):
+            write_output(runs[0].rundir, data='zeros')
+
+    def test_flags(self):
+        self.plan['xpoint_base']['meta']['write_primi'] = False
+        self.plan['xpoint_base']['meta']['separateflux'] = False
+        run = self.make_run('run0')
+        paths = write_output(run.rundir)
+        names = [os.path.relpath(path, run.rundir) for path in paths]
+        self.assertIn(os.path.join('output', 'efe_GB.dat'), names)
+        self.assertNotIn(os.path.join('output', 'efeITG_GB.dat'), names)
+        self.assertFalse(any(name.startswith(os.path.join('output', 'primitive'))
+                             for name in names))
+
+    def test_stub(self):
+        bindir = os.path.join(self.testdir, 'bin')
+        install_stub(os.path.join(bindir, 'QuaLiKiz'))
+        mpirun = os.path.join(bindir, 'mpirun')
+        with open(mpirun, 'w') as file_:
+            file_.write(stub_mpirun)
+        os.chmod(mpirun, os.stat(mpirun).st_mode | stat.S_IXUSR)
+        old_path = os.environ['PATH']
+        os.environ['PATH'] = bindir + os.pathsep + old_path
+        try:
+            run = self.make_run('run0', run_class=Run, tasks=1)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                run.launch()
+        finally:
+            os.environ['PATH'] = old_path
+        self.assertTrue(run.is_complete())
+
+        # Only rank 0 writes
+        other = self.make_run('run1')
+        env = dict(os.environ, OMPI_COMM_WORLD_RANK='1')
+        subprocess.check_call([os.path.join(bindir, 'QuaLiKiz')], cwd=other.rundir, env=env)
+        self.assertIsNone(other.output_sizes())
+
+    def tearDown(self):
+        if self.old_env is None:
+            del os.environ[campaign_env_var]
+        else:
+            os.environ[campaign_env_var] = self.old_env
+        shutil.rmtree(self.testdir, ignore_errors=True)
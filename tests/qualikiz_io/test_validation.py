@@ -0,0 +1,69 @@
+from unittest import TestCase
+from collections import OrderedDict
+import warnings
+
+import numpy as np
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.validation import *
+
+def failing_points(plan):
+    """ Indices of points that fail in the point-by-point setup """
+    failing = []
+    for ii, point in enumerate(plan.scan_array()):
+        scan_dict = OrderedDict((name, [value]) for name, value
+                                in zip(plan['scan_dict'], point))
+        single = QuaLiKizPlan(scan_dict, 'parallel', plan['xpoint_base'])
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                single.setup()
+        except Exception:
+            failing.append(ii)
+    return failing
+
+class TestValidatePlan(TestCase):
+    def setUp(self):
+        self.plan = QuaLiKizPlan.from_defaults()
+
+    def test_valid(self):
+        table = validate_plan(self.plan)
+        self.assertEqual(len(table), 0)
+        self.assertEqual(list(table.columns), ['dimx', 'check', 'value', 'Ati'])
+
+    def test_normni(self):
+        self.plan['scan_dict'] = OrderedDict([('Zeff', [1, 2, 4.5, 6]),
+                                              ('Ane', [-2, 3])])
+        self.plan['scan_type'] = 'hyperrect'
+        table = validate_plan(self.plan)
+        normni = table[table['check'] == 'normni']
+        self.assertEqual(list(normni['dimx']), [4, 5, 6, 7])
+        self.assertEqual(list(normni['Zeff']), [4.5, 4.5, 6, 6])
+        self.assertTrue(np.all(normni['value'] < 0))
+        self.assertEqual(sorted(set(table['dimx'])), failing_points(self.plan))
+
+    def test_quasineutrality_gradient(self):
+        self.plan['xpoint_base']['options']['set_qn_An'] = False
+        self.plan['scan_dict'] = OrderedDict([('Ane', [-2, 2.96, 5])])
+        self.plan['scan_type'] = 'parallel'
+        table = validate_plan(self.plan)
+        self.assertEqual(list(table['check']), ['quasineutrality_gradient'] * 2)
+        self.assertEqual(list(table['dimx']), [0, 2])
+        self.assertEqual(list(table['dimx']), failing_points(self.plan))
+
+    def test_quasineutrality(self):
+        self.plan['xpoint_base']['options']['set_qn_normni'] = False
+        self.plan['scan_dict'] = OrderedDict([('ni0', [.6, .8, 1.])])
+        self.plan['scan_type'] = 'parallel'
+        table = validate_plan(self.plan)
+        quasi = table[table['check'] == 'quasineutrality']
+        self.assertEqual(list(quasi['dimx']), [1, 2])
+        self.assertEqual(sorted(set(table['dimx'])), failing_points(self.plan))
+
+    def test_nustar(self):
+        self.plan['scan_dict'] = OrderedDict([('Nustar', [1e-2, 1, 1e15])])
+        self.plan['scan_type'] = 'parallel'
+        table = validate_plan(self.plan)
+        self.assertEqual(list(table['check']), ['Nustar'])
+        self.assertEqual(list(table['dimx']), [2])
+        self.assertEqual(list(table['dimx']), failing_points(self.plan))
@@ -0,0 +1,131 @@
+from unittest import TestCase
+from collections import OrderedDict
+import os
+import shutil
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun
+from qualikiz_tools.qualikiz_io.walltime_model import *
+
+stdout_template = """QuaLiKiz started
+Profiling: MPI tasks = {cores:d}
+Profiling: OpenMP threads = 1
+Profiling: points per task = 4
+Profiling: input time = 0.012 s
+Profiling: dispersion relation time = {disp_sec:d}.{disp_msec:03d} s
+Profiling: eigenvalue time = 1.000 s
+Profiling: integration time = 1.000 s
+Profiling: flux time = 0.100 s
+Profiling: output time = 0.010 s
+Profiling: Total time = {sec:d}.{msec:03d} s
+"""
+
+def walltime_formula(dimx, cores):
+    return 0.5 * dimx ** 0.9 / cores ** 0.8
+
+class TestWalltimeModel(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_walltime_model')
+        self.plan = QuaLiKizPlan.from_defaults()
+        self.plan['scan_type'] = 'parallel'
+
+    def make_table(self, features):
+        rows = []
+        for dimx in [10, 40, 160, 640]:
+            self.plan['scan_dict'] = OrderedDict([('Ati', np.linspace(1, 2, dimx))])
+            for cores in [1, 4, 16]:
+                row = plan_features(self.plan, cores, names=features)
+                row['walltime'] = walltime_formula(dimx, cores)
+                rows.append(row)
+        return pd.DataFrame(rows)
+
+    def test_fit(self):
+        features = ['log_dimx', 'log_cores']
+        model = WalltimeModel(features=features).fit(self.make_table(features))
+        np.testing.assert_allclose(model.coefficients, [np.log(.5), .9, -.8],
+                                   atol=1e-10)
+        self.assertAlmostEqual(model.sigma, 0)
+        self.plan['scan_dict'] = OrderedDict([('Ati', np.linspace(1, 2, 100))])
+        self.assertAlmostEqual(model.predict_walltime(self.plan, 8),
+                               walltime_formula(100, 8))
+
+    def test_scanned_feature(self):
+        self.plan['scan_dict'] = OrderedDict([('Ati', [1., 3.])])
+        features = plan_features(self.plan, 2, names=['Ati', 'Ate', 'cores'])
+        self.assertEqual(list(features.values()), [2., self.plan['xpoint_base']['Ate'], 2.])
+
+    def test_json(self):
+        model = WalltimeModel(features=['log_dimx'], coefficients=[1., 2.],
+                              sigma=.1, num_samples=4)
+        os.makedirs(self.testdir)
+        path = os.path.join(self.testdir, 'model.json')
+        model.to_json(path)
+        loaded = load_model(path)
+        self.assertEqual(loaded.__dict__, model.__dict__)
+
+    def test_load_model_once(self):
+        os.makedirs(self.testdir)
+        path = os.path.join(self.testdir, 'model.json')
+        WalltimeModel(features=['log_dimx'], coefficients=[1., 2.]).to_json(path)
+        loaded = load_model(path)
+        self.assertIs(load_model(path), loaded)
+        os.environ[model_env_var] = ''
+        try:
+            self.assertIsNone(load_model())
+        finally:
+            del os.environ[model_env_var]
+
+    def test_not_fitted(self):
+        with self.assertRaises(Exception):
+            WalltimeModel().predict_walltime(self.plan, 1)
+
+    def write_run(self, name, dimx, cores):
+        self.plan['scan_dict'] = OrderedDict([('Ati', np.linspace(1, 2, dimx))])
+        run = QuaLiKizRun(self.testdir, name, '../QuaLiKiz',
+                          qualikiz_plan=QuaLiKizPlan(**self.plan))
+        os.makedirs(run.rundir)
+        walltime = walltime_formula(dimx, cores)
+        sec, msec = divmod(int(round(walltime * 1000)), 1000)
+        with open(os.path.join(run.rundir, run.stdout), 'w') as file_:
+            file_.write(stdout_template.format(cores=cores, sec=sec, msec=msec,
+                                               disp_sec=sec + 1, disp_msec=0))
+        return run
+
+    def test_from_runs(self):
+        runlist = [self.write_run('run' + str(ii), dimx, cores)
+                   for ii, (dimx, cores) in enumerate([(100, 1), (400, 1),
+                                                       (400, 4), (1600, 4),
+                                                       (1600, 16)])]
+        broken = QuaLiKizRun(self.testdir, 'broken', '../QuaLiKiz',
+                             qualikiz_plan=self.plan)
+        with self.assertWarns(UserWarning):
+            table = WalltimeModel.table_from_runs(runlist + [broken],
+                                                  features=['log_dimx', 'log_cores'])
+        self.assertEqual(len(table), 5)
+        self.assertEqual(list(table['log_cores']), list(np.log([1, 1, 4, 4, 16])))
+        model = WalltimeModel.from_runs(runlist, features=['log_dimx', 'log_cores'])
+        self.assertEqual(model.num_samples, 5)
+        np.testing.assert_allclose(model.coefficients[1:], [.9, -.8], atol=1e-2)
+
+    def test_estimate_walltime(self):
+        model = WalltimeModel(features=['log_cores'], coefficients=[np.log(100), -1.])
+        run = QuaLiKizRun(self.testdir, 'run', '../QuaLiKiz', qualikiz_plan=self.plan)
+        self.assertAlmostEqual(run.estimate_walltime(4, model=model), 25)
+        self.assertAlmostEqual(run.estimate_cputime(4, model=model), 100)
+
+        os.makedirs(self.testdir)
+        path = os.path.join(self.testdir, 'model.json')
+        model.to_json(path)
+        os.environ[model_env_var] = path
+        try:
+            self.assertAlmostEqual(run.estimate_walltime(5), 20)
+        finally:
+            del os.environ[model_env_var]
+        self.assertNotAlmostEqual(run.estimate_walltime(5), 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.testdir, ignore_errors=True)
@@ -0,0 +1,138 @@
+from unittest import TestCase
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+import shutil
+import threading
+import warnings
+
+from qualikiz_tools.qualikiz_io.inputfiles import QuaLiKizPlan
+from qualikiz_tools.qualikiz_io.outputfiles import output_file_names
+from qualikiz_tools.qualikiz_io.qualikizrun import QuaLiKizRun, QuaLiKizBatch
+from qualikiz_tools.qualikiz_io.campaign import campaign_env_var, record_state
+from qualikiz_tools.qualikiz_io.watch import watch
+
+class TestWatch(TestCase):
+    def setUp(self):
+        self.testdir = os.path.abspath('test_watch')
+        shutil.rmtree(self.testdir, ignore_errors=True)
+        self.old_env = os.environ.get(campaign_env_var)
+        os.environ[campaign_env_var] = ''
+        plan = QuaLiKizPlan.from_defaults()
+        runlist = [QuaLiKizRun(os.path.join(self.testdir, 'batch'), 'run' + str(ii),
+                               '../../QuaLiKiz', qualikiz_plan=plan)
+                   for ii in range(2)]
+        self.batch = QuaLiKizBatch(self.testdir, 'batch', runlist)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.batch.prepare(overwrite_batch=True)
+        xpoint_base = plan['xpoint_base']
+        self.names = output_file_names(phys_meth=xpoint_base['phys_meth'],
+                                       separateflux=xpoint_base['separateflux'])
+        self.converted = []
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def convert(self, rundir, **kwargs):
+        self.converted.append((rundir, time.time()))
+
+    def write_output(self, run, delay=0):
+        time.sleep(delay)
+        for name in self.names:
+            with open(os.path.join(run.rundir, run.outputdir, name + '.dat'), 'w') as file_:
+                file_.write('1.\n')
+
+    def in_background(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.start()
+        self.addCleanup(thread.join)
+        return thread
+
+    def watch(self, targets, **kwargs):
+        return watch(targets, poll_interval=.02, executor=self.executor,
+                     convert=self.convert, **kwargs)
+
+    def test_converts_as_finished(self):
+        run0, run1 = self.batch.runlist
+        self.write_output(run0)
+        self.in_background(self.write_output, run1, .3)
+        results = self.watch([self.batch])
+        self.assertEqual(list(results.items()), [(run0.rundir, None), (run1.rundir, None)])
+        # The first run did not wait for the second
+        self.assertLess(self.converted[1][1] - self.converted[0][1], .4)
+        self.assertGreater(self.converted[1][1] - self.converted[0][1], .1)
+
+    def test_waits_for_stable_sizes(self):
+        run = self.batch.runlist[0]
+        self.write_output(run)
+        path = os.path.join(run.rundir, run.outputdir, self.names[0] + '.dat')
+        def grow():
+            for __ in range(10):
+                with open(path, 'a') as file_:
+                    file_.write('2.\n')
+                time.sleep(.03)
+            self.grown = time.time()
+        self.in_background(grow)
+        self.watch([run], stable_polls=3)
+        self.assertGreater(self.converted[0][1], self.grown)
+
+    def test_glue(self):
+        for run in self.batch.runlist:
+            self.write_output(run)
+        with patch.object(self.batch, 'to_netcdf') as to_netcdf:
+            self.watch([self.batch], glue='glue_orthogonal')
+        to_netcdf.assert_called_once_with(mode='glue_orthogonal', overwrite_runs=False,
+                                          overwrite_batch=True)
+
+    def test_failed_conversion(self):
+        for run in self.batch.runlist:
+            self.write_output(run)
+        def convert(rundir, **kwargs):
+            raise Exception('Broken output')
+        with patch.object(self.batch, 'to_netcdf') as to_netcdf:
+            results = watch([self.batch], poll_interval=.02, executor=self.executor,
+                            convert=convert, glue='glue_orthogonal')
+        self.assertIsInstance(results[self.batch.runlist[0].rundir], Exception)
+        to_netcdf.assert_not_called()
+
+    def test_glue_error(self):
+        for run in self.batch.runlist:
+            self.write_output(run)
+        with patch.object(self.batch, 'to_netcdf', side_effect=Exception('Broken glue')):
+            results = self.watch([self.batch], glue='glue_orthogonal')
+        batchdir = os.path.join(self.testdir, 'batch')
+        self.assertIsInstance(results[batchdir], Exception)
+        self.assertEqual(len(self.converted), 2)
+
+    def test_kwargs_not_changed(self):
+        run_kwargs = {'genfromtxt': True}
+        batch_kwargs = {}
+        self.watch([self.batch], timeout=.05, run_kwargs=run_kwargs,
+                   batch_kwargs=batch_kwargs)
+        self.assertEqual(run_kwargs, {'genfromtxt': True})
+        self.assertEqual(batch_kwargs, {})
+
+    def test_skips_converted(self):
+        run0, run1 = self.batch.runlist
+        for run in self.batch.runlist:
+            self.write_output(run)
+        with open(os.path.join(run0.rundir, 'run0.nc'), 'w'):
+            pass
+        os.environ[campaign_env_var] = os.path.join(self.testdir, 'campaign.sqlite')
+        record_state([run1.rundir], 'netcdf')
+        results = self.watch([self.batch])
+        self.assertEqual(results, {run0.rundir: None, run1.rundir: None})
+        self.assertEqual(self.converted, [])
+
+    def test_timeout(self):
+        results = self.watch([self.batch], timeout=.1)
+        self.assertEqual(results, {})
+        self.assertEqual(self.converted, [])
+
+    def tearDown(self):
+        self.executor.shutdown()
+        if self.old_env is None:
+            del os.environ[campaign_env_var]
+        else:
+            os.environ[campaign_env_var] = self.old_env
+        shutil.rmtree(self.testdir, ignore_errors=True)